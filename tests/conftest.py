@@ -0,0 +1,29 @@
+import pytest
+
+from ttsmutility.data.config import (
+    config_override,
+    load_config,
+    save_config,
+)
+from ttsmutility.data.db import create_new_db
+
+
+@pytest.fixture
+def tts_config(tmp_path):
+    # Keep the config file, DB and mods directory inside the test's tmp dir
+    config_override(tmp_path / "configuration.json")
+    load_config.cache_clear()
+    config = load_config()
+    config.db_path = str(tmp_path / "ttsmutility.sqlite")
+    config.tts_mods_dir = str(tmp_path / "Mods")
+    config.tts_saves_dir = str(tmp_path)
+    config = save_config(config)
+    yield config
+    config_override("")
+    load_config.cache_clear()
+
+
+@pytest.fixture
+def tts_db(tts_config):
+    create_new_db(tts_config.db_path)
+    return tts_config.db_path
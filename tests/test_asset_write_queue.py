@@ -0,0 +1,164 @@
+import sqlite3
+import time
+
+from ttsmutility.parse.AssetList import AssetList
+from ttsmutility.parse.AssetWriteQueue import AssetWriteQueue
+
+
+def add_asset(db_path, url, filename):
+    with sqlite3.connect(db_path) as db:
+        db.execute(
+            "INSERT INTO tts_assets (asset_url, asset_filename) VALUES (?, ?)",
+            (url, filename),
+        )
+        db.commit()
+
+
+def get_asset(db_path, url):
+    with sqlite3.connect(db_path) as db:
+        return db.execute(
+            """
+            SELECT asset_path, asset_ext, asset_size, asset_dl_status, asset_sha1
+            FROM tts_assets WHERE asset_url=?
+            """,
+            (url,),
+        ).fetchone()
+
+
+def make_asset(url, filename="", dl_status=""):
+    return {
+        "url": url,
+        "filename": filename,
+        "mtime": 10,
+        "size": 0 if filename == "" else 100,
+        "sha1": "",
+        "steam_sha1": "",
+        "dl_status": dl_status,
+        "content_name": "",
+        "ignore_missing": False,
+    }
+
+
+def test_updates_are_written_on_flush(tts_db):
+    add_asset(tts_db, "http://a", "httpa")
+    add_asset(tts_db, "http://b", "httpb")
+
+    queue = AssetWriteQueue(batch_size=1000, flush_interval=1000)
+    queue.download_done(make_asset("http://a", "Images/httpa.png"))
+    queue.set_dl_status("http://b", "HTTPError 404 (Not Found)")
+    queue.sha1_scan_done("Images/httpa.png", "ABC", "", 20)
+
+    assert queue.depth == 3
+    assert get_asset(tts_db, "http://a")[2] == 0
+
+    queue.flush()
+
+    assert queue.depth == 0
+    assert queue.flush_count == 1
+    assert get_asset(tts_db, "http://a") == ("Images", ".png", 100, "", "ABC")
+    assert get_asset(tts_db, "http://b")[3] == "HTTPError 404 (Not Found)"
+    queue.close()
+
+
+def test_download_sha1_is_kept(tts_db):
+    add_asset(tts_db, "http://a", "httpa")
+
+    queue = AssetWriteQueue(batch_size=1000, flush_interval=1000)
+    queue.download_done(
+        make_asset("http://a", "Images/httpa.png") | {"sha1": "ABC", "sha1_mtime": 10}
+    )
+    queue.flush()
+    assert get_asset(tts_db, "http://a")[4] == "ABC"
+
+    # A failed download doesn't know the SHA1 of the file we have
+    queue.download_done(make_asset("http://a", "Images/httpa.png", "Removed"))
+    queue.close()
+    assert get_asset(tts_db, "http://a")[3:] == ("Removed", "ABC")
+
+
+def test_updates_are_coalesced(tts_db):
+    add_asset(tts_db, "http://a", "httpa")
+
+    queue = AssetWriteQueue(batch_size=1000, flush_interval=1000)
+    queue.set_dl_status("http://a", "Retries exhausted")
+    queue.download_done(make_asset("http://a", dl_status="Removed"))
+    queue.set_dl_status("http://a", "HTTPError 404 (Not Found)")
+
+    assert queue.depth == 1
+    queue.close()
+    assert get_asset(tts_db, "http://a")[3] == "HTTPError 404 (Not Found)"
+
+
+def test_size_trigger_flushes_in_background(tts_db):
+    add_asset(tts_db, "http://a", "httpa")
+    add_asset(tts_db, "http://b", "httpb")
+
+    queue = AssetWriteQueue(batch_size=2, flush_interval=1000)
+    queue.set_dl_status("http://a", "Removed")
+    queue.set_dl_status("http://b", "Removed")
+
+    deadline = time.time() + 5
+    while queue.flush_count == 0 and time.time() < deadline:
+        time.sleep(0.01)
+
+    assert queue.flush_count == 1
+    assert get_asset(tts_db, "http://b")[3] == "Removed"
+    queue.close()
+
+
+class FailingAssetList:
+    """Fails the first `failures` batches, calling `during` while the first
+    one is being written."""
+
+    def __init__(self, asset_list, failures, during=lambda: None):
+        self.asset_list = asset_list
+        self.failures = failures
+        self.during = during
+
+    def apply_updates(self, downloads, sha1s, dl_statuses):
+        self.during()
+        self.during = lambda: None
+        if self.failures > 0:
+            self.failures -= 1
+            raise sqlite3.OperationalError("database is locked")
+        self.asset_list.apply_updates(downloads, sha1s, dl_statuses)
+
+
+def test_background_flush_retries_after_error(tts_db):
+    add_asset(tts_db, "http://a", "httpa")
+    errors = []
+    queue = AssetWriteQueue(
+        batch_size=1,
+        flush_interval=0.05,
+        asset_list=FailingAssetList(AssetList(), 2),
+        on_error=errors.append,
+    )
+    queue.set_dl_status("http://a", "Removed")
+
+    deadline = time.time() + 5
+    while queue.flush_count == 0 and time.time() < deadline:
+        time.sleep(0.01)
+
+    assert queue.flush_count == 1
+    assert queue.flush_errors == 2
+    assert [str(error) for error in errors] == ["database is locked"] * 2
+    assert get_asset(tts_db, "http://a")[3] == "Removed"
+    queue.close()
+
+
+def test_failed_flush_keeps_newer_download(tts_db):
+    add_asset(tts_db, "http://a", "httpa")
+    queue = AssetWriteQueue(batch_size=1000, flush_interval=1000)
+    queue.asset_list = FailingAssetList(
+        AssetList(),
+        1,
+        during=lambda: queue.download_done(make_asset("http://a", "Images/httpa.png")),
+    )
+    queue.set_dl_status("http://a", "Retries exhausted")
+
+    try:
+        queue.flush()
+    except sqlite3.OperationalError:
+        pass
+    queue.close()
+    assert get_asset(tts_db, "http://a")[2:4] == (100, "")
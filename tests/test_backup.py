@@ -0,0 +1,544 @@
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile, ZipInfo
+
+import pytest
+from textual.app import App
+
+from ttsmutility.workers.backup import (
+    CAN_UPDATE_ZIPS,
+    READ_AHEAD_MAX_FILE,
+    STORE_ALL,
+    BackupProgress,
+    CompressionPolicy,
+    ModBackup,
+    drop_members,
+    restore_members,
+    restore_zip,
+    unzip_backup,
+    write_files,
+    write_zip,
+)
+
+
+def make_files(root, num_files, size):
+    files = []
+    for i in range(num_files):
+        path = root / f"asset_{i}.bin"
+        path.write_bytes(i.to_bytes(4, "little") * (size // 4))
+        files.append((path, f"Mods/Images/asset_{i}.bin", size))
+    return files
+
+
+def test_write_files(tmp_path):
+    files = make_files(tmp_path, 20, 4096)
+    big = tmp_path / "big.bin"
+    big.write_bytes(b"\1" * (READ_AHEAD_MAX_FILE + 1))
+    files.insert(5, (big, "Mods/Models/big.bin", READ_AHEAD_MAX_FILE + 1))
+
+    written = []
+    with ThreadPoolExecutor(4) as readers:
+        with ZipFile(tmp_path / "mod.zip", "w") as modzip:
+            assert write_files(
+                modzip,
+                files,
+                readers,
+                on_written=lambda filepath, size: written.append(filepath),
+            )
+
+    # Written in order, with their own mtimes
+    assert written == [filepath for filepath, _, _ in files]
+    with ZipFile(tmp_path / "mod.zip") as modzip:
+        assert modzip.namelist() == [arcname for _, arcname, _ in files]
+        for filepath, arcname, _ in files:
+            assert modzip.read(arcname) == filepath.read_bytes()
+            # Zips keep times to 2 seconds
+            date_time = ZipInfo.from_file(filepath, arcname).date_time
+            date_time = (*date_time[:5], date_time[5] // 2 * 2)
+            assert modzip.getinfo(arcname).date_time == date_time
+
+
+def test_unreadable_file(tmp_path):
+    files = make_files(tmp_path, 3, 100)
+    files.insert(1, (tmp_path / "missing.bin", "Mods/Images/missing.bin", 100))
+
+    errors = []
+    with ThreadPoolExecutor(2) as readers:
+        with ZipFile(tmp_path / "mod.zip", "w") as modzip:
+            assert write_files(
+                modzip,
+                files,
+                readers,
+                on_error=lambda filepath, error: errors.append(filepath),
+            )
+    assert errors == [tmp_path / "missing.bin"]
+    with ZipFile(tmp_path / "mod.zip") as modzip:
+        assert len(modzip.namelist()) == 3
+
+
+def test_cancelled(tmp_path):
+    files = make_files(tmp_path, 10, 100)
+    written = []
+    with ThreadPoolExecutor(2) as readers:
+        with ZipFile(tmp_path / "mod.zip", "w") as modzip:
+            assert not write_files(
+                modzip,
+                files,
+                readers,
+                is_cancelled=lambda: len(written) == 3,
+                on_written=lambda filepath, size: written.append(filepath),
+            )
+    assert len(written) == 3
+
+
+def test_progress():
+    progress = BackupProgress()
+    assert progress.start("a.json", 100) == (0, 100, 0, 100)
+    assert progress.start("b.json", 50) == (0, 50, 0, 150)
+    assert progress.advance("a.json", 60) == (60, 100, 60, 150)
+    assert progress.advance("b.json", 10) == (10, 50, 70, 150)
+
+    # A mod smaller than expected doesn't leave the total short of done
+    assert progress.finish("b.json") == (10, 10, 70, 110)
+    assert progress.advance("a.json", 40) == (100, 100, 110, 110)
+    assert progress.finish("a.json") == (100, 100, 110, 110)
+
+    # The next backup starts afresh
+    assert progress.start("c.json", 10) == (0, 10, 0, 10)
+
+
+def test_concurrent_backups(tmp_path):
+    mods = []
+    for i in range(4):
+        (tmp_path / str(i)).mkdir()
+        mods.append(make_files(tmp_path / str(i), 20, 1024))
+
+    def backup(i, files):
+        with ZipFile(tmp_path / f"mod_{i}.zip", "w") as modzip:
+            assert write_files(modzip, files, readers)
+
+    # Mods backed up at once share the readers
+    with ThreadPoolExecutor(2) as backups, ThreadPoolExecutor(4) as readers:
+        list(backups.map(lambda args: backup(*args), enumerate(mods)))
+
+    for i, files in enumerate(mods):
+        with ZipFile(tmp_path / f"mod_{i}.zip") as modzip:
+            for filepath, arcname, _ in files:
+                assert modzip.read(arcname) == filepath.read_bytes()
+
+
+@pytest.mark.benchmark
+def test_backup_throughput(tmp_path):
+    mods = []
+    for i in range(4):
+        (tmp_path / str(i)).mkdir()
+        mods.append(make_files(tmp_path / str(i), 200, 64 * 1024))
+
+    def backup(i, files, readers):
+        with ZipFile(tmp_path / f"mod_{i}.zip", "w") as modzip:
+            if readers is None:
+                for filepath, arcname, _ in files:
+                    modzip.write(filepath, arcname)
+            else:
+                write_files(modzip, files, readers)
+
+    start = time.perf_counter()
+    for i, files in enumerate(mods):
+        backup(i, files, None)
+    serial = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(2) as backups, ThreadPoolExecutor(4) as readers:
+        list(backups.map(lambda args: backup(*args, readers), enumerate(mods)))
+    pooled = time.perf_counter() - start
+
+    for i, files in enumerate(mods):
+        with ZipFile(tmp_path / f"mod_{i}.zip") as modzip:
+            assert len(modzip.namelist()) == len(files)
+    print(f"4 mods of 200 assets: {serial:.2f}s serial, {pooled:.2f}s pooled")
+
+
+def test_compression_policy():
+    policy = CompressionPolicy(level=1)
+    text = b"v 0.000000 1.000000 0.500000\n" * 100
+    noise = os.urandom(10000)
+    assert policy.choose("Mods/Images/a.png", text) == (ZIP_STORED, None)
+    assert policy.choose("Mods/Audio/a.MP3", text) == (ZIP_STORED, None)
+    assert policy.choose("Mods/Models/a.obj", noise) == (ZIP_DEFLATED, 1)
+    assert policy.choose("Mods/Workshop/1.json") == (ZIP_DEFLATED, 1)
+    assert policy.choose("Mods/PDF/a.PDF") == (ZIP_DEFLATED, 1)
+
+    # Unknown types are sampled
+    assert policy.choose("Mods/Images Raw/a.rawt", text) == (ZIP_DEFLATED, 1)
+    assert policy.choose("Mods/Images Raw/a.rawt", noise) == (ZIP_STORED, None)
+    assert CompressionPolicy(1, sniff=False).choose("a.rawt", noise) == (
+        ZIP_DEFLATED,
+        1,
+    )
+    assert STORE_ALL.choose("Mods/Models/a.obj", text) == (ZIP_STORED, None)
+
+
+def make_mod(root):
+    """Files in the proportions of a typical mod: mostly images and
+    bundles, with some models and the save itself."""
+    random.seed(1)
+    files = []
+
+    def add(arcname, data):
+        path = root / arcname.replace("/", "_")
+        path.write_bytes(data)
+        files.append((path, arcname, len(data)))
+
+    for i in range(40):
+        add(f"Mods/Images/{i}.png", os.urandom(256 * 1024))
+    for i in range(4):
+        add(f"Mods/Assetbundles/{i}.unity3d", os.urandom(1024 * 1024))
+    for i in range(8):
+        lines = [
+            f"v {random.uniform(-1, 1):.6f} {random.uniform(-1, 1):.6f} "
+            f"{random.uniform(-1, 1):.6f}\nvt {random.random():.6f} "
+            f"{random.random():.6f}\n"
+            for _ in range(10000)
+        ]
+        add(f"Mods/Models/{i}.obj", "".join(lines).encode())
+    save = {
+        "ObjectStates": [
+            {
+                "Name": "Card",
+                "Transform": {"posX": random.random(), "posY": 1.0},
+                "CustomImage": {"ImageURL": f"http://a.com/{i}.png"},
+            }
+            for i in range(5000)
+        ]
+    }
+    add("Mods/Workshop/1.json", json.dumps(save, indent=2).encode())
+    return files
+
+
+def test_compression(tmp_path):
+    files = []
+    for arcname, data in [
+        ("Mods/Images/0.png", os.urandom(16 * 1024)),
+        ("Mods/Models/0.obj", b"v 0.000000 1.000000 0.500000\n" * 1000),
+        ("Mods/Workshop/1.json", json.dumps({"ObjectStates": [{}] * 1000}).encode()),
+    ]:
+        path = tmp_path / arcname.replace("/", "_")
+        path.write_bytes(data)
+        files.append((path, arcname, len(data)))
+
+    with ThreadPoolExecutor(2) as readers:
+        with ZipFile(tmp_path / "mod.zip", "w") as modzip:
+            assert write_files(modzip, files, readers, policy=CompressionPolicy(1))
+
+    with ZipFile(tmp_path / "mod.zip") as modzip:
+        assert modzip.getinfo("Mods/Images/0.png").compress_type == ZIP_STORED
+        assert modzip.getinfo("Mods/Models/0.obj").compress_type == ZIP_DEFLATED
+        assert modzip.getinfo("Mods/Workshop/1.json").compress_type == ZIP_DEFLATED
+        for filepath, arcname, _ in files:
+            assert modzip.read(arcname) == filepath.read_bytes()
+
+
+@pytest.mark.benchmark
+def test_compression_benchmark(tmp_path):
+    files = make_mod(tmp_path)
+    results = {}
+    with ThreadPoolExecutor(2) as readers:
+        for name, policy in [
+            ("stored", STORE_ALL),
+            ("policy", CompressionPolicy(1)),
+            ("deflate all", CompressionPolicy(6, sniff=False)),
+        ]:
+            if name == "deflate all":
+                # Everything through the compressor, as a zip tool would
+                policy.STORED = set()
+            zip_path = tmp_path / f"{name}.zip"
+            start = time.perf_counter()
+            with ZipFile(zip_path, "w") as modzip:
+                assert write_files(modzip, files, readers, policy=policy)
+            results[name] = (time.perf_counter() - start, zip_path.stat().st_size)
+
+    assert results["policy"][1] < 0.9 * results["stored"][1]
+    assert results["policy"][0] < results["deflate all"][0]
+    for name, (seconds, size) in results.items():
+        print(f"{name}: {seconds:.2f}s, {size / 2**20:.1f} MiB")
+
+
+def zip_offsets(zip_path):
+    with ZipFile(zip_path) as modzip:
+        assert modzip.testzip() is None
+        return {info.filename: info.header_offset for info in modzip.infolist()}
+
+
+def test_update_zip(tmp_path):
+    files = make_files(tmp_path, 10, 4096)
+    zip_path = tmp_path / "mod.zip"
+    with ThreadPoolExecutor(2) as readers:
+        assert write_zip(zip_path, files, {"a.csv": "old"}, readers)
+        offsets = zip_offsets(zip_path)
+
+        files[3][0].write_bytes(b"changed")
+        del files[7]
+        new_file = tmp_path / "new.bin"
+        new_file.write_bytes(b"new")
+        files.append((new_file, "Mods/Images/new.bin", 3))
+        written = []
+        assert write_zip(
+            zip_path,
+            files,
+            {"a.csv": "new"},
+            readers,
+            on_written=lambda filepath, size: written.append(filepath),
+            max_dead=0.5,
+        )
+
+    # Only the changed and new files are written
+    assert written == [None, files[3][0], new_file]
+    new_offsets = zip_offsets(zip_path)
+    with ZipFile(zip_path) as modzip:
+        assert sorted(modzip.namelist()) == sorted(
+            [arcname for _, arcname, _ in files] + ["a.csv"]
+        )
+        for filepath, arcname, _ in files:
+            assert modzip.read(arcname) == filepath.read_bytes()
+            if filepath not in written:
+                assert new_offsets[arcname] == offsets[arcname]
+        assert modzip.read("a.csv") == b"new"
+
+
+def test_zip_internals(tmp_path):
+    # Updating zips in place relies on these, a Python upgrade may change them
+    assert CAN_UPDATE_ZIPS, "zipfile internals changed, zips will be rewritten"
+
+    files = make_files(tmp_path, 3, 100)
+    zip_path = tmp_path / "mod.zip"
+    with ThreadPoolExecutor(2) as readers:
+        assert write_zip(zip_path, files, {}, readers)
+    names = [arcname for _, arcname, _ in files]
+
+    with ZipFile(zip_path, "a") as modzip:
+        dropped = drop_members(modzip, names[:2])
+        assert [info.filename for info in dropped] == names[:2]
+        assert modzip.namelist() == names[2:]
+    with ZipFile(zip_path) as modzip:
+        assert modzip.namelist() == names[2:]
+
+    with ZipFile(zip_path, "a") as modzip:
+        restore_members(modzip, dropped)
+    with ZipFile(zip_path) as modzip:
+        assert sorted(modzip.namelist()) == names
+        assert modzip.testzip() is None
+
+
+def test_update_rewrites_dead_space(tmp_path):
+    files = make_files(tmp_path, 10, 4096)
+    zip_path = tmp_path / "mod.zip"
+    with ThreadPoolExecutor(2) as readers:
+        assert write_zip(zip_path, files, {}, readers)
+        size = zip_path.stat().st_size
+
+        for filepath, _, _ in files[:5]:
+            filepath.write_bytes(b"changed")
+        assert write_zip(zip_path, files, {}, readers, max_dead=0.25)
+
+    # Half the zip would be dead, so it was rewritten
+    assert zip_path.stat().st_size < size
+    with ZipFile(zip_path) as modzip:
+        assert modzip.read(files[0][1]) == b"changed"
+
+
+def test_cancelled_update(tmp_path):
+    files = make_files(tmp_path, 4, 100)
+    zip_path = tmp_path / "mod.zip"
+    with ThreadPoolExecutor(2) as readers:
+        assert write_zip(zip_path, files, {}, readers)
+        old = {arcname: filepath.read_bytes() for filepath, arcname, _ in files}
+
+        for filepath, _, _ in files:
+            filepath.write_bytes(b"changed")
+        assert not write_zip(
+            zip_path, files[:3], {}, readers, is_cancelled=lambda: True, max_dead=1
+        )
+
+    # Every member is still there
+    with ZipFile(zip_path) as modzip:
+        assert {name: modzip.read(name) for name in modzip.namelist()} == old
+
+
+def test_update_corrupt_backup(tmp_path):
+    files = make_files(tmp_path, 4, 100)
+    zip_path = tmp_path / "mod.zip"
+    with ThreadPoolExecutor(2) as readers:
+        assert write_zip(zip_path, files, {}, readers)
+        # Cut short, as by a crash part way through writing it
+        zip_path.write_bytes(zip_path.read_bytes()[:200])
+        assert write_zip(zip_path, files, {}, readers, max_dead=0.25)
+
+    with ZipFile(zip_path) as modzip:
+        assert modzip.testzip() is None
+        for filepath, arcname, _ in files:
+            assert modzip.read(arcname) == filepath.read_bytes()
+
+
+@pytest.mark.benchmark
+def test_update_benchmark(tmp_path):
+    files = make_files(tmp_path, 200, 1024 * 1024)
+    zip_path = tmp_path / "mod.zip"
+    with ThreadPoolExecutor(2) as readers:
+        assert write_zip(zip_path, files, {}, readers)
+        for filepath, _, _ in files[:2]:
+            filepath.write_bytes(os.urandom(1024 * 1024))
+            # Same size, so only a later time shows it changed
+            os.utime(filepath, (time.time() + 10, time.time() + 10))
+
+        start = time.perf_counter()
+        assert write_zip(tmp_path / "full.zip", files, {}, readers)
+        full = time.perf_counter() - start
+
+        start = time.perf_counter()
+        assert write_zip(zip_path, files, {}, readers, max_dead=0.25)
+        incremental = time.perf_counter() - start
+
+    with ZipFile(zip_path) as modzip:
+        assert modzip.read(files[0][1]) == files[0][0].read_bytes()
+    assert incremental < full
+    print(
+        f"200 MiB backup, 2 assets changed: {full:.2f}s rewritten, "
+        f"{incremental:.2f}s updated"
+    )
+
+
+def test_restore_zip(tmp_path):
+    files = make_files(tmp_path, 5, 1000)
+    zip_path = tmp_path / "mod.zip"
+    with ThreadPoolExecutor(2) as readers:
+        assert write_zip(zip_path, files, {"content_names.csv": ""}, readers)
+    with ZipFile(zip_path, "a") as modzip:
+        modzip.writestr("../outside.bin", b"no")
+
+    dest = tmp_path / "restored"
+    newer = dest / "Mods" / "Images" / "asset_1.bin"
+    newer.parent.mkdir(parents=True)
+    newer.write_bytes(b"newer")
+    os.utime(newer, (time.time() + 60, time.time() + 60))
+
+    progress = []
+    restored = restore_zip(
+        zip_path, dest, on_progress=lambda **kwargs: progress.append(kwargs)
+    )
+    assert sorted(restored) == [files[i][1] for i in (0, 2, 3, 4)]
+    assert progress[0] == {"total": 4000}
+    assert sum(update.get("advance", 0) for update in progress) == 4000
+    assert newer.read_bytes() == b"newer"
+    assert not (tmp_path / "outside.bin").exists()
+    assert not (dest / "content_names.csv").exists()
+    for i in (0, 2, 3, 4):
+        filepath, arcname, _ = files[i]
+        restored_path = dest / arcname
+        assert restored_path.read_bytes() == filepath.read_bytes()
+        # Restored with the time it was backed up
+        assert abs(restored_path.stat().st_mtime - filepath.stat().st_mtime) < 2
+
+    # Nothing is newer the second time
+    assert restore_zip(zip_path, dest) == []
+
+
+def test_unzip_backup_records_assets(tts_db, tmp_path):
+    with sqlite3.connect(tts_db) as db:
+        db.execute(
+            """
+            INSERT INTO tts_assets (
+                asset_url, asset_path, asset_filename, asset_ext, asset_dl_status)
+            VALUES ('http://a.com/0.png', 'Images', 'asset_0', '.bin', 'HTTPError 404')
+            """
+        )
+    files = make_files(tmp_path, 2, 100)
+    files.append((files[0][0], "Mods/Workshop/1.json", 100))
+    zip_path = tmp_path / "mod.zip"
+    with ThreadPoolExecutor(2) as readers:
+        assert write_zip(
+            zip_path,
+            files,
+            {"content_names.csv": "Images/asset_0.bin\tzero.png\thttp://a.com/0.png\n"},
+            readers,
+        )
+
+    assert unzip_backup(zip_path, tmp_path / "restored", "1.json") == "1.json"
+    with sqlite3.connect(tts_db) as db:
+        rows = db.execute(
+            """
+            SELECT asset_url, asset_filename, asset_size, asset_dl_status,
+                asset_content_name
+            FROM tts_assets ORDER BY asset_filename
+            """
+        ).fetchall()
+    assert rows == [
+        ("http://a.com/0.png", "asset_0", 100, "", "zero.png"),
+        (None, "asset_1", 100, "", ""),
+    ]
+
+
+@pytest.mark.benchmark
+def test_restore_benchmark(tmp_path):
+    files = make_files(tmp_path, 200, 1024 * 1024)
+    zip_path = tmp_path / "mod.zip"
+    with ThreadPoolExecutor(2) as readers:
+        assert write_zip(zip_path, files, {}, readers)
+
+    start = time.perf_counter()
+    with ZipFile(zip_path) as modzip:
+        modzip.extractall(tmp_path / "extractall")
+    extractall = time.perf_counter() - start
+
+    start = time.perf_counter()
+    assert len(restore_zip(zip_path, tmp_path / "restored", 4)) == 200
+    parallel = time.perf_counter() - start
+
+    start = time.perf_counter()
+    assert restore_zip(zip_path, tmp_path / "restored", 4) == []
+    again = time.perf_counter() - start
+
+    print(
+        f"200 MiB restore: {extractall:.2f}s extractall, {parallel:.2f}s "
+        f"parallel, {again:.2f}s when up to date"
+    )
+
+
+class BackupApp(App):
+    """Just enough of the app for backups to run in."""
+
+    def __init__(self):
+        super().__init__()
+        self.backup = ModBackup()
+        self.completed = []
+
+    def compose(self):
+        yield self.backup
+
+    def on_mod_backup_backup_complete(self, event):
+        self.completed.append((event.filename, event.failed))
+
+
+def test_failed_backup_completes(tts_db, tmp_path, monkeypatch):
+    def fail(self, mod_filename, *args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(ModBackup, "backup_mod", fail)
+
+    async def backup():
+        app = BackupApp()
+        async with app.run_test() as pilot:
+            app.run_worker(app.backup.backup_daemon, thread=True)
+            app.backup.add_mods([("Workshop/1.json", tmp_path / "1.zip", None)])
+            deadline = time.time() + 5
+            while len(app.completed) == 0 and time.time() < deadline:
+                await pilot.pause(0.05)
+            app.workers.cancel_all()
+        return app.completed
+
+    # The mod's row is told the backup is over
+    assert asyncio.run(backup()) == [("Workshop/1.json", True)]
@@ -0,0 +1,207 @@
+import hashlib
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from zipfile import ZipFile
+
+import pytest
+
+from ttsmutility.workers.backup import write_files
+from ttsmutility.workers.backupstore import (
+    BackupStore,
+    make_manifest,
+    read_manifest,
+    restore_manifest,
+    store_files,
+    write_manifest,
+)
+
+
+def sha1(data):
+    return hashlib.sha1(data).hexdigest().upper()
+
+
+def make_files(root, contents):
+    files = []
+    for i, data in enumerate(contents):
+        path = root / f"asset_{i}.bin"
+        path.write_bytes(data)
+        files.append((path, f"Mods/Images/asset_{i}.bin", len(data), None))
+    return files
+
+
+def test_add_file(tmp_path):
+    store = BackupStore(tmp_path / "backups")
+    (tmp_path / "a.bin").write_bytes(b"same")
+    (tmp_path / "b.bin").write_bytes(b"same")
+
+    assert store.add_file(tmp_path / "a.bin") == (sha1(b"same"), True)
+    assert store.add_file(tmp_path / "b.bin") == (sha1(b"same"), False)
+    assert store.blob_path(sha1(b"same")).read_bytes() == b"same"
+    assert len(list(store.blob_dir.rglob("*"))) == 2
+
+    # A wrong SHA1 is corrected by hashing the copy
+    (tmp_path / "c.bin").write_bytes(b"other")
+    assert store.add_file(tmp_path / "c.bin", "0" * 40) == (sha1(b"other"), True)
+    assert not store.has("0" * 40)
+
+
+def test_known_sha1_isnt_read(tmp_path):
+    store = BackupStore(tmp_path / "backups")
+    (tmp_path / "a.bin").write_bytes(b"stored")
+    store.add_file(tmp_path / "a.bin")
+
+    path = tmp_path / "b.bin"
+    path.write_bytes(b"changed")
+    stat = path.stat()
+    fingerprint = (sha1(b"stored"), stat.st_size, stat.st_mtime_ns)
+    with ThreadPoolExecutor(2) as readers:
+        # Unchanged since it was hashed, so the recorded SHA1 is used
+        entries = store_files(
+            store, [(path, "Mods/Images/b.bin", 7, fingerprint)], readers
+        )
+        assert entries[0][1] == sha1(b"stored")
+
+        # Changed since, so it's hashed again
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        entries = store_files(
+            store, [(path, "Mods/Images/b.bin", 7, fingerprint)], readers
+        )
+        assert entries[0][1] == sha1(b"changed")
+
+
+def test_store_files(tmp_path):
+    store = BackupStore(tmp_path / "backups")
+    files = make_files(tmp_path, [b"a", b"b", b"a"])
+    files.insert(1, (tmp_path / "missing.bin", "Mods/Images/missing.bin", 1, None))
+
+    stored = []
+    errors = []
+    with ThreadPoolExecutor(2) as readers:
+        entries = store_files(
+            store,
+            files,
+            readers,
+            on_stored=lambda filepath, size, written: stored.append(written),
+            on_error=lambda filepath, error: errors.append(filepath),
+        )
+        assert errors == [tmp_path / "missing.bin"]
+        assert [entry[:3] for entry in entries] == [
+            ["Mods/Images/asset_0.bin", sha1(b"a"), 1],
+            ["Mods/Images/asset_1.bin", sha1(b"b"), 1],
+            ["Mods/Images/asset_2.bin", sha1(b"a"), 1],
+        ]
+        assert stored == [True, True, False]
+
+        assert store_files(store, files[:1], readers, is_cancelled=lambda: True) is None
+
+
+def test_restore(tts_db, tmp_path):
+    with sqlite3.connect(tts_db) as db:
+        db.execute(
+            """
+            INSERT INTO tts_assets (asset_url, asset_path, asset_filename, asset_ext)
+            VALUES ('http://a.com/0.bin', 'Images', 'asset_0', '.bin')
+            """
+        )
+
+    store = BackupStore(tmp_path / "backups")
+    files = make_files(tmp_path, [b"zero", b"one"])
+    with ThreadPoolExecutor(2) as readers:
+        entries = store_files(store, files, readers)
+    manifest_path = tmp_path / "backups" / "Mod [1].manifest.json"
+    rows = {
+        "missing_assets": [],
+        "invalid_urls": [],
+        "content_names": [["Images/asset_0.bin", "zero.png", "http://a.com/0.bin"]],
+    }
+    write_manifest(
+        manifest_path,
+        make_manifest({"filename": "Workshop/1.json", "name": "Mod"}, entries, rows),
+    )
+    assert read_manifest(manifest_path)["files"] == entries
+
+    dest = tmp_path / "restored"
+    (dest / "Mods" / "Images").mkdir(parents=True)
+    # Newer than the backup, so left alone
+    newer = dest / "Mods" / "Images" / "asset_1.bin"
+    newer.write_bytes(b"newer")
+    os.utime(newer, (time.time() + 60, time.time() + 60))
+
+    assert restore_manifest(manifest_path, dest, "1.json") == "1.json"
+    restored = dest / "Mods" / "Images" / "asset_0.bin"
+    assert restored.read_bytes() == b"zero"
+    assert restored.stat().st_mtime == files[0][0].stat().st_mtime
+    assert newer.read_bytes() == b"newer"
+    with sqlite3.connect(tts_db) as db:
+        assert db.execute(
+            "SELECT asset_content_name, asset_size, asset_mtime FROM tts_assets"
+        ).fetchall() == [("zero.png", 4, files[0][0].stat().st_mtime)]
+
+
+def test_shared_files_stored_once(tmp_path):
+    shared = [os.urandom(100) for _ in range(5)]
+    store = BackupStore(tmp_path / "backups")
+    written = []
+    with ThreadPoolExecutor(2) as readers:
+        for i in range(3):
+            (tmp_path / str(i)).mkdir()
+            files = make_files(tmp_path / str(i), shared + [os.urandom(100)])
+            store_files(
+                store, files, readers, on_stored=lambda f, s, w: written.append(w)
+            )
+        assert sum(written) == 5 + 3
+        assert len(list(store.blob_dir.rglob("*/*"))) == 5 + 3
+
+        # Backing up again writes nothing
+        del written[:]
+        store_files(store, files, readers, on_stored=lambda f, s, w: written.append(w))
+        assert written == [False] * 6
+
+
+@pytest.mark.benchmark
+def test_library_benchmark(tmp_path):
+    # Mods sharing most of their assets, as mods of one game do
+    shared = [os.urandom(64 * 1024) for _ in range(80)]
+    mods = []
+    for i in range(10):
+        (tmp_path / str(i)).mkdir()
+        contents = shared + [os.urandom(64 * 1024) for _ in range(20)]
+        mods.append(make_files(tmp_path / str(i), contents))
+
+    with ThreadPoolExecutor(4) as readers:
+        start = time.perf_counter()
+        for i, files in enumerate(mods):
+            with ZipFile(tmp_path / f"{i}.zip", "w") as modzip:
+                write_files(modzip, [entry[:3] for entry in files], readers)
+        zip_time = time.perf_counter() - start
+        zip_size = sum((tmp_path / f"{i}.zip").stat().st_size for i in range(10))
+
+        store = BackupStore(tmp_path / "backups")
+        written = []
+        start = time.perf_counter()
+        for files in mods:
+            store_files(
+                store, files, readers, on_stored=lambda f, s, w: written.append(w)
+            )
+        store_time = time.perf_counter() - start
+        store_size = sum(p.stat().st_size for p in store.blob_dir.rglob("*/*"))
+
+        # Backing up again writes nothing
+        assert sum(written) == 80 + 10 * 20
+        del written[:]
+        start = time.perf_counter()
+        for files in mods:
+            store_files(
+                store, files, readers, on_stored=lambda f, s, w: written.append(w)
+            )
+        again_time = time.perf_counter() - start
+        assert not any(written)
+
+    assert store_size < zip_size / 3
+    print(
+        f"10 mods: zips {zip_size / 2**20:.1f} MiB in {zip_time:.2f}s, "
+        f"store {store_size / 2**20:.1f} MiB in {store_time:.2f}s, "
+        f"{again_time:.2f}s again"
+    )
@@ -0,0 +1,82 @@
+import time
+
+import pytest
+
+from ttsmutility.workers.bandwidth import (
+    PAUSED,
+    BandwidthLimiter,
+    RateWindow,
+    parse_windows,
+)
+
+
+def test_parse_windows():
+    windows = parse_windows("09:00-17:30=256, 23:00-07:00=paused,17:30-23:00=0")
+    assert windows == [
+        RateWindow(9 * 60, 17 * 60 + 30, 256 * 1024),
+        RateWindow(23 * 60, 7 * 60, PAUSED),
+        RateWindow(17 * 60 + 30, 23 * 60, None),
+    ]
+    assert parse_windows("") == []
+
+    for spec in ["9-17=256", "09:00-17:00", "25:00-01:00=1", "09:00-10:00=-1"]:
+        with pytest.raises(ValueError):
+            parse_windows(spec)
+
+
+def test_window_past_midnight():
+    window = RateWindow(23 * 60, 7 * 60, PAUSED)
+    assert window.contains(23 * 60)
+    assert window.contains(0)
+    assert not window.contains(7 * 60)
+    assert not window.contains(12 * 60)
+
+
+def test_rate_by_time_of_day():
+    noon = time.mktime((2024, 1, 1, 12, 0, 0, 0, 0, -1))
+    night = time.mktime((2024, 1, 1, 23, 30, 0, 0, 0, -1))
+    limiter = BandwidthLimiter(1000, parse_windows("23:00-07:00=paused"))
+    assert limiter.rate(noon) == 1000
+    assert limiter.rate(night) == PAUSED
+    assert limiter.reserve(100, now=0, wall=night) == -1
+    # Started again at the next minute, when the window may have ended
+    assert limiter.paused_delay(night + 15) == pytest.approx(45)
+    assert limiter.paused_delay(noon) == 0
+    assert BandwidthLimiter().rate(noon) is None
+
+
+def test_chunks_are_paid_for_in_order():
+    limiter = BandwidthLimiter(1000, burst=0.5)
+    # Each worker waits for the chunks reserved before its own
+    assert limiter.reserve(100, now=0) == pytest.approx(0.1)
+    assert limiter.reserve(100, now=0) == pytest.approx(0.2)
+    assert limiter.reserve(100, now=0) == pytest.approx(0.3)
+
+    # Unused bandwidth is saved up, but only up to the burst
+    assert limiter.reserve(0, now=10) == 0
+    assert limiter.reserve(500, now=10) == 0
+    assert limiter.reserve(100, now=10) == pytest.approx(0.1)
+
+
+def test_chunk_size_follows_rate():
+    assert BandwidthLimiter().chunk_size(1024 * 1024) == 1024 * 1024
+    assert BandwidthLimiter(256 * 1024).chunk_size(1024 * 1024) == 256 * 1024 // 10
+    assert BandwidthLimiter(1024).chunk_size(1024 * 1024) == 4096
+
+
+def test_consume_doesnt_stall_while_paused():
+    # Downloads already running when a pause starts are left to finish
+    limiter = BandwidthLimiter(windows=[RateWindow(0, 24 * 60, PAUSED)])
+    start = time.monotonic()
+    limiter.consume(1000)
+    assert time.monotonic() - start < 0.5
+    assert limiter.status() == "paused"
+
+
+def test_consume_limits_rate():
+    limiter = BandwidthLimiter(10000)
+    start = time.monotonic()
+    for _ in range(5):
+        limiter.consume(1000)
+    assert time.monotonic() - start >= 0.45
+    assert limiter.status() == "limit 10 KiB/s"
@@ -0,0 +1,323 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from ttsmutility.data.db import (
+    DB_MIN_SCHEMA_VERSION,
+    DB_SCHEMA_VERSION,
+    MIGRATIONS,
+    DbSchemaError,
+    set_blocking_db_reporter,
+    update_db_schema,
+    verify_mod_counts,
+)
+from ttsmutility.parse.AssetList import AssetList
+from ttsmutility.parse.ModList import ModList
+
+
+def test_async_api_does_not_block(tts_db):
+    blocked = []
+    set_blocking_db_reporter(blocked.append)
+    try:
+        asset_list = AssetList()
+        # Sync calls on the main thread are reported...
+        asset_list.get_content_names()
+        assert blocked == ["AssetList.get_content_names"]
+
+        # ...the async variants run on the DB executor and are not
+        blocked.clear()
+        assert asyncio.run(asset_list.get_mods_using_asset_a("http://x/1")) == []
+        assert asyncio.run(asset_list.find_asset_a("http://x/1")) == []
+        assert blocked == []
+    finally:
+        set_blocking_db_reporter(None)
+
+
+def add_rows(db_path):
+    with sqlite3.connect(db_path) as db:
+        db.executemany(
+            "INSERT INTO tts_mods (mod_filename) VALUES (?)",
+            [("Workshop/1.json",), ("Workshop/2.json",)],
+        )
+        db.executemany(
+            """
+            INSERT INTO tts_assets
+                (asset_url, asset_filename, asset_mtime, asset_size, asset_dl_status)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            [
+                ("http://x/1", "x1", 0, 0, ""),
+                ("http://x/2", "x2", 5, 100, ""),
+                ("http://x/3", "x3", 0, 0, "404"),
+            ],
+        )
+        db.executemany(
+            """
+            INSERT INTO tts_mod_assets
+                (asset_id_fk, mod_id_fk, mod_asset_trail, mod_asset_ignore_missing)
+            VALUES (
+                (SELECT id FROM tts_assets WHERE asset_url=?),
+                (SELECT id FROM tts_mods WHERE mod_filename=?),
+                "", ?)
+            """,
+            [
+                ("http://x/1", "Workshop/1.json", 0),
+                ("http://x/2", "Workshop/1.json", 0),
+                ("http://x/3", "Workshop/1.json", 0),
+                ("http://x/2", "Workshop/2.json", 0),
+                ("http://x/3", "Workshop/2.json", 1),
+            ],
+        )
+        db.commit()
+
+
+def test_mod_count_triggers(tts_db):
+    add_rows(tts_db)
+    mod_list = ModList()
+
+    def check(mod_filename, total, missing, invalid, size):
+        with sqlite3.connect(tts_db) as db:
+            assert verify_mod_counts(db, repair=False) == []
+        assert mod_list.get_mod_counts(mod_filename) == {
+            "total": total,
+            "missing": missing,
+            "invalid": invalid,
+            "size": size,
+        }
+
+    check("Workshop/1.json", 3, 2, 1, 100)
+    check("Workshop/2.json", 2, 0, 0, 100)
+
+    # Asset downloaded
+    asset_list = AssetList()
+    asset_list.set_dl_status("http://x/3", "")
+    with sqlite3.connect(tts_db) as db:
+        db.execute("UPDATE tts_assets SET asset_mtime=7, asset_size=50 WHERE id=1")
+    check("Workshop/1.json", 3, 1, 0, 150)
+
+    asset_list.set_ignore("Workshop/1.json", "http://x/3", True)
+    check("Workshop/1.json", 3, 0, 0, 150)
+
+    with sqlite3.connect(tts_db) as db:
+        db.execute("DELETE FROM tts_mod_assets WHERE asset_id_fk=2 AND mod_id_fk=1")
+    with sqlite3.connect(tts_db) as db:
+        db.execute("PRAGMA foreign_keys = ON")
+        db.execute("DELETE FROM tts_assets WHERE id=2")
+    check("Workshop/1.json", 2, 0, 0, 50)
+    check("Workshop/2.json", 1, 0, 0, 0)
+
+
+def test_check_mod_counts_repairs(tts_db):
+    add_rows(tts_db)
+    with sqlite3.connect(tts_db) as db:
+        db.execute("UPDATE tts_mods SET mod_size=-1 WHERE id=2")
+
+    assert ModList().check_mod_counts(repair=True) == ["Workshop/2.json"]
+    assert ModList().check_mod_counts(repair=False) == []
+
+
+def make_historic_db(db_path, version):
+    """Turn a fresh DB back into one with the given (older) schema version."""
+    with sqlite3.connect(db_path) as db:
+        db.execute("DROP TABLE tts_migrations")
+        if version < 12:
+            db.execute("DROP TABLE tts_hosts")
+        if version < 11:
+            for column in ["size", "mtime_ns", "inode"]:
+                db.execute(f"ALTER TABLE tts_assets DROP COLUMN asset_sha1_{column}")
+            db.execute("DROP TABLE tts_sha1_dirs")
+        if version < 10:
+            for column in ["etag", "last_modified", "checked_time"]:
+                db.execute(f"ALTER TABLE tts_assets DROP COLUMN asset_{column}")
+        if version < 9:
+            db.execute("ALTER TABLE tts_downloads DROP COLUMN dl_duration")
+        if version < 8:
+            db.execute("DROP TABLE tts_download_mods")
+            db.execute("DROP TABLE tts_downloads")
+        if version < 7:
+            for name in ["insert", "delete", "update"]:
+                db.execute(f"DROP TRIGGER tts_assets_fts_{name}")
+            db.execute("DROP TABLE tts_assets_fts")
+            db.execute("DROP INDEX tts_assets_sha1")
+            db.execute("DROP INDEX tts_assets_content_name")
+        if version < 6:
+            for (name,) in db.execute(
+                "SELECT name FROM sqlite_master WHERE type='trigger'"
+            ).fetchall():
+                db.execute(f"DROP TRIGGER {name}")
+            db.execute("ALTER TABLE tts_mods DROP COLUMN mod_needs_refresh")
+        if version < 5:
+            db.execute("ALTER TABLE tts_mods DROP COLUMN mod_invalid_assets")
+        if version < 4:
+            db.execute(
+                "ALTER TABLE tts_mod_assets DROP COLUMN mod_asset_ignore_missing"
+            )
+        if version < 3:
+            db.execute("ALTER TABLE tts_mods DROP COLUMN mod_max_asset_mtime")
+        db.execute("UPDATE tts_app SET db_schema_version=?", (version,))
+
+
+def get_columns(db_path):
+    with sqlite3.connect(db_path) as db:
+        return {
+            table: {row[1] for row in db.execute(f"PRAGMA table_info({table})")}
+            for (table,) in db.execute(
+                "SELECT name FROM sqlite_master WHERE type='table'"
+            ).fetchall()
+        }
+
+
+@pytest.mark.parametrize("version", range(DB_MIN_SCHEMA_VERSION, DB_SCHEMA_VERSION))
+def test_update_from_historic_versions(tts_db, tmp_path, version):
+    expected_columns = get_columns(tts_db)
+    make_historic_db(tts_db, version)
+    with sqlite3.connect(tts_db) as db:
+        # Before schema 6, -1 flagged mods waiting for an asset refresh
+        db.executemany(
+            "INSERT INTO tts_mods (mod_filename, mod_total_assets) VALUES (?, ?)",
+            [("Workshop/1.json", -1 if version < 6 else 0), ("Workshop/2.json", 0)],
+        )
+        db.executemany(
+            """
+            INSERT INTO tts_assets
+                (asset_url, asset_filename, asset_mtime, asset_size, asset_content_name)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            [
+                ("http://x/1", "x1", 0, 0, "Dragon Back.png"),
+                ("http://x/2", "x2", 5, 100, "Knight.png"),
+            ],
+        )
+        db.executemany(
+            """
+            INSERT INTO tts_mod_assets (asset_id_fk, mod_id_fk, mod_asset_trail)
+            VALUES (?, ?, "")
+            """,
+            [(1, 1), (2, 1), (2, 2)],
+        )
+
+    migrated = []
+    assert (
+        update_db_schema(tts_db, log=migrated.append, batch_size=1) == DB_SCHEMA_VERSION
+    )
+    assert len(migrated) == DB_SCHEMA_VERSION - version
+    assert get_columns(tts_db) == expected_columns
+
+    mod_list = ModList()
+    # Schema 5 added invalid counts as -1, flagging every mod
+    needs_refresh = {
+        4: ["Workshop/1.json", "Workshop/2.json"],
+        5: ["Workshop/1.json"],
+        6: [],
+    }
+    assert (
+        mod_list.get_mods_needing_asset_refresh()
+        == needs_refresh[min(max(version, 4), 6)]
+    )
+    assert mod_list.get_mod_counts("Workshop/1.json") == {
+        "total": 2,
+        "missing": 1,
+        "invalid": 0,
+        "size": 100,
+    }
+    assert AssetList().find_asset("http://y/Dragon%20Back.png")[0][0][0] == (
+        "http://x/1"
+    )
+
+    # Nothing left to do
+    assert update_db_schema(tts_db, log=migrated.append) == DB_SCHEMA_VERSION
+    assert len(migrated) == DB_SCHEMA_VERSION - version
+
+
+def test_update_resumes_after_interruption(tts_db, monkeypatch):
+    # Indexing content names is the migration with a backfill
+    migration = MIGRATIONS[7 - 3]
+    assert migration.version == 7
+    make_historic_db(tts_db, migration.version - 1)
+    with sqlite3.connect(tts_db) as db:
+        db.executemany(
+            """
+            INSERT INTO tts_assets (asset_url, asset_filename, asset_content_name)
+            VALUES (?, ?, ?)
+            """,
+            [(f"http://x/{i}", f"x{i}", f"Card {i}.png") for i in range(1, 6)],
+        )
+
+    backfill = migration.backfill
+    ranges = []
+
+    def interrupted_backfill(db, first, last):
+        if len(ranges) == 2:
+            raise KeyboardInterrupt
+        ranges.append((first, last))
+        backfill(db, first, last)
+
+    monkeypatch.setattr(migration, "backfill", interrupted_backfill)
+    with pytest.raises(KeyboardInterrupt):
+        update_db_schema(tts_db, batch_size=2)
+    with sqlite3.connect(tts_db) as db:
+        assert db.execute("SELECT db_schema_version FROM tts_app").fetchone()[0] == (
+            migration.version - 1
+        )
+
+    ranges.append("resumed")
+    assert update_db_schema(tts_db, batch_size=2) == DB_SCHEMA_VERSION
+    assert ranges == [(1, 2), (3, 4), "resumed", (5, 5)]
+    # Each asset was indexed exactly once
+    with sqlite3.connect(tts_db) as db:
+        assert db.execute(
+            "SELECT COUNT(*) FROM tts_assets_fts WHERE tts_assets_fts MATCH 'Card'"
+        ).fetchone() == (5,)
+        assert db.execute(
+            "SELECT complete FROM tts_migrations WHERE version=?",
+            (migration.version,),
+        ).fetchone() == (1,)
+
+
+@pytest.mark.parametrize("version", [0, 1, DB_SCHEMA_VERSION + 1])
+def test_update_unsupported_versions(tts_db, version):
+    with sqlite3.connect(tts_db) as db:
+        db.execute("UPDATE tts_app SET db_schema_version=?", (version,))
+    with pytest.raises(DbSchemaError):
+        update_db_schema(tts_db)
+
+
+def test_find_asset_search_index(tts_db):
+    with sqlite3.connect(tts_db) as db:
+        db.executemany(
+            """
+            INSERT INTO tts_assets
+                (asset_url, asset_filename, asset_ext, asset_content_name)
+            VALUES (?, ?, ?, ?)
+            """,
+            [
+                ("http://x/1", "x1", ".png", "dragon back.png"),
+                ("http://x/2", "x2", ".png", "Big Dragon Back v2.png"),
+                ("http://x/3", "x3", ".jpg", "Dragon Back.jpg"),
+                ("http://x/4", "x4", ".png", "ab.png"),
+            ],
+        )
+    asset_list = AssetList()
+
+    matches = asset_list.find_asset("http://y/Dragon%20Back.png")
+    assert matches == [
+        (("http://x/1", "dragon back.png"), "Exact Name"),
+        (("http://x/2", "Big Dragon Back v2.png"), "Fuzzy Match"),
+    ]
+
+    # Too short for the trigram index
+    assert asset_list.find_asset("http://y/ab.png") == [
+        (("http://x/4", "ab.png"), "Exact Name")
+    ]
+
+    # Index follows updates and deletes
+    asset_list.set_content_names(["http://x/2"], ["Red Knight.png"])
+    with sqlite3.connect(tts_db) as db:
+        db.execute("DELETE FROM tts_assets WHERE asset_url='http://x/1'")
+    assert asset_list.find_asset("http://y/Dragon%20Back.png") == []
+    assert asset_list.find_asset("http://y/Knight.png")[0][0][0] == "http://x/2"
+
+    assert asset_list.find_assets_with_matches(
+        [("http://y/Knight.png", ""), ("http://y/Missing.png", "")]
+    ) == ["http://y/Knight.png"]
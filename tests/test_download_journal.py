@@ -0,0 +1,132 @@
+import sqlite3
+import time
+from pathlib import Path
+
+from ttsmutility.parse.DownloadJournal import DownloadJournal
+from ttsmutility.parse.FileFinder import recodeURL
+from ttsmutility.parse.HostCapabilities import HostCapabilities
+
+TRAIL = ["ObjectStates", "CustomImage", "ImageURL"]
+
+
+def get_jobs(db_path):
+    with sqlite3.connect(db_path) as db:
+        return {
+            url: (state, attempts)
+            for url, state, attempts in db.execute(
+                "SELECT dl_url, dl_state, dl_attempts FROM tts_downloads"
+            )
+        }
+
+
+def test_outstanding_downloads_are_resumed(tts_db):
+    journal = DownloadJournal()
+    journal.queue(["http://h/1", "http://h/2", "http://h/3"], [TRAIL] * 3, "a.json")
+    journal.queue(["http://h/3", "http://h/4"], [TRAIL] * 2, "b.json")
+    journal.start("http://h/1")
+    journal.finish("http://h/1", "", 10, 10, True)
+    journal.start("http://h/2")
+    journal.finish("http://h/2", "HTTPError 404 (Not Found)", 0, 0, False)
+    # Interrupted
+    journal.start("http://h/3")
+    journal.close()
+
+    assert get_jobs(tts_db) == {
+        "http://h/1": ("done", 1),
+        "http://h/2": ("failed", 1),
+        "http://h/3": ("running", 1),
+        "http://h/4": ("queued", 0),
+    }
+    assert DownloadJournal().get_outstanding() == {
+        "a.json": (["http://h/3"], [TRAIL]),
+        "b.json": (["http://h/3", "http://h/4"], [TRAIL, TRAIL]),
+    }
+    assert get_jobs(tts_db)["http://h/3"] == ("queued", 1)
+
+
+def test_requeue_and_cancel(tts_db):
+    journal = DownloadJournal()
+    journal.queue(["http://h/1", "http://h/2"], [TRAIL] * 2, "a.json")
+    journal.queue(["http://h/2"], [TRAIL], "b.json")
+    journal.start("http://h/1")
+    # Throttled, it will be tried again
+    journal.finish("http://h/1", "HTTPError 429", 0, 0, False, requeue=True)
+    journal.cancel("a.json")
+    journal.flush()
+
+    # Still wanted by b.json
+    assert get_jobs(tts_db) == {"http://h/2": ("queued", 0)}
+    assert journal.get_outstanding() == {"b.json": (["http://h/2"], [TRAIL])}
+
+    # Queueing a finished download again starts it over
+    journal.start("http://h/2")
+    journal.finish("http://h/2", "", 10, 10, False)
+    journal.queue(["http://h/2"], [TRAIL], "c.json")
+    journal.close()
+    assert get_jobs(tts_db) == {"http://h/2": ("queued", 0)}
+
+
+def test_old_jobs_and_partials_are_removed(tts_config, tts_db):
+    capabilities = HostCapabilities()
+    capabilities.record("plain", ranges=False)
+    journal = DownloadJournal(retention=0, capabilities=capabilities)
+    images = Path(tts_config.tts_mods_dir) / "Images"
+    images.mkdir(parents=True)
+    partials = {}
+    urls = ["http://h/ranged.png", "http://h/first.png", "http://plain/a.png"]
+    for url in urls:
+        partials[url] = images / (recodeURL(url) + ".tmp")
+        partials[url].write_bytes(b"partial")
+
+    journal.queue(["http://h/done.png"], [TRAIL], "a.json")
+    journal.finish("http://h/done.png", "", 10, 10, False)
+    journal.queue(urls, [TRAIL] * 3, "a.json")
+    journal.start("http://h/ranged.png")
+    journal.finish("http://h/ranged.png", "Retries exhausted", 7, 10, True)
+    journal.queue(["http://h/ranged.png"], [TRAIL], "a.json")
+    # Interrupted on its first attempt, before Accept-Ranges was recorded
+    journal.start("http://h/first.png")
+    journal.start("http://plain/a.png")
+    journal.close()
+
+    assert journal.get_outstanding() == {"a.json": (urls, [TRAIL] * 3)}
+    assert "http://h/done.png" not in get_jobs(tts_db)
+    # Only hosts known not to support ranges lose their partial download
+    assert partials["http://h/ranged.png"].exists()
+    assert partials["http://h/first.png"].exists()
+    assert not partials["http://plain/a.png"].exists()
+
+
+def test_history(tts_db):
+    journal = DownloadJournal()
+    journal.queue(["http://h/1", "http://h/2", "http://h/3"], [TRAIL] * 3, "a.json")
+    journal.finish("http://h/1", "HTTPError 404 (Not Found)", 0, 0, False, duration=2)
+    journal.finish("http://h/2", "", 10, 10, False, duration=1)
+
+    history = journal.get_history(0)
+    assert [(url, error, duration) for url, error, _, duration in history] == [
+        ("http://h/1", "HTTPError 404 (Not Found)", 2),
+        ("http://h/2", "", 1),
+    ]
+    assert journal.get_history(history[-1][2]) == []
+    journal.close()
+
+
+def test_background_flush_retries_after_error(tts_db, tmp_path):
+    errors = []
+    journal = DownloadJournal(flush_interval=0.05, on_error=errors.append)
+    journal.db_path = tmp_path / "missing" / "ttsmutility.sqlite"
+    journal.queue(["http://h/1"], [TRAIL], "a.json")
+
+    deadline = time.time() + 5
+    while journal.flush_errors < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    assert isinstance(errors[0], sqlite3.OperationalError)
+
+    # Still running, so the log is written once the DB can be opened
+    journal.db_path = Path(tts_db)
+    deadline = time.time() + 5
+    while len(get_jobs(tts_db)) == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    assert get_jobs(tts_db) == {"http://h/1": ("queued", 0)}
+    journal.close()
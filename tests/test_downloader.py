@@ -0,0 +1,393 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+from ttsmutility.parse.FileFinder import recodeURL
+from ttsmutility.parse.HostCapabilities import HostCapabilities
+from ttsmutility.workers.downloader import (
+    DownloadPool,
+    FileDownload,
+    make_download_session,
+)
+from ttsmutility.workers.bandwidth import PAUSED, BandwidthLimiter, RateWindow
+from ttsmutility.workers.resolver import AssetResolver
+from ttsmutility.workers.retry import RetryPolicy
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\0" * 512
+PNG_SHA1 = hashlib.sha1(PNG).hexdigest().upper()
+TRAIL = ["ObjectStates", "CustomImage", "ImageURL"]
+
+
+class AssetHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        if self.path.startswith("/busy") and self.path not in self.server.throttled:
+            self.server.throttled.add(self.path)
+            self.send_response(429)
+            self.send_header("Retry-After", "0.1")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.path.startswith("/ranged") and "Range" in self.headers:
+            start = int(self.headers["Range"].split("=")[1].rstrip("-"))
+            self.server.ranges.append(start)
+            self.send_response(206)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Content-Length", str(len(PNG) - start))
+            self.end_headers()
+            self.wfile.write(PNG[start:])
+            return
+        if self.path.startswith("/flaky") and self.path not in self.server.throttled:
+            self.server.throttled.add(self.path)
+            self.send_response(500)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.path.startswith("/missing"):
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        if self.path.startswith("/bad_length"):
+            # Body ends when the connection closes
+            self.send_header("Content-Length", "unknown")
+            self.send_header("Connection", "close")
+            self.close_connection = True
+        else:
+            self.send_header("Content-Length", str(len(PNG)))
+        self.end_headers()
+        self.wfile.write(PNG)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server(tts_config, monkeypatch):
+    os.makedirs(os.path.join(tts_config.tts_mods_dir, "Images"))
+    # Downloads are not mounted in an app, so there is nobody to post to
+    monkeypatch.setattr(FileDownload, "post_message", lambda self, message: True)
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), AssetHandler)
+    httpd.daemon_threads = True
+    httpd.lock = threading.Lock()
+    httpd.connections = 0
+    httpd.throttled = set()
+    httpd.ranges = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}", httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_download_asset(server):
+    base_url, _ = server
+    fd = FileDownload()
+
+    error, asset = fd.download(0, f"{base_url}/card.png", TRAIL)
+    assert error == ""
+    assert asset["filename"] == Path("Images") / (
+        recodeURL(f"{base_url}/card.png") + ".png"
+    )
+    assert asset["size"] == len(PNG)
+    assert asset["mtime"] > 0
+    assert asset["dl_status"] == ""
+    assert asset["content_name"] == "card.png"
+    # Worked out while downloading, the file isn't read again
+    assert asset["sha1"] == PNG_SHA1
+    assert asset["sha1_mtime"] == asset["mtime"]
+
+    # The extension comes from the content, not the url
+    error, asset = fd.download(0, f"{base_url}/photo.jpg", TRAIL)
+    assert error == ""
+    assert asset["filename"].suffix == ".png"
+
+    error, asset = fd.download(0, f"{base_url}/missing.png", TRAIL)
+    assert error == "HTTPError 404 (Not Found)"
+    assert asset["dl_status"] == error
+    assert asset["size"] == 0
+
+
+def test_malformed_content_length(server):
+    base_url, _ = server
+    fd = FileDownload()
+    error, asset = fd.download(0, f"{base_url}/bad_length.png", TRAIL)
+    assert error == ""
+    assert fd.content_length == 0
+    assert asset["sha1"] == PNG_SHA1
+
+
+def test_server_errors_are_retried(server):
+    base_url, _ = server
+    fd = FileDownload(retry_policy=RetryPolicy(base=0.01))
+
+    error, asset = fd.download(0, f"{base_url}/flaky.png", TRAIL)
+    assert error == ""
+    assert asset["size"] == len(PNG)
+
+    # Not worth retrying
+    start = time.perf_counter()
+    error, asset = fd.download(0, f"{base_url}/missing.png", TRAIL)
+    assert error == "HTTPError 404 (Not Found)"
+    assert time.perf_counter() - start < 1
+    assert fd.duration > 0
+
+
+def test_resume_partial_download(server, tts_config):
+    base_url, httpd = server
+    fd = FileDownload()
+
+    for path, ranges in [("ranged.png", [100]), ("plain.png", [])]:
+        partial = (
+            Path(tts_config.tts_mods_dir)
+            / "Images"
+            / (recodeURL(f"{base_url}/{path}") + ".tmp")
+        )
+        partial.write_bytes(PNG[:100])
+        httpd.ranges.clear()
+
+        error, asset = fd.download(0, f"{base_url}/{path}", TRAIL)
+        assert error == ""
+        assert httpd.ranges == ranges
+        assert fd.accept_ranges == (ranges != [])
+        # A host that ignores the range starts over rather than appending
+        assert (Path(tts_config.tts_mods_dir) / asset["filename"]).read_bytes() == PNG
+        assert asset["sha1"] == PNG_SHA1
+        assert not partial.exists()
+
+
+def test_no_range_for_host_without_ranges(server, tts_db, tts_config):
+    base_url, httpd = server
+    capabilities = HostCapabilities()
+    fd = FileDownload(capabilities=capabilities)
+
+    for path in ["plain.png", "ranged.png"]:
+        partial = (
+            Path(tts_config.tts_mods_dir)
+            / "Images"
+            / (recodeURL(f"{base_url}/{path}") + ".tmp")
+        )
+        partial.write_bytes(PNG[:100])
+        error, asset = fd.download(0, f"{base_url}/{path}", TRAIL)
+        assert error == ""
+        assert (Path(tts_config.tts_mods_dir) / asset["filename"]).read_bytes() == PNG
+
+    # plain.png showed the host ignores ranges, so none was asked for
+    assert httpd.ranges == []
+    assert capabilities.get("127.0.0.1").ranges is False
+    assert capabilities.get("127.0.0.1").latency > 0
+
+
+def test_download_rate_limit(server):
+    base_url, _ = server
+    fd = FileDownload(bandwidth=BandwidthLimiter(1024))
+
+    start = time.monotonic()
+    error, asset = fd.download(0, f"{base_url}/slow.png", TRAIL)
+    assert error == ""
+    assert time.monotonic() - start >= len(PNG) / 1024 - 0.05
+
+
+def test_no_downloads_start_while_paused(server):
+    base_url, httpd = server
+    bandwidth = BandwidthLimiter(windows=[RateWindow(0, 24 * 60, PAUSED)])
+
+    async def download():
+        pool = DownloadPool(2, max_per_host=2, bandwidth=bandwidth)
+        try:
+            task = asyncio.create_task(pool.download(f"{base_url}/paused.png", TRAIL))
+            await asyncio.sleep(0.2)
+            assert not task.done()
+            assert httpd.connections == 0
+
+            # The window ends
+            bandwidth.windows = []
+            pool.wakeup.set()
+            return await asyncio.wait_for(task, 5)
+        finally:
+            pool.close()
+
+    _, error, _ = asyncio.run(download())
+    assert error == ""
+
+
+def test_mirrors_are_tried_first(server, tts_db):
+    base_url, _ = server
+    resolver = AssetResolver(
+        [
+            (f"{base_url}/old/", f"{base_url}/missing/"),
+            (f"{base_url}/missing/", f"{base_url}/new/"),
+        ]
+    )
+    fd = FileDownload(resolver=resolver)
+
+    # The mirror is gone, fall back to the url itself
+    error, asset = fd.download(0, f"{base_url}/old/a.png", TRAIL)
+    assert error == ""
+    assert asset["filename"] == Path("Images") / (
+        recodeURL(f"{base_url}/old/a.png") + ".png"
+    )
+
+    # The url is gone, but the mirror has it
+    error, asset = fd.download(0, f"{base_url}/missing/b.png", TRAIL)
+    assert error == ""
+    assert asset["sha1"] == PNG_SHA1
+
+
+def test_local_match_is_copied(server, tts_db, tts_config):
+    base_url, httpd = server
+    fd = FileDownload(resolver=AssetResolver())
+    error, asset = fd.download(0, f"{base_url}/first.png", TRAIL)
+    assert error == ""
+    with sqlite3.connect(tts_db) as db:
+        db.executemany(
+            """
+            INSERT INTO tts_assets
+                (asset_url, asset_path, asset_filename, asset_ext, asset_mtime, asset_sha1)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (
+                    asset["url"],
+                    "Images",
+                    asset["filename"].stem,
+                    ".png",
+                    asset["mtime"],
+                    asset["sha1"],
+                ),
+                # We know what it should be from an earlier download
+                ("http://127.0.0.1:9/gone.png", "Images", "gone", ".png", 0, PNG_SHA1),
+            ],
+        )
+
+    connections = httpd.connections
+    error, asset = fd.download(0, "http://127.0.0.1:9/gone.png", TRAIL)
+    assert error == ""
+    assert httpd.connections == connections
+    assert asset["sha1"] == PNG_SHA1
+    assert (Path(tts_config.tts_mods_dir) / asset["filename"]).read_bytes() == PNG
+
+
+@pytest.mark.benchmark
+def test_pooled_download_throughput(server):
+    base_url, httpd = server
+    urls = [f"{base_url}/asset_{i}.png" for i in range(5000)]
+    num_downloads = 8
+
+    def connect_per_file(worker_num):
+        # What every download used to do, a new connection per file
+        for url in urls[worker_num::num_downloads]:
+            fd = FileDownload(session=make_download_session(1))
+            fd.download(worker_num, url, TRAIL)
+
+    threads = [
+        threading.Thread(target=connect_per_file, args=(i,))
+        for i in range(num_downloads)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    unpooled = time.perf_counter() - start
+    unpooled_connections = httpd.connections
+
+    async def pooled():
+        pool = DownloadPool(num_downloads, max_per_host=num_downloads)
+        try:
+            return await asyncio.gather(*(pool.download(url, TRAIL) for url in urls))
+        finally:
+            pool.close()
+
+    httpd.connections = 0
+    start = time.perf_counter()
+    results = asyncio.run(pooled())
+    pooled_time = time.perf_counter() - start
+
+    assert all(error == "" for _, error, _ in results)
+    assert unpooled_connections == len(urls)
+    assert httpd.connections <= num_downloads
+    print(
+        f"{len(urls)} files: {len(urls) / unpooled:.0f}/s new connections, "
+        f"{len(urls) / pooled_time:.0f}/s pooled"
+    )
+    assert pooled_time < unpooled
+
+
+def test_crashed_download_is_reported(tts_config):
+    errors = []
+
+    def crash(worker_num, url, trail):
+        raise RuntimeError("crashed")
+
+    async def download():
+        pool = DownloadPool(
+            1, max_per_host=1, on_error=lambda *args: errors.append(args)
+        )
+        pool.fds[0].download = crash
+        try:
+            with pytest.raises(RuntimeError):
+                await pool.download("http://a.com/crash.png", TRAIL)
+            # Let the task's callbacks run
+            await asyncio.sleep(0)
+            return pool.tasks
+        finally:
+            pool.close()
+
+    assert asyncio.run(download()) == set()
+    assert [(url, str(error)) for url, error in errors] == [
+        ("http://a.com/crash.png", "crashed")
+    ]
+
+
+def test_per_host_limit(server):
+    base_url, httpd = server
+
+    async def download():
+        pool = DownloadPool(8, max_per_host=2)
+        try:
+            return await asyncio.gather(
+                *(pool.download(f"{base_url}/limit_{i}.png", TRAIL) for i in range(50))
+            )
+        finally:
+            pool.close()
+
+    results = asyncio.run(download())
+    assert all(error == "" for _, error, _ in results)
+    assert httpd.connections <= 2
+
+
+def test_throttled_download_is_retried(server):
+    base_url, _ = server
+
+    async def download():
+        pool = DownloadPool(2, max_per_host=2)
+        try:
+            result = await pool.download(f"{base_url}/busy.png", TRAIL)
+            return result, pool.hosts["127.0.0.1"]
+        finally:
+            pool.close()
+
+    (_, error, asset), limiter = asyncio.run(download())
+    assert error == ""
+    assert asset["size"] == len(PNG)
+    assert limiter.throttled == 1
+    assert limiter.completed == 1
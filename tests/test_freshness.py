@@ -0,0 +1,147 @@
+import sqlite3
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from ttsmutility.parse.AssetList import AssetList
+from ttsmutility.workers.downloader import make_download_session
+from ttsmutility.workers.freshness import (
+    CHANGED,
+    FAILED,
+    FRESH,
+    check_freshness,
+)
+
+BODY = b"\0" * 100
+ETAG = '"v1"'
+LAST_MODIFIED = "Mon, 01 Jan 2024 00:00:00 GMT"
+
+
+class ValidatingHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _headers(self):
+        if self.path.startswith("/missing"):
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return False
+        if self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+            self.send_header("ETag", ETAG)
+            self.end_headers()
+            return False
+        self.send_response(200)
+        self.send_header("ETag", ETAG)
+        self.send_header("Last-Modified", LAST_MODIFIED)
+        if self.path.startswith("/bad_length"):
+            self.send_header("Content-Length", "unknown")
+        else:
+            self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        return True
+
+    def do_HEAD(self):
+        self.server.methods.append("HEAD")
+        self._headers()
+
+    def do_GET(self):
+        self.server.methods.append("GET")
+        if self._headers():
+            self.wfile.write(BODY)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), ValidatingHandler)
+    httpd.daemon_threads = True
+    httpd.methods = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    session = make_download_session(2)
+    yield f"http://127.0.0.1:{httpd.server_port}", httpd, session
+    session.close()
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_not_modified(server):
+    base_url, httpd, session = server
+    result = check_freshness(session, f"{base_url}/a.png", len(BODY), ETAG)
+    assert result == (FRESH, ETAG, "", 304)
+    assert httpd.methods == ["GET"]
+
+
+def test_etag_changed(server):
+    base_url, _, session = server
+    outcome, etag, last_modified, status = check_freshness(
+        session, f"{base_url}/a.png", len(BODY), '"v0"'
+    )
+    assert outcome == CHANGED
+    assert (etag, last_modified, status) == (ETAG, LAST_MODIFIED, 200)
+
+
+def test_head_without_validators(server):
+    base_url, httpd, session = server
+    result = check_freshness(session, f"{base_url}/a.png", len(BODY))
+    # The validators are returned so the next check can be conditional
+    assert result == (FRESH, ETAG, LAST_MODIFIED, 200)
+    assert httpd.methods == ["HEAD"]
+
+    outcome, *_ = check_freshness(session, f"{base_url}/a.png", len(BODY) + 1)
+    assert outcome == CHANGED
+
+
+def test_malformed_length(server):
+    base_url, _, session = server
+    result = check_freshness(session, f"{base_url}/bad_length.png", len(BODY) + 1)
+    # Nothing to compare, so the validators decide
+    assert result == (FRESH, ETAG, LAST_MODIFIED, 200)
+
+
+def test_check_failed(server):
+    base_url, _, session = server
+    result = check_freshness(session, f"{base_url}/missing.png", len(BODY), ETAG)
+    # Validators we had are kept
+    assert result == (FAILED, ETAG, "", 404)
+
+
+def test_assets_to_check(tts_db):
+    with sqlite3.connect(tts_db) as db:
+        db.execute("INSERT INTO tts_mods (mod_filename) VALUES ('a.json')")
+        db.executemany(
+            """
+            INSERT INTO tts_assets (asset_url, asset_mtime, asset_size, asset_steam_sha1)
+            VALUES (?, ?, 100, ?)
+            """,
+            [
+                ("http://h/fresh.png", 10, ""),
+                ("http://h/missing.png", 0, ""),
+                ("http://steam/ugc/1/", 10, "ABCD"),
+            ],
+        )
+        db.execute(
+            """
+            INSERT INTO tts_mod_assets (asset_id_fk, mod_id_fk, mod_asset_trail)
+            SELECT tts_assets.id, tts_mods.id, 'ObjectStates->ImageURL'
+            FROM tts_assets, tts_mods
+            """
+        )
+
+    asset_list = AssetList()
+    assets = asset_list.get_assets_to_check(1000)
+    assert [asset["url"] for asset in assets] == ["http://h/fresh.png"]
+    assert assets[0]["size"] == 100
+    assert assets[0]["etag"] == ""
+
+    asset_list.set_validators([("http://h/fresh.png", ETAG, "", 2000)])
+    assert asset_list.get_assets_to_check(1000) == []
+    assert asset_list.get_assets_to_check(3000)[0]["etag"] == ETAG
+
+    # An empty validator doesn't clear the one we have
+    asset_list.set_validators([("http://h/fresh.png", "", "", 2000)])
+    assert asset_list.get_assets_to_check(3000)[0]["etag"] == ETAG
@@ -0,0 +1,74 @@
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+
+from ttsmutility.parse.HostCapabilities import HostCapabilities
+
+
+def response(status_code, headers, elapsed=0.1):
+    return SimpleNamespace(
+        status_code=status_code,
+        headers=headers,
+        elapsed=timedelta(seconds=elapsed),
+    )
+
+
+def test_saved_between_runs(tts_db):
+    capabilities = HostCapabilities()
+    assert capabilities.get("a.com").content_disposition is None
+    capabilities.record("a.com", content_disposition=False, head=True, latency=0.5)
+    capabilities.flush()
+
+    capabilities = HostCapabilities()
+    capability = capabilities.get("a.com")
+    assert capability.content_disposition is False
+    assert capability.head is True
+    assert capability.ranges is None
+    assert capability.latency == 0.5
+    assert not capabilities.sends_content_disposition("a.com")
+    assert capabilities.sends_content_disposition("b.com")
+    # Hosts are asked again eventually
+    assert capabilities.sends_content_disposition(
+        "a.com", now=time.time() + HostCapabilities.RECHECK_AGE + 1
+    )
+
+
+def test_flushed_periodically(tts_db):
+    capabilities = HostCapabilities(flush_interval=0)
+    capabilities.record("a.com", ranges=True)
+    assert HostCapabilities().get("a.com").ranges is True
+
+
+def test_record_response(tts_db):
+    capabilities = HostCapabilities()
+    capabilities.record_response(
+        "a.com", response(200, {"Accept-Ranges": "bytes"}), False
+    )
+    capability = capabilities.get("a.com")
+    assert capability.ranges is True
+    assert capability.content_disposition is False
+
+    # A range request answered with the whole file
+    capabilities.record_response(
+        "a.com",
+        response(200, {"Content-Disposition": "attachment", "Accept-Ranges": ""}, 0.6),
+        True,
+    )
+    assert capability.ranges is False
+    assert capability.content_disposition is True
+    assert 0.1 < capability.latency < 0.6
+    assert capabilities.timeout("a.com", 10) == 10
+    assert capabilities.timeout("slow.com", 10) == 10
+
+    # Errors say nothing about the host
+    capabilities.record_response("b.com", response(404, {}), True)
+    assert capabilities.get("b.com").ranges is None
+
+
+def test_steam_sends_some_names(tts_db):
+    capabilities = HostCapabilities()
+    host = "cloud-3.steamusercontent.com"
+    capabilities.record(host, content_disposition=False)
+    assert capabilities.sends_content_disposition(host)
+    capabilities.record(host, content_disposition=True)
+    assert capabilities.get(host).content_disposition is True
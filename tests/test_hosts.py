@@ -0,0 +1,81 @@
+from ttsmutility.workers.hosts import (
+    OK,
+    THROTTLED,
+    TIMEOUT,
+    HostLimiter,
+    HostLimits,
+    HostPolicy,
+)
+
+
+def test_aimd_concurrency():
+    limiter = HostLimiter("example.com", HostPolicy(8))
+    assert limiter.limit == 2
+
+    # Two slots, then we have to wait for one to finish
+    limiter.start(now=0)
+    limiter.start(now=0)
+    assert limiter.delay(now=0) is None
+
+    # Additive increase, one more slot per window of successes
+    limiter.finish(OK, now=0)
+    limiter.finish(OK, now=0)
+    assert limiter.limit == 3
+    for _ in range(3):
+        limiter.start(now=0)
+    for _ in range(3):
+        limiter.finish(OK, now=0)
+    assert limiter.limit == 4
+
+    # Multiplicative decrease on timeouts
+    limiter.start(now=0)
+    limiter.finish(TIMEOUT, now=0)
+    assert limiter.limit == 2
+    assert limiter.delay(now=0) == 0
+
+    # Never above the host's maximum
+    for _ in range(100):
+        limiter.start(now=0)
+        limiter.finish(OK, now=0)
+    assert limiter.limit == 8
+
+
+def test_throttle_pauses_host():
+    limiter = HostLimiter("example.com", HostPolicy(8))
+    limiter.start(now=0)
+    limiter.finish(THROTTLED, retry_after=30, now=0)
+    assert limiter.limit == 1
+    assert limiter.delay(now=10) == 20
+    assert limiter.delay(now=30) == 0
+
+    # Without Retry-After the pause backs off exponentially
+    limiter.start(now=30)
+    limiter.finish(THROTTLED, now=30)
+    assert limiter.delay(now=30) == 1
+    limiter.start(now=31)
+    limiter.finish(THROTTLED, now=31)
+    assert limiter.delay(now=31) == 2
+    # ...and resets on success
+    limiter.start(now=33)
+    limiter.finish(OK, now=33)
+    assert limiter.backoff == HostLimiter.MIN_BACKOFF
+
+
+def test_token_bucket():
+    limiter = HostLimiter("pastebin.com", HostPolicy(4, rate=2.0, burst=2.0))
+    limiter.last_refill = 0
+    limiter.start(now=0)
+    limiter.finish(OK, now=0)
+    limiter.start(now=0)
+    limiter.finish(OK, now=0)
+    # Burst used up, next token in half a second
+    assert limiter.delay(now=0) == 0.5
+    assert limiter.delay(now=0.5) == 0
+
+
+def test_host_policies():
+    limits = HostLimits(4)
+    assert limits["cloud-3.steamusercontent.com"].policy.max_concurrency == 16
+    assert limits["pastebin.com"].policy.rate == 1.0
+    assert limits["i.imgur.com"].policy.max_concurrency == 4
+    assert limits["notpastebin.com"].policy.rate is None
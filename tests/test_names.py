@@ -0,0 +1,199 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from ttsmutility.parse.HostCapabilities import HostCapabilities
+from ttsmutility.workers.downloader import make_download_session
+from ttsmutility.workers.hosts import SharedHostLimits
+from ttsmutility.workers.names import (
+    CD_NAME,
+    NO_CD,
+    URL_NAME,
+    NameScanner,
+    fetch_content_disposition,
+)
+
+BODY = b"\0" * 10000
+
+
+class NameHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _headers(self, method):
+        with self.server.lock:
+            self.server.requests.append(
+                (method, self.path, self.headers.get("Range", ""))
+            )
+        if self.path.startswith("/missing"):
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+        if self.path.startswith("/nohead") and method == "HEAD":
+            self.send_response(405)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+        body = BODY
+        if self.headers.get("Range") == "bytes=0-0":
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes 0-0/{len(BODY)}")
+            body = BODY[:1]
+        else:
+            self.send_response(200)
+        if not self.path.startswith("/noname"):
+            name = self.path.strip("/").replace("/", "_")
+            self.send_header(
+                "Content-Disposition", f'attachment; filename="{name}.png"'
+            )
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        return body
+
+    def do_HEAD(self):
+        self._headers("HEAD")
+
+    def do_GET(self):
+        body = self._headers("GET")
+        if body is not None:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), NameHandler)
+    httpd.daemon_threads = True
+    httpd.lock = threading.Lock()
+    httpd.requests = []
+    # Lookups close connections without reading the body
+    httpd.handle_error = lambda request, client_address: None
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    session = make_download_session(8)
+    yield f"http://127.0.0.1:{httpd.server_port}", httpd, session
+    session.close()
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_head(server):
+    base_url, httpd, session = server
+    result = fetch_content_disposition(session, f"{base_url}/a/1", {})
+    assert result == (200, "OK", 'attachment; filename="a_1.png"')
+    assert httpd.requests == [("HEAD", "/a/1", "")]
+
+
+def test_range_without_head(server):
+    base_url, httpd, session = server
+    result = fetch_content_disposition(session, f"{base_url}/a/1", {}, use_head=False)
+    assert result == (200, "Partial Content", 'attachment; filename="a_1.png"')
+    assert httpd.requests == [("GET", "/a/1", "bytes=0-0")]
+
+
+def test_range_when_head_fails(server):
+    base_url, httpd, session = server
+    result = fetch_content_disposition(session, f"{base_url}/nohead/1", {})
+    assert result[0] == 200
+    assert result[2] == 'attachment; filename="nohead_1.png"'
+    assert httpd.requests == [
+        ("HEAD", "/nohead/1", ""),
+        ("GET", "/nohead/1", "bytes=0-0"),
+    ]
+
+
+def test_known_head_failure(tts_db, server):
+    base_url, httpd, session = server
+    capabilities = HostCapabilities()
+    fetch_content_disposition(
+        session, f"{base_url}/nohead/1", {}, capabilities=capabilities
+    )
+    assert capabilities.get("127.0.0.1").head is False
+    assert capabilities.get("127.0.0.1").ranges is True
+
+    # HEAD isn't tried again
+    fetch_content_disposition(
+        session, f"{base_url}/nohead/2", {}, capabilities=capabilities
+    )
+    assert httpd.requests[-1] == ("GET", "/nohead/2", "bytes=0-0")
+    assert len(httpd.requests) == 3
+
+
+def test_lookup_name(tts_db, server):
+    base_url, httpd, session = server
+    hosts = SharedHostLimits(4)
+    scanner = NameScanner()
+
+    # Named by the url, nothing to fetch
+    assert scanner.lookup_name(session, hosts, f"{base_url}/b.png")[:2] == (
+        "b.png",
+        URL_NAME,
+    )
+    assert httpd.requests == []
+
+    assert scanner.lookup_name(session, hosts, f"{base_url}/a/1")[:2] == (
+        "a_1.png",
+        CD_NAME,
+    )
+    assert scanner.lookup_name(session, hosts, f"{base_url}/noname/1")[:2] == (
+        "",
+        NO_CD,
+    )
+    _, _, _, dl_status = scanner.lookup_name(session, hosts, f"{base_url}/missing/1")
+    assert dl_status.startswith("HTTPError 404")
+
+    # A site known not to send names isn't asked
+    capabilities = HostCapabilities()
+    scanner.lookup_name(session, hosts, f"{base_url}/noname/2", capabilities)
+    assert capabilities.get("127.0.0.1").content_disposition is False
+    del httpd.requests[:]
+    result = scanner.lookup_name(session, hosts, f"{base_url}/a/2", capabilities)
+    assert result[0] == ""
+    assert httpd.requests == []
+    assert all(limiter.active == 0 for limiter in hosts.limiters.values())
+
+
+def test_pooled_lookups(server):
+    base_url, _, session = server
+    urls = [f"{base_url}/asset/{i}" for i in range(50)]
+    hosts = SharedHostLimits(8)
+    scanner = NameScanner()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(
+            executor.map(lambda url: scanner.lookup_name(session, hosts, url), urls)
+        )
+    assert [name for name, *_ in results] == [f"asset_{i}.png" for i in range(50)]
+
+
+@pytest.mark.benchmark
+def test_pooled_lookup_throughput(server):
+    base_url, httpd, session = server
+    urls = [f"{base_url}/asset/{i}" for i in range(2000)]
+
+    start = time.perf_counter()
+    for url in urls:
+        # What every lookup used to do, a full GET on a new connection
+        with requests.get(url, stream=True) as response:
+            assert "Content-Disposition" in response.headers
+    sequential = time.perf_counter() - start
+
+    hosts = SharedHostLimits(8)
+    scanner = NameScanner()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(
+            executor.map(lambda url: scanner.lookup_name(session, hosts, url), urls)
+        )
+    pooled = time.perf_counter() - start
+
+    assert [name for name, *_ in results] == [f"asset_{i}.png" for i in range(2000)]
+    print(
+        f"{len(urls)} names: {len(urls) / sequential:.0f}/s sequential GETs, "
+        f"{len(urls) / pooled:.0f}/s pooled"
+    )
@@ -0,0 +1,62 @@
+from collections import deque
+from types import SimpleNamespace
+
+from ttsmutility.workers.progress import DownloadProgress, WorkerProgress
+
+
+def make_fd():
+    return SimpleNamespace(
+        active=False,
+        url="",
+        content_length=0,
+        bytes_complete=0,
+        bytes_received=0,
+        log_lines=deque(),
+    )
+
+
+def test_sample_gathers_every_worker():
+    fds = [make_fd(), make_fd()]
+    progress = DownloadProgress(fds, window=1.0)
+    assert progress.sample(now=0).is_empty()
+
+    fds[0].active = True
+    fds[0].url = "http://h/1"
+    fds[0].content_length = 1000
+    fds[0].bytes_complete = 200
+    fds[0].bytes_received = 200
+    fds[0].log_lines.append(("Downloading: `http://h/1`", None))
+
+    snapshot = progress.sample(queued=3, now=1)
+    assert snapshot.workers == [WorkerProgress(0, "http://h/1", 1000, 200)]
+    assert snapshot.log == [("Downloading: `http://h/1`", None)]
+    assert snapshot.rate == 200
+    # Nothing has finished, so the size of the queued downloads is unknown
+    assert snapshot.eta == 4
+
+    # Log lines and completions are only sent once
+    progress.complete(0, "", {"url": "http://h/1", "size": 1000}, {"a.json": 3})
+    fds[0].active = False
+    fds[0].bytes_received = 1000
+    snapshot = progress.sample(queued=3, now=2)
+    assert snapshot.log == []
+    assert snapshot.workers == []
+    assert snapshot.completed == [
+        (0, "", {"url": "http://h/1", "size": 1000}, {"a.json": 3})
+    ]
+    assert snapshot.rate == 800
+    # Queued downloads are guessed to be the average size
+    assert snapshot.eta == 3 * 1000 / 800
+
+    assert progress.sample(now=3).is_empty()
+
+
+def test_rate_is_averaged_over_window():
+    fd = make_fd()
+    progress = DownloadProgress([fd], window=2.0)
+    progress.sample(now=0)
+    fd.bytes_received = 1000
+    assert progress.sample(now=1).rate == 1000
+    assert progress.sample(now=2).rate == 500
+    # The first second has left the window
+    assert progress.sample(now=3).rate == 0
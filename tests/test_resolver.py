@@ -0,0 +1,68 @@
+import sqlite3
+
+import pytest
+
+from ttsmutility.workers.resolver import AssetResolver, parse_mirrors
+
+MIRRORS = "http://old.com/ => https://new.com/; http://old.com/ugc/ => https://ugc.com/"
+
+
+def test_parse_mirrors():
+    assert parse_mirrors(MIRRORS) == [
+        ("http://old.com/", "https://new.com/"),
+        ("http://old.com/ugc/", "https://ugc.com/"),
+    ]
+    assert parse_mirrors("") == []
+    with pytest.raises(ValueError):
+        parse_mirrors("http://old.com/ https://new.com/")
+
+
+def test_mirrors_in_order(tts_config):
+    resolver = AssetResolver(parse_mirrors(MIRRORS))
+    assert resolver.mirrors_for("http://old.com/ugc/1/") == [
+        "https://new.com/ugc/1/",
+        "https://ugc.com/1/",
+    ]
+    assert resolver.mirrors_for("http://other.com/ugc/1/") == []
+
+
+def test_find_local(tts_db, tts_config, tmp_path):
+    steam_url = "http://cloud-3.steamusercontent.com/ugc/1/" + "AB" * 20 + "/"
+    with sqlite3.connect(tts_db) as db:
+        db.executemany(
+            """
+            INSERT INTO tts_assets
+                (asset_url, asset_path, asset_filename, asset_ext, asset_mtime,
+                 asset_sha1, asset_content_name)
+            VALUES (?, 'Images', ?, '.png', ?, ?, ?)
+            """,
+            [
+                # On disk, with the SHA1 from the steam url
+                ("http://mirror/a.png", "a", 10, "AB" * 20, "a.png"),
+                # Downloaded once, but the file has gone
+                ("http://gone/b.png", "b", 0, "CD" * 20, ""),
+                ("http://copy/b.png", "b_copy", 10, "CD" * 20, None),
+                # A corrupt copy of the steam url
+                (steam_url, "steam", 0, "EF" * 20, ""),
+                ("http://corrupt/c.png", "c", 10, "EF" * 20, ""),
+            ],
+        )
+    images = tmp_path / "Mods" / "Images"
+    images.mkdir(parents=True)
+    (images / "a.png").write_bytes(b"a")
+
+    resolver = AssetResolver()
+    (images / "c.png").write_bytes(b"c")
+    assert resolver.find_local(steam_url) == (images / "a.png", "AB" * 20, "a.png")
+    # The DB thinks there is a copy, but it isn't on disk
+    assert resolver.find_local("http://gone/b.png") is None
+    (images / "b_copy.png").write_bytes(b"b")
+    assert resolver.find_local("http://gone/b.png") == (
+        images / "b_copy.png",
+        "CD" * 20,
+        "",
+    )
+    assert resolver.find_local("http://unknown/c.png") is None
+    # Only the steam SHA1 is trusted for a steam url
+    (images / "a.png").unlink()
+    assert resolver.find_local(steam_url) is None
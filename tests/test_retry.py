@@ -0,0 +1,74 @@
+import pytest
+
+from ttsmutility.workers.retry import (
+    DEAD_HOST,
+    PERMANENT,
+    TRANSIENT,
+    NegativeCache,
+    RetryPolicy,
+    classify,
+)
+
+DAY = 24 * 60 * 60
+
+
+@pytest.mark.parametrize(
+    "error, kind",
+    [
+        ("", None),
+        ("HTTPError 404 (Not Found)", PERMANENT),
+        ("HTTPError 410 (Gone)", PERMANENT),
+        ("HTTPError 500 (Internal Server Error)", TRANSIENT),
+        ("HTTPError 429 (Too Many Requests)", TRANSIENT),
+        ("Removed", PERMANENT),
+        ("Wrong context type (text/html)", PERMANENT),
+        ("Retries exhausted", TRANSIENT),
+        ("Filesize mismatch. Received 1. Expected 2.", TRANSIENT),
+        ("URLError ([Errno 111] Connection refused)", TRANSIENT),
+        (
+            "URLError (<urllib3.connection.HTTPConnection object at 0x1>: "
+            "Failed to resolve 'dead.example' ([Errno -2] Name or service not known))",
+            DEAD_HOST,
+        ),
+    ],
+)
+def test_classify(error, kind):
+    assert classify(error) == kind
+
+
+def test_backoff_has_jitter_and_cap():
+    policy = RetryPolicy(base=1.0, cap=5.0)
+    for attempt in range(10):
+        delays = {policy.delay(attempt) for _ in range(20)}
+        assert all(0 <= delay <= min(5.0, 2**attempt) for delay in delays)
+        assert len(delays) > 1
+
+
+def test_negative_cache():
+    cache = NegativeCache()
+    cache.add("http://h/404", "HTTPError 404 (Not Found)", 0, duration=2.0)
+    cache.add("http://h/500", "HTTPError 500 (Internal Server Error)", 0)
+    cache.add("http://dead/a", "URLError (Failed to resolve 'dead')", 0, 5.0)
+
+    assert cache.lookup("http://h/404", now=1).duration == 2.0
+    assert cache.lookup("http://h/500", now=1) is None
+    # Everything on a host that doesn't resolve is dead
+    assert cache.lookup("http://dead/b", now=1).duration == 5.0
+
+    # Entries expire
+    assert cache.lookup("http://dead/b", now=cache.host_ttl + 1) is None
+    assert cache.lookup("http://h/404", now=cache.host_ttl + 1) is not None
+    assert cache.lookup("http://h/404", now=cache.ttl + 1) is None
+
+    urls, trails, skipped = cache.filter(
+        ["http://h/404", "http://h/ok", "http://dead/c"], ["t1", "t2", "t3"], now=1
+    )
+    assert urls == ["http://h/ok"]
+    assert trails == ["t2"]
+    assert [dead.duration for dead in skipped] == [2.0, 5.0]
+
+    # A later success clears the url and its host
+    cache.add("http://h/404", "", DAY)
+    cache.add("http://dead/a", "", DAY)
+    assert cache.lookup("http://h/404", now=DAY) is None
+    assert cache.lookup("http://dead/b", now=DAY) is None
@@ -0,0 +1,130 @@
+from ttsmutility.workers.scheduler import DownloadScheduler, url_host
+
+TRAIL = ["ObjectStates", "CustomImage", "ImageURL"]
+
+
+def add(scheduler, mod_filename, urls):
+    return scheduler.add(urls, [TRAIL] * len(urls), mod_filename)
+
+
+def drain(scheduler, host):
+    urls = []
+    while (job := scheduler.pop(host)) is not None:
+        urls.append(job.url)
+        scheduler.done(job.url)
+    return urls
+
+
+def test_url_host():
+    assert url_host("http://cloud-3.steamusercontent.com/ugc/1/") == (
+        "cloud-3.steamusercontent.com"
+    )
+    assert url_host(" https://i.imgur.com/a.png ") == "i.imgur.com"
+    assert url_host("not a url") == ""
+
+
+def test_shared_asset_downloaded_once():
+    scheduler = DownloadScheduler()
+    assert add(scheduler, "a.json", ["http://h/1", "http://h/2"]) == 2
+    assert add(scheduler, "b.json", ["http://h/2", "http://h/3"]) == 2
+    # Queueing the same mod again doesn't duplicate its downloads
+    assert add(scheduler, "b.json", ["http://h/2"]) == 2
+    assert len(scheduler) == 3
+    assert scheduler.mods_for("http://h/2") == {"a.json", "b.json"}
+
+    assert sorted(drain(scheduler, "h")) == ["http://h/1", "http://h/2", "http://h/3"]
+    assert len(scheduler) == 0
+
+
+def test_done_reports_every_waiting_mod():
+    scheduler = DownloadScheduler()
+    add(scheduler, "a.json", ["http://h/1", "http://h/2"])
+    add(scheduler, "b.json", ["http://h/2"])
+
+    # b.json has fewer remaining, so its download goes first
+    job = scheduler.pop("h")
+    assert job.url == "http://h/2"
+    assert scheduler.done(job.url) == {"a.json": 1, "b.json": 0}
+    assert scheduler.done("http://h/unknown") == {}
+
+
+def test_fewest_remaining_first():
+    scheduler = DownloadScheduler()
+    add(scheduler, "big.json", [f"http://h/big_{i}" for i in range(10)])
+    add(scheduler, "small.json", ["http://h/small_0", "http://h/small_1"])
+
+    order = drain(scheduler, "h")
+    assert order[:2] == ["http://h/small_0", "http://h/small_1"]
+    assert scheduler.remaining("big.json") == 0
+
+
+def test_focused_mod_first():
+    scheduler = DownloadScheduler()
+    add(scheduler, "big.json", [f"http://h/big_{i}" for i in range(10)])
+    add(scheduler, "small.json", ["http://h/small_0"])
+    scheduler.focus("big.json")
+
+    job = scheduler.pop("h")
+    assert job.url.startswith("http://h/big_")
+    scheduler.done(job.url)
+
+    # Focus moves on, the old heap entries are ignored
+    scheduler.focus("small.json")
+    assert scheduler.pop("h").url == "http://h/small_0"
+
+
+def test_hosts_have_separate_queues():
+    scheduler = DownloadScheduler()
+    add(scheduler, "a.json", ["http://one/1", "http://two/1", "http://one/2"])
+    assert sorted(scheduler.hosts()) == ["one", "two"]
+    assert scheduler.pop("two").url == "http://two/1"
+    assert scheduler.pop("two") is None
+    assert drain(scheduler, "one") == ["http://one/1", "http://one/2"]
+
+
+def test_running_job_is_not_started_twice():
+    scheduler = DownloadScheduler()
+    add(scheduler, "a.json", ["http://h/1"])
+    job = scheduler.pop("h")
+    # Another mod wants it while it is downloading
+    assert add(scheduler, "b.json", ["http://h/1"]) == 1
+    assert scheduler.pop("h") is None
+    assert scheduler.done(job.url) == {"a.json": 0, "b.json": 0}
+
+
+def test_requeue():
+    scheduler = DownloadScheduler()
+    add(scheduler, "a.json", ["http://h/1", "http://h/2"])
+    job = scheduler.pop("h")
+    scheduler.requeue(job)
+    # Goes back to the front of the queue
+    assert scheduler.pop("h").url == job.url
+
+
+def test_cancel():
+    scheduler = DownloadScheduler()
+    add(scheduler, "a.json", ["http://h/1", "http://h/2", "http://h/3"])
+    add(scheduler, "b.json", ["http://h/1", "http://h/4", "http://h/5"])
+    running = scheduler.pop("h")
+    assert running.url == "http://h/1"
+
+    # Running downloads finish, and b.json still wants them
+    assert sorted(scheduler.cancel("a.json")) == ["http://h/2", "http://h/3"]
+    assert scheduler.remaining("a.json") == 0
+    assert scheduler.cancel("a.json") == []
+    assert scheduler.done(running.url) == {"b.json": 2}
+
+    running = scheduler.pop("h")
+    assert running.url == "http://h/4"
+    assert scheduler.cancel("b.json") == ["http://h/5"]
+    # Nobody is waiting on it any more
+    assert scheduler.done(running.url) == {}
+    assert scheduler.pop("h") is None
+
+    # A throttled download for a cancelled mod is dropped
+    add(scheduler, "c.json", ["http://h/6"])
+    job = scheduler.pop("h")
+    scheduler.cancel("c.json")
+    scheduler.requeue(job)
+    assert len(scheduler) == 0
+    assert scheduler.pop("h") is None
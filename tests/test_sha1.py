@@ -0,0 +1,206 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+import pytest
+from textual.app import App
+
+from ttsmutility.parse.AssetList import AssetList
+from ttsmutility.parse.AssetWriteQueue import AssetWriteQueue
+from ttsmutility.workers import sha1 as sha1_module
+from ttsmutility.workers.sha1 import HashPipeline, Sha1Scanner, hash_file
+
+
+def make_tree(root, num_files, size):
+    files = []
+    for i in range(num_files):
+        subdir = root / f"dir_{i % 100}"
+        subdir.mkdir(exist_ok=True)
+        path = subdir / f"asset_{i}.bin"
+        path.write_bytes(i.to_bytes(4, "little") * (size // 4))
+        files.append(path)
+    return files
+
+
+def hash_all(files, num_hashers):
+    results = {}
+
+    def hashed(path, sha1):
+        results[path] = sha1
+
+    hashers = HashPipeline(num_hashers, hashed)
+    for path in files:
+        hashers.submit(path, path)
+    hashers.finish()
+    return results
+
+
+def test_hash_file(tmp_path):
+    path = tmp_path / "a.bin"
+    path.write_bytes(b"hello")
+    assert hash_file(path) == hashlib.sha1(b"hello").hexdigest().upper()
+
+
+def test_unreadable_file(tmp_path):
+    (tmp_path / "a.bin").write_bytes(b"hello")
+    results = hash_all([tmp_path / "a.bin", tmp_path / "missing.bin"], 2)
+    assert results[tmp_path / "a.bin"] == hash_file(tmp_path / "a.bin")
+    assert isinstance(results[tmp_path / "missing.bin"], FileNotFoundError)
+
+
+def test_pending_is_bounded(tmp_path):
+    files = make_tree(tmp_path, 50, 1024)
+    hashers = HashPipeline(2, lambda path, sha1: None, max_pending=4)
+    for path in files:
+        hashers.submit(path, path)
+        assert len(hashers.pending) <= 4
+    hashers.cancel()
+    assert hashers.pending == {}
+
+
+def test_parallel_hash(tmp_path):
+    files = make_tree(tmp_path, 200, 4096)
+    serial = hash_all(files, 1)
+    assert len(serial) == len(files)
+    assert hash_all(files, 8) == serial
+
+
+@pytest.mark.benchmark
+def test_parallel_hash_throughput(tmp_path):
+    files = make_tree(tmp_path, 50000, 4096)
+
+    start = time.perf_counter()
+    serial = hash_all(files, 1)
+    serial_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    parallel = hash_all(files, 8)
+    parallel_time = time.perf_counter() - start
+
+    assert parallel == serial
+    assert len(serial) == len(files)
+    print(
+        f"{len(files)} files: {len(files) / serial_time:.0f}/s with 1 hasher, "
+        f"{len(files) / parallel_time:.0f}/s with 8"
+    )
+
+
+def test_fingerprints(tts_db):
+    with sqlite3.connect(tts_db) as db:
+        db.executemany(
+            """
+            INSERT INTO tts_assets (asset_url, asset_path, asset_filename, asset_mtime)
+            VALUES (?, 'Images', ?, ?)
+            """,
+            [
+                ("http://a", "httpa", 10),
+                ("http://b", "httpb", 10),
+                ("http://c", "httpc", 0),
+            ],
+        )
+
+    asset_list = AssetList()
+    assets = asset_list.get_sha1_info("Images")
+    assert assets["httpa"] == ("", "", 0, (0, 0, 0))
+    # Files that aren't on disk don't need hashing
+    assert set(asset_list.get_sha1_info("Images", unhashed_only=True)) == {
+        "httpa",
+        "httpb",
+    }
+
+    queue = AssetWriteQueue(batch_size=1000, flush_interval=1000)
+    queue.sha1_scan_done("Images/httpa.png", "ABC", "", 20, (5, 20 * 10**9, 7))
+    queue.flush()
+    queue.close()
+
+    assert asset_list.get_sha1_info("Images")["httpa"] == (
+        "ABC",
+        "",
+        20,
+        (5, 20 * 10**9, 7),
+    )
+    assert set(asset_list.get_sha1_info("Images", unhashed_only=True)) == {"httpb"}
+
+
+def test_scanned_dirs(tts_db):
+    asset_list = AssetList()
+    assert asset_list.get_sha1_dirs() == {}
+    asset_list.set_sha1_dirs({"Images": 10, "Models": 20})
+    asset_list.set_sha1_dirs({"Images": 30})
+    assert asset_list.get_sha1_dirs() == {"Images": 30, "Models": 20}
+
+
+class ScanApp(App):
+    """Just enough of the app for the scanner to run in."""
+
+    def __init__(self):
+        super().__init__()
+        self.write_queue = AssetWriteQueue(batch_size=1000, flush_interval=1000)
+        self.sha1 = Sha1Scanner(num_hashers=2)
+
+    def compose(self):
+        yield self.sha1
+
+
+def scan_sha1s():
+    async def scan():
+        app = ScanApp()
+        async with app.run_test():
+            await app.run_worker(app.sha1.scan_sha1s, thread=True).wait()
+        app.write_queue.close()
+
+    asyncio.run(scan())
+
+
+def test_scan_sha1s(tts_config, tts_db, monkeypatch):
+    images = Path(tts_config.tts_mods_dir) / "Images"
+    images.mkdir(parents=True)
+    for name in ("httpa", "httpb", "httpc"):
+        (images / f"{name}.png").write_bytes(name.encode())
+    with sqlite3.connect(tts_db) as db:
+        db.executemany(
+            """
+            INSERT INTO tts_assets
+                (asset_url, asset_path, asset_filename, asset_ext, asset_mtime)
+            VALUES (?, 'Images', ?, '.png', 10)
+            """,
+            [("http://a", "httpa"), ("http://b", "httpb"), ("http://c", "httpc")],
+        )
+
+    hashed = []
+
+    def counting_hash_file(filepath):
+        hashed.append(Path(filepath).stem)
+        return hash_file(filepath)
+
+    monkeypatch.setattr(sha1_module, "hash_file", counting_hash_file)
+
+    scan_sha1s()
+    assert sorted(hashed) == ["httpa", "httpb", "httpc"]
+    assert AssetList().get_sha1_info("Images")["httpa"][0] == (
+        hashlib.sha1(b"httpa").hexdigest().upper()
+    )
+
+    # Nothing changed, so the directory isn't even listed
+    del hashed[:]
+    scan_sha1s()
+    assert hashed == []
+
+    # One file re-downloaded with a new size, one touched
+    tmp_path = images / "httpa.tmp"
+    tmp_path.write_bytes(b"new httpa")
+    os.replace(tmp_path, images / "httpa.png")
+    stat = (images / "httpb.png").stat()
+    os.utime(images / "httpb.png", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    # As the rename does, in case it was within the directory's mtime resolution
+    stat = images.stat()
+    os.utime(images, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    scan_sha1s()
+    assert sorted(hashed) == ["httpa", "httpb"]
+    assert AssetList().get_sha1_info("Images")["httpa"][0] == (
+        hashlib.sha1(b"new httpa").hexdigest().upper()
+    )
@@ -0,0 +1,102 @@
+import hashlib
+import sqlite3
+import struct
+
+import pytest
+
+from ttsmutility.parse.AssetList import AssetList
+from ttsmutility.workers.verify import (
+    EXTRA_DATA,
+    REENCODED,
+    TRUNCATED,
+    UNVERIFIED,
+    WRONG_CONTENT,
+    classify_mismatch,
+)
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\0" * 512 + b"IEND\xaeB`\x82"
+PNG_SHA1 = hashlib.sha1(PNG).hexdigest().upper()
+OTHER_SHA1 = "0" * 40
+
+
+def unityfs(size):
+    header = b"UnityFS\0" + struct.pack(">I", 6) + b"5.x.x\0" + b"2019.4.1f1\0"
+    header += struct.pack(">Q", size)
+    return header + b"\0" * (size - len(header))
+
+
+@pytest.mark.parametrize(
+    "name, data, steam_sha1, expected_size, outcome",
+    [
+        ("a.png", PNG, OTHER_SHA1, len(PNG), REENCODED),
+        ("a.png", PNG[:-100], OTHER_SHA1, len(PNG), TRUNCATED),
+        # Without a Content-Length the missing trailer gives it away
+        ("a.png", PNG[:-100], OTHER_SHA1, 0, TRUNCATED),
+        ("a.png", PNG + b"junk", PNG_SHA1, len(PNG), EXTRA_DATA),
+        (
+            "a.png",
+            b"<!DOCTYPE html><html>Not Found</html>",
+            OTHER_SHA1,
+            0,
+            WRONG_CONTENT,
+        ),
+        ("a.png", b"\0" * 100, OTHER_SHA1, 0, WRONG_CONTENT),
+        ("a.png", b"", OTHER_SHA1, 0, WRONG_CONTENT),
+        ("a.unity3d", unityfs(1000), OTHER_SHA1, 0, REENCODED),
+        ("a.unity3d", unityfs(1000)[:600], OTHER_SHA1, 0, TRUNCATED),
+        ("a.rawt", b"\0" * 100, OTHER_SHA1, 0, UNVERIFIED),
+        ("a.obj", b"# obj\nv 0 0 0\n", OTHER_SHA1, 0, UNVERIFIED),
+        # Valid files without the magic FILE_TYPES knows them by
+        ("a.obj", b"v 0 0 0\nv 0 1 0\n", OTHER_SHA1, 0, UNVERIFIED),
+        ("a.obj", b"mtllib a.mtl\nv 0 0 0\n", OTHER_SHA1, 0, UNVERIFIED),
+        ("a.mp3", b"\xff\xfb\x90\x64" + b"\0" * 400, OTHER_SHA1, 0, UNVERIFIED),
+        ("a.ogg", b"\0" * 100, OTHER_SHA1, 0, WRONG_CONTENT),
+    ],
+)
+def test_classify_mismatch(tmp_path, name, data, steam_sha1, expected_size, outcome):
+    filepath = tmp_path / name
+    filepath.write_bytes(data)
+    assert classify_mismatch(filepath, steam_sha1, expected_size) == outcome
+
+
+def test_mismatches_to_verify(tts_db):
+    with sqlite3.connect(tts_db) as db:
+        db.execute("INSERT INTO tts_mods (mod_filename) VALUES ('a.json')")
+        db.executemany(
+            """
+            INSERT INTO tts_assets (
+                asset_url, asset_path, asset_filename, asset_ext, asset_mtime,
+                asset_sha1, asset_steam_sha1)
+            VALUES (?, 'Images', ?, '.png', ?, ?, ?)
+            """,
+            [
+                ("http://steam/1/", "steam1", 10, "AAAA", "BBBB"),
+                ("http://steam/2/", "steam2", 10, "BBBB", "BBBB"),
+                ("http://steam/3/", "steam3", 0, "AAAA", "BBBB"),
+                ("http://steam/4/", "steam4", 10, "", "BBBB"),
+            ],
+        )
+        db.execute(
+            """
+            INSERT INTO tts_mod_assets (asset_id_fk, mod_id_fk, mod_asset_trail)
+            SELECT tts_assets.id, tts_mods.id, 'ObjectStates->ImageURL'
+            FROM tts_assets, tts_mods
+            """
+        )
+        db.execute(
+            """
+            INSERT INTO tts_downloads (dl_url, dl_trail, dl_state, dl_filesize)
+            VALUES ('http://steam/1/', 'ObjectStates->ImageURL', 'done', 525)
+            """
+        )
+
+    assets = AssetList().get_mismatches_to_verify()
+    assert assets == [
+        {
+            "filename": "Images/steam1.png",
+            "url": "http://steam/1/",
+            "steam_sha1": "BBBB",
+            "expected_size": 525,
+            "trail": "ObjectStates->ImageURL",
+        }
+    ]
@@ -1,3 +1,4 @@
+import asyncio
 import time
 from argparse import ArgumentParser, Namespace
 from pathlib import Path
@@ -14,8 +15,15 @@ from textual import work
 
 from . import __version__
 from .data import load_config, save_config, config_override
-from .data.db import create_new_db, update_db_schema
+from .data.db import (
+    DbSchemaError,
+    create_new_db,
+    set_blocking_db_reporter,
+    update_db_schema,
+)
 from .parse import AssetList, ModList
+from .parse.AssetWriteQueue import AssetWriteQueue
+from .parse.HostCapabilities import HostCapabilities
 from .screens.AssetDetailScreen import AssetDetailScreen
 from .screens.AssetListScreen import AssetListScreen
 from .screens.MissingAssetScreen import MissingAssetScreen
@@ -24,8 +32,9 @@ from .screens.ModListScreen import ModListScreen
 from .utility.advertising import APPLICATION_TITLE, PACKAGE_NAME
 from .utility.messages import UpdateLog
 from .workers.backup import ModBackup
-from .workers.downloader import FileDownload
+from .workers.freshness import FreshnessChecker
 from .workers.sha1 import Sha1Scanner
+from .workers.verify import Sha1Verifier
 from .workers.TTSWorker import TTSWorker
 from .workers.names import NameScanner
 
@@ -36,12 +45,6 @@ class TTSMutility(App):
     TITLE = APPLICATION_TITLE
     SUB_TITLE = __version__
 
-    class UpdateCounts(Message):
-        def __init__(self, mod_filename, counts) -> None:
-            super().__init__()
-            self.mod_filename = mod_filename
-            self.counts = counts
-
     class InitComplete(Message):
         def __init__(self) -> None:
             super().__init__()
@@ -65,11 +68,18 @@ class TTSMutility(App):
         # Update config file in case some settings have been added
         save_config(config)
         self.start_time = time.time()
+        self.write_queue = AssetWriteQueue(
+            on_error=lambda error: self.write_log(
+                f"DB write queue flush failed: {error}"
+            )
+        )
+        # Shared by downloads and name scans
+        self.host_capabilities = HostCapabilities()
         self.sha1 = Sha1Scanner()
         self.backup = ModBackup()
         self.name_scanner = NameScanner()
-
-        self.mods_queued_dl = {}
+        self.freshness = FreshnessChecker()
+        self.verifier = Sha1Verifier()
 
         if cli_args.force_refresh:
             self.force_refresh = True
@@ -97,15 +107,32 @@ class TTSMutility(App):
         self.force_md_update = cli_args.force_md_update
         self.clean_db = cli_args.clean_db
 
+        if cli_args.debug_blocking_db:
+            set_blocking_db_reporter(self.report_blocking_db)
+
         self.write_log(f"\n# TTSMutility v{__version__}", prefix="")
         self.write_log(
             f"Started at {time.ctime(self.start_time)}", prefix="", suffix="\n\n"
         )
 
+    def on_unmount(self):
+        # Blocking is expected (and harmless) while shutting down
+        set_blocking_db_reporter(None)
+        # Make sure queued asset updates make it to the DB before we exit
+        self.write_queue.close()
+        self.host_capabilities.flush()
+        self.write_log(
+            f"DB write queue: {self.write_queue.flush_count} flushes, "
+            f"max latency {self.write_queue.max_flush_latency * 1000:.1f}ms."
+        )
+
     def __del__(self):
         if self.f_log is not None:
             self.f_log.close()
 
+    def report_blocking_db(self, name: str) -> None:
+        self.write_log(f"Blocking DB call on UI thread: `{name}`")
+
     def compose(self) -> ComposeResult:
         yield Header()
         # Loading indicator causes poor scrolling performance on Textual > 0.31
@@ -127,8 +154,22 @@ class TTSMutility(App):
         self.mount(self.sha1)
         self.mount(self.backup)
         self.mount(self.name_scanner)
+        self.mount(self.freshness)
+        self.mount(self.verifier)
         self.initialize_database()
 
+    def migration_progress(self, migration, done: int, total: int) -> None:
+        if total == 0:
+            perc_done = 1.00
+        else:
+            perc_done = done / total
+        self.post_message(
+            self.InitProcessing(
+                f"Updating DB to schema {migration.version}: "
+                f"{migration.description} ({perc_done:0.0%})"
+            )
+        )
+
     @work(thread=True)
     def initialize_database(self) -> None:
         config = load_config()
@@ -142,7 +183,16 @@ class TTSMutility(App):
             db_schema = create_new_db(config.db_path)
             self.write_log(f"Created DB with schema version {db_schema}.")
         else:
-            db_schema = update_db_schema(config.db_path)
+            try:
+                db_schema = update_db_schema(
+                    config.db_path,
+                    progress=self.migration_progress,
+                    log=self.write_log,
+                )
+            except DbSchemaError as error:
+                self.write_log(str(error))
+                self.call_from_thread(self.exit, return_code=1, message=str(error))
+                return
             self.write_log(f"Using DB schema version {db_schema}.")
 
         self.post_message(self.InitProcessing("Loading Workshop Mods"))
@@ -212,27 +262,36 @@ class TTSMutility(App):
             mod_list.set_mod_details(
                 {mod_filename: mod_asset_list.get_mod_info(mod_filename)}
             )
-            mod_list.update_mod_counts(mod_filename)
             self.write_log(f"'{mod_filename}' refreshed.")
 
+        if self.clean_db:
+            self.post_message(self.InitProcessing("Checking Mod Asset Counts"))
+            mismatched = mod_list.check_mod_counts(repair=True)
+            self.write_log(f"Repaired asset counts for {len(mismatched)} Mods.")
+            self.post_message(self.InitProcessing("Optimizing Asset Search Index"))
+            mod_asset_list.optimize_search_index()
+
         self.post_message(self.InitProcessing("Init complete. Loading UI."))
         self.write_log("Initialization complete.")
         self.f_log.flush()
         self.post_message(self.InitComplete())
 
-    def force_refresh_mod(self, mod_filename: str) -> None:
+    @work()
+    async def force_refresh_mod(self, mod_filename: str) -> None:
         mod_list = ModList.ModList()
         mod_asset_list = AssetList.AssetList()
 
-        mod_asset_list.get_mod_assets(mod_filename, parse_only=True, force_refresh=True)
-        mod_list.set_mod_details(
+        await mod_asset_list.get_mod_assets_a(
+            mod_filename, parse_only=True, force_refresh=True
+        )
+        await mod_list.set_mod_details_a(
             {mod_filename: mod_asset_list.get_mod_info(mod_filename)}
         )
-        counts = mod_list.update_mod_counts(mod_filename)
+        counts = await mod_list.get_mod_counts_a(mod_filename)
 
         if self.is_screen_installed("mod_list"):
             screen = self.get_screen("mod_list")
-            screen.update_counts(
+            await screen.update_counts(
                 mod_filename,
                 counts["total"],
                 counts["missing"],
@@ -242,34 +301,24 @@ class TTSMutility(App):
 
         if self.is_screen_installed("mod_details"):
             screen = self.get_screen("mod_details")
-            screen.action_refresh_mod_details()
-
-    async def on_ttsmutility_update_counts(self, event: UpdateCounts):
-        if self.is_screen_installed("mod_list"):
-            screen = self.get_screen("mod_list")
-            await screen.update_counts_a(
-                event.mod_filename,
-                event.counts["total"],
-                event.counts["missing"],
-                event.counts["invalid"],
-                event.counts["size"],
-            )
-        if False:
-            if self.is_screen_installed("mod_details"):
-                screen = self.get_screen("mod_details")
-                screen.action_refresh_mod_details()
+            await screen.action_refresh_mod_details()
 
     @work(exclusive=True)
     async def refresh_mods(self) -> None:
         mod_list = ModList.ModList()
         mod_asset_list = AssetList.AssetList()
 
+        # Counts are calculated from the DB, so pending updates must be written first
+        await asyncio.get_running_loop().run_in_executor(None, self.write_queue.flush)
+
+        # Counts are maintained by the DB, only changed mod files need parsing
         mods = await mod_list.get_mods_needing_asset_refresh_a()
         for mod_filename in mods:
-            await mod_asset_list.get_mod_assets_a(mod_filename)
-            counts = await mod_list.update_mod_counts_a(mod_filename)
+            await mod_asset_list.get_mod_assets_a(mod_filename, parse_only=True)
 
-            self.post_message(self.UpdateCounts(mod_filename, counts))
+        if self.is_screen_installed("mod_list"):
+            screen = self.get_screen("mod_list")
+            await screen.refresh_counts(await mod_list.get_mod_counts_a())
 
     def load_screen(self, new_screen: Screen, name: str):
         if self.is_screen_installed(name):
@@ -345,15 +394,11 @@ class TTSMutility(App):
             urls.append(asset["url"])
             trails.append(asset["trail"])
 
-        if event.mod_filename in self.mods_queued_dl:
-            self.mods_queued_dl[event.mod_filename] += urls
-        else:
-            self.mods_queued_dl[event.mod_filename] = urls
         screen = self.get_screen("mod_list")
-        screen.set_files_remaining(
-            event.mod_filename, None, len(self.mods_queued_dl[event.mod_filename]), -1
-        )
-        screen.dl_urls(urls, trails)
+        files_remaining = screen.dl_urls(urls, trails, event.mod_filename)
+        screen.set_files_remaining(event.mod_filename, files_remaining, -1)
+        # The user is looking at this mod, so get its assets first
+        screen.dl_pool.focus(event.mod_filename)
 
     def on_asset_list_screen_update_counts(self):
         self.refresh_mods()
@@ -367,50 +412,69 @@ class TTSMutility(App):
     # ╚═════╝  ╚═════╝  ╚══╝╚══╝ ╚═╝  ╚═══╝╚══════╝ ╚═════╝ ╚═╝  ╚═╝╚═════╝ ╚══════╝╚═╝  ╚═╝
     """  # noqa
 
-    async def on_file_download_file_download_progress(
-        self, event: FileDownload.FileDownloadProgress
+    async def on_mod_list_screen_downloads_updated(
+        self, event: ModListScreen.DownloadsUpdated
     ):
         screen = self.get_screen("mod_list")
         if self.is_screen_installed("mod_details"):
             detail_screen = self.get_screen("mod_details")
         else:
             detail_screen = None
-        for mod_filename in self.mods_queued_dl:
-            if event.url in self.mods_queued_dl[mod_filename]:
-                screen.set_dl_progress(
-                    mod_filename,
-                    event.url,
-                    event.worker_num,
-                    event.filesize,
-                    event.bytes_complete,
-                )
-                if detail_screen is not None:
-                    detail_screen.update_size(
-                        mod_filename, event.url, event.bytes_complete
+        snapshot = event.snapshot
+
+        for message, prefix in snapshot.log:
+            if prefix is None:
+                self.write_log(message)
+            else:
+                self.write_log(message, prefix=prefix)
+
+        updated = set()
+        for worker in snapshot.workers:
+            for mod_filename in screen.dl_pool.scheduler.mods_for(worker.url):
+                if mod_filename in screen.status:
+                    screen.set_dl_progress(
+                        mod_filename,
+                        worker.url,
+                        worker.worker_num,
+                        worker.filesize,
+                        worker.bytes_complete,
                     )
+                    updated.add(mod_filename)
+                    if detail_screen is not None:
+                        detail_screen.update_size(
+                            mod_filename, worker.url, worker.bytes_complete
+                        )
 
-    async def on_mod_list_screen_file_download_complete(
-        self, event: ModListScreen.FileDownloadComplete
-    ):
-        asset_list = AssetList.AssetList()
-        screen = self.get_screen("mod_list")
-        if self.is_screen_installed("mod_details"):
-            detail_screen = self.get_screen("mod_details")
-        else:
-            detail_screen = None
-        await asset_list.download_done(event.asset)
-        # Find the mods being downloaded that contain this URL so we can update the status
-        for mod_filename in self.mods_queued_dl:
-            if event.asset["url"] in self.mods_queued_dl[mod_filename]:
-                self.mods_queued_dl[mod_filename].remove(event.asset["url"])
-                files_remaining = len(self.mods_queued_dl[mod_filename])
-                screen.set_files_remaining(
-                    mod_filename, event.asset["url"], files_remaining, event.worker_num
+        refresh = False
+        for worker_num, error, asset, files_remaining in snapshot.completed:
+            if error == "":
+                message = (
+                    f"DL Task {worker_num}: Download Complete `{asset['filename']}`"
+                )
+                if asset["content_name"] != "":
+                    message += f" (`{asset['content_name']}`)"
+            else:
+                message = (
+                    f"DL Task {worker_num}: Download Failed ({error}): `{asset['url']}`"
                 )
-                if files_remaining == 0:
-                    self.refresh_mods()
+            self.write_log(message)
+            self.write_queue.download_done(asset)
+            # Update the status of each mod that was waiting on this URL
+            for mod_filename, remaining in files_remaining.items():
+                if mod_filename in screen.status:
+                    screen.set_files_remaining(mod_filename, remaining, worker_num)
+                    updated.discard(mod_filename)
+                if remaining == 0:
+                    refresh = True
                 if detail_screen is not None:
-                    detail_screen.update_asset(mod_filename, event.asset)
+                    detail_screen.update_asset(mod_filename, asset)
+
+        for mod_filename in updated:
+            screen.update_dl_status(mod_filename)
+        if refresh:
+            self.refresh_mods()
+        if len(snapshot.completed) > 0 and self.f_log is not None:
+            self.f_log.flush()
 
     async def on_asset_detail_screen_copy_complete(
         self, event: AssetDetailScreen.CopyComplete
@@ -429,9 +493,12 @@ class TTSMutility(App):
     def on_mod_list_screen_mod_refresh(self, event: ModListScreen.ModRefresh):
         self.force_refresh_mod(event.filename)
 
-    def on_mod_list_screen_mod_selected(self, event: ModListScreen.ModSelected):
+    async def on_mod_list_screen_mod_selected(self, event: ModListScreen.ModSelected):
+        mod_detail = await ModList.ModList().get_mod_details_a(event.filename)
         self.load_screen(
-            ModDetailScreen(event.filename, event.backup_time, self.force_md_update),
+            ModDetailScreen(
+                event.filename, mod_detail, event.backup_time, self.force_md_update
+            ),
             "mod_details",
         )
 
@@ -441,23 +508,29 @@ class TTSMutility(App):
     def on_mod_list_screen_download_selected(
         self, event: ModListScreen.DownloadSelected
     ):
-        self.run_worker(
-            self.download_selected(event.mod_filenames), thread=True, exclusive=True
-        )
+        self.run_worker(self.download_selected(event.mod_filenames), exclusive=True)
 
     async def download_selected(self, mod_filenames: list[str]) -> None:
         mod_asset_list = AssetList.AssetList()
         screen = self.get_screen("mod_list")
+        # Don't waste time on urls that failed for good recently
+        dead_urls = await screen.load_dead_urls()
+        skipped = []
 
         for mod_filename in mod_filenames:
-            turls = await mod_asset_list.get_missing_assets(mod_filename)
-            if len(turls) == 0:
+            turls = await mod_asset_list.get_missing_assets_a(mod_filename)
+            if len(turls) > 0:
+                urls, trails = tuple(zip(*turls))
+                urls, trails, dead = dead_urls.filter(urls, trails)
+                skipped += dead
+            if len(turls) == 0 or len(urls) == 0:
+                # Nothing left to download
+                screen.set_files_remaining(mod_filename, 0, 0)
                 continue
-            screen.set_files_remaining(mod_filename, None, len(turls), -1)
-            urls, trails = tuple(zip(*turls))
             self.write_log(f"Downloading missing assets from `{mod_filename}`.")
-            self.mods_queued_dl[mod_filename] = list(urls)
-            screen.dl_urls(urls, trails, mod_filename)
+            files_remaining = screen.dl_urls(urls, trails, mod_filename)
+            screen.set_files_remaining(mod_filename, files_remaining, -1)
+        screen.skipped_dead_urls(skipped)
 
     def on_mod_list_screen_sha1selected(self, event: ModListScreen.Sha1Selected):
         self.run_worker(self.sha1.scan_sha1s, exclusive=True, thread=True)
@@ -471,6 +544,24 @@ class TTSMutility(App):
     def on_mod_list_screen_scan_names(self, event: ModListScreen.ScanNames):
         self.run_worker(self.name_scanner.scan_names, exclusive=True, thread=True)
 
+    def on_mod_list_screen_check_freshness(self, event: ModListScreen.CheckFreshness):
+        self.run_worker(self.freshness.check_assets, exclusive=True, thread=True)
+
+    def on_freshness_checker_assets_changed(
+        self, event: FreshnessChecker.AssetsChanged
+    ):
+        self.write_log(f"Re-downloading {len(event.urls)} changed assets.")
+        screen = self.get_screen("mod_list")
+        screen.dl_urls(event.urls, event.trails)
+
+    def on_mod_list_screen_verify_sha1s(self, event: ModListScreen.VerifySha1s):
+        self.run_worker(self.verifier.verify_mismatches, exclusive=True, thread=True)
+
+    def on_sha1verifier_assets_corrupt(self, event: Sha1Verifier.AssetsCorrupt):
+        self.write_log(f"Re-downloading {len(event.urls)} corrupt assets.")
+        screen = self.get_screen("mod_list")
+        screen.dl_urls(event.urls, event.trails)
+
     def on_mod_detail_screen_bgg_id_updated(self, event: ModDetailScreen.BggIdUpdated):
         if self.is_screen_installed("mod_list"):
             screen = self.get_screen("mod_list")
@@ -496,10 +587,15 @@ class TTSMutility(App):
             self.f_log.flush()
 
     def on_mod_backup_update_progress(self, event: ModBackup.UpdateProgress):
-        up_prog = TTSWorker.UpdateProgress(
-            update_total=event.update_total, advance_amount=event.advance_amount
+        # Progress covers every mod being backed up at once
+        self.on_ttsworker_update_progress(
+            TTSWorker.UpdateProgress(update_total=event.total)
+        )
+        self.on_ttsworker_update_progress(
+            TTSWorker.UpdateProgress(advance_amount=event.done)
         )
-        self.on_ttsworker_update_progress(up_prog)
+        screen = self.get_screen("mod_list")
+        screen.set_backup_progress(event.filename, event.mod_done, event.mod_total)
 
     def on_mod_backup_backup_start(self, event: ModBackup.BackupStart):
         screen = self.get_screen("mod_list")
@@ -509,7 +605,7 @@ class TTSMutility(App):
 
     def on_mod_backup_backup_complete(self, event: ModBackup.BackupComplete):
         screen = self.get_screen("mod_list")
-        screen.set_backup_complete(event.filename)
+        screen.set_backup_complete(event.filename, event.failed)
 
     def on_ttsworker_update_progress(self, event: TTSWorker.UpdateProgress):
         if event.update_total is not None:
@@ -619,11 +715,18 @@ def get_args() -> Namespace:
 
     parser.add_argument(
         "--clean-db",
-        help="Remove stale assets and deleted mods from the DB",
+        help="Remove stale assets and deleted mods from the DB, verify asset counts",
         dest="clean_db",
         action="store_true",
     )
 
+    parser.add_argument(
+        "--debug-blocking-db",
+        help="Log DB calls that block the UI thread",
+        dest="debug_blocking_db",
+        action="store_true",
+    )
+
     parser.add_argument(
         "-c",
         "--config_file",
@@ -69,11 +69,68 @@ class Config:
         "How many days before metadata is refreshed from Steam and BGG"
     )
 
-    num_download_threads: str = "3"
+    num_download_threads: str = "8"
     num_download_threads_help: str = (
         "Number of background threads to use when downloading missing assets"
     )
 
+    num_downloads_per_host: str = "4"
+    num_downloads_per_host_help: str = (
+        "Maximum number of assets downloaded at once from a host without "
+        "known limits (concurrency adapts below this as the host responds)"
+    )
+
+    num_backup_threads: str = "2"
+    num_backup_threads_help: str = (
+        "Number of mods backed up at once (raise for fast disks, 1 for "
+        "spinning disks)"
+    )
+
+    backup_dead_space: str = "25"
+    backup_dead_space_help: str = (
+        "Percentage of a zip backup that can be left unused when it is "
+        "updated with just the changed assets, before it is rewritten in "
+        "full (0 always rewrites)"
+    )
+
+    backup_store: bool = False
+    backup_store_help: str = (
+        "Back up into a store in the backup directory where assets shared "
+        "by several mods are kept once, with a small manifest per mod, "
+        "instead of a zip per mod"
+    )
+
+    backup_compression_level: str = "1"
+    backup_compression_level_help: str = (
+        "Deflate level (1-9) for compressible assets such as OBJ and JSON in "
+        "backups, 0 to store every file uncompressed"
+    )
+
+    download_mirrors: str = (
+        "http://cloud-3.steamusercontent.com/ugc/ => "
+        "https://steamusercontent-a.akamaihd.net/ugc/; "
+        "https://cloud-3.steamusercontent.com/ugc/ => "
+        "https://steamusercontent-a.akamaihd.net/ugc/; "
+        "http://i.imgur.com/ => https://i.imgur.com/; "
+        "http://imgur.com/ => https://i.imgur.com/"
+    )
+    download_mirrors_help: str = (
+        "Urls to try before an asset's own url, tried in order. Separated by "
+        "';', each rewrites the start of the url: 'prefix => replacement'"
+    )
+
+    download_rate_limit: str = "0"
+    download_rate_limit_help: str = (
+        "Maximum download rate in KiB/s, shared by all downloads (0 for unlimited)"
+    )
+
+    download_rate_windows: str = ""
+    download_rate_windows_help: str = (
+        "Times of day with their own download rate limit, used instead of "
+        "download_rate_limit. Comma separated, in KiB/s, e.g. "
+        "'09:00-17:00=256, 17:00-23:00=paused, 23:00-09:00=0'"
+    )
+
     steam_api_key: str = ""
     steam_api_key_help: str = (
         "Personal Steam API key. Not currently used, so completely optional."
@@ -1,92 +1,627 @@
+import asyncio
 import sqlite3
-import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import closing
+from dataclasses import dataclass
+from functools import partial, wraps
 from pathlib import Path
+from typing import Callable
 
-DB_SCHEMA_VERSION = 5
+DB_SCHEMA_VERSION = 12
 
+# All async DB access is funneled through this executor so the Textual event
+# loop never waits on sqlite.  A single thread keeps writers from fighting
+# over the DB lock.
+DB_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ttsmutility_db")
 
-def update_db_schema(db_path: Path) -> int:
-    with closing(sqlite3.connect(db_path)) as db:
-        cursor = db.execute(
+BLOCKING_DB_REPORTER = None
+
+
+def set_blocking_db_reporter(reporter) -> None:
+    """Report synchronous DB calls made from the UI thread.
+
+    Args:
+        reporter: Called with the qualified name of the offending method, or
+            None to disable the check.
+    """
+    global BLOCKING_DB_REPORTER
+    BLOCKING_DB_REPORTER = reporter
+
+
+def blocking_db_call(func):
+    """Decorator for synchronous methods that access the DB."""
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if (
+            BLOCKING_DB_REPORTER is not None
+            and threading.current_thread() is threading.main_thread()
+        ):
+            BLOCKING_DB_REPORTER(func.__qualname__)
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+async def run_db(func, *args, **kwargs):
+    """Run a synchronous DB method on the DB executor and await the result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(DB_EXECUTOR, partial(func, *args, **kwargs))
+
+
+# How much a single tts_mod_assets row contributes to the mod counts.  The
+# triggers below and MOD_COUNTS_QUERY must agree on these.
+_MISSING = "(asset_mtime IS 0 AND {link}.mod_asset_ignore_missing IS 0)"
+_INVALID = (
+    "(IFNULL(asset_dl_status, '') != '' AND {link}.mod_asset_ignore_missing IS 0)"
+)
+
+
+def _link_delta(link: str, sign: str) -> str:
+    return f"""
+            UPDATE tts_mods
+            SET
+                mod_total_assets = mod_total_assets {sign} 1,
+                mod_missing_assets = mod_missing_assets {sign} IFNULL((
+                    SELECT {_MISSING.format(link=link)}
+                    FROM tts_assets WHERE id={link}.asset_id_fk), 0),
+                mod_invalid_assets = mod_invalid_assets {sign} IFNULL((
+                    SELECT {_INVALID.format(link=link)}
+                    FROM tts_assets WHERE id={link}.asset_id_fk), 0),
+                mod_size = mod_size {sign} IFNULL((
+                    SELECT asset_size
+                    FROM tts_assets WHERE id={link}.asset_id_fk), 0)
+            WHERE id={link}.mod_id_fk;
             """
-            SELECT
-                db_schema_version
-            FROM
-                tts_app
+
+
+# The total/missing/invalid/size columns in tts_mods are kept current by
+# these triggers.  mod_max_asset_mtime is bumped when the mod gains or loses
+# an asset, or when one of its asset files changes on disk.
+MOD_COUNT_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS tts_mod_assets_insert
+    AFTER INSERT ON tts_mod_assets
+    BEGIN
+        {_link_delta("NEW", "+")}
+        UPDATE tts_mods SET mod_max_asset_mtime=UNIXEPOCH() WHERE id=NEW.mod_id_fk;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS tts_mod_assets_delete
+    AFTER DELETE ON tts_mod_assets
+    BEGIN
+        {_link_delta("OLD", "-")}
+        UPDATE tts_mods SET mod_max_asset_mtime=UNIXEPOCH() WHERE id=OLD.mod_id_fk;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS tts_mod_assets_update
+    AFTER UPDATE OF asset_id_fk, mod_id_fk, mod_asset_ignore_missing
+    ON tts_mod_assets
+    BEGIN
+        {_link_delta("OLD", "-")}
+        {_link_delta("NEW", "+")}
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tts_assets_update
+    AFTER UPDATE OF asset_mtime, asset_size, asset_dl_status ON tts_assets
+    WHEN
+        OLD.asset_mtime IS NOT NEW.asset_mtime
+        OR OLD.asset_size IS NOT NEW.asset_size
+        OR OLD.asset_dl_status IS NOT NEW.asset_dl_status
+    BEGIN
+        UPDATE tts_mods
+        SET
+            mod_missing_assets = mod_missing_assets + IFNULL((
+                SELECT (NEW.asset_mtime IS 0) - (OLD.asset_mtime IS 0)
+                FROM tts_mod_assets
+                WHERE asset_id_fk=NEW.id AND mod_id_fk=tts_mods.id
+                    AND mod_asset_ignore_missing IS 0), 0),
+            mod_invalid_assets = mod_invalid_assets + IFNULL((
+                SELECT
+                    (IFNULL(NEW.asset_dl_status, '') != '')
+                    - (IFNULL(OLD.asset_dl_status, '') != '')
+                FROM tts_mod_assets
+                WHERE asset_id_fk=NEW.id AND mod_id_fk=tts_mods.id
+                    AND mod_asset_ignore_missing IS 0), 0),
+            mod_size = mod_size + IFNULL(NEW.asset_size, 0) - IFNULL(OLD.asset_size, 0),
+            mod_max_asset_mtime = CASE
+                WHEN NEW.asset_mtime > 0 AND NEW.asset_mtime IS NOT OLD.asset_mtime
+                THEN UNIXEPOCH()
+                ELSE mod_max_asset_mtime
+            END
+        WHERE id IN (SELECT mod_id_fk FROM tts_mod_assets WHERE asset_id_fk=NEW.id);
+    END
+    """,
+    # Runs before the cascade removes the links, so the asset is still
+    # there to subtract.  The link delete trigger then only adjusts totals.
+    """
+    CREATE TRIGGER IF NOT EXISTS tts_assets_delete
+    BEFORE DELETE ON tts_assets
+    BEGIN
+        UPDATE tts_mods
+        SET
+            mod_missing_assets = mod_missing_assets - IFNULL((
+                SELECT OLD.asset_mtime IS 0
+                FROM tts_mod_assets
+                WHERE asset_id_fk=OLD.id AND mod_id_fk=tts_mods.id
+                    AND mod_asset_ignore_missing IS 0), 0),
+            mod_invalid_assets = mod_invalid_assets - IFNULL((
+                SELECT IFNULL(OLD.asset_dl_status, '') != ''
+                FROM tts_mod_assets
+                WHERE asset_id_fk=OLD.id AND mod_id_fk=tts_mods.id
+                    AND mod_asset_ignore_missing IS 0), 0),
+            mod_size = mod_size - IFNULL(OLD.asset_size, 0)
+        WHERE id IN (SELECT mod_id_fk FROM tts_mod_assets WHERE asset_id_fk=OLD.id);
+    END
+    """,
+]
+
+# Trigram index of asset content names for substring searches.  It is an
+# external content table, so the triggers must mirror every change.  URLs are
+# deliberately left out, their common trigrams ("htt", "ttp", ...) would be
+# in every row and slow down any search that contains them.
+ASSET_SEARCH_SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS tts_assets_fts USING fts5(
+        asset_content_name,
+        content='tts_assets',
+        content_rowid='id',
+        tokenize='trigram'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tts_assets_fts_insert
+    AFTER INSERT ON tts_assets
+    BEGIN
+        INSERT INTO tts_assets_fts (rowid, asset_content_name)
+        VALUES (NEW.id, NEW.asset_content_name);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tts_assets_fts_delete
+    AFTER DELETE ON tts_assets
+    BEGIN
+        INSERT INTO tts_assets_fts (tts_assets_fts, rowid, asset_content_name)
+        VALUES ('delete', OLD.id, OLD.asset_content_name);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tts_assets_fts_update
+    AFTER UPDATE OF asset_content_name ON tts_assets
+    BEGIN
+        INSERT INTO tts_assets_fts (tts_assets_fts, rowid, asset_content_name)
+        VALUES ('delete', OLD.id, OLD.asset_content_name);
+        INSERT INTO tts_assets_fts (rowid, asset_content_name)
+        VALUES (NEW.id, NEW.asset_content_name);
+    END
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS tts_assets_sha1 ON tts_assets (asset_sha1)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS tts_assets_content_name
+    ON tts_assets (asset_content_name COLLATE NOCASE)
+    """,
+]
+
+# Download queue, so downloads that were queued or running when the app
+# closed can be resumed.  A url is downloaded once for all the mods waiting
+# on it, tts_download_mods records who those are.
+DOWNLOAD_JOURNAL_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS tts_downloads (
+        id                  INTEGER PRIMARY KEY,
+        dl_url              VARCHAR(255)    NOT NULL UNIQUE,
+        dl_trail            VARCHAR(128)    NOT NULL,
+        dl_state            VARCHAR(16)     NOT NULL    DEFAULT 'queued',
+        dl_attempts         INT             NOT NULL    DEFAULT 0,
+        dl_bytes_complete   INT             NOT NULL    DEFAULT 0,
+        dl_filesize         INT             NOT NULL    DEFAULT 0,
+        dl_accept_ranges    INT2            NOT NULL    DEFAULT 0,
+        dl_error            VARCHAR(255)    NOT NULL    DEFAULT "",
+        dl_queued_time      TIMESTAMP                   DEFAULT 0,
+        dl_update_time      TIMESTAMP                   DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS tts_download_mods (
+        dl_id_fk            INT             NOT NULL REFERENCES tts_downloads (id) ON DELETE CASCADE,
+        mod_filename        VARCHAR(128)    NOT NULL,
+        PRIMARY KEY (dl_id_fk, mod_filename)
+    ) WITHOUT ROWID
+    """,  # noqa
+    """
+    CREATE INDEX IF NOT EXISTS tts_downloads_state ON tts_downloads (dl_state)
+    """,
+]
+
+# Modification time of each asset directory when a SHA1 scan last completed,
+# a directory that hasn't changed since doesn't need to be listed again.
+SHA1_SCAN_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS tts_sha1_dirs (
+        dir_path            VARCHAR(32)     PRIMARY KEY COLLATE NOCASE,
+        dir_mtime_ns        INTEGER         NOT NULL    DEFAULT 0
+    ) WITHOUT ROWID
+    """,
+]
+
+# What each host supports, learnt from downloads and name scans.  NULL is
+# not known yet.
+HOSTS_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS tts_hosts (
+        host_name                   VARCHAR(255)    PRIMARY KEY,
+        host_content_disposition    INT2,
+        host_head                   INT2,
+        host_ranges                 INT2,
+        host_latency                REAL            NOT NULL    DEFAULT 0,
+        host_update_time            TIMESTAMP                   DEFAULT 0
+    ) WITHOUT ROWID
+    """,
+]
+
+# Full recompute of the trigger maintained counts, used to verify them
+MOD_COUNTS_QUERY = f"""
+    SELECT
+        mod_filename,
+        mod_total_assets, mod_missing_assets, mod_invalid_assets, mod_size,
+        COUNT(tts_mod_assets.id),
+        IFNULL(SUM({_MISSING.format(link="tts_mod_assets")}), 0),
+        IFNULL(SUM({_INVALID.format(link="tts_mod_assets")}), 0),
+        IFNULL(SUM(asset_size), 0)
+    FROM tts_mods
+        LEFT JOIN tts_mod_assets ON tts_mod_assets.mod_id_fk=tts_mods.id
+        LEFT JOIN tts_assets ON tts_assets.id=tts_mod_assets.asset_id_fk
+    WHERE tts_mods.id BETWEEN ? AND ?
+    GROUP BY tts_mods.id
+    """
+
+
+def optimize_asset_search(db) -> None:
+    # Merges the FTS index into a single b-tree, lookups are several times
+    # faster afterwards than against the segments left by bulk inserts.
+    db.execute("INSERT INTO tts_assets_fts (tts_assets_fts) VALUES ('optimize')")
+
+
+def verify_mod_counts(
+    db: sqlite3.Connection,
+    repair: bool = True,
+    id_range: tuple[int, int] = (0, 2**63 - 1),
+) -> list:
+    """Compare the trigger maintained mod counts against a full recompute.
+
+    Args:
+        db: Open connection, committed by the caller.
+        repair: Overwrite stored counts that do not match.
+        id_range: Only check mods with ids in this (inclusive) range.
+
+    Returns:
+        Filenames of the mods whose counts did not match.
+    """
+    mismatched = []
+    fixes = []
+    for row in db.execute(MOD_COUNTS_QUERY, id_range).fetchall():
+        if row[1:5] != row[5:9]:
+            mismatched.append(row[0])
+            fixes.append((*row[5:9], row[0]))
+    if repair and len(fixes) > 0:
+        db.executemany(
             """
+            UPDATE tts_mods
+            SET
+                mod_total_assets=?, mod_missing_assets=?,
+                mod_invalid_assets=?, mod_size=?
+            WHERE mod_filename=?
+            """,
+            fixes,
         )
-        result = cursor.fetchone()
-        if result[0] != DB_SCHEMA_VERSION:
-            updated = False
-
-            if result[0] == 0:
-                cursor.execute(
-                    """
-                    ALTER TABLE
-                        tts_mods
-                    ADD
-                        mod_bgg_id      VARCHAR(16)
-                    """,
-                )
-                updated = True
+    return mismatched
 
-            if result[0] <= 1:
-                print(
-                    "Unable to upgrade from schema 1.  Please delete existing DB.",
-                    file=sys.stderr,
-                )
-                sys.exit(1)
-
-            if result[0] <= 2:
-                cursor.execute(
-                    """
-                    ALTER TABLE
-                        tts_mods
-                    ADD
-                        mod_max_asset_mtime TIMESTAMP DEFAULT 0
-                    """,
-                )
-                updated = True
-
-            if result[0] <= 3:
-                cursor.execute(
-                    """
-                    ALTER TABLE
-                        tts_mod_assets
-                    ADD
-                        mod_asset_ignore_missing INT2 DEFAULT 0
-                    """,
-                )
-                updated = True
-
-            if result[0] <= 4:
-                cursor.execute(
-                    """
-                    ALTER TABLE
-                        tts_mods
-                    ADD
-                        mod_invalid_assets INT NOT NULL DEFAULT -1
-                    """,
-                )
-                updated = True
 
-            if not updated:
-                # We don't know how to upgrade from here!
-                return -1
+class DbSchemaError(Exception):
+    """The DB cannot be upgraded to DB_SCHEMA_VERSION."""
 
-            cursor.execute(
+
+# Oldest schema that can still be upgraded
+DB_MIN_SCHEMA_VERSION = 2
+
+# Ids handled per backfill transaction
+DB_MIGRATION_BATCH_SIZE = 5000
+
+# Progress of each migration, so an interrupted one can be resumed
+MIGRATIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS tts_migrations (
+        version         INTEGER PRIMARY KEY,
+        description     VARCHAR(128),
+        last_id         INT             NOT NULL    DEFAULT 0,
+        max_id          INT             NOT NULL    DEFAULT 0,
+        start_time      TIMESTAMP,
+        duration        REAL            NOT NULL    DEFAULT 0,
+        complete        INT2            NOT NULL    DEFAULT 0
+    )
+    """
+
+
+@dataclass
+class Migration:
+    """Upgrade from schema `version - 1` to `version`.
+
+    `schema` runs first in its own transaction and must be safe to run again,
+    an interrupted migration starts over from it.  `backfill(db, first, last)`
+    is then called for consecutive id ranges of `table` that existed when the
+    migration started, each range is committed along with the progress.
+    `finish` runs in the transaction that bumps the schema version.
+    """
+
+    version: int
+    description: str
+    schema: Callable[[sqlite3.Connection], None]
+    table: str = ""
+    backfill: Callable[[sqlite3.Connection, int, int], None] | None = None
+    finish: Callable[[sqlite3.Connection], None] | None = None
+
+
+def _add_column(db: sqlite3.Connection, table: str, column: str, spec: str) -> None:
+    columns = [row[1] for row in db.execute(f"PRAGMA table_info({table})")]
+    if column not in columns:
+        db.execute(f"ALTER TABLE {table} ADD {column} {spec}")
+
+
+def _v6_schema(db: sqlite3.Connection) -> None:
+    _add_column(db, "tts_mods", "mod_needs_refresh", "INT2 NOT NULL DEFAULT 0")
+    # -1 used to mean the mod was waiting for a rescan
+    db.execute(
+        """
+        UPDATE tts_mods
+        SET mod_needs_refresh=1
+        WHERE
+            mod_total_assets=-1 OR mod_missing_assets=-1
+            OR mod_invalid_assets=-1 OR mod_size=-1
+        """
+    )
+    for trigger in MOD_COUNT_TRIGGERS:
+        db.execute(trigger)
+
+
+def _v6_backfill(db: sqlite3.Connection, first: int, last: int) -> None:
+    verify_mod_counts(db, id_range=(first, last))
+
+
+def _v7_schema(db: sqlite3.Connection) -> None:
+    for statement in ASSET_SEARCH_SCHEMA:
+        db.execute(statement)
+
+
+def _v7_backfill(db: sqlite3.Connection, first: int, last: int) -> None:
+    db.execute(
+        """
+        INSERT INTO tts_assets_fts (rowid, asset_content_name)
+        SELECT id, asset_content_name
+        FROM tts_assets
+        WHERE id BETWEEN ? AND ?
+        """,
+        (first, last),
+    )
+
+
+def _v8_schema(db: sqlite3.Connection) -> None:
+    for statement in DOWNLOAD_JOURNAL_SCHEMA:
+        db.execute(statement)
+
+
+def _v9_schema(db: sqlite3.Connection) -> None:
+    # Seconds each download took, for the download history
+    _add_column(db, "tts_downloads", "dl_duration", "REAL NOT NULL DEFAULT 0")
+
+
+def _v10_schema(db: sqlite3.Connection) -> None:
+    # Lets a freshness check ask the host whether an asset changed
+    _add_column(db, "tts_assets", "asset_etag", 'VARCHAR(128) DEFAULT ""')
+    _add_column(db, "tts_assets", "asset_last_modified", 'VARCHAR(64) DEFAULT ""')
+    _add_column(db, "tts_assets", "asset_checked_time", "TIMESTAMP DEFAULT 0")
+
+
+def _v11_schema(db: sqlite3.Connection) -> None:
+    # The stat of the file when its SHA1 was computed, so an unchanged file
+    # isn't hashed again
+    for column in ["size", "mtime_ns", "inode"]:
+        _add_column(db, "tts_assets", f"asset_sha1_{column}", "INTEGER DEFAULT 0")
+    for statement in SHA1_SCAN_SCHEMA:
+        db.execute(statement)
+
+
+def _v12_schema(db: sqlite3.Connection) -> None:
+    for statement in HOSTS_SCHEMA:
+        db.execute(statement)
+
+
+MIGRATIONS = [
+    Migration(
+        3,
+        "Add mod asset mtime",
+        lambda db: _add_column(
+            db, "tts_mods", "mod_max_asset_mtime", "TIMESTAMP DEFAULT 0"
+        ),
+    ),
+    Migration(
+        4,
+        "Add ignore missing assets",
+        lambda db: _add_column(
+            db, "tts_mod_assets", "mod_asset_ignore_missing", "INT2 DEFAULT 0"
+        ),
+    ),
+    Migration(
+        5,
+        "Add invalid asset counts",
+        lambda db: _add_column(
+            db, "tts_mods", "mod_invalid_assets", "INT NOT NULL DEFAULT -1"
+        ),
+    ),
+    Migration(
+        6,
+        "Verify mod asset counts",
+        _v6_schema,
+        table="tts_mods",
+        backfill=_v6_backfill,
+    ),
+    Migration(
+        7,
+        "Index asset content names",
+        _v7_schema,
+        table="tts_assets",
+        backfill=_v7_backfill,
+        finish=optimize_asset_search,
+    ),
+    Migration(
+        8,
+        "Add download journal",
+        _v8_schema,
+    ),
+    Migration(9, "Add download durations", _v9_schema),
+    Migration(10, "Add asset validators", _v10_schema),
+    Migration(11, "Add SHA1 scan fingerprints", _v11_schema),
+    Migration(12, "Add host capabilities", _v12_schema),
+]
+
+
+def _run_migration(
+    db: sqlite3.Connection, migration: Migration, batch_size: int, progress
+) -> float:
+    checkpoint = time.perf_counter()
+    total = 0.0
+
+    def elapsed() -> float:
+        nonlocal checkpoint, total
+        now = time.perf_counter()
+        delta = now - checkpoint
+        checkpoint = now
+        total += delta
+        return delta
+
+    try:
+        db.execute("BEGIN")
+        migration.schema(db)
+        if migration.table != "":
+            max_id = db.execute(
+                f"SELECT IFNULL(MAX(id), 0) FROM {migration.table}"
+            ).fetchone()[0]
+        else:
+            max_id = 0
+        db.execute(
+            """
+            INSERT OR IGNORE INTO tts_migrations
+                (version, description, max_id, start_time)
+            VALUES (?, ?, ?, UNIXEPOCH())
+            """,
+            (migration.version, migration.description, max_id),
+        )
+        last_id, max_id = db.execute(
+            "SELECT last_id, max_id FROM tts_migrations WHERE version=?",
+            (migration.version,),
+        ).fetchone()
+        db.execute(
+            "UPDATE tts_migrations SET duration=duration+? WHERE version=?",
+            (elapsed(), migration.version),
+        )
+        db.execute("COMMIT")
+
+        while last_id < max_id:
+            if progress is not None:
+                progress(migration, last_id, max_id)
+            first = last_id + 1
+            last_id = min(last_id + batch_size, max_id)
+            db.execute("BEGIN")
+            migration.backfill(db, first, last_id)
+            db.execute(
                 """
-                UPDATE
-                    tts_app
-                SET
-                    db_schema_version=?
+                UPDATE tts_migrations
+                SET last_id=?, duration=duration+?
+                WHERE version=?
                 """,
-                (DB_SCHEMA_VERSION,),
+                (last_id, elapsed(), migration.version),
             )
-            db.commit()
+            db.execute("COMMIT")
+
+        if progress is not None:
+            progress(migration, max_id, max_id)
+        db.execute("BEGIN")
+        if migration.finish is not None:
+            migration.finish(db)
+        db.execute("UPDATE tts_app SET db_schema_version=?", (migration.version,))
+        db.execute(
+            """
+            UPDATE tts_migrations
+            SET complete=1, duration=duration+?
+            WHERE version=?
+            """,
+            (elapsed(), migration.version),
+        )
+        db.execute("COMMIT")
+    except BaseException:
+        if db.in_transaction:
+            db.execute("ROLLBACK")
+        raise
 
-    return DB_SCHEMA_VERSION
+    return total
+
+
+def update_db_schema(
+    db_path: Path,
+    progress=None,
+    log=None,
+    batch_size: int = DB_MIGRATION_BATCH_SIZE,
+) -> int:
+    """Bring an existing DB up to DB_SCHEMA_VERSION.
+
+    Each migration is committed as soon as it completes, and long backfills
+    are committed in batches, so an interrupted upgrade resumes where it left
+    off on the next start.
+
+    Args:
+        db_path: DB to upgrade.
+        progress: Called with (migration, done, total) as backfills advance.
+        log: Called with a message, including timing, for each migration.
+        batch_size: Ids handled per backfill transaction.
+
+    Returns:
+        The schema version of the DB.
+
+    Raises:
+        DbSchemaError: The DB is too old, or too new, to be upgraded.
+    """
+    with closing(sqlite3.connect(db_path, isolation_level=None)) as db:
+        version = db.execute("SELECT db_schema_version FROM tts_app").fetchone()[0]
+        if version == DB_SCHEMA_VERSION:
+            return version
+        if version < DB_MIN_SCHEMA_VERSION:
+            raise DbSchemaError(
+                f"Unable to upgrade from schema {version}.  Please delete existing DB."
+            )
+        if version > DB_SCHEMA_VERSION:
+            raise DbSchemaError(
+                f"DB schema {version} is newer than the supported schema "
+                f"{DB_SCHEMA_VERSION}.  Please upgrade TTSMutility."
+            )
+
+        db.execute(MIGRATIONS_TABLE)
+        for migration in MIGRATIONS:
+            if migration.version <= version:
+                continue
+            duration = _run_migration(db, migration, batch_size, progress)
+            if log is not None:
+                log(
+                    f"Migrated DB to schema {migration.version} "
+                    f"({migration.description}) in {duration:.3f}s."
+                )
+            version = migration.version
+
+    return version
 
 
 def create_new_db(db_path: Path) -> int:
@@ -107,7 +642,13 @@ def create_new_db(db_path: Path) -> int:
                 asset_size          INTEGER                             DEFAULT 0,
                 asset_dl_status     VARCHAR(255)                        DEFAULT "",
                 asset_content_name  VARCHAR(255)                        DEFAULT "",
-                asset_new           INT2
+                asset_new           INT2,
+                asset_etag          VARCHAR(128)                        DEFAULT "",
+                asset_last_modified VARCHAR(64)                         DEFAULT "",
+                asset_checked_time  TIMESTAMP                           DEFAULT 0,
+                asset_sha1_size     INTEGER                             DEFAULT 0,
+                asset_sha1_mtime_ns INTEGER                             DEFAULT 0,
+                asset_sha1_inode    INTEGER                             DEFAULT 0
                 )
             """
             )
@@ -132,11 +673,12 @@ def create_new_db(db_path: Path) -> int:
                 mod_mtime           TIMESTAMP                   DEFAULT 0,
                 mod_fetch_time      TIMESTAMP                   DEFAULT 0,
                 mod_backup_time     TIMESTAMP                   DEFAULT 0,
-                mod_size            INT             NOT NULL    DEFAULT -1,
-                mod_total_assets    INT             NOT NULL    DEFAULT -1,
-                mod_missing_assets  INT             NOT NULL    DEFAULT -1,
-                mod_invalid_assets  INT             NOT NULL    DEFAULT -1,
-                mod_max_asset_mtime TIMESTAMP                   DEFAULT 0
+                mod_size            INT             NOT NULL    DEFAULT 0,
+                mod_total_assets    INT             NOT NULL    DEFAULT 0,
+                mod_missing_assets  INT             NOT NULL    DEFAULT 0,
+                mod_invalid_assets  INT             NOT NULL    DEFAULT 0,
+                mod_max_asset_mtime TIMESTAMP                   DEFAULT 0,
+                mod_needs_refresh   INT2            NOT NULL    DEFAULT 0
                 )
             """
             )
@@ -185,6 +727,24 @@ def create_new_db(db_path: Path) -> int:
             """
             )
 
+            for trigger in MOD_COUNT_TRIGGERS:
+                cursor.execute(trigger)
+
+            for statement in ASSET_SEARCH_SCHEMA:
+                cursor.execute(statement)
+
+            for statement in DOWNLOAD_JOURNAL_SCHEMA:
+                cursor.execute(statement)
+            _v9_schema(cursor)
+
+            for statement in SHA1_SCAN_SCHEMA:
+                cursor.execute(statement)
+
+            for statement in HOSTS_SCHEMA:
+                cursor.execute(statement)
+
+            cursor.execute(MIGRATIONS_TABLE)
+
             cursor.execute(
                 """
                 INSERT INTO tts_app
@@ -1,16 +1,13 @@
-import operator
 import os
 import os.path
 import pathlib
 import sqlite3
 import time
-from functools import reduce
 from pathlib import Path
 from shutil import copy, move
 
-import aiosqlite
-
 from ..data.config import load_config
+from ..data.db import blocking_db_call, optimize_asset_search, run_db
 from ..parse.FileFinder import (
     FILES_TO_IGNORE,
     TTS_RAW_DIRS,
@@ -66,52 +63,65 @@ class AssetList:
     def get_mod_infos(self) -> dict:
         return self.mod_infos
 
-    def get_sha1_info(self, path: str) -> dict:
-        def my_factory(cursor, row):
-            fields = [column[0] for column in cursor.description]
+    @blocking_db_call
+    def get_sha1_info(self, path: str, unhashed_only: bool = False) -> dict:
+        """SHA1 state of the assets in a directory, by filename (without ext).
+
+        Args:
+            unhashed_only: Only return files on disk that have no fingerprint.
+
+        Returns:
+            Tuples of (sha1, steam_sha1, sha1_mtime, fingerprint) where the
+            fingerprint is the (size, mtime_ns, inode) of the file when its
+            SHA1 was computed, or (0, 0, 0).
+        """
+        query = """
+            SELECT
+                asset_filename, asset_sha1, asset_steam_sha1, asset_sha1_mtime,
+                asset_sha1_size, asset_sha1_mtime_ns, asset_sha1_inode
+            FROM
+                tts_assets
+            WHERE
+                asset_path=?
+            """
+        if unhashed_only:
+            query += """
+                AND asset_mtime > 0
+                AND (asset_sha1_mtime_ns = 0 OR IFNULL(asset_sha1, "") = "")
+            """
+        with sqlite3.connect(self.db_path) as db:
             return {
-                row[0]: {
-                    key.replace("asset_", ""): value
-                    for key, value in zip(fields[1:], row[1:])
-                }
+                filename: (sha1, steam_sha1, sha1_mtime, (size, mtime_ns, inode))
+                for (
+                    filename,
+                    sha1,
+                    steam_sha1,
+                    sha1_mtime,
+                    size,
+                    mtime_ns,
+                    inode,
+                ) in db.execute(query, (path,))
             }
 
+    @blocking_db_call
+    def get_sha1_dirs(self) -> dict:
+        """Modification time (ns) of each directory when it was last scanned."""
         with sqlite3.connect(self.db_path) as db:
-            db.row_factory = my_factory
-            cursor = db.execute(
-                """
-                SELECT
-                    asset_filename, asset_sha1, asset_steam_sha1,
-                    asset_sha1_mtime, asset_mtime, asset_size
-                FROM
-                    tts_assets
-                WHERE
-                    asset_path=?
-                """,
-                (path,),
-            )
-            results = cursor.fetchall()
-            # We now have a list of dictionaries, combine them into one:
-            sha1s = reduce(operator.ior, results, {})
-            return sha1s
+            return dict(db.execute("SELECT dir_path, dir_mtime_ns FROM tts_sha1_dirs"))
 
-    async def sha1_scan_done(
-        self, filepath: str, sha1: str, steam_sha1: str, sha1_mtime: float
-    ) -> None:
-        path, filename = os.path.split(filepath)
-        if filename != "":
-            filename, _ = os.path.splitext(filename)
-        async with aiosqlite.connect(self.db_path, timeout=10.0) as db:
-            await db.execute(
+    @blocking_db_call
+    def set_sha1_dirs(self, dirs: dict) -> None:
+        with sqlite3.connect(self.db_path) as db:
+            db.executemany(
                 """
-                UPDATE tts_assets
-                SET asset_sha1=?, asset_steam_sha1=?, asset_sha1_mtime=?
-                WHERE asset_filename=? and asset_path=?
+                INSERT INTO tts_sha1_dirs (dir_path, dir_mtime_ns)
+                VALUES (?, ?)
+                ON CONFLICT (dir_path) DO UPDATE SET dir_mtime_ns=excluded.dir_mtime_ns
                 """,
-                (sha1, steam_sha1, sha1_mtime, filename, path),
+                dirs.items(),
             )
-            await db.commit()
 
+    @blocking_db_call
     def get_sha1_mismatches(self):
         assets = []
         with sqlite3.connect(self.db_path) as db:
@@ -136,6 +146,36 @@ class AssetList:
             assets = cursor.fetchall()
         return assets
 
+    @blocking_db_call
+    def get_mismatches_to_verify(self) -> list:
+        """Files on disk that don't match the SHA1 in their steam url.
+
+        expected_size is the Content-Length of the url's last download, or 0.
+        """
+        with sqlite3.connect(self.db_path) as db:
+            db.row_factory = asset_factory
+            return db.execute(
+                """
+                SELECT
+                    (asset_path || "/" || asset_filename || asset_ext) as filename,
+                    asset_url, asset_steam_sha1,
+                    IFNULL(dl_filesize, 0) AS expected_size,
+                    MIN(mod_asset_trail) AS trail
+                FROM tts_assets
+                    INNER JOIN tts_mod_assets
+                        ON tts_mod_assets.asset_id_fk=tts_assets.id
+                    LEFT JOIN tts_downloads
+                        ON tts_downloads.dl_url=tts_assets.asset_url
+                WHERE
+                    asset_mtime > 0
+                    AND asset_steam_sha1 != ""
+                    AND asset_sha1 != ""
+                    AND asset_sha1 != asset_steam_sha1
+                GROUP BY tts_assets.id
+                """
+            ).fetchall()
+
+    @blocking_db_call
     def get_missing(self):
         assets = []
         with sqlite3.connect(self.db_path) as db:
@@ -159,39 +199,26 @@ class AssetList:
             assets = cursor.fetchall()
         return assets
 
-    async def download_done(self, asset: dict) -> None:
-        # Don't overwrite the calculated filepath with something that is empty
-        async with aiosqlite.connect(self.db_path, timeout=15.0) as db:
+    def _download_done_queries(self, assets: list) -> list:
+        no_file = []
+        with_file = []
+        for asset in assets:
+            # Don't overwrite the calculated filepath with something that is empty
             if asset["filename"] is None or asset["filename"] == "":
-                await db.execute(
-                    """
-                    UPDATE tts_assets
-                    SET
-                        asset_dl_status=?, asset_steam_sha1=?, asset_content_name=?
-                    WHERE asset_url=?
-                    """,
+                no_file.append(
                     (
                         asset["dl_status"],
                         asset["steam_sha1"],
                         asset["content_name"],
                         asset["url"],
-                    ),
+                    )
                 )
             else:
                 ext = ""
                 path, filename = os.path.split(asset["filename"])
                 if filename != "":
                     filename, ext = os.path.splitext(filename)
-
-                await db.execute(
-                    """
-                    UPDATE tts_assets
-                    SET
-                        asset_filename=?, asset_path=?, asset_ext=?,
-                        asset_mtime=?, asset_size=?, asset_dl_status=?,
-                        asset_content_name=?, asset_steam_sha1=?
-                    WHERE asset_url=?
-                    """,
+                with_file.append(
                     (
                         filename,
                         path,
@@ -201,50 +228,141 @@ class AssetList:
                         asset["dl_status"],
                         asset["content_name"],
                         asset["steam_sha1"],
+                        asset.get("etag", ""),
+                        asset.get("last_modified", ""),
+                        asset["sha1"],
+                        asset.get("sha1_mtime", 0),
                         asset["url"],
-                    ),
-                )
-
-            # dl_status is empty if the download was successful
-            if asset["dl_status"] == "":
-                # Set mod asset counts containing this asset to -1
-                # to represent an update to the system
-                await db.execute(
-                    """
-                    UPDATE tts_mods
-                    SET mod_total_assets=-1, mod_missing_assets=-1, mod_invalid_assets=-1, mod_size=-1
-                    WHERE id IN (
-                        SELECT mod_id_fk
-                        FROM tts_mod_assets
-                        WHERE asset_id_fk IN (
-                            SELECT id FROM tts_assets
-                            WHERE asset_url=?
-                        )
                     )
-                    """,
-                    (asset["url"],),
                 )
-            else:
-                await db.execute(
-                    """
-                    UPDATE tts_mods
-                    SET mod_invalid_assets=-1
-                    WHERE id IN (
-                        SELECT mod_id_fk
-                        FROM tts_mod_assets
-                        WHERE asset_id_fk IN (
-                            SELECT id FROM tts_assets
-                            WHERE asset_url=?
-                        )
-                    )
-                    """,
-                    (asset["url"],),
-                )
-            await db.commit()
 
-    async def get_missing_assets(self, mod_filename: str) -> list:
-        async with aiosqlite.connect(self.db_path, timeout=10) as db:
-            async with db.execute(
+        return [
+            (
+                """
+                UPDATE tts_assets
+                SET
+                    asset_dl_status=?, asset_steam_sha1=?, asset_content_name=?
+                WHERE asset_url=?
+                """,
+                no_file,
+            ),
+            (
+                """
+                UPDATE tts_assets
+                SET
+                    asset_filename=?, asset_path=?, asset_ext=?,
+                    asset_mtime=?, asset_size=?, asset_dl_status=?,
+                    asset_content_name=?, asset_steam_sha1=?,
+                    asset_etag=?, asset_last_modified=?,
+                    asset_sha1=COALESCE(NULLIF(?, ""), asset_sha1),
+                    asset_sha1_mtime=COALESCE(NULLIF(?, 0), asset_sha1_mtime),
+                    asset_sha1_size=0, asset_sha1_mtime_ns=0, asset_sha1_inode=0
+                WHERE asset_url=?
+                """,
+                with_file,
+            ),
+        ]
+
+    @blocking_db_call
+    def apply_updates(
+        self, downloads: list = (), sha1s: list = (), dl_statuses: list = ()
+    ) -> None:
+        """Write a batch of asset updates in a single transaction.
+
+        Args:
+            downloads: Asset dicts as returned by `FileDownload.make_asset`.
+            sha1s: Tuples of (filepath, sha1, steam_sha1, sha1_mtime, fingerprint)
+                where fingerprint is the (size, mtime_ns, inode) of the file.
+            dl_statuses: Tuples of (url, dl_status).
+        """
+        sha1_params = []
+        for filepath, sha1, steam_sha1, sha1_mtime, fingerprint in sha1s:
+            path, filename = os.path.split(filepath)
+            if filename != "":
+                filename, _ = os.path.splitext(filename)
+            sha1_params.append(
+                (sha1, steam_sha1, sha1_mtime, *fingerprint, filename, path)
+            )
+
+        queries = self._download_done_queries(downloads)
+        queries.append(
+            (
+                """
+                UPDATE tts_assets
+                SET
+                    asset_sha1=?, asset_steam_sha1=?, asset_sha1_mtime=?,
+                    asset_sha1_size=?, asset_sha1_mtime_ns=?, asset_sha1_inode=?
+                WHERE asset_filename=? and asset_path=?
+                """,
+                sha1_params,
+            )
+        )
+        queries.append(
+            (
+                """
+                UPDATE tts_assets
+                SET asset_dl_status=?
+                WHERE asset_url=?
+                """,
+                [(dl_status, url) for url, dl_status in dl_statuses],
+            )
+        )
+
+        with sqlite3.connect(self.db_path, timeout=15.0) as db:
+            for query, params in queries:
+                if len(params) > 0:
+                    db.executemany(query, params)
+            db.commit()
+
+    @blocking_db_call
+    def get_assets_to_check(self, checked_before: float) -> list:
+        """Downloaded assets whose freshness wasn't checked since `checked_before`.
+
+        Steam assets are named by their SHA1, so can't change and are left out.
+        """
+        with sqlite3.connect(self.db_path) as db:
+            db.row_factory = asset_factory
+            return db.execute(
+                """
+                SELECT
+                    asset_url, asset_size, asset_etag, asset_last_modified,
+                    MIN(mod_asset_trail) AS trail
+                FROM tts_assets
+                    INNER JOIN tts_mod_assets
+                        ON tts_mod_assets.asset_id_fk=tts_assets.id
+                WHERE
+                    asset_mtime > 0
+                    AND asset_checked_time < ?
+                    AND IFNULL(asset_steam_sha1, "") = ""
+                GROUP BY tts_assets.id
+                """,
+                (checked_before,),
+            ).fetchall()
+
+    @blocking_db_call
+    def set_validators(self, validators: list) -> None:
+        """Record that assets were found to be fresh.
+
+        Args:
+            validators: Tuples of (url, etag, last_modified, checked_time).
+        """
+        with sqlite3.connect(self.db_path, timeout=15.0) as db:
+            db.executemany(
+                """
+                UPDATE tts_assets
+                SET
+                    asset_etag=IIF(?2 = "", asset_etag, ?2),
+                    asset_last_modified=IIF(?3 = "", asset_last_modified, ?3),
+                    asset_checked_time=?4
+                WHERE asset_url=?1
+                """,
+                validators,
+            )
+
+    @blocking_db_call
+    def get_missing_assets(self, mod_filename: str) -> list:
+        with sqlite3.connect(self.db_path, timeout=10) as db:
+            cursor = db.execute(
                 """
                 SELECT
                     asset_url, asset_mtime, asset_sha1,
@@ -257,8 +375,8 @@ class AssetList:
                 WHERE mod_filename=?
                 """,
                 (mod_filename,),
-            ) as cursor:
-                results = await cursor.fetchall()
+            )
+            results = cursor.fetchall()
         urls = []
         for result in results:
             skip = True
@@ -282,6 +400,10 @@ class AssetList:
                 urls.append((result[0], trailstring_to_trail(result[4])))
         return urls
 
+    async def get_missing_assets_a(self, mod_filename: str) -> list:
+        return await run_db(self.get_missing_assets, mod_filename)
+
+    @blocking_db_call
     def scan_cached_assets(self, clean_db=False):
         scan_time = time.time()
         new_count = 0
@@ -545,7 +667,6 @@ class AssetList:
                                 filepath.suffix,
                                 mtime,
                                 size,
-                                1,
                             )
                         )
 
@@ -555,16 +676,15 @@ class AssetList:
                 """
                 INSERT INTO tts_assets
                     (asset_path, asset_filename, asset_ext,
-                    asset_mtime, asset_size, asset_new)
+                    asset_mtime, asset_size)
                 VALUES
-                    (?, ?, ?, ?, ?, ?)
+                    (?, ?, ?, ?, ?)
                 ON CONFLICT (asset_filename)
                 DO UPDATE SET
                     asset_path=excluded.asset_path,
                     asset_ext=excluded.asset_ext,
                     asset_mtime=excluded.asset_mtime,
-                    asset_size=excluded.asset_size,
-                    asset_new=excluded.asset_new;
+                    asset_size=excluded.asset_size;
                 """,
                 assets,
             )
@@ -580,6 +700,7 @@ class AssetList:
 
             db.commit()
 
+    @blocking_db_call
     def update_mod_assets(
         self, mod_filename: str, mod_mtime, force_file_check=False
     ) -> int:
@@ -672,7 +793,6 @@ class AssetList:
             new_asset_count = len(new_assets)
 
             removed_assets = list(mod_urls - set(urls))
-            removed_asset_count = len(removed_assets)
 
             cursor = db.executemany(
                 """
@@ -714,7 +834,9 @@ class AssetList:
                 cursor = db.execute(
                     """
                     UPDATE tts_assets
-                    SET asset_sha1="", asset_mtime=0, asset_size=0
+                    SET
+                        asset_sha1="", asset_mtime=0, asset_size=0,
+                        asset_sha1_mtime_ns=0
                     WHERE asset_filename IN ({0})
                     """.format(
                         ",".join("?" for _ in deleted_files)
@@ -722,28 +844,19 @@ class AssetList:
                     deleted_files,
                 )
 
-            if new_asset_count > 0 or removed_asset_count > 0:
-                db.execute(
-                    """
-                    UPDATE tts_mods
-                    SET mod_total_assets=-1, mod_missing_assets=-1,
-                        mod_size=-1, mod_invalid_assets=-1, mod_max_asset_mtime=UNIXEPOCH()
-                    WHERE mod_filename=?
-                    """,
-                    (mod_filename,),
-                )
-            else:
-                db.execute(
-                    """
-                    UPDATE tts_mods
-                    SET mod_total_assets=-1, mod_missing_assets=-1, mod_size=-1, mod_invalid_assets=-1
-                    WHERE mod_filename=?
-                    """,
-                    (mod_filename,),
-                )
+            # The counts were kept up to date by the DB triggers
+            db.execute(
+                """
+                UPDATE tts_mods
+                SET mod_needs_refresh=0
+                WHERE mod_filename=?
+                """,
+                (mod_filename,),
+            )
             db.commit()
         return new_asset_count
 
+    @blocking_db_call
     def get_mods_using_asset(self, url: str) -> list:
         results = []
         with sqlite3.connect(self.db_path) as db:
@@ -767,27 +880,9 @@ class AssetList:
         return results
 
     async def get_mods_using_asset_a(self, url: str) -> list:
-        results = []
-        async with aiosqlite.connect(self.db_path, timeout=10) as db:
-            async with db.execute(
-                """
-                SELECT mod_filename, mod_name
-                FROM tts_mods
-                WHERE id IN (
-                    SELECT mod_id_fk
-                    FROM tts_mod_assets
-                    WHERE asset_id_fk = (
-                        SELECT id
-                        FROM tts_assets
-                        WHERE asset_url=?
-                    )
-                )
-                """,
-                (url,),
-            ) as cursor:
-                results = await cursor.fetchall()
-        return results
+        return await run_db(self.get_mods_using_asset, url)
 
+    @blocking_db_call
     def get_mod_assets(
         self, mod_filename: str, parse_only=False, force_refresh=False, all_nodes=False
     ) -> list:
@@ -858,7 +953,8 @@ class AssetList:
                         (asset_path || "/" || asset_filename || asset_ext) as filename,
                         asset_url, asset_mtime, asset_sha1, asset_steam_sha1,
                         mod_asset_trail as trail, asset_dl_status, asset_size,
-                        asset_content_name, mod_asset_ignore_missing as ignore_missing
+                        asset_content_name, mod_asset_ignore_missing as ignore_missing,
+                        asset_sha1_size, asset_sha1_mtime_ns
                     FROM tts_assets
                         INNER JOIN tts_mod_assets
                             ON tts_mod_assets.asset_id_fk=tts_assets.id
@@ -875,36 +971,14 @@ class AssetList:
                         asset["trail"] = trails[asset["url"]]
         return assets
 
-    async def get_mod_assets_a(self, mod_filename: str) -> list:
-        assets = []
-        if mod_filename == "sha1":
-            # TODO: Not needed yet
-            return assets
-
-        async with aiosqlite.connect(self.db_path, timeout=10) as db:
-            db.row_factory = asset_factory
-            async with db.execute(
-                (
-                    """
-                SELECT
-                    (asset_path || "/" || asset_filename || asset_ext) as filename,
-                    asset_url, asset_mtime, asset_sha1, asset_steam_sha1,
-                    mod_asset_trail as trail, asset_dl_status, asset_size,
-                    asset_content_name, mod_asset_ignore_missing as ignore_missing
-                FROM tts_assets
-                    INNER JOIN tts_mod_assets
-                        ON tts_mod_assets.asset_id_fk=tts_assets.id
-                    INNER JOIN tts_mods
-                        ON tts_mod_assets.mod_id_fk=tts_mods.id
-                WHERE mod_filename=?
-                """
-                ),
-                (mod_filename,),
-            ) as cursor:
-                assets = await cursor.fetchall()
-
-        return assets
+    async def get_mod_assets_a(
+        self, mod_filename: str, parse_only=False, force_refresh=False, all_nodes=False
+    ) -> list:
+        return await run_db(
+            self.get_mod_assets, mod_filename, parse_only, force_refresh, all_nodes
+        )
 
+    @blocking_db_call
     def get_content_names(self) -> list:
         with sqlite3.connect(self.db_path) as db:
             # Check if we have this mod in our DB
@@ -918,6 +992,10 @@ class AssetList:
             results = cursor.fetchall()
             return list(zip(*results))
 
+    async def get_content_names_a(self) -> list:
+        return await run_db(self.get_content_names)
+
+    @blocking_db_call
     def get_blank_content_names(self) -> list:
         with sqlite3.connect(self.db_path) as db:
             # Check if we have this mod in our DB
@@ -939,6 +1017,7 @@ class AssetList:
 
             return list(zip(*results))[0]
 
+    @blocking_db_call
     def set_content_names(self, urls, content_names) -> None:
         with sqlite3.connect(self.db_path) as db:
             db.executemany(
@@ -951,6 +1030,38 @@ class AssetList:
             )
             db.commit()
 
+    async def set_content_names_a(self, urls, content_names) -> None:
+        await run_db(self.set_content_names, urls, content_names)
+
+    @blocking_db_call
+    def set_restored_assets(self, assets: list) -> None:
+        """Record files restored from a backup, as a scan would find them.
+
+        Args:
+            assets: (path, filename, ext, mtime, size) of each file.
+        """
+        with sqlite3.connect(self.db_path) as db:
+            db.executemany(
+                """
+                INSERT INTO tts_assets
+                    (asset_path, asset_filename, asset_ext,
+                    asset_mtime, asset_size)
+                VALUES
+                    (?, ?, ?, ?, ?)
+                ON CONFLICT (asset_filename)
+                DO UPDATE SET
+                    asset_path=excluded.asset_path,
+                    asset_ext=excluded.asset_ext,
+                    asset_mtime=excluded.asset_mtime,
+                    asset_size=excluded.asset_size,
+                    asset_dl_status="",
+                    asset_sha1_size=0, asset_sha1_mtime_ns=0, asset_sha1_inode=0;
+                """,
+                assets,
+            )
+            db.commit()
+
+    @blocking_db_call
     def set_dl_status(self, url, dl_status) -> None:
         with sqlite3.connect(self.db_path) as db:
             db.execute(
@@ -963,9 +1074,10 @@ class AssetList:
             )
             db.commit()
 
-    async def set_ignore(self, mod_filename, url, ignore):
-        async with aiosqlite.connect(self.db_path, timeout=10) as db:
-            await db.execute(
+    @blocking_db_call
+    def set_ignore(self, mod_filename, url, ignore):
+        with sqlite3.connect(self.db_path, timeout=10) as db:
+            db.execute(
                 """
                 UPDATE tts_mod_assets
                 SET mod_asset_ignore_missing=?
@@ -978,63 +1090,59 @@ class AssetList:
                 """,
                 (1 if ignore else 0, url, mod_filename),
             )
-            await db.execute(
-                """
-                UPDATE tts_mods
-                SET mod_missing_assets=-1, mod_invalid_assets=-1
-                WHERE mod_filename=?
-                """,
-                (mod_filename,),
-            )
-            await db.commit()
+            db.commit()
+
+    async def set_ignore_a(self, mod_filename, url, ignore):
+        await run_db(self.set_ignore, mod_filename, url, ignore)
 
-    async def copy_asset(self, src_url, dest_url):
+    @blocking_db_call
+    def copy_asset(self, src_url, dest_url):
         if src_url == dest_url:
             return
 
-        async with aiosqlite.connect(self.db_path, timeout=10) as db:
-            async with db.execute(
+        with sqlite3.connect(self.db_path, timeout=10) as db:
+            cursor = db.execute(
                 """
                 SELECT asset_path, asset_filename, asset_ext, asset_size, asset_content_name
                 FROM tts_assets
                 WHERE asset_url=?
                 """,
                 (src_url,),
-            ) as cursor:
-                result = await cursor.fetchone()
-                # No match, or our src url is not on disk
-                if result is None or result[3] == 0:
-                    self.post_message(
-                        UpdateLog(
-                            f"Cannot copy `{src_url}` because the asset does not exist."
-                        )
+            )
+            result = cursor.fetchone()
+            # No match, or our src url is not on disk
+            if result is None or result[3] == 0:
+                self.post_message(
+                    UpdateLog(
+                        f"Cannot copy `{src_url}` because the asset does not exist."
                     )
-                    return
-                src_path = result[0]
-                src_ext = result[2]
-                src_filepath = (Path(self.mod_dir) / src_path / result[1]).with_suffix(
-                    src_ext
                 )
-                content_name = result[4]
+                return
+            src_path = result[0]
+            src_ext = result[2]
+            src_filepath = (Path(self.mod_dir) / src_path / result[1]).with_suffix(
+                src_ext
+            )
+            content_name = result[4]
 
-            async with db.execute(
+            cursor = db.execute(
                 """
                     SELECT asset_filename, asset_content_name
                     FROM tts_assets
                     WHERE asset_url=?
                     """,
                 (dest_url,),
-            ) as cursor:
-                result = await cursor.fetchone()
-                if result is None:
-                    return
-                dest_filepath = (Path(self.mod_dir) / src_path / result[0]).with_suffix(
-                    src_ext
-                )
-                dest_content_name = result[1]
+            )
+            result = cursor.fetchone()
+            if result is None:
+                return
+            dest_filepath = (Path(self.mod_dir) / src_path / result[0]).with_suffix(
+                src_ext
+            )
+            dest_content_name = result[1]
 
             if content_name != "" and dest_content_name == "":
-                await db.execute(
+                db.execute(
                     """
                     UPDATE tts_assets
                     SET asset_content_name=?
@@ -1042,196 +1150,50 @@ class AssetList:
                     """,
                     (content_name, dest_url),
                 )
-                await db.commit()
+                db.commit()
 
         self.post_message(UpdateLog(f"Copying `{src_filepath}` to `{dest_filepath}`"))
         copy(src_filepath, dest_filepath)
 
-    def find_asset(self, url, trail=None, max_matches=20):
-        sha_match = ""
-        name_matches = []
-        trail_matches = []
-        fuzzy_matches = []
-        total_matches = 0
+    @blocking_db_call
+    def find_local_copies(self, url: str, max_matches: int = 5) -> list:
+        """Files on disk with the SHA1 of `url`.
 
-        trail_name = self.get_asset_trail_name(trail)
+        The SHA1 is taken from a steam url, or from an earlier download of
+        the url whose file has since gone.  A steam url's own file may be
+        corrupt, so what was recorded for it isn't used.
 
+        Returns:
+            Tuples of (filepath relative to the mod dir, sha1, content_name).
+        """
+        steam_sha1 = get_steam_sha1_from_url(url).upper()
         with sqlite3.connect(self.db_path) as db:
-            content_name = get_content_name(url)
-            if content_name == "":
-                cursor = db.execute(
-                    """
-                    SELECT asset_content_name
-                    FROM tts_assets
-                    WHERE asset_url=?
-                    """,
-                    (url,),
-                )
-                result = cursor.fetchone()
-                if result is not None:
-                    content_name = result[0]
-
-            if content_name == "":
-                if "=" in url:
-                    content_name = url[url.rfind("=") :]
-                else:
-                    content_name = recodeURL(url)
-
-            steam_sha1 = get_steam_sha1_from_url(url)
-
-            if steam_sha1 != "":
-                cursor = db.execute(
-                    """
-                    SELECT asset_url, asset_content_name
-                    FROM tts_assets
-                    WHERE asset_sha1=?
-                    """,
-                    (steam_sha1,),
-                )
-                result = cursor.fetchone()
-                if result is not None and result[0] != url:
-                    sha_match = result[0], result[1]
-                    total_matches += 1
-
-            if content_name != "":
-                cursor = db.execute(
-                    """
-                    SELECT asset_url, asset_content_name
-                    FROM tts_assets
-                    WHERE asset_content_name LIKE ?
-                    """,
-                    (content_name,),
-                )
-                results = cursor.fetchall()
-                for result in results:
-                    if result[0] != url and result[0] not in sha_match:
-                        name_matches.append((result[0], result[1]))
-                        total_matches += 1
-
-                content_name, ext = os.path.splitext(content_name)
-                cursor = db.execute(
-                    """
-                    SELECT asset_url, asset_content_name
-                    FROM tts_assets
-                    WHERE asset_content_name LIKE ? AND asset_ext LIKE ?
-                    """,
-                    ("%" + recodeURL(content_name) + "%", "%" + ext),
-                )
-                results = cursor.fetchall()
-                for result in results:
-                    if total_matches > max_matches:
-                        break
-                    if (
-                        result[0] != url
-                        and result[0] != sha_match
-                        and result[0] not in name_matches
-                    ):
-                        fuzzy_matches.append((result[0], result[1]))
-                        total_matches += 1
-
-                cursor = db.execute(
-                    """
-                    SELECT asset_url, asset_content_name
-                    FROM tts_assets
-                    WHERE asset_content_name LIKE ? AND asset_ext LIKE ?
-                    """,
-                    ("%" + content_name + "%", "%" + ext),
-                )
-                results = cursor.fetchall()
-                for result in results:
-                    if total_matches > max_matches:
-                        break
-                    if (
-                        result[0] != url
-                        and result[0] != sha_match
-                        and result[0] not in name_matches
-                        and result[0] not in fuzzy_matches
-                    ):
-                        fuzzy_matches.append((result[0], result[1]))
-                        total_matches += 1
-
-            if trail_name != "":
-                cursor = db.execute(
-                    """
-                    SELECT asset_url, asset_content_name
-                    FROM tts_assets
-                    WHERE asset_content_name LIKE ?
-                    """,
-                    ("%" + trail_name + "%",),
-                )
-                results = cursor.fetchall()
-                for result in results:
-                    if total_matches > max_matches:
-                        break
-                    if (
-                        result[0] != url
-                        and result[0] != sha_match
-                        and result[0] not in name_matches
-                        and result[0] not in fuzzy_matches
-                    ):
-                        trail_matches.append((result[0], result[1]))
-                        total_matches += 1
-
-                cursor = db.execute(
-                    """
-                    SELECT asset_url, asset_content_name
-                    FROM tts_assets
-                    WHERE tts_assets.id IN (SELECT asset_id_fk FROM tts_mod_assets
-                                    WHERE mod_asset_trail LIKE ?)
-                    """,
-                    ("%" + trail_name + "%",),
-                )
-                results = cursor.fetchall()
-                for result in results:
-                    if total_matches > max_matches:
-                        break
-                    if (
-                        result[0] != url
-                        and result[0] != sha_match
-                        and result[0] not in name_matches
-                        and result[0] not in fuzzy_matches
-                        and result[0] not in trail_matches
-                    ):
-                        trail_matches.append((result[0], result[1]))
-                        total_matches += 1
-
-                # If our trail_name is more than one word, strip out the last as it
-                # is likely a count or some other thing that will throw off a match
-                if len(trail_matches) == 0 and trail_name.count(" ") > 0:
-                    trail_name = trail_name[: trail_name.find(" ")]
-
-                    cursor = db.execute(
-                        """
-                        SELECT asset_url, asset_content_name
-                        FROM tts_assets
-                        WHERE tts_assets.id IN (SELECT asset_id_fk FROM tts_mod_assets
-                                        WHERE mod_asset_trail LIKE ?)
-                        """,
-                        ("%" + trail_name + "%",),
+            results = db.execute(
+                """
+                SELECT asset_path, asset_filename, asset_ext, asset_sha1, asset_content_name
+                FROM tts_assets
+                WHERE
+                    asset_sha1 IN (
+                        ?1, IIF(?1 = "", (SELECT asset_sha1 FROM tts_assets WHERE asset_url=?2), "")
                     )
-                    results = cursor.fetchall()
-                    for result in results:
-                        if total_matches > max_matches:
-                            break
-                        if (
-                            result[0] != url
-                            and result[0] != sha_match
-                            and result[0] not in name_matches
-                            and result[0] not in fuzzy_matches
-                            and result[0] not in trail_matches
-                        ):
-                            trail_matches.append((result[0], result[1]))
-                            total_matches += 1
-
-        matches = []
-        if sha_match != "":
-            matches += [(sha_match, "SHA1")]
-
-        matches += [(url, "Exact Name") for url in name_matches]
-        matches += [(url, "Fuzzy Match") for url in fuzzy_matches]
-        matches += [(url, "Trail Match") for url in trail_matches]
+                    AND asset_sha1 != ""
+                    AND asset_mtime > 0
+                    AND asset_url != ?2
+                LIMIT ?3
+                """,
+                (steam_sha1, url, max_matches),
+            ).fetchall()
+        return [
+            (
+                Path(path) / (filename + ext),
+                sha1,
+                "" if content_name is None else content_name,
+            )
+            for path, filename, ext, sha1, content_name in results
+        ]
 
-        return matches
+    async def copy_asset_a(self, src_url, dest_url):
+        await run_db(self.copy_asset, src_url, dest_url)
 
     def get_asset_trail_name(self, trail):
         trail_name = ""
@@ -1249,117 +1211,174 @@ class AssetList:
             trail_name = trail_name.strip()
         return trail_name
 
-    async def find_asset_a(self, url, trail=None) -> bool:
+    def _search_content_names(
+        self, db, text: str, ext: str = "", limit: int = 20
+    ) -> list:
+        """Assets whose content name contains `text`, best match first."""
+        if len(text) >= 3:
+            # Trigram index needs at least 3 characters to match against
+            query = '"%s"' % text.replace('"', '""')
+            cursor = db.execute(
+                """
+                SELECT tts_assets.asset_url, tts_assets.asset_content_name
+                FROM tts_assets_fts
+                    INNER JOIN tts_assets ON tts_assets.id=tts_assets_fts.rowid
+                WHERE tts_assets_fts MATCH ? AND asset_ext LIKE ?
+                ORDER BY rank
+                LIMIT ?
+                """,
+                (query, "%" + ext, limit),
+            )
+        else:
+            cursor = db.execute(
+                """
+                SELECT asset_url, asset_content_name
+                FROM tts_assets
+                WHERE asset_content_name LIKE ? AND asset_ext LIKE ?
+                LIMIT ?
+                """,
+                ("%" + text + "%", "%" + ext, limit),
+            )
+        return cursor.fetchall()
+
+    def _find_asset(self, db, url, trail=None, max_matches=20) -> list:
+        matches = []
+        seen = {url}
+
+        def add_matches(results, match_type):
+            for result in results:
+                if len(matches) > max_matches:
+                    break
+                if result[0] not in seen:
+                    seen.add(result[0])
+                    matches.append(((result[0], result[1]), match_type))
+            return len(matches) > max_matches
+
+        # Leave room for results we have already seen
+        def limit():
+            return max_matches + len(seen) + 1
+
         trail_name = self.get_asset_trail_name(trail)
 
-        async with aiosqlite.connect(self.db_path, timeout=10) as db:
-            content_name = get_content_name(url)
-            if content_name == "":
-                async with db.execute(
-                    """
-                    SELECT asset_content_name
-                    FROM tts_assets
-                    WHERE asset_url=?
-                    """,
-                    (url,),
-                ) as cursor:
-                    result = await cursor.fetchone()
-                    if result is not None and result[0] != "":
-                        return True
+        content_name = get_content_name(url)
+        if content_name == "":
+            cursor = db.execute(
+                """
+                SELECT asset_content_name
+                FROM tts_assets
+                WHERE asset_url=?
+                """,
+                (url,),
+            )
+            result = cursor.fetchone()
+            if result is not None and result[0] is not None:
+                content_name = result[0]
 
-            if content_name == "":
-                if "=" in url:
-                    content_name = url[url.rfind("=") :]
-                else:
-                    content_name = recodeURL(url)
+        if content_name == "":
+            if "=" in url:
+                content_name = url[url.rfind("=") :]
+            else:
+                content_name = recodeURL(url)
 
-            steam_sha1 = get_steam_sha1_from_url(url)
+        steam_sha1 = get_steam_sha1_from_url(url)
 
-            if steam_sha1 != "":
-                async with db.execute(
-                    """
-                    SELECT asset_url
-                    FROM tts_assets
-                    WHERE asset_sha1=?
-                    """,
-                    (steam_sha1,),
-                ) as cursor:
-                    async for result in cursor:
-                        if result[0] != url:
-                            return True
-
-            if content_name != "":
-                async with db.execute(
-                    """
-                    SELECT asset_url
-                    FROM tts_assets
-                    WHERE asset_content_name LIKE ?
-                    """,
-                    (content_name,),
-                ) as cursor:
-                    async for result in cursor:
-                        if result[0] != url:
-                            return True
-
-                # Ignore the extension for the fuuzzy searches
-                content_name, ext = os.path.splitext(content_name)
-                async with db.execute(
-                    """
-                    SELECT asset_url
-                    FROM tts_assets
-                    WHERE asset_content_name LIKE ? AND asset_ext LIKE ?
-                    """,
-                    ("%" + recodeURL(content_name) + "%", "%" + ext),
-                ) as cursor:
-                    async for result in cursor:
-                        if result[0] != url:
-                            return True
+        if steam_sha1 != "":
+            cursor = db.execute(
+                """
+                SELECT asset_url, asset_content_name
+                FROM tts_assets
+                WHERE asset_sha1=? AND asset_url!=?
+                LIMIT 1
+                """,
+                (steam_sha1, url),
+            )
+            if add_matches(cursor.fetchall(), "SHA1"):
+                return matches
 
-                async with db.execute(
-                    """
-                    SELECT asset_url
-                    FROM tts_assets
-                    WHERE asset_content_name LIKE ? AND asset_ext LIKE ?
-                    """,
-                    ("%" + content_name + "%", "%" + ext),
-                ) as cursor:
-                    async for result in cursor:
-                        if result[0] != url:
-                            return True
-
-            if trail_name != "":
-                # If our trail_name is more than one word, strip out the last as it
-                # is likely a count or some other thing that will throw off a match
-                if trail_name.count(" ") > 0:
-                    trail_name = trail_name[: trail_name.find(" ")]
-
-                async with db.execute(
-                    """
-                    SELECT asset_url
-                    FROM tts_assets
-                    WHERE asset_content_name LIKE ?
-                    """,
-                    ("%" + trail_name + "%",),
-                ) as cursor:
-                    async for result in cursor:
-                        if result[0] != url:
-                            return True
+        if content_name != "":
+            cursor = db.execute(
+                """
+                SELECT asset_url, asset_content_name
+                FROM tts_assets
+                WHERE asset_content_name=? COLLATE NOCASE
+                LIMIT ?
+                """,
+                (content_name, limit()),
+            )
+            if add_matches(cursor.fetchall(), "Exact Name"):
+                return matches
+
+            # Ignore the extension for the fuzzy searches
+            content_name, ext = os.path.splitext(content_name)
+            for name in (recodeURL(content_name), content_name):
+                results = self._search_content_names(db, name, ext, limit())
+                if add_matches(results, "Fuzzy Match"):
+                    return matches
+
+        if trail_name != "":
+            results = self._search_content_names(db, trail_name, limit=limit())
+            if add_matches(results, "Trail Match"):
+                return matches
+
+            trail_matches = len(matches)
+            cursor = db.execute(
+                """
+                SELECT asset_url, asset_content_name
+                FROM tts_assets
+                WHERE tts_assets.id IN (SELECT asset_id_fk FROM tts_mod_assets
+                                WHERE mod_asset_trail LIKE ?)
+                LIMIT ?
+                """,
+                ("%" + trail_name + "%", limit()),
+            )
+            if add_matches(cursor.fetchall(), "Trail Match"):
+                return matches
 
-                async with db.execute(
+            # If our trail_name is more than one word, strip out the last as it
+            # is likely a count or some other thing that will throw off a match
+            if len(matches) == trail_matches and trail_name.count(" ") > 0:
+                trail_name = trail_name[: trail_name.find(" ")]
+                cursor = db.execute(
                     """
-                    SELECT asset_url
+                    SELECT asset_url, asset_content_name
                     FROM tts_assets
                     WHERE tts_assets.id IN (SELECT asset_id_fk FROM tts_mod_assets
                                     WHERE mod_asset_trail LIKE ?)
+                    LIMIT ?
                     """,
-                    ("%" + trail_name + "%",),
-                ) as cursor:
-                    async for result in cursor:
-                        if result[0] != url:
-                            return True
+                    ("%" + trail_name + "%", limit()),
+                )
+                add_matches(cursor.fetchall(), "Trail Match")
+
+        return matches
+
+    @blocking_db_call
+    def find_asset(self, url, trail=None, max_matches=20):
+        with sqlite3.connect(self.db_path) as db:
+            return self._find_asset(db, url, trail, max_matches)
+
+    async def find_asset_a(self, url, trail=None, max_matches=20):
+        return await run_db(self.find_asset, url, trail, max_matches)
+
+    @blocking_db_call
+    def find_assets_with_matches(self, assets: list) -> list:
+        """Return the urls, from a list of (url, trail), that have a possible match."""
+        with sqlite3.connect(self.db_path) as db:
+            return [
+                url
+                for url, trail in assets
+                if len(self._find_asset(db, url, trail, max_matches=0)) > 0
+            ]
 
-        return False
+    async def find_assets_with_matches_a(self, assets: list) -> list:
+        return await run_db(self.find_assets_with_matches, assets)
 
+    @blocking_db_call
+    def optimize_search_index(self) -> None:
+        with sqlite3.connect(self.db_path) as db:
+            optimize_asset_search(db)
+
+    @blocking_db_call
     def get_asset(self, url: str, mod_filename: str = "") -> dict:
         asset = {}
         mods = self.get_mods_using_asset(url)
@@ -1407,25 +1426,29 @@ class AssetList:
             asset["mods"] = sorted(mod_names)
         return asset
 
-    async def delete_asset(self, url):
-        async with aiosqlite.connect(self.db_path, timeout=10) as db:
-            async with db.execute(
+    async def get_asset_a(self, url: str, mod_filename: str = "") -> dict:
+        return await run_db(self.get_asset, url, mod_filename)
+
+    @blocking_db_call
+    def delete_asset(self, url):
+        with sqlite3.connect(self.db_path, timeout=10) as db:
+            cursor = db.execute(
                 """
                 SELECT asset_path, asset_filename, asset_ext, asset_size
                 FROM tts_assets
                 WHERE asset_url=?
                 """,
                 (url,),
-            ) as cursor:
-                result = await cursor.fetchone()
-                # No match, or our src url is not on disk
-                if result is None or result[3] == 0:
-                    self.post_message(
-                        UpdateLog(
-                            f"Cannot delete `{url}` because the asset does not exist."
-                        )
+            )
+            result = cursor.fetchone()
+            # No match, or our src url is not on disk
+            if result is None or result[3] == 0:
+                self.post_message(
+                    UpdateLog(
+                        f"Cannot delete `{url}` because the asset does not exist."
                     )
-                    return
+                )
+                return
             src_path = result[0]
             src_ext = result[2]
             src_filepath = (Path(self.mod_dir) / src_path / result[1]).with_suffix(
@@ -1434,3 +1457,6 @@ class AssetList:
 
         self.post_message(UpdateLog(f"Deleting `{src_filepath}`"))
         os.remove(src_filepath)
+
+    async def delete_asset_a(self, url):
+        await run_db(self.delete_asset, url)
@@ -0,0 +1,113 @@
+import time
+
+from .AssetList import AssetList
+from .WriteBehind import WriteBehind
+
+
+class AssetWriteQueue(WriteBehind):
+    """Coalesces asset updates and writes them to the DB in batches.
+
+    Download results, SHA1 results and dl_status changes are held in memory
+    (the newest update for a url/file wins) and written in one transaction
+    when `batch_size` updates are pending, every `flush_interval` seconds,
+    or when `flush()`/`close()` is called.  Anything that has been flushed
+    is committed; anything still pending is lost if the process dies.
+
+    A background flush that fails keeps its batch and is tried again on the
+    next interval, see `WriteBehind`.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = 200,
+        flush_interval: float = 2.0,
+        asset_list: AssetList | None = None,
+        on_error=None,
+    ) -> None:
+        super().__init__("AssetWriteQueue", flush_interval, on_error)
+        self.batch_size = batch_size
+        if asset_list is None:
+            self.asset_list = AssetList()
+        else:
+            self.asset_list = asset_list
+
+        self.downloads = {}
+        self.sha1s = {}
+        self.dl_statuses = {}
+
+        self.flush_count = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+
+    @property
+    def depth(self) -> int:
+        """Number of updates waiting to be written."""
+        with self._lock:
+            return len(self.downloads) + len(self.sha1s) + len(self.dl_statuses)
+
+    def _added(self) -> None:
+        self._start()
+        if self.depth >= self.batch_size:
+            self._wake.set()
+
+    def download_done(self, asset: dict) -> None:
+        with self._lock:
+            # The download result includes the latest dl_status
+            self.dl_statuses.pop(asset["url"], None)
+            self.downloads[asset["url"]] = asset
+        self._added()
+
+    def sha1_scan_done(
+        self,
+        filepath: str,
+        sha1: str,
+        steam_sha1: str,
+        sha1_mtime: float,
+        fingerprint: tuple = (0, 0, 0),
+    ) -> None:
+        with self._lock:
+            self.sha1s[filepath] = (filepath, sha1, steam_sha1, sha1_mtime, fingerprint)
+        self._added()
+
+    def set_dl_status(self, url: str, dl_status: str) -> None:
+        with self._lock:
+            if url in self.downloads:
+                self.downloads[url] = self.downloads[url] | {"dl_status": dl_status}
+            else:
+                self.dl_statuses[url] = dl_status
+        self._added()
+
+    def flush(self) -> None:
+        """Write all pending updates. Returns once they are committed."""
+        with self._flush_lock:
+            with self._lock:
+                downloads = list(self.downloads.values())
+                sha1s = list(self.sha1s.values())
+                dl_statuses = list(self.dl_statuses.items())
+                self.downloads = {}
+                self.sha1s = {}
+                self.dl_statuses = {}
+
+            if len(downloads) + len(sha1s) + len(dl_statuses) == 0:
+                return
+
+            start = time.perf_counter()
+            try:
+                self.asset_list.apply_updates(downloads, sha1s, dl_statuses)
+            except Exception:
+                # Put the batch back (behind anything newer) so it can be retried
+                with self._lock:
+                    self.downloads = {a["url"]: a for a in downloads} | self.downloads
+                    self.sha1s = {s[0]: s for s in sha1s} | self.sha1s
+                    # A download that finished since has the newer dl_status
+                    self.dl_statuses = {
+                        url: dl_status
+                        for url, dl_status in dl_statuses
+                        if url not in self.downloads
+                    } | self.dl_statuses
+                raise
+            self.last_flush_latency = time.perf_counter() - start
+            self.max_flush_latency = max(
+                self.max_flush_latency, self.last_flush_latency
+            )
+            self.flush_count += 1
@@ -0,0 +1,278 @@
+import os
+import sqlite3
+import time
+import urllib.parse
+from pathlib import Path
+
+from ..data.config import load_config
+from ..data.db import blocking_db_call, run_db
+from .FileFinder import get_fs_path, trail_to_trailstring, trailstring_to_trail
+from .HostCapabilities import HostCapabilities
+from .WriteBehind import WriteBehind
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class DownloadJournal(WriteBehind):
+    """Records the download queue in the DB so it survives a restart.
+
+    Queueing, starting and finishing downloads only appends to an in memory
+    log, which is written in order, in one transaction, every
+    `flush_interval` seconds or when `flush()`/`close()` is called.  Jobs
+    that were queued or running when the app closed are returned by
+    `get_outstanding()` so they can be queued again.  Finished jobs are kept
+    for `retention` seconds.
+    """
+
+    def __init__(
+        self,
+        flush_interval: float = 1.0,
+        retention: float = 30 * 24 * 60 * 60,
+        on_error=None,
+        capabilities: HostCapabilities | None = None,
+    ) -> None:
+        """
+        Args:
+            capabilities: Says which hosts can't resume a partial download.
+        """
+        super().__init__("DownloadJournal", flush_interval, on_error)
+        config = load_config()
+        self.db_path = Path(config.db_path)
+        self.mod_dir = Path(config.tts_mods_dir)
+        self.retention = retention
+        self.capabilities = capabilities
+
+        self.pending = []
+
+    def _log(self, query: str, params: list) -> None:
+        with self._lock:
+            self.pending.append((query, params))
+        self._start()
+
+    def queue(self, urls: list, trails: list, mod_filename: str) -> None:
+        now = time.time()
+        params = [
+            (url, trail_to_trailstring(trail), now, now)
+            for url, trail in zip(urls, trails)
+        ]
+        self._log(
+            f"""
+            INSERT INTO tts_downloads
+                (dl_url, dl_trail, dl_state, dl_queued_time, dl_update_time)
+            VALUES (?, ?, '{QUEUED}', ?, ?)
+            ON CONFLICT (dl_url) DO UPDATE SET
+                dl_trail=excluded.dl_trail,
+                dl_state=IIF(dl_state='{RUNNING}', dl_state, '{QUEUED}'),
+                dl_attempts=IIF(dl_state IN ('{DONE}', '{FAILED}'), 0, dl_attempts),
+                dl_error='',
+                dl_queued_time=excluded.dl_queued_time,
+                dl_update_time=excluded.dl_update_time
+            """,
+            params,
+        )
+        self._log(
+            """
+            INSERT OR IGNORE INTO tts_download_mods (dl_id_fk, mod_filename)
+            SELECT id, ? FROM tts_downloads WHERE dl_url=?
+            """,
+            [(mod_filename, url) for url in urls],
+        )
+
+    def start(self, url: str) -> None:
+        self._log(
+            f"""
+            UPDATE tts_downloads
+            SET dl_state='{RUNNING}', dl_attempts=dl_attempts+1, dl_update_time=?
+            WHERE dl_url=?
+            """,
+            [(time.time(), url)],
+        )
+
+    def finish(
+        self,
+        url: str,
+        error: str,
+        bytes_complete: int,
+        filesize: int,
+        accept_ranges: bool,
+        requeue: bool = False,
+        duration: float = 0.0,
+    ) -> None:
+        """Record the outcome of a download attempt.
+
+        Args:
+            requeue: The download will be tried again later.
+            duration: Seconds the attempt took.
+        """
+        if requeue:
+            state = QUEUED
+        elif error == "":
+            state = DONE
+        else:
+            state = FAILED
+        self._log(
+            """
+            UPDATE tts_downloads
+            SET
+                dl_state=?, dl_error=?, dl_bytes_complete=?, dl_filesize=?,
+                dl_accept_ranges=dl_accept_ranges OR ?, dl_duration=?,
+                dl_update_time=?
+            WHERE dl_url=?
+            """,
+            [
+                (
+                    state,
+                    error,
+                    bytes_complete,
+                    filesize,
+                    accept_ranges,
+                    duration,
+                    time.time(),
+                    url,
+                )
+            ],
+        )
+        if not requeue:
+            # Nobody is waiting on it any more
+            self._log(
+                """
+                DELETE FROM tts_download_mods
+                WHERE dl_id_fk=(SELECT id FROM tts_downloads WHERE dl_url=?)
+                """,
+                [(url,)],
+            )
+
+    def cancel(self, mod_filename: str) -> None:
+        self._log(
+            "DELETE FROM tts_download_mods WHERE mod_filename=?",
+            [(mod_filename,)],
+        )
+        self._log(
+            f"""
+            DELETE FROM tts_downloads
+            WHERE
+                dl_state='{QUEUED}'
+                AND id NOT IN (SELECT dl_id_fk FROM tts_download_mods)
+            """,
+            [()],
+        )
+
+    def flush(self) -> None:
+        """Write the pending log. Returns once it is committed."""
+        with self._flush_lock:
+            with self._lock:
+                pending = self.pending
+                self.pending = []
+
+            if len(pending) == 0:
+                return
+
+            try:
+                with sqlite3.connect(self.db_path, timeout=15.0) as db:
+                    for query, params in pending:
+                        db.executemany(query, params)
+            except Exception:
+                # Keep the order, so put the log back in front of anything newer
+                with self._lock:
+                    self.pending = pending + self.pending
+                raise
+
+    @blocking_db_call
+    def get_outstanding(self) -> dict:
+        """Downloads that were queued or running when the app closed.
+
+        Partial downloads from hosts known not to support ranges can't be
+        resumed, so they are deleted here rather than requested again.  A
+        download interrupted on its first attempt hasn't recorded whether
+        its host sent `Accept-Ranges`, so its partial is kept unless
+        `capabilities` knows better.
+
+        Returns:
+            A (urls, trails) tuple for each mod that was waiting on downloads.
+        """
+        self.flush()
+        with sqlite3.connect(self.db_path) as db:
+            db.execute(
+                f"""
+                DELETE FROM tts_download_mods
+                WHERE dl_id_fk IN (
+                    SELECT id FROM tts_downloads
+                    WHERE dl_state IN ('{DONE}', '{FAILED}') AND dl_update_time<?
+                )
+                """,
+                (time.time() - self.retention,),
+            )
+            db.execute(
+                f"""
+                DELETE FROM tts_downloads
+                WHERE dl_state IN ('{DONE}', '{FAILED}') AND dl_update_time<?
+                """,
+                (time.time() - self.retention,),
+            )
+            db.execute(
+                f"""
+                UPDATE tts_downloads
+                SET dl_state='{QUEUED}'
+                WHERE dl_state='{RUNNING}'
+                """
+            )
+            results = db.execute(
+                f"""
+                SELECT mod_filename, dl_url, dl_trail, dl_accept_ranges
+                FROM tts_downloads
+                    INNER JOIN tts_download_mods ON tts_downloads.id=dl_id_fk
+                WHERE dl_state='{QUEUED}'
+                ORDER BY tts_downloads.id
+                """
+            ).fetchall()
+
+        outstanding = {}
+        for mod_filename, url, trailstring, accept_ranges in results:
+            trail = trailstring_to_trail(trailstring)
+            if not accept_ranges and self._cannot_resume(url):
+                filename = get_fs_path(trail, url.strip())
+                if filename is not None:
+                    partial = self.mod_dir / Path(filename).with_suffix(".tmp")
+                    if partial.exists():
+                        os.remove(partial)
+            urls, trails = outstanding.setdefault(mod_filename, ([], []))
+            urls.append(url)
+            trails.append(trail)
+        return outstanding
+
+    def _cannot_resume(self, url: str) -> bool:
+        if self.capabilities is None:
+            return False
+        try:
+            host = urllib.parse.urlparse(url.strip()).hostname or ""
+        except ValueError:
+            return False
+        return self.capabilities.get(host).ranges is False
+
+    async def get_outstanding_a(self) -> dict:
+        return await run_db(self.get_outstanding)
+
+    @blocking_db_call
+    def get_history(self, since: float) -> list:
+        """Finished downloads updated after `since`, oldest first.
+
+        Returns:
+            Tuples of (url, error, update time, duration).
+        """
+        self.flush()
+        with sqlite3.connect(self.db_path) as db:
+            return db.execute(
+                f"""
+                SELECT dl_url, dl_error, dl_update_time, dl_duration
+                FROM tts_downloads
+                WHERE dl_state IN ('{DONE}', '{FAILED}') AND dl_update_time>?
+                ORDER BY dl_update_time
+                """,
+                (since,),
+            ).fetchall()
+
+    async def get_history_a(self, since: float) -> list:
+        return await run_db(self.get_history, since)
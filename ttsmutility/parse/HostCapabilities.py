@@ -0,0 +1,165 @@
+import sqlite3
+import threading
+import time
+from dataclasses import astuple, dataclass
+from pathlib import Path
+
+from ..data.config import load_config
+
+
+@dataclass
+class HostCapability:
+    """What a host has been seen to support, None if we don't know yet."""
+
+    host: str
+    # Sends a Content-Disposition, so the name scanner can ask it for names
+    content_disposition: bool | None = None
+    # Answers HEAD requests properly
+    head: bool | None = None
+    # Honours Range requests
+    ranges: bool | None = None
+    # Seconds until the response headers arrive, averaged
+    latency: float = 0.0
+    update_time: float = 0.0
+
+
+class HostCapabilities:
+    """Remembers what each host supports, in the DB, so it isn't probed again.
+
+    Downloads and the name scanner record what they see in each response
+    with `record_response()`.  Changes are kept in memory and written every
+    `flush_interval` seconds, or when `flush()` is called.  The table is
+    read on first use, which may be before the DB was created.
+    """
+
+    # Weight of the newest response in the latency
+    LATENCY_WEIGHT = 0.2
+    # A host that didn't send names is asked again after this long
+    RECHECK_AGE = 30 * 24 * 60 * 60
+    # Steam only sends names for some files
+    MIXED_CONTENT_DISPOSITION = ("steamusercontent.com",)
+
+    def __init__(self, flush_interval: float = 30.0) -> None:
+        self.flush_interval = flush_interval
+        self.hosts = None
+        self.dirty = set()
+        self.last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict:
+        if self.hosts is None:
+            db_path = Path(load_config().db_path)
+            with sqlite3.connect(db_path) as db:
+                results = db.execute(
+                    """
+                    SELECT
+                        host_name, host_content_disposition, host_head,
+                        host_ranges, host_latency, host_update_time
+                    FROM tts_hosts
+                    """
+                ).fetchall()
+            self.hosts = {
+                host: HostCapability(
+                    host,
+                    *(None if value is None else bool(value) for value in flags),
+                    latency,
+                    update_time,
+                )
+                for host, *flags, latency, update_time in results
+            }
+        return self.hosts
+
+    def get(self, host: str) -> HostCapability:
+        with self._lock:
+            return self._load().get(host) or HostCapability(host)
+
+    def sends_content_disposition(self, host: str, now: float | None = None) -> bool:
+        """False if the host is known not to send names, so needn't be asked."""
+        if now is None:
+            now = time.time()
+        capability = self.get(host)
+        return (
+            capability.content_disposition is not False
+            or now - capability.update_time > self.RECHECK_AGE
+        )
+
+    def use_head(self, host: str) -> bool:
+        return self.get(host).head is not False
+
+    def timeout(self, host: str, timeout: float) -> float:
+        """`timeout`, stretched for hosts that are known to be slow to answer."""
+        return min(max(timeout, 4 * self.get(host).latency), 60.0)
+
+    def record(
+        self,
+        host: str,
+        content_disposition: bool | None = None,
+        head: bool | None = None,
+        ranges: bool | None = None,
+        latency: float | None = None,
+    ) -> None:
+        """Update what we know about a host, None leaves a field as it was."""
+        if host == "":
+            return
+        with self._lock:
+            hosts = self._load()
+            capability = hosts.setdefault(host, HostCapability(host))
+            if content_disposition is not None:
+                if content_disposition or not any(
+                    host == domain or host.endswith("." + domain)
+                    for domain in self.MIXED_CONTENT_DISPOSITION
+                ):
+                    capability.content_disposition = content_disposition
+            if head is not None:
+                capability.head = head
+            if ranges is not None:
+                capability.ranges = ranges
+            if latency is not None:
+                if capability.latency == 0:
+                    capability.latency = latency
+                else:
+                    capability.latency += self.LATENCY_WEIGHT * (
+                        latency - capability.latency
+                    )
+            capability.update_time = time.time()
+            self.dirty.add(host)
+            flush = time.monotonic() - self.last_flush > self.flush_interval
+        if flush:
+            self.flush()
+
+    def record_response(self, host: str, response, range_requested: bool) -> None:
+        """Record what a response to a GET or HEAD says about its host."""
+        if response.status_code not in (200, 206):
+            return
+        accept_ranges = response.headers.get("Accept-Ranges", "")
+        if response.status_code == 206 or accept_ranges == "bytes":
+            ranges = True
+        elif range_requested or accept_ranges == "none":
+            ranges = False
+        else:
+            ranges = None
+        self.record(
+            host,
+            content_disposition="Content-Disposition" in response.headers,
+            ranges=ranges,
+            latency=response.elapsed.total_seconds(),
+        )
+
+    def flush(self) -> None:
+        with self._lock:
+            self.last_flush = time.monotonic()
+            if len(self.dirty) == 0:
+                return
+            rows = [astuple(self.hosts[host]) for host in self.dirty]
+            self.dirty = set()
+        db_path = Path(load_config().db_path)
+        with sqlite3.connect(db_path, timeout=15.0) as db:
+            db.executemany(
+                """
+                INSERT OR REPLACE INTO tts_hosts (
+                    host_name, host_content_disposition, host_head,
+                    host_ranges, host_latency, host_update_time)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                rows,
+            )
@@ -5,9 +5,8 @@ from datetime import datetime
 from glob import glob
 from pathlib import Path
 
-import aiosqlite
-
 from ..data.config import load_config
+from ..data.db import blocking_db_call, run_db, verify_mod_counts
 from ..utility.messages import UpdateLog
 
 
@@ -36,6 +35,7 @@ class ModList:
             path = self.save_dir
         return os.path.join(path, filename)
 
+    @blocking_db_call
     def get_all_mod_filenames(self):
         with sqlite3.connect(self.db_path) as db:
             cursor = db.execute(
@@ -47,389 +47,70 @@ class ModList:
             results = cursor.fetchall()
             return list(zip(*results))[0]
 
+    @blocking_db_call
     def get_mods_needing_asset_refresh(self):
         with sqlite3.connect(self.db_path) as db:
             cursor = db.execute(
                 """
                 SELECT mod_filename
                 FROM tts_mods
-                WHERE (mod_total_assets=-1 OR mod_missing_assets=-1 OR mod_size=-1 OR mod_invalid_assets=-1)""",
-            )
-            result = cursor.fetchall()
-            # Results are returned as a list of tuples, unzip to a list of mod_filenames
-            if len(result) > 0:
-                part1 = list(list(zip(*result))[0])
-            else:
-                part1 = []
-
-            cursor = db.execute(
-                """
-                SELECT mod_filename
-                FROM tts_mods
-                WHERE id IN (
-                    SELECT mod_id_fk
-                    FROM tts_mod_assets
-                    WHERE asset_id_fk IN (
-                        SELECT id
-                        FROM tts_assets
-                        WHERE asset_new=1
-                    )
-                )
+                WHERE mod_needs_refresh=1
+                ORDER BY mod_filename
                 """,
             )
-            result = cursor.fetchall()
-            if len(result) > 0:
-                part2 = list(list(zip(*result))[0])
-            else:
-                part2 = []
-
-            db.executemany(
-                """
-                UPDATE tts_mods
-                SET mod_total_assets=-1, mod_missing_assets=-1, mod_invalid_assets=-1, mod_size=-1, mod_max_asset_mtime=UNIXEPOCH()
-                WHERE mod_filename=?
-                """,
-                result,
-            )
-
-            combined = list(set(part1 + part2))
-
-            db.execute(
-                """
-                UPDATE tts_assets
-                SET asset_new=0
-                """,
-            )
-
-            db.commit()
-
-        return sorted(combined)
+            return [mod_filename for mod_filename, in cursor.fetchall()]
 
     async def get_mods_needing_asset_refresh_a(self):
-        async with aiosqlite.connect(self.db_path, timeout=10) as db:
-            async with db.execute(
-                """
-                SELECT mod_filename
-                FROM tts_mods
-                WHERE (mod_total_assets=-1 OR mod_missing_assets=-1 OR mod_size=-1 or mod_invalid_assets=-1)""",
-            ) as cursor:
-                result = await cursor.fetchall()
-            # Results are returned as a list of tuples, unzip to a list of mod_filenames
-            if len(result) > 0:
-                part1 = list(list(zip(*result))[0])
-            else:
-                part1 = []
-
-            async with db.execute(
-                """
-                SELECT mod_filename
-                FROM tts_mods
-                WHERE id IN (
-                    SELECT mod_id_fk
-                    FROM tts_mod_assets
-                    WHERE asset_id_fk IN (
-                        SELECT id
-                        FROM tts_assets
-                        WHERE asset_new=1
-                    )
-                )
-                """,
-            ) as cursor:
-                result = await cursor.fetchall()
-            if len(result) > 0:
-                part2 = list(list(zip(*result))[0])
-            else:
-                part2 = []
-
-            await db.executemany(
-                """
-                UPDATE tts_mods
-                SET mod_total_assets=-1, mod_missing_assets=-1, mod_invalid_assets=-1, mod_size=-1, mod_max_asset_mtime=UNIXEPOCH()
-                WHERE mod_filename=?
-                """,
-                result,
-            )
-
-            combined = list(set(part1 + part2))
-
-            await db.commit()
-
-        return sorted(combined)
+        return await run_db(self.get_mods_needing_asset_refresh)
+
+    @blocking_db_call
+    def get_mod_counts(self, mod_filename: str | None = None) -> dict:
+        """Asset counts for one mod, or for every mod keyed by filename."""
+        query = """
+            SELECT
+                mod_filename, mod_total_assets, mod_missing_assets,
+                mod_size, mod_invalid_assets
+            FROM tts_mods
+            """
+        params = ()
+        if mod_filename is not None:
+            query += "WHERE mod_filename=?"
+            params = (mod_filename,)
 
-    def update_mod_counts(self, mod_filename):
-        counts = {}
         with sqlite3.connect(self.db_path) as db:
-            cursor = db.execute(
-                """
-                SELECT mod_total_assets, mod_missing_assets, mod_size, mod_invalid_assets
-                FROM tts_mods
-                WHERE mod_filename=?
-                """,
-                (mod_filename,),
-            )
-            result = cursor.fetchone()
-            if result is None:
-                return
-            counts["total"] = result[0]
-            counts["missing"] = result[1]
-            counts["size"] = result[2]
-            counts["invalid"] = result[3]
-
-        if counts["total"] == -1:
-            counts["total"] = self._count_total_assets(mod_filename)
-        if counts["missing"] == -1:
-            counts["missing"] = self._count_missing_assets(mod_filename)
-        if counts["invalid"] == -1:
-            counts["invalid"] = self._count_invalid_assets(mod_filename)
-        if counts["size"] == -1:
-            counts["size"] = self._calc_asset_size(mod_filename)
-
+            cursor = db.execute(query, params)
+            counts = {
+                result[0]: {
+                    "total": result[1],
+                    "missing": result[2],
+                    "size": result[3],
+                    "invalid": result[4],
+                }
+                for result in cursor.fetchall()
+            }
+
+        if mod_filename is not None:
+            return counts.get(mod_filename)
         return counts
 
-    async def update_mod_counts_a(self, mod_filename):
-        counts = {}
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute(
-                """
-                SELECT mod_total_assets, mod_missing_assets, mod_size, mod_invalid_assets
-                FROM tts_mods
-                WHERE mod_filename=?
-                """,
-                (mod_filename,),
-            ) as cursor:
-                result = await cursor.fetchone()
-                if result is None:
-                    return
-                counts["total"] = result[0]
-                counts["missing"] = result[1]
-                counts["size"] = result[2]
-                counts["invalid"] = result[3]
-
-        if counts["total"] == -1:
-            counts["total"] = await self._count_total_assets_a(mod_filename)
-        if counts["missing"] == -1:
-            counts["missing"] = await self._count_missing_assets_a(mod_filename)
-        if counts["invalid"] == -1:
-            counts["invalid"] = await self._count_invalid_assets_a(mod_filename)
-        if counts["size"] == -1:
-            counts["size"] = await self._calc_asset_size_a(mod_filename)
+    async def get_mod_counts_a(self, mod_filename: str | None = None) -> dict:
+        return await run_db(self.get_mod_counts, mod_filename)
 
-        return counts
-
-    def _calc_asset_size(self, filename: str) -> int:
+    @blocking_db_call
+    def check_mod_counts(self, repair: bool = True) -> list:
         with sqlite3.connect(self.db_path) as db:
-            cursor = db.execute(
-                """
-            SELECT SUM(asset_size)
-            FROM tts_assets
-            WHERE id IN (
-                SELECT asset_id_fk
-                FROM tts_mod_assets
-                WHERE mod_id_fk IN (
-                    SELECT id FROM tts_mods
-                    WHERE mod_filename=?
-                )
-            )
-            """,
-                (filename,),
-            )
-            result = cursor.fetchone()
-            if result[0] is None:
-                mod_size = 0
-            else:
-                mod_size = result[0]
-            db.execute(
-                """
-                UPDATE tts_mods
-                SET mod_size=?
-                WHERE mod_filename=?
-                """,
-                (mod_size, filename),
-            )
+            mismatched = verify_mod_counts(db, repair)
             db.commit()
-        return mod_size
-
-    async def _calc_asset_size_a(self, filename: str) -> int:
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute(
-                """
-            SELECT SUM(asset_size)
-            FROM tts_assets
-            WHERE id IN (
-                SELECT asset_id_fk
-                FROM tts_mod_assets
-                WHERE mod_id_fk IN (
-                    SELECT id FROM tts_mods
-                    WHERE mod_filename=?
+        for mod_filename in mismatched:
+            self.post_message(
+                UpdateLog(
+                    f"Asset counts for `{mod_filename}` were out of date"
+                    + (", repaired." if repair else ".")
                 )
             )
-            """,
-                (filename,),
-            ) as cursor:
-                result = await cursor.fetchone()
-            if result[0] is None:
-                mod_size = 0
-            else:
-                mod_size = result[0]
-            await db.execute(
-                """
-                UPDATE tts_mods
-                SET mod_size=?
-                WHERE mod_filename=?
-                """,
-                (mod_size, filename),
-            )
-            await db.commit()
-        return mod_size
-
-    def _count_total_assets(self, filename: str) -> int:
-        with sqlite3.connect(self.db_path) as db:
-            cursor = db.execute(
-                """
-            SELECT COUNT(asset_id_fk)
-            FROM tts_mod_assets
-            WHERE mod_id_fk=(SELECT id FROM tts_mods WHERE mod_filename=?)
-            """,
-                (filename,),
-            )
-            result = cursor.fetchone()
-            db.execute(
-                """
-                UPDATE tts_mods
-                SET mod_total_assets=?
-                WHERE mod_filename=?
-                """,
-                (result[0], filename),
-            )
-            db.commit()
-        return result[0]
-
-    async def _count_total_assets_a(self, filename: str) -> int:
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute(
-                """
-            SELECT COUNT(asset_id_fk)
-            FROM tts_mod_assets
-            WHERE mod_id_fk=(SELECT id FROM tts_mods WHERE mod_filename=?)
-            """,
-                (filename,),
-            ) as cursor:
-                result = await cursor.fetchone()
-            await db.execute(
-                """
-                UPDATE tts_mods
-                SET mod_total_assets=?
-                WHERE mod_filename=?
-                """,
-                (result[0], filename),
-            )
-            await db.commit()
-        return result[0]
-
-    def _count_missing_assets(self, filename: str) -> int:
-        with sqlite3.connect(self.db_path) as db:
-            query = """
-            SELECT COUNT(asset_id_fk)
-            FROM tts_mod_assets
-                WHERE (
-                    mod_id_fk=(SELECT id FROM tts_mods WHERE mod_filename=?)
-                    AND
-                    asset_id_fk IN (SELECT id FROM tts_assets WHERE asset_mtime=?)
-                    AND
-                    mod_asset_ignore_missing=0
-                )
-            """
-            cursor = db.execute(query, (filename, 0))
-            result = cursor.fetchone()
-            db.execute(
-                """
-                UPDATE tts_mods
-                SET mod_missing_assets=?
-                WHERE mod_filename=?
-                """,
-                (result[0], filename),
-            )
-            db.commit()
-        return result[0]
-
-    async def _count_missing_assets_a(self, filename: str) -> int:
-        async with aiosqlite.connect(self.db_path) as db:
-            query = """
-            SELECT COUNT(asset_id_fk)
-            FROM tts_mod_assets
-                WHERE (
-                    mod_id_fk=(SELECT id FROM tts_mods WHERE mod_filename=?)
-                    AND
-                    asset_id_fk IN (SELECT id FROM tts_assets WHERE asset_mtime=?)
-                    AND
-                    mod_asset_ignore_missing=0
-                )
-            """
-            async with db.execute(query, (filename, 0)) as cursor:
-                result = await cursor.fetchone()
-            await db.execute(
-                """
-                UPDATE tts_mods
-                SET mod_missing_assets=?
-                WHERE mod_filename=?
-                """,
-                (result[0], filename),
-            )
-            await db.commit()
-        return result[0]
-
-    def _count_invalid_assets(self, filename: str) -> int:
-        with sqlite3.connect(self.db_path) as db:
-            query = """
-            SELECT COUNT(asset_id_fk)
-            FROM tts_mod_assets
-                WHERE (
-                    mod_id_fk=(SELECT id FROM tts_mods WHERE mod_filename=?)
-                    AND
-                    asset_id_fk IN (SELECT id FROM tts_assets WHERE asset_dl_status!='')
-                    AND
-                    mod_asset_ignore_missing=0
-                )
-            """
-            cursor = db.execute(query, (filename,))
-            result = cursor.fetchone()
-            db.execute(
-                """
-                UPDATE tts_mods
-                SET mod_invalid_assets=?
-                WHERE mod_filename=?
-                """,
-                (result[0], filename),
-            )
-            db.commit()
-        return result[0]
-
-    async def _count_invalid_assets_a(self, filename: str) -> int:
-        async with aiosqlite.connect(self.db_path) as db:
-            query = """
-            SELECT COUNT(asset_id_fk)
-            FROM tts_mod_assets
-                WHERE (
-                    mod_id_fk=(SELECT id FROM tts_mods WHERE mod_filename=?)
-                    AND
-                    asset_id_fk IN (SELECT id FROM tts_assets WHERE asset_dl_status!='')
-                    AND
-                    mod_asset_ignore_missing=0
-                )
-            """
-            async with db.execute(query, (filename,)) as cursor:
-                result = await cursor.fetchone()
-            await db.execute(
-                """
-                UPDATE tts_mods
-                SET mod_invalid_assets=?
-                WHERE mod_filename=?
-                """,
-                (result[0], filename),
-            )
-            await db.commit()
-        return result[0]
+        return mismatched
 
+    @blocking_db_call
     def get_mod_details(self, filename: str) -> dict:
         with sqlite3.connect(self.db_path) as db:
             # Now that all mods are in the db, extract the data...
@@ -471,6 +152,10 @@ class ModList:
 
         return mod
 
+    async def get_mod_details_a(self, filename: str) -> dict:
+        return await run_db(self.get_mod_details, filename)
+
+    @blocking_db_call
     def set_mod_details(self, mod_infos: dict) -> None:
         db_params = []
         mod_tags = []
@@ -582,6 +267,10 @@ class ModList:
             )
             db.commit()
 
+    async def set_mod_details_a(self, mod_infos: dict) -> None:
+        await run_db(self.set_mod_details, mod_infos)
+
+    @blocking_db_call
     def get_mods(
         self,
         parse_only=False,
@@ -664,15 +353,13 @@ class ModList:
                 db.executemany(
                     """
                     INSERT INTO tts_mods
-                        (mod_filename, mod_total_assets, mod_missing_assets, mod_invalid_assets, mod_size)
+                        (mod_filename, mod_total_assets, mod_missing_assets,
+                        mod_invalid_assets, mod_size, mod_needs_refresh)
                     VALUES
-                        (?, -1, -1, -1, -1)
+                        (?, 0, 0, 0, 0, 1)
                     ON CONFLICT (mod_filename)
                     DO UPDATE SET
-                        mod_total_assets=excluded.mod_total_assets,
-                        mod_missing_assets=excluded.mod_missing_assets,
-                        mod_invalid_assets=excluded.mod_invalid_assets,
-                        mod_size=excluded.mod_size
+                        mod_needs_refresh=1
                     """,
                     mod_list,
                 )
@@ -751,9 +438,21 @@ class ModList:
             db.commit()
         return mods
 
-    async def set_bgg_id(self, mod_filename: str, bgg_id: str) -> None:
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(
+    async def get_mods_a(
+        self,
+        parse_only=False,
+        force_refresh=False,
+        include_deleted=False,
+        clean_db=False,
+    ) -> dict:
+        return await run_db(
+            self.get_mods, parse_only, force_refresh, include_deleted, clean_db
+        )
+
+    @blocking_db_call
+    def set_bgg_id(self, mod_filename: str, bgg_id: str) -> None:
+        with sqlite3.connect(self.db_path) as db:
+            db.execute(
                 """
                 UPDATE
                     tts_mods
@@ -764,4 +463,7 @@ class ModList:
                 """,
                 (bgg_id, mod_filename),
             )
-            await db.commit()
+            db.commit()
+
+    async def set_bgg_id_a(self, mod_filename: str, bgg_id: str) -> None:
+        await run_db(self.set_bgg_id, mod_filename, bgg_id)
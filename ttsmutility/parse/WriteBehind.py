@@ -0,0 +1,61 @@
+import threading
+
+
+class WriteBehind:
+    """Base for writers that hold updates in memory and write them to the DB
+    on a background thread.
+
+    The thread is started by `_start()` and calls `flush()` every
+    `flush_interval` seconds, or sooner when `_wake` is set.  A subclass's
+    `flush()` writes everything pending and, if the write fails, keeps it
+    pending and raises.  A failed background flush is counted in
+    `flush_errors`, passed to `on_error` and tried again on the next
+    interval, rather than stopping the thread.
+    """
+
+    def __init__(self, name: str, flush_interval: float, on_error=None) -> None:
+        self.name = name
+        self.flush_interval = flush_interval
+        self.on_error = on_error
+        self.flush_errors = 0
+
+        # Protects what is pending
+        self._lock = threading.Lock()
+        # Serializes flushes so updates are written in order
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = None
+
+    def _start(self) -> None:
+        if self._thread is None and not self._closed:
+            self._thread = threading.Thread(
+                target=self._flush_daemon, name=self.name, daemon=True
+            )
+            self._thread.start()
+
+    def _flush_daemon(self) -> None:
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if self._closed:
+                break
+            try:
+                self.flush()
+            except Exception as error:
+                # What failed is still pending, so it's retried next time round
+                self.flush_errors += 1
+                if self.on_error is not None:
+                    self.on_error(error)
+
+    def flush(self) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Stop the background flusher and write anything still pending."""
+        self._closed = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
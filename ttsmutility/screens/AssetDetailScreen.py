@@ -43,12 +43,16 @@ class AssetDetailScreen(ModalScreen):
             yield Footer()
             with VerticalScroll(id="ad_scroll"):
                 yield Markdown(
-                    self.get_markdown(),
                     id="ad_markdown",
                 )
 
-    def get_markdown(self) -> str:
-        asset_detail = self.asset_list.get_asset(self.url, self.mod_filename)
+    async def on_mount(self) -> None:
+        self.query_one("#ad_markdown", expect_type=Markdown).update(
+            await self.get_markdown()
+        )
+
+    async def get_markdown(self) -> str:
+        asset_detail = await self.asset_list.get_asset_a(self.url, self.mod_filename)
         if asset_detail is None:
             return ""
 
@@ -74,7 +78,7 @@ class AssetDetailScreen(ModalScreen):
             asset_detail["mod_name"] = ""
         else:
             mod_list = ModList()
-            mod_detail = mod_list.get_mod_details(self.mod_filename)
+            mod_detail = await mod_list.get_mod_details_a(self.mod_filename)
             asset_detail["mod_name"] = mod_detail["name"]
 
         if self.trail != "":
@@ -151,7 +155,9 @@ class AssetDetailScreen(ModalScreen):
 
         if asset_detail["dl_status"] != "":
             asset_detail["matches"] = "### Asset Matches\n"
-            matches = self.asset_list.find_asset(self.url, asset_detail["trail"])
+            matches = await self.asset_list.find_asset_a(
+                self.url, asset_detail["trail"]
+            )
             if len(matches) == 0:
                 asset_detail["matches"] += "None Found\n"
             else:
@@ -173,13 +179,13 @@ class AssetDetailScreen(ModalScreen):
         if "//localhost/" in event.href:
             link = event.href.replace("//localhost/", "file:///")
         elif self.uri_copy in event.href:
-            await self.asset_list.copy_asset(
+            await self.asset_list.copy_asset_a(
                 event.href.split(self.uri_copy)[1], self.url
             )
             self.post_message(self.CopyComplete(self.url))
             self.app.push_screen(InfoDialog("Copied asset. Restart to update mod."))
         elif self.uri_delete in event.href:
-            await self.asset_list.delete_asset(self.url)
+            await self.asset_list.delete_asset_a(self.url)
             self.app.push_screen(InfoDialog("Deleted asset. Restart to update mod."))
         elif self.ad_uri_prefix in event.href:
             self.app.push_screen(
@@ -60,6 +60,7 @@ class AssetListScreen(Widget):
         self.url_width = 40
         self.al_id = al_id
         self.explore = False
+        self.assets = {}
 
         config = load_config()
         self.mod_dir = config.tts_mods_dir
@@ -81,7 +82,7 @@ class AssetListScreen(Widget):
         with Container(id="al_container"):
             yield DataTableFilter(id=self.al_id)
 
-    def on_mount(self) -> None:
+    async def on_mount(self) -> None:
         self.sort_order = {
             "url": False,
             "ext": False,
@@ -101,11 +102,13 @@ class AssetListScreen(Widget):
         table.add_column("Modified", key="mtime", width=25)
         table.add_column("Trail", key="trail")
 
-        self.load_data()
+        await self.load_data()
 
-    def load_data(self):
+    async def load_data(self):
         asset_list = AssetList()
-        assets = asset_list.get_mod_assets(self.mod_filename, all_nodes=self.all_nodes)
+        assets = await asset_list.get_mod_assets_a(
+            self.mod_filename, all_nodes=self.all_nodes
+        )
         self.assets = {}
 
         table = next(self.query("#" + self.al_id).results(DataTable))
@@ -162,17 +165,19 @@ class AssetListScreen(Widget):
     async def check_for_matches(self):
         asset_list = AssetList()
         table = next(self.query("#" + self.al_id).results(DataTable))
-        for asset in self.assets.values():
-            if asset["size"] == 0 and asset["dl_status"] != "":
-                if await asset_list.find_asset_a(asset["url"], asset["trail"]):
-                    asset["size"] = "-1.0 B"
-                    try:
-                        table.update_cell(
-                            asset["url"], "size", asset["size"], update_width=True
-                        )
-                    except CellDoesNotExist:
-                        # This can happen if the table cell is filtered at the moment
-                        pass
+        missing = [
+            (asset["url"], asset["trail"])
+            for asset in self.assets.values()
+            if asset["size"] == 0 and asset["dl_status"] != ""
+        ]
+        for url in await asset_list.find_assets_with_matches_a(missing):
+            asset = self.assets[url]
+            asset["size"] = "-1.0 B"
+            try:
+                table.update_cell(url, "size", asset["size"], update_width=True)
+            except CellDoesNotExist:
+                # This can happen if the table cell is filtered at the moment
+                pass
 
     def format_url(self, url: str) -> str:
         if url[-1] == "/":
@@ -367,17 +372,17 @@ class AssetListScreen(Widget):
         self.assets[row_key]["ignore_missing"] = not self.assets[row_key][
             "ignore_missing"
         ]
-        await asset_list.set_ignore(
+        await asset_list.set_ignore_a(
             self.mod_filename, row_key.value, self.assets[row_key]["ignore_missing"]
         )
         self.updated_counts = True
         self.update_asset(self.assets[row_key])
 
-    def action_all_nodes(self):
+    async def action_all_nodes(self):
         self.all_nodes = not self.all_nodes
         table = next(self.query("#" + self.al_id).results(DataTable))
         table.clear()
-        self.load_data()
+        await self.load_data()
 
     def action_filter(self) -> None:
         f = self.query_one("#al_filter_center")
@@ -1,23 +1,39 @@
 from textual import work
 from textual.app import ComposeResult
 from textual.screen import ModalScreen
-from textual.widgets import LoadingIndicator
+from textual.widgets import LoadingIndicator, ProgressBar
 
 
 class LoadingScreen(ModalScreen[int]):
-    def __init__(self, busy_work, *args):
+    def __init__(self, busy_work, *args, show_progress=False):
+        """
+        Args:
+            show_progress: Show a progress bar, which `busy_work` updates
+                through the `on_progress` callback it is passed.
+        """
         super().__init__()
         self.busy_work = busy_work
         self.busy_work_args = args
+        self.show_progress = show_progress
 
     def compose(self) -> ComposeResult:
         """Compose the child widgets."""
         yield LoadingIndicator(id="busy_indicator")
+        if self.show_progress:
+            yield ProgressBar(id="busy_progress")
 
     def on_mount(self) -> None:
         self.do_busy_work()
 
+    def on_progress(self, **kwargs) -> None:
+        self.app.call_from_thread(self.query_one(ProgressBar).update, **kwargs)
+
     @work(thread=True)
     def do_busy_work(self) -> None:
-        return_value = self.busy_work(*self.busy_work_args)
+        if self.show_progress:
+            return_value = self.busy_work(
+                *self.busy_work_args, on_progress=self.on_progress
+            )
+        else:
+            return_value = self.busy_work(*self.busy_work_args)
         self.app.call_from_thread(self.dismiss, return_value)
@@ -43,7 +43,11 @@ class ModDetailScreen(Screen):
         self.app.pop_screen()
 
     def __init__(
-        self, filename: str, backup_time: float, force_md_update: bool = False
+        self,
+        filename: str,
+        mod_detail: dict,
+        backup_time: float,
+        force_md_update: bool = False,
     ) -> None:
         self.filename = filename
         self.backup_time = backup_time
@@ -59,7 +63,7 @@ class ModDetailScreen(Screen):
         self.mod_list = ModList()
         self.bs = BggSearch()
         self.force_update = force_md_update
-        self.mod_detail = self.mod_list.get_mod_details(self.filename).copy()
+        self.mod_detail = mod_detail.copy()
         self.tab_names = [
             "md_pane_mod",
             "md_pane_steam",
@@ -110,7 +114,7 @@ class ModDetailScreen(Screen):
         tc = self.query_one(TabbedContent)
         tc.add_pane(pane, before="md_pane_assets")
 
-    def on_mount(self):
+    async def on_mount(self):
         self.query_one("#md_markdown_mod", expect_type=Markdown).update(
             self.get_markdown()
         )
@@ -124,7 +128,7 @@ class ModDetailScreen(Screen):
                 self.get_markdown_bgg()
             )
         self.query_one("#title", expect_type=Label).update(self.mod_detail["name"])
-        if self.is_infected():
+        if await self.is_infected():
             iw = self.query_one("#infection_warning", expect_type=Label)
             iw.update(
                 (
@@ -144,10 +148,10 @@ class ModDetailScreen(Screen):
             image_path = self.save_dir / Path(self.filename).with_suffix(".png")
         return image_path
 
-    def is_infected(self) -> bool:
+    async def is_infected(self) -> bool:
         asset_list = AssetList()
-        infected_mods = asset_list.get_mods_using_asset(INFECTION_URL)
-        infected_filenames = [mod_filename for mod_filename in infected_mods]
+        infected_mods = await asset_list.get_mods_using_asset_a(INFECTION_URL)
+        infected_filenames = [mod_filename for mod_filename, _ in infected_mods]
         if self.mod_detail["filename"] in infected_filenames:
             return True
         else:
@@ -389,18 +393,20 @@ class ModDetailScreen(Screen):
                 break
         return bgg_md
 
-    def on_markdown_link_clicked(self, event: Markdown.LinkClicked):
+    async def on_markdown_link_clicked(self, event: Markdown.LinkClicked):
         if "//localhost/" in event.href:
             link = event.href.replace("//localhost/", "file:///")
             open_url(link)
         elif self.dl_image_uri_prefix in event.href:
-            self.action_set_tts_thumb()
+            await self.action_set_tts_thumb()
         else:
             open_url(event.href)
 
-    def action_refresh_mod_details(self):
+    async def action_refresh_mod_details(self):
         asset_list = AssetList()
-        asset_list.get_mod_assets(self.filename, parse_only=True, force_refresh=True)
+        await asset_list.get_mod_assets_a(
+            self.filename, parse_only=True, force_refresh=True
+        )
 
         self.query_one("#md_markdown_mod", expect_type=Markdown).update(
             self.get_markdown()
@@ -434,7 +440,7 @@ class ModDetailScreen(Screen):
             async def set_id(index: int) -> None:
                 if index == len(options) - 1:
                     if self.mod_detail["bgg_id"] is not None:
-                        await self.mod_list.set_bgg_id(self.filename, None)
+                        await self.mod_list.set_bgg_id_a(self.filename, None)
                     # TODO: remove bgg tab if it exists
                 else:
                     if self.mod_detail["bgg_id"] is None:
@@ -446,7 +452,7 @@ class ModDetailScreen(Screen):
                     if bgg_id != self.mod_detail["bgg_id"]:
                         self.mod_detail["bgg_id"] = bgg_id
                         md = self.query_one("#md_markdown_bgg", expect_type=Markdown)
-                        await self.mod_list.set_bgg_id(self.filename, bgg_id)
+                        await self.mod_list.set_bgg_id_a(self.filename, bgg_id)
                         md.update(self.get_markdown_bgg())
                         self.post_message(
                             self.BggIdUpdated(self.mod_detail["filename"], bgg_id)
@@ -458,7 +464,7 @@ class ModDetailScreen(Screen):
                 msg="No matches found. Please update search string:"
             )
 
-    def action_set_tts_thumb(self):
+    async def action_set_tts_thumb(self):
         if self.mod_detail["bgg_id"] is None:
             self.app.push_screen(
                 InfoDialog(
@@ -473,7 +479,7 @@ class ModDetailScreen(Screen):
             img = Image.open(BytesIO(response.content))
             save_path = self.get_mod_image_path()
             img.save(save_path)
-            self.action_refresh_mod_details()
+            await self.action_refresh_mod_details()
             self.app.push_screen(InfoDialog("Updated TTS Thumbnail"))
 
     def on_tabbed_content_tab_activated(
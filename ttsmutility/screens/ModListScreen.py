@@ -3,8 +3,6 @@ import math
 import time
 from dataclasses import dataclass
 from pathlib import Path
-from queue import Empty, Queue
-from typing import NamedTuple
 from webbrowser import open as open_url
 
 from aiopath import AsyncPath
@@ -21,20 +19,25 @@ from textual.message import Message
 from textual.screen import Screen
 from textual.widgets import DataTable, Footer, Header, Input
 from textual.widgets.data_table import CellDoesNotExist, RowKey
-from textual.worker import get_current_worker
 
 from ..data.config import config_file, load_config
 from ..dialogs.HelpDialog import HelpDialog
 from ..dialogs.InfoDialog import InfoDialog
 from ..parse import ModList
 from ..parse.AssetList import AssetList
+from ..parse.DownloadJournal import DownloadJournal
 from ..parse.FileFinder import trailstring_to_trail
 from ..parse.ModParser import INFECTION_URL
 from ..utility.messages import UpdateLog
 from ..utility.util import MyText, format_time, make_safe_filename, sizeof_fmt
 from ..widgets.DataTableFilter import DataTableFilter
 from ..workers.backup import unzip_backup
-from ..workers.downloader import FileDownload
+from ..workers.backupstore import MANIFEST_SUFFIX, restore_manifest
+from ..workers.bandwidth import BandwidthLimiter, parse_rate, parse_windows
+from ..workers.downloader import DownloadPool
+from ..workers.progress import DownloadProgress, ProgressSnapshot
+from ..workers.resolver import AssetResolver, parse_mirrors
+from ..workers.retry import NegativeCache
 from .DebugScreen import DebugScreen
 from .LoadingScreen import LoadingScreen
 from .ModExplorerScreen import ModExplorerScreen
@@ -73,6 +76,26 @@ class ModListCommands(Provider):
             "Attempt to get content names for all assets",
             "action_scan_names",
         ),
+        "Verify SHA1 Mismatches": (
+            "Find out why SteamCloud assets don't match their SHA1, and re-fetch corrupt ones",
+            "action_verify_sha1s",
+        ),
+        "Check Asset Freshness": (
+            "Ask hosts whether downloaded assets changed, and re-fetch those that did",
+            "action_check_freshness",
+        ),
+        "Show Download Hosts": (
+            "Shows download concurrency and throttling for each host",
+            "action_download_hosts",
+        ),
+        "Show Dead URLs": (
+            "Shows urls skipped by bulk downloads, and the time saved",
+            "action_dead_urls",
+        ),
+        "Cancel Download": (
+            "Stop queued downloads for the selected mod",
+            "action_cancel_download",
+        ),
     }
 
     async def startup(self) -> None:
@@ -99,19 +122,10 @@ class ModListCommands(Provider):
 
 
 class ModListScreen(Screen):
-    class FileDownloadComplete(Message):
-        def __init__(
-            self,
-            worker_num: int,
-            asset: dict,
-        ) -> None:
+    class DownloadsUpdated(Message):
+        def __init__(self, snapshot: ProgressSnapshot) -> None:
             super().__init__()
-            self.asset = asset
-            self.worker_num = worker_num
-
-    class DownloadEntry(NamedTuple):
-        url: str
-        trail: list
+            self.snapshot = snapshot
 
     @dataclass
     class WorkerStatus:
@@ -131,6 +145,9 @@ class ModListScreen(Screen):
 
     COMMANDS = App.COMMANDS | {ModListCommands}
 
+    # Download progress is sent to the UI at most this often
+    DL_PROGRESS_INTERVAL = 1 / 10
+
     BINDINGS = [
         Binding("f1", "help", "Help"),
         Binding("ctrl+q", "app.quit", "Quit"),
@@ -140,10 +157,13 @@ class ModListScreen(Screen):
         Binding("r", "mod_refresh", "Refresh"),
         Binding("u", "unzip", "Unzip"),
         Binding("e", "explore", "Explore", show=True),
+        Binding("x", "cancel_download", "Cancel Download", show=False),
     ]
 
     def __init__(self) -> None:
         self.prev_selected = None
+        self.mods = {}
+        self.infected_filenames = []
         self.filter = ""
         self.prev_filter = ""
         self.active_rows = {}
@@ -153,31 +173,51 @@ class ModListScreen(Screen):
         self.backup_status = {}
         self.backup_filenames = {}
         self.backup_ready = False
-        self.dl_queue = Queue()
         self.filter_timer = None
-        self.downloads = []
-        self.fds = []
         self.dl_worker_status = []
+        self.dead_urls = NegativeCache()
+        self.dead_urls_skipped = 0
+        self.dl_time_saved = 0.0
         super().__init__()
 
         config = load_config()
         self.mod_dir = config.tts_mods_dir
         self.save_dir = config.tts_saves_dir
         self.num_dl_threads = int(config.num_download_threads)
-        self.last_dl_update_time = 0.0
 
-        for i in range(self.num_dl_threads):
-            fd = FileDownload()
-            self.fds.append(fd)
+        # Reported once we are mounted
+        self.config_errors = []
+        try:
+            windows = parse_windows(config.download_rate_windows)
+        except ValueError as error:
+            windows = []
+            self.config_errors.append(f"Ignoring download_rate_windows: {error}")
+        try:
+            mirrors = parse_mirrors(config.download_mirrors)
+        except ValueError as error:
+            mirrors = []
+            self.config_errors.append(f"Ignoring download_mirrors: {error}")
+        self.dl_pool = DownloadPool(
+            self.num_dl_threads,
+            int(config.num_downloads_per_host),
+            on_done=self.download_done,
+            journal=DownloadJournal(
+                on_error=self.journal_failed,
+                capabilities=self.app.host_capabilities,
+            ),
+            bandwidth=BandwidthLimiter(parse_rate(config.download_rate_limit), windows),
+            resolver=AssetResolver(mirrors),
+            capabilities=self.app.host_capabilities,
+            on_error=self.download_failed,
+        )
+        for fd in self.dl_pool.fds:
             self.dl_worker_status.append(self.DlWorkerStatus("", "", 0, 0))
             self.mount(fd)
-            self.run_worker(
-                self.download_daemon,
-                name=f"{i}",
-                group="downloaders",
-                description=f"DL Task {i}",
-                thread=True,
-            )
+        self.dl_progress = DownloadProgress(self.dl_pool.fds)
+        self.dl_snapshot = ProgressSnapshot()
+
+    def on_unmount(self) -> None:
+        self.dl_pool.close()
 
     def compose(self) -> ComposeResult:
         yield Header()
@@ -217,6 +257,14 @@ class ModListScreen(Screen):
         def __init__(self) -> None:
             super().__init__()
 
+    class CheckFreshness(Message):
+        def __init__(self) -> None:
+            super().__init__()
+
+    class VerifySha1s(Message):
+        def __init__(self) -> None:
+            super().__init__()
+
     class DownloadSelected(Message):
         def __init__(self, mod_filenames: list[str]) -> None:
             self.mod_filenames = mod_filenames
@@ -235,7 +283,7 @@ class ModListScreen(Screen):
         def __init__(self) -> None:
             super().__init__()
 
-    def on_mount(self) -> None:
+    async def on_mount(self) -> None:
         self.sort_order = {
             "name": False,
             "type": False,
@@ -274,7 +322,7 @@ class ModListScreen(Screen):
         table.sort("name", reverse=self.sort_order["name"])
         self.last_sort_key = "name"
 
-        self.load_mods()
+        await self.load_mods()
 
         table.sort(self.last_sort_key, reverse=self.sort_order[self.last_sort_key])
         table.focus()
@@ -282,13 +330,65 @@ class ModListScreen(Screen):
         self.backup_times = {}
         self.update_backup()
 
-    def load_mods(self) -> None:
+        for error in self.config_errors:
+            self.post_message(UpdateLog(error))
+        self.set_interval(1.0, self.update_host_status)
+        self.set_interval(self.DL_PROGRESS_INTERVAL, self.update_dl_progress)
+
+        await self.resume_downloads()
+
+    async def resume_downloads(self) -> None:
+        """Queue the downloads left over from the last time we ran."""
+        outstanding = await self.dl_pool.journal.get_outstanding_a()
+        if len(outstanding) == 0:
+            return
+        num_urls = len({url for urls, _ in outstanding.values() for url in urls})
+        self.post_message(
+            UpdateLog(
+                f"Resuming {num_urls} downloads for {len(outstanding)} mods "
+                "from the last session."
+            )
+        )
+        for mod_filename, (urls, trails) in outstanding.items():
+            if mod_filename in self.status:
+                self.status[mod_filename].download = "Queued"
+            files_remaining = self.dl_urls(urls, trails, mod_filename)
+            if mod_filename in self.status:
+                self.set_files_remaining(mod_filename, files_remaining, -1)
+
+    def update_host_status(self) -> None:
+        status = self.dl_pool.status()
+        snapshot = self.dl_snapshot
+        if len(snapshot.workers) > 0 or snapshot.queued > 0:
+            rate = " ".join(sizeof_fmt(snapshot.rate, "B/s").split())
+            progress = f"{rate}, {snapshot.queued} queued"
+            if (limit := self.dl_pool.bandwidth.status()) != "":
+                progress += f" ({limit})"
+            if snapshot.eta is not None:
+                minutes, seconds = divmod(int(snapshot.eta), 60)
+                progress += f", ETA {minutes}:{seconds:02d}"
+            status = progress if status == "" else f"{progress} | {status}"
+        if status == "":
+            self.sub_title = None
+        else:
+            self.sub_title = f"DL: {status}"
+
+    def update_dl_progress(self) -> None:
+        """Send everything that happened to the downloads since the last frame."""
+        snapshot = self.dl_progress.sample(len(self.dl_pool.scheduler))
+        self.dl_snapshot = snapshot
+        active = {worker.worker_num for worker in snapshot.workers}
+        for worker_num, dl_stat in enumerate(self.dl_worker_status):
+            if worker_num not in active:
+                dl_stat.filename = ""
+        if not snapshot.is_empty():
+            self.post_message(self.DownloadsUpdated(snapshot))
+
+    async def load_mods(self) -> None:
         mod_list = ModList.ModList()
-        self.mods = mod_list.get_mods()
+        self.mods = await mod_list.get_mods_a()
 
-        asset_list = AssetList()
-        infected_mods = asset_list.get_mods_using_asset(INFECTION_URL)
-        self.infected_filenames = [mod_filename for mod_filename, _ in infected_mods]
+        await self.update_infected()
 
         for mod_filename in self.mods.keys():
             self.add_mod_row(self.mods[mod_filename])
@@ -346,19 +446,23 @@ class ModListScreen(Screen):
         if not Path(config.mod_backup_dir).exists():
             return
 
-        async for bf in AsyncPath(config.mod_backup_dir).glob("*.zip"):
-            stat = await bf.stat()
-            name = bf.name
-            s = name.rfind("[")
-            e = name.rfind("]")
-            # Handle embedded []'s in name
-            t = name.rfind("]", 0, e)
-            while t > s:
-                s = name.rfind("[", 0, s)
-                t = name.rfind("]", 0, t)
-            mod_filename = name[s + 1 : e] + ".json"
-            self.backup_times[mod_filename] = stat.st_mtime
-            self.backup_filenames[mod_filename] = bf
+        for pattern in ("*.zip", "*" + MANIFEST_SUFFIX):
+            async for bf in AsyncPath(config.mod_backup_dir).glob(pattern):
+                stat = await bf.stat()
+                name = bf.name
+                s = name.rfind("[")
+                e = name.rfind("]")
+                # Handle embedded []'s in name
+                t = name.rfind("]", 0, e)
+                while t > s:
+                    s = name.rfind("[", 0, s)
+                    t = name.rfind("]", 0, t)
+                mod_filename = name[s + 1 : e] + ".json"
+                # Use the newest if a mod is both zipped and in the store
+                if self.backup_times.get(mod_filename, 0) > stat.st_mtime:
+                    continue
+                self.backup_times[mod_filename] = stat.st_mtime
+                self.backup_filenames[mod_filename] = bf
 
         for mod_filename in self.mods.keys():
             name = Path(mod_filename).name
@@ -469,60 +573,57 @@ class ModListScreen(Screen):
         else:
             table.cursor_coordinate = Coordinate(0, 0)
 
-    def update_counts(
-        self, mod_filename, total_assets, missing_assets, invalid_assets, size
-    ):
+    async def update_infected(self) -> None:
         asset_list = AssetList()
-        infected_mods = asset_list.get_mods_using_asset(INFECTION_URL)
+        infected_mods = await asset_list.get_mods_using_asset_a(INFECTION_URL)
         self.infected_filenames = [mod_filename for mod_filename, _ in infected_mods]
 
-        table = self.query_one(DataTable)
-
-        row_key = mod_filename
-        if row_key not in self.mods:
-            return
-
-        name = self.stylize_name(self.mods[row_key])
-
-        # We need to update both our internal asset information
-        # and what is shown on the table...
-        self.mods[row_key]["total_assets"] = total_assets
-        self.mods[row_key]["missing_assets"] = missing_assets
-        self.mods[row_key]["invalid_assets"] = missing_assets
-        self.mods[row_key]["size"] = size
+    async def update_counts(
+        self, mod_filename, total_assets, missing_assets, invalid_assets, size
+    ):
+        await self.update_infected()
+        self.set_counts(
+            mod_filename, total_assets, missing_assets, invalid_assets, size
+        )
 
-        try:
-            table.update_cell(row_key, "name", name)
-            table.update_cell(row_key, "total_assets", total_assets)
-            table.update_cell(row_key, "missing_assets", missing_assets)
-            table.update_cell(row_key, "invalid_assets", invalid_assets)
-            table.update_cell(row_key, "size", sizeof_fmt(size))
-        except CellDoesNotExist:
-            # This can happen if some of our mods are filtered and an
-            # asset is shared with a filtered one that isn't being displayed.
-            pass
+    async def refresh_counts(self, counts: dict) -> None:
+        """Update the rows whose counts differ from `counts` (keyed by filename)."""
+        await self.update_infected()
+        for mod_filename, mod_counts in counts.items():
+            if mod_filename not in self.mods:
+                continue
+            mod = self.mods[mod_filename]
+            if (
+                mod["total_assets"] != mod_counts["total"]
+                or mod["missing_assets"] != mod_counts["missing"]
+                or mod["invalid_assets"] != mod_counts["invalid"]
+                or mod["size"] != mod_counts["size"]
+            ):
+                self.set_counts(
+                    mod_filename,
+                    mod_counts["total"],
+                    mod_counts["missing"],
+                    mod_counts["invalid"],
+                    mod_counts["size"],
+                )
 
-    async def update_counts_a(
+    def set_counts(
         self, mod_filename, total_assets, missing_assets, invalid_assets, size
     ):
-        asset_list = AssetList()
-        infected_mods = await asset_list.get_mods_using_asset_a(INFECTION_URL)
-        self.infected_filenames = [mod_filename for mod_filename, _ in infected_mods]
-
         table = self.query_one(DataTable)
 
         row_key = mod_filename
         if row_key not in self.mods:
             return
 
-        name = self.stylize_name(self.mods[row_key])
-
         # We need to update both our internal asset information
         # and what is shown on the table...
         self.mods[row_key]["total_assets"] = total_assets
         self.mods[row_key]["missing_assets"] = missing_assets
-        self.mods[row_key]["invalid_assets"] = missing_assets
-        self.mods[row_key]["size"] = sizeof_fmt(size)
+        self.mods[row_key]["invalid_assets"] = invalid_assets
+        self.mods[row_key]["size"] = size
+
+        name = self.stylize_name(self.mods[row_key])
 
         try:
             table.update_cell(row_key, "name", name)
@@ -545,6 +646,8 @@ class ModListScreen(Screen):
                     backup_time = self.backup_times[name]
                 else:
                     backup_time = 0
+                # Downloads for the mod being viewed jump the queue
+                self.dl_pool.focus(mod_filename)
                 self.post_message(self.ModSelected(mod_filename, backup_time))
             self.prev_selected = event.row_key
 
@@ -568,6 +671,12 @@ class ModListScreen(Screen):
     def action_scan_names(self) -> None:
         self.post_message(self.ScanNames())
 
+    def action_check_freshness(self) -> None:
+        self.post_message(self.CheckFreshness())
+
+    def action_verify_sha1s(self) -> None:
+        self.post_message(self.VerifySha1s())
+
     def action_download_all(self) -> None:
         filenames = []
         for filename in self.active_rows:
@@ -730,19 +839,79 @@ class ModListScreen(Screen):
     def action_missing_assets(self):
         self.post_message(self.ShowMissing())
 
+    def action_download_hosts(self):
+        def supports(flag):
+            return "?" if flag is None else "yes" if flag else "no"
+
+        lines = [
+            "| Host | Active | Limit | Done | Throttled | Timeouts "
+            "| Latency | Names | HEAD | Ranges |",
+            "| --- | --- | --- | --- | --- | --- | --- | --- | --- | --- |",
+        ]
+        for limiter in self.dl_pool.hosts.limiters.values():
+            capability = self.app.host_capabilities.get(limiter.host)
+            lines.append(
+                f"| {limiter.host} | {limiter.active} | {int(limiter.limit)} "
+                f"| {limiter.completed} | {limiter.throttled} | {limiter.timeouts} "
+                f"| {capability.latency * 1000:.0f}ms "
+                f"| {supports(capability.content_disposition)} "
+                f"| {supports(capability.head)} | {supports(capability.ranges)} |"
+            )
+        self.app.push_screen(DebugScreen(Markdown("\n".join(lines))))
+
+    async def load_dead_urls(self) -> NegativeCache:
+        """Urls that recently failed for good, from the download journal."""
+        dead_urls = NegativeCache()
+        since = time.time() - max(dead_urls.ttl, dead_urls.host_ttl)
+        history = await self.dl_pool.journal.get_history_a(since)
+        for url, error, update_time, duration in history:
+            dead_urls.add(url, error, update_time, duration)
+        self.dead_urls = dead_urls
+        return dead_urls
+
+    def skipped_dead_urls(self, skipped: list) -> None:
+        if len(skipped) == 0:
+            return
+        time_saved = sum(dead.duration for dead in skipped)
+        self.dead_urls_skipped += len(skipped)
+        self.dl_time_saved += time_saved
+        self.post_message(
+            UpdateLog(
+                f"Skipped {len(skipped)} known dead urls, "
+                f"saving about {time_saved:.1f}s."
+            )
+        )
+
+    def action_dead_urls(self):
+        now = time.time()
+        lines = [
+            f"Skipped {self.dead_urls_skipped} downloads of known dead urls "
+            f"this session, saving about {self.dl_time_saved:.1f}s.",
+            "",
+            "| Url/Host | Error | Retry After |",
+            "| --- | --- | --- |",
+        ]
+        for dead_urls in (self.dead_urls.hosts, self.dead_urls.urls):
+            for url, dead in dead_urls.items():
+                if dead.expires > now:
+                    lines.append(
+                        f"| {url} | {dead.error} | {format_time(dead.expires)} |"
+                    )
+        self.app.push_screen(DebugScreen(Markdown("\n".join(lines))))
+
     def action_mod_refresh(self):
         table = self.query_one(DataTable)
         row_key, _ = table.coordinate_to_cell_key(table.cursor_coordinate)
         if row_key.value is not None:
             self.post_message(self.ModRefresh(row_key.value))
 
-    def action_content_name_report(self):
+    async def action_content_name_report(self):
         config = load_config()
 
         outname = Path(config.mod_backup_dir) / "content_names.csv"
 
         asset_list = AssetList()
-        urls, content_names, sha1s = asset_list.get_content_names()
+        urls, content_names, sha1s = await asset_list.get_content_names_a()
 
         with open(outname, "w", encoding="utf-8", newline="") as f:
             csv_out = csv.writer(f, delimiter="\t")
@@ -751,7 +920,7 @@ class ModListScreen(Screen):
 
         self.app.push_screen(InfoDialog(f"Saved content name report to '{outname}'."))
 
-    def action_content_name_load(self):
+    async def action_content_name_load(self):
         urls = []
         content_names = []
 
@@ -771,7 +940,7 @@ class ModListScreen(Screen):
                 content_names.append(line[1].strip())
 
         asset_list = AssetList()
-        asset_list.set_content_names(urls, content_names)
+        await asset_list.set_content_names_a(urls, content_names)
 
         self.app.push_screen(InfoDialog(f"Loaded content names from '{inname}'."))
 
@@ -800,24 +969,13 @@ class ModListScreen(Screen):
         if filename not in self.status:
             return
 
-        cur_time = time.time()
-        if cur_time > (self.last_dl_update_time + 0.5):
-            do_update = True
-            self.last_dl_update_time = cur_time
-        else:
-            do_update = False
-
         stat_message = ""
         if self.status[filename].download == "Queued":
             stat_message += "Q"
-            do_update = True
         elif self.status[filename].download == "Done":
             stat_message += "✓"
-            do_update = True
         elif self.status[filename].download == "Running":
             stat_message += f"{self.progress[filename].files_remaining}->"
-            if self.progress[filename].files_remaining == 0:
-                do_update = True
             for i, dl_stat in enumerate(self.dl_worker_status):
                 if dl_stat.filename == filename:
                     if dl_stat.filesize == 0:
@@ -829,15 +987,12 @@ class ModListScreen(Screen):
                         stat_message += chart_chars[index]
                     stat_message += "▏"
 
-        if do_update:
-            try:
-                table = self.query_one(DataTable)
-                table.update_cell(
-                    filename, "dl_status", stat_message, update_width=True
-                )
-            except (CellDoesNotExist, KeyError):
-                # This cell may be currently filtered, so ignore any errors
-                pass
+        try:
+            table = self.query_one(DataTable)
+            table.update_cell(filename, "dl_status", stat_message, update_width=True)
+        except (CellDoesNotExist, KeyError):
+            # This cell may be currently filtered, so ignore any errors
+            pass
 
     def set_dl_progress(self, filename, url, worker_num, filesize, bytes_complete):
         if self.status[filename].download != "Running":
@@ -846,13 +1001,8 @@ class ModListScreen(Screen):
         self.dl_worker_status[worker_num].url = url
         self.dl_worker_status[worker_num].filesize = filesize
         self.dl_worker_status[worker_num].bytes_complete = bytes_complete
-        # No need to update status when file is done, as we will get updated when remaining files are updated
-        if bytes_complete != filesize:
-            self.update_dl_status(filename)
 
-    def set_files_remaining(self, filename, url_completed, files_remaining, worker_num):
-        if url_completed is not None and url_completed in self.downloads:
-            self.downloads.remove(url_completed)
+    def set_files_remaining(self, filename, files_remaining, worker_num):
         self.progress[filename] = self.ModDlProgress(files_remaining)
         if worker_num != -1:
             if self.status[filename].download == "Queued":
@@ -861,48 +1011,43 @@ class ModListScreen(Screen):
                 self.status[filename].download = "Done"
         self.update_dl_status(filename)
 
-    def dl_urls(self, urls, trails, mod_filename="") -> None:
-        for url, trail in zip(urls, trails):
-            if url in self.downloads:
-                continue
-            self.downloads.append(url)
-            if type(trail) is not list:
-                trail = trailstring_to_trail(trail)
-
-            self.dl_queue.put(self.DownloadEntry(url, trail))
-
-    def download_daemon(self) -> None:
-        worker = get_current_worker()
-        fd = self.fds[int(worker.name)]
+    def dl_urls(self, urls, trails, mod_filename="") -> int:
+        """Queue downloads, returns the number the mod is waiting on."""
+        trails = [
+            trail if type(trail) is list else trailstring_to_trail(trail)
+            for trail in trails
+        ]
+        return self.dl_pool.add(urls, trails, mod_filename)
 
-        while True:
-            if worker.is_cancelled:
-                return
+    def download_done(self, worker_num, error, asset, files_remaining) -> None:
+        # Sent with the next frame of progress
+        self.dl_progress.complete(worker_num, error, asset, files_remaining)
 
-            try:
-                dl_task = self.dl_queue.get(timeout=1)
-            except Empty:
-                continue
+    def journal_failed(self, error) -> None:
+        self.post_message(UpdateLog(f"Download journal flush failed: {error}"))
 
-            error, asset = fd.download(int(worker.name), dl_task.url, dl_task.trail)
+    def download_failed(self, url, exception) -> None:
+        self.post_message(UpdateLog(f"Download of `{url}` failed: {exception!r}"))
 
-            if error == "":
-                message = (
-                    f"{worker.description}: Download Complete `{asset['filename']}`"
-                )
-                if asset["content_name"] != "":
-                    message += f" (`{asset['content_name']}`)"
-                self.post_message(UpdateLog(message, flush=True))
-            else:
-                self.post_message(
-                    UpdateLog(
-                        f"{worker.description}: Download Failed ({error}): `{dl_task.url}`",
-                        flush=True,
-                    )
-                )
-
-            self.post_message(self.FileDownloadComplete(int(worker.name), asset))
-            self.dl_queue.task_done()
+    def action_cancel_download(self) -> None:
+        filename = self.get_current_row_key().value
+        if filename not in self.status or self.status[filename].download not in (
+            "Queued",
+            "Running",
+        ):
+            return
+        cancelled = self.dl_pool.cancel(filename)
+        self.post_message(
+            UpdateLog(f"Cancelled {len(cancelled)} downloads for `{filename}`.")
+        )
+        self.status[filename].download = ""
+        self.progress.pop(filename, None)
+        try:
+            self.query_one(DataTable).update_cell(
+                filename, "dl_status", "", update_width=True
+            )
+        except (CellDoesNotExist, KeyError):
+            pass
 
     def get_backup_name(self, mod):
         config = load_config()
@@ -914,12 +1059,13 @@ class ModListScreen(Screen):
 
         backup_filepath = Path(backup_path) / backup_basename
 
+        suffix = MANIFEST_SUFFIX if config.backup_store else ".zip"
         if mod["missing_assets"] > 0:
             zip_path = Path(
-                str(backup_filepath) + f" (-{mod['missing_assets']})" + ".zip"
+                str(backup_filepath) + f" (-{mod['missing_assets']})" + suffix
             )
         else:
-            zip_path = Path(str(backup_filepath) + ".zip")
+            zip_path = Path(str(backup_filepath) + suffix)
 
         mf = Path(mod["filename"]).name
         if mf in self.backup_filenames:
@@ -963,9 +1109,22 @@ class ModListScreen(Screen):
         self.status[filename].backup = "Running"
         self.update_backup_status(filename)
 
-    def set_backup_complete(self, filename):
+    def set_backup_progress(self, filename, done, total):
+        if filename not in self.status or self.status[filename].backup != "Running":
+            return
+        if total > 0:
+            self.backup_status[filename] = f"{min(done * 100 // total, 99)}%"
+        table = self.query_one(DataTable)
+        try:
+            table.update_cell(filename, "backup", self.backup_status[filename])
+        except (CellDoesNotExist, KeyError):
+            # This cell may be currently filtered, so ignore any errors
+            pass
+
+    def set_backup_complete(self, filename, failed=False):
         self.status[filename].backup = ""
-        self.backup_status[filename] = " ✓"
+        # A failed backup is left to be tried again
+        self.backup_status[filename] = " ✘" if failed else " ✓"
         self.update_backup_status(filename)
 
     def update_bgg(self, mod_filename, bgg_id):
@@ -981,12 +1140,18 @@ class ModListScreen(Screen):
         if row_key.value is not None:
             backup_name = Path(row_key.value).name
             if backup_name in self.backup_filenames:
+                backup_path = self.backup_filenames[backup_name]
+                if Path(backup_path).name.endswith(MANIFEST_SUFFIX):
+                    restore = restore_manifest
+                else:
+                    restore = unzip_backup
                 self.app.push_screen(
                     LoadingScreen(
-                        unzip_backup,
-                        self.backup_filenames[backup_name],
+                        restore,
+                        backup_path,
                         Path(self.mod_dir).parent,
                         backup_name,
+                        show_progress=True,
                     ),
                     callback=self.unzip_done,
                 )
@@ -1005,10 +1170,10 @@ class ModListScreen(Screen):
                 flush=True,
             )
         )
+        # Restored assets are already in the DB, so only the counts change
+        self.app.refresh_mods()
         self.app.push_screen(
-            InfoDialog(
-                f"Mod Backup ({self.backup_filenames[backup_name]}) unzipped.  Restart to scan for new assets."
-            )
+            InfoDialog(f"Mod Backup ({self.backup_filenames[backup_name]}) unzipped.")
         )
 
     def action_explore(self):
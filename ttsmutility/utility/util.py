@@ -109,24 +109,31 @@ class MyText(Text):
         return False
 
 
+FILE_TYPES = {
+    ".unity3d": b"\x55\x6e\x69\x74\x79\x46\x53",  # UnityFS
+    ".OGG": b"\x47\x67\x67\x53",
+    ".WAV": b"\x52\x49\x46\x46",  # RIFF
+    ".MP3": b"\x49\x44\x33",  # ID3
+    ".png": b"\x89\x50\x4E\x47",  # ?PNG
+    ".jpg": b"\xFF\xD8",  # ??
+    ".obj": b"\x23\x20",  # "# "
+    ".PDF": b"\x25\x50\x44\x46",  # %PDF
+}
+# Enough of the start of a file to recognise any of the FILE_TYPES
+FILE_TYPE_HEADER_LEN = 10
+
+
+def detect_file_type_from_header(f_data: bytes) -> str:
+    for ext, pattern in FILE_TYPES.items():
+        if pattern in f_data[0 : len(pattern)]:
+            return ext
+    else:
+        return ""
+
+
 def detect_file_type(filepath):
-    FILE_TYPES = {
-        ".unity3d": b"\x55\x6e\x69\x74\x79\x46\x53",  # UnityFS
-        ".OGG": b"\x47\x67\x67\x53",
-        ".WAV": b"\x52\x49\x46\x46",  # RIFF
-        ".MP3": b"\x49\x44\x33",  # ID3
-        ".png": b"\x89\x50\x4E\x47",  # ?PNG
-        ".jpg": b"\xFF\xD8",  # ??
-        ".obj": b"\x23\x20",  # "# "
-        ".PDF": b"\x25\x50\x44\x46",  # %PDF
-    }
     with open(filepath, "rb") as f:
-        f_data = f.read(10)
-        for ext, pattern in FILE_TYPES.items():
-            if pattern in f_data[0 : len(pattern)]:
-                return ext
-        else:
-            return ""
+        return detect_file_type_from_header(f.read(FILE_TYPE_HEADER_LEN))
 
 
 def sizeof_fmt(num, suffix="B"):
@@ -3,10 +3,20 @@ import datetime
 import io
 import os
 import os.path
+import shutil
+import threading
 import time
+import zlib
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
 from pathlib import Path, PurePosixPath
 from queue import Empty, Queue
-from zipfile import ZipFile
+from zipfile import ZIP_DEFLATED, ZIP_STORED, BadZipFile, ZipFile, ZipInfo
 
 from textual.app import ComposeResult
 from textual.message import Message
@@ -17,15 +27,378 @@ from ..data.config import load_config
 from ..parse.AssetList import AssetList
 from ..parse.ModList import ModList
 from ..utility.messages import UpdateLog
+from .backupstore import (
+    MANIFEST_SUFFIX,
+    BackupStore,
+    existing_mtimes,
+    make_manifest,
+    member_path,
+    record_restored,
+    store_files,
+    write_manifest,
+)
+
+# Bigger files are streamed into the zip rather than read ahead
+READ_AHEAD_MAX_FILE = 16 * 1024 * 1024
+# Most a mod can have read but not yet written
+READ_AHEAD_BYTES = 64 * 1024 * 1024
+READ_AHEAD_FILES = 256
+# Reduce number of messages to improve performance
+PROGRESS_STEP = 2 * 1024 * 1024
+# Reports written alongside the files, which aren't restored
+REPORTS = ("missing_assets.csv", "invalid_urls.csv", "content_names.csv")
+
+
+class CompressionPolicy:
+    """Chooses how each file is stored in a backup zip.
+
+    Images, audio, video and asset bundles are already compressed, so are
+    stored as they are.  Text formats are deflated.  Anything else is
+    deflated if a sample of it compresses, when `sniff` is set.
+    """
+
+    STORED = {
+        ".png",
+        ".jpg",
+        ".jpeg",
+        ".gif",
+        ".webp",
+        ".mp3",
+        ".ogg",
+        ".mp4",
+        ".webm",
+        ".unity3d",
+        ".zip",
+    }
+    DEFLATED = {".obj", ".json", ".pdf", ".txt", ".lua", ".xml", ".csv"}
+    SAMPLE_LEN = 64 * 1024
+    # Deflated samples bigger than this fraction aren't worth compressing
+    SNIFF_RATIO = 0.9
+
+    def __init__(self, level: int = 1, sniff: bool = True) -> None:
+        """
+        Args:
+            level: Deflate level, 0 stores every file.
+        """
+        self.level = level
+        self.sniff = sniff
+
+    def choose(self, arcname, sample: bytes = b"") -> tuple:
+        """Returns:
+        The compress_type and compresslevel for `ZipFile.writestr()`.
+        """
+        stored = (ZIP_STORED, None)
+        deflated = (ZIP_DEFLATED, self.level)
+        ext = os.path.splitext(arcname)[1].lower()
+        if self.level == 0 or ext in self.STORED:
+            return stored
+        if ext in self.DEFLATED or not self.sniff:
+            return deflated
+        sample = sample[: self.SAMPLE_LEN]
+        if len(sample) == 0:
+            return stored
+        if len(zlib.compress(sample, 1)) > self.SNIFF_RATIO * len(sample):
+            return stored
+        return deflated
+
+
+# Store everything, as ZipFile does by default
+STORE_ALL = CompressionPolicy(level=0)
+
+
+def read_file(filepath, arcname, policy: CompressionPolicy = STORE_ALL) -> tuple:
+    """The ZipInfo, contents and compression of a file, read ahead of it
+    being zipped."""
+    zinfo = ZipInfo.from_file(filepath, arcname)
+    with open(filepath, "rb") as f:
+        data = f.read()
+    return zinfo, data, *policy.choose(arcname, data)
+
+
+def write_files(
+    modzip: ZipFile,
+    files,
+    readers,
+    is_cancelled=lambda: False,
+    on_written=lambda filepath, size: None,
+    on_error=lambda filepath, error: None,
+    policy: CompressionPolicy = STORE_ALL,
+) -> bool:
+    """Write files into a zip in order, reading ahead on a thread pool so
+    the reads overlap with the zip writes.
+
+    Args:
+        files: (filepath, arcname, size) of each file.
+        readers: Executor the files are read on.
+        policy: Chooses whether each file is compressed.
+
+    Returns:
+        False if cancelled before every file was written.
+    """
+    files = iter(files)
+    pending = deque()
+    pending_bytes = 0
+    while True:
+        while pending_bytes < READ_AHEAD_BYTES and len(pending) < READ_AHEAD_FILES:
+            entry = next(files, None)
+            if entry is None:
+                break
+            filepath, arcname, size = entry
+            if size > READ_AHEAD_MAX_FILE:
+                future = None
+            else:
+                future = readers.submit(read_file, filepath, arcname, policy)
+                pending_bytes += size
+            pending.append((future, filepath, arcname, size))
+
+        if len(pending) == 0:
+            return True
+        if is_cancelled():
+            for future, *_ in pending:
+                if future is not None:
+                    future.cancel()
+            return False
+
+        future, filepath, arcname, size = pending.popleft()
+        try:
+            if future is None:
+                with open(filepath, "rb") as f:
+                    sample = f.read(policy.SAMPLE_LEN)
+                modzip.write(filepath, arcname, *policy.choose(arcname, sample))
+            else:
+                pending_bytes -= size
+                modzip.writestr(*future.result())
+        except OSError as error:
+            on_error(filepath, error)
+            continue
+        on_written(filepath, size)
+
+
+def member_size(info: ZipInfo) -> int:
+    """Bytes a member takes in a zip before the central directory, roughly,
+    as its local header's extra field may differ from the central one."""
+    data_descriptor = 16 if info.flag_bits & 0x08 else 0
+    return (
+        30
+        + len(info.filename.encode("utf-8"))
+        + len(info.extra)
+        + info.compress_size
+        + data_descriptor
+    )
+
+
+def same_time(date_time, other) -> bool:
+    # Zips keep times to 2 seconds
+    return date_time[:5] == other[:5] and date_time[5] // 2 == other[5] // 2
+
+
+def plan_update(zip_path, files, max_dead: float) -> tuple | None:
+    """Work out what an existing zip backup needs to bring it up to date.
+
+    A member is kept if it has the name, size and time of a file to be
+    written.  Dropped members are left in the zip as dead space.
+
+    Args:
+        files: (filepath, arcname, size) of each file, as `write_files()`.
+        max_dead: Most of the zip that can be dead space, from 0 to 1.
+
+    Returns:
+        The files still to write, the names of members to drop and the
+        bytes of files kept.  None if the zip should be rewritten instead,
+        as it must be when it can't be read.
+    """
+    try:
+        with ZipFile(zip_path) as modzip:
+            infos = {info.filename: info for info in modzip.infolist()}
+            start_dir = modzip.start_dir
+    except (BadZipFile, OSError):
+        return None
+    dead = start_dir - sum(member_size(info) for info in infos.values())
+
+    to_write = []
+    kept = {}
+    for filepath, arcname, size in files:
+        try:
+            zinfo = ZipInfo.from_file(filepath, arcname)
+        except OSError:
+            # Left for write_files() to report
+            to_write.append((filepath, arcname, size))
+            continue
+        info = infos.get(zinfo.filename)
+        if (
+            info is not None
+            and info.file_size == zinfo.file_size
+            and same_time(info.date_time, zinfo.date_time)
+        ):
+            kept[info.filename] = size
+        else:
+            to_write.append((filepath, arcname, size))
+
+    dropped = [name for name in infos if name not in kept]
+    dead += sum(member_size(infos[name]) for name in dropped)
+    total = start_dir + sum(size for _, _, size in to_write)
+    if total > 0 and dead / total > max_dead:
+        return None
+    return to_write, dropped, sum(kept.values())
+
+
+# Dropping members from a zip opened for appending relies on ZipFile
+# internals: its `filelist` and `NameToInfo`, and `_didModify` to have the
+# central directory written again on close.  They are only touched by
+# `_set_members()`.  Without them, zips are rewritten rather than updated.
+ZIP_INTERNALS = ("filelist", "NameToInfo", "_didModify")
+
+
+def _has_zip_internals() -> bool:
+    with ZipFile(io.BytesIO(), "w") as probe:
+        return all(hasattr(probe, name) for name in ZIP_INTERNALS)
+
+
+CAN_UPDATE_ZIPS = _has_zip_internals()
+
+
+def _set_members(modzip: ZipFile, infos: list) -> None:
+    """Make `infos` the members written to the central directory."""
+    modzip.filelist = infos
+    modzip.NameToInfo = {info.filename: info for info in infos}
+    modzip._didModify = True
+
+
+def drop_members(modzip: ZipFile, names) -> list:
+    """Take members out of a zip opened for appending.  Their data stays
+    where it is, but isn't in the central directory written on close.
+
+    Returns:
+        The ZipInfo of each member dropped, for `restore_members()`.
+    """
+    names = set(names)
+    dropped = [info for info in modzip.infolist() if info.filename in names]
+    _set_members(
+        modzip, [info for info in modzip.infolist() if info.filename not in names]
+    )
+    return dropped
+
+
+def restore_members(modzip: ZipFile, infos) -> None:
+    """Put back dropped members that weren't written again."""
+    present = set(modzip.namelist())
+    _set_members(
+        modzip,
+        modzip.infolist() + [info for info in infos if info.filename not in present],
+    )
+
+
+def write_zip(
+    zip_path,
+    files,
+    extras: dict,
+    readers,
+    is_cancelled=lambda: False,
+    on_written=lambda filepath, size: None,
+    on_error=lambda filepath, error: None,
+    policy: CompressionPolicy = STORE_ALL,
+    max_dead: float | None = None,
+) -> bool:
+    """Write a zip backup, updating an existing one when `max_dead` is set.
+
+    An update appends the files that are new or changed.  If too much of
+    the zip would be left as dead space it is rewritten instead.  A
+    cancelled update leaves the zip with every member it had, some of them
+    perhaps replaced, while a cancelled rewrite removes it.
+
+    Args:
+        files: (filepath, arcname, size) of each file, as `write_files()`.
+        extras: Contents of generated members, written every time.
+
+    Returns:
+        False if cancelled before every file was written.
+    """
+    plan = None
+    if max_dead is not None and CAN_UPDATE_ZIPS and Path(zip_path).exists():
+        plan = plan_update(zip_path, files, max_dead)
+
+    if plan is None:
+        with ZipFile(zip_path, "w") as modzip:
+            completed = write_files(
+                modzip, files, readers, is_cancelled, on_written, on_error, policy
+            )
+            for name, data in extras.items():
+                modzip.writestr(name, data, *policy.choose(name))
+        if not completed:
+            os.remove(zip_path)
+        return completed
+
+    to_write, dropped, kept_size = plan
+    on_written(None, kept_size)
+    changed = {Path(arcname).as_posix() for _, arcname, _ in to_write}
+    with ZipFile(zip_path, "a") as modzip:
+        dropped = drop_members(modzip, dropped)
+        completed = write_files(
+            modzip, to_write, readers, is_cancelled, on_written, on_error, policy
+        )
+        if completed:
+            for name, data in extras.items():
+                modzip.writestr(name, data, *policy.choose(name))
+            # Members of files that couldn't be read are kept
+            restore_members(
+                modzip, [info for info in dropped if info.filename in changed]
+            )
+        else:
+            restore_members(modzip, dropped)
+    return completed
+
+
+class BackupProgress:
+    """Bytes backed up, for each mod and for all the mods running at once."""
+
+    def __init__(self):
+        # filename -> [bytes done, bytes total]
+        self.mods = {}
+        self.done = 0
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def _snapshot(self, filename) -> tuple:
+        return (*self.mods[filename], self.done, self.total)
+
+    def start(self, filename, total) -> tuple:
+        """Returns:
+        (mod done, mod total, done, total) as in `advance()`.
+        """
+        with self._lock:
+            if len(self.mods) == 0:
+                self.done = 0
+                self.total = 0
+            self.mods[filename] = [0, total]
+            self.total += total
+            return self._snapshot(filename)
+
+    def advance(self, filename, amount) -> tuple:
+        with self._lock:
+            self.mods[filename][0] += amount
+            self.done += amount
+            return self._snapshot(filename)
+
+    def finish(self, filename) -> tuple:
+        """Stop counting a mod, leaving the total as what it really took."""
+        with self._lock:
+            done, total = self.mods[filename]
+            self.total += done - total
+            self.mods[filename][1] = done
+            snapshot = self._snapshot(filename)
+            del self.mods[filename]
+            return snapshot
 
 
 class ModBackup(Widget):
     class UpdateProgress(Message):
-        def __init__(self, filename, update_total=None, advance_amount=None):
+        def __init__(self, filename, mod_done, mod_total, done, total):
             super().__init__()
             self.filename = filename
-            self.update_total = update_total
-            self.advance_amount = advance_amount
+            self.mod_done = mod_done
+            self.mod_total = mod_total
+            self.done = done
+            self.total = total
 
     class BackupStart(Message):
         def __init__(self, filename, zip_path):
@@ -34,13 +407,15 @@ class ModBackup(Widget):
             self.zip_path = zip_path
 
     class BackupComplete(Message):
-        def __init__(self, filename):
+        def __init__(self, filename, failed: bool = False):
             super().__init__()
             self.filename = filename
+            self.failed = failed
 
     def __init__(self):
         super().__init__()
         self.mod_filenames = Queue()
+        self.progress = BackupProgress()
 
     # Base class is installed in each screen, so we don't want
     # to inherit the same widgets when this subclass is mounted
@@ -52,155 +427,292 @@ class ModBackup(Widget):
             self.mod_filenames.put(entry)
 
     def backup_daemon(self) -> None:
+        """Back up queued mods, `num_backup_threads` at a time.  Each mod is
+        zipped on its own thread, with the assets read on a shared pool."""
         worker = get_current_worker()
+        num_mods = max(1, int(load_config().num_backup_threads))
+        self.asset_list = AssetList()
+        self.mod_list = ModList()
+
+        running = {}
+        with ThreadPoolExecutor(num_mods) as backups, ThreadPoolExecutor(
+            2 * num_mods
+        ) as readers:
+            while not worker.is_cancelled:
+                for future in [f for f in running if f.done()]:
+                    mod_filename = running.pop(future)
+                    if future.exception() is not None:
+                        if mod_filename in self.progress.mods:
+                            self.progress.finish(mod_filename)
+                        self.post_message(
+                            UpdateLog(
+                                f"Backup of {mod_filename} failed: {future.exception()}"
+                            )
+                        )
+                        # So its row doesn't stay in progress
+                        self.post_message(self.BackupComplete(mod_filename, True))
+                    self.mod_filenames.task_done()
 
-        while True:
-            if worker.is_cancelled:
-                return
+                # Leave mods in the queue until they can start
+                if len(running) >= num_mods:
+                    wait(running, timeout=1, return_when=FIRST_COMPLETED)
+                    continue
 
-            try:
-                (
+                try:
+                    (
+                        mod_filename,
+                        zip_path,
+                        existing_backup,
+                    ) = self.mod_filenames.get(timeout=1)
+                except Empty:
+                    continue
+
+                future = backups.submit(
+                    self.backup_mod,
                     mod_filename,
                     zip_path,
                     existing_backup,
-                ) = self.mod_filenames.get(timeout=1)
-            except Empty:
-                continue
-
-            self.backup_mod(mod_filename, zip_path, existing_backup)
+                    readers,
+                    lambda: worker.is_cancelled,
+                )
+                running[future] = mod_filename
 
-    def backup_mod(self, mod_filename, zip_path, old_file):
+    def backup_mod(self, mod_filename, zip_path, old_file, readers, is_cancelled):
         config = load_config()
-        worker = get_current_worker()
-        asset_list = AssetList()
-        mod_list = ModList()
-        mod = mod_list.get_mod_details(mod_filename)
+        mod = self.mod_list.get_mod_details(mod_filename)
 
         self.post_message(
             UpdateLog(f"Starting backup of {mod_filename}: {mod['name']}.")
         )
-        self.post_message(self.UpdateProgress(mod_filename, mod["size"], None))
+        self.post_message(
+            self.UpdateProgress(
+                mod_filename, *self.progress.start(mod_filename, mod["size"])
+            )
+        )
 
-        assets = asset_list.get_mod_assets(mod_filename)
+        assets = self.asset_list.get_mod_assets(mod_filename)
 
-        if old_file != "":
+        to_store = Path(zip_path).name.endswith(MANIFEST_SUFFIX)
+        max_dead = int(config.backup_dead_space) / 100
+        update = (
+            not to_store
+            and max_dead > 0
+            and old_file != ""
+            and Path(old_file).suffix == ".zip"
+            and Path(old_file).exists()
+        )
+        if update:
+            old_stat = os.stat(old_file)
+            if Path(old_file) != Path(zip_path):
+                # Renamed as the number of missing assets changed
+                os.replace(old_file, zip_path)
+            self.post_message(UpdateLog(f"Updating old backup: '{old_file}'"))
+        elif old_file != "" and not to_store:
             self.post_message(UpdateLog(f"Removing old backup: '{old_file}"))
             os.remove(old_file)
 
         self.post_message(UpdateLog(f"Backing up to '{zip_path}'"))
         self.post_message(self.BackupStart(mod["filename"], zip_path))
 
-        cancelled = False
-        with ZipFile(zip_path, "w") as modzip:
-            # Store the json and png files
-            if "Workshop" in mod["filename"]:
-                mod_path = Path(config.tts_mods_dir) / mod["filename"]
-                path_in_zip = Path("Mods") / mod["filename"]
-            else:
-                mod_path = Path(config.tts_saves_dir) / mod["filename"]
-                path_in_zip = mod["filename"]
-            modzip.write(mod_path, path_in_zip)
-
-            mod_png_path = os.path.splitext(mod_path)[0] + ".png"
-            if Path(mod_png_path).exists():
-                modzip.write(
-                    mod_png_path,
-                    os.path.splitext(path_in_zip)[0] + ".png",
-                )
+        # Store the json and png files
+        if "Workshop" in mod["filename"]:
+            mod_path = Path(config.tts_mods_dir) / mod["filename"]
+            path_in_zip = Path("Mods") / mod["filename"]
+        else:
+            mod_path = Path(config.tts_saves_dir) / mod["filename"]
+            path_in_zip = Path(mod["filename"])
+        files = [(mod_path, path_in_zip, 0, None)]
 
-            amount_stored = 0
-            missing_csv = io.StringIO()
-            missing_writer = csv.writer(missing_csv, delimiter="\t")
-            invalid_urls_csv = io.StringIO()
-            invalid_writer = csv.writer(invalid_urls_csv, delimiter="\t")
-            content_names_csv = io.StringIO()
-            content_writer = csv.writer(content_names_csv, delimiter="\t")
-            for asset in assets:
-                if worker.is_cancelled:
-                    cancelled = True
-                    break
-                if asset["size"] > 0:
-                    # self.post_message(UpdateLog(f"Adding {asset['filename']}."))
-                    modzip.write(
+        mod_png_path = os.path.splitext(mod_path)[0] + ".png"
+        if Path(mod_png_path).exists():
+            files.append(
+                (mod_png_path, os.path.splitext(path_in_zip)[0] + ".png", 0, None)
+            )
+
+        rows = {"missing_assets": [], "invalid_urls": [], "content_names": []}
+        for asset in assets:
+            row = [f"{asset['url']}", f"{asset['trail']}", f"{asset['dl_status']}"]
+            if asset["size"] > 0:
+                files.append(
+                    (
                         Path(config.tts_mods_dir) / asset["filename"],
                         Path("Mods") / asset["filename"],
+                        asset["size"],
+                        # Lets the store skip reading files it already has
+                        (asset["sha1"], asset["sha1_size"], asset["sha1_mtime_ns"])
+                        if asset["sha1_mtime_ns"] > 0 and asset["sha1"]
+                        else None,
                     )
-                    amount_stored += asset["size"]
-                    # Reduce number of messages to improve performance
-                    if amount_stored > 2 * 1024 * 1024:
-                        self.post_message(
-                            self.UpdateProgress(mod_filename, None, amount_stored)
-                        )
-                        amount_stored = 0
-                    if asset["dl_status"] != "":
-                        invalid_writer.writerow(
-                            [
-                                f"{asset['url']}",
-                                f"{asset['trail']}",
-                                f"{asset['dl_status']}",
-                            ]
-                        )
-                else:
-                    missing_writer.writerow(
-                        [
-                            f"{asset['url']}",
-                            f"{asset['trail']}",
-                            f"{asset['dl_status']}",
-                        ]
-                    )
-                    invalid_writer.writerow(
-                        [
-                            f"{asset['url']}",
-                            f"{asset['trail']}",
-                            f"{asset['dl_status']}",
-                        ]
-                    )
-                if asset["content_name"] != "":
-                    content_writer.writerow(
-                        [
-                            f"{PurePosixPath(Path(asset['filename']))}",  # Use posix path formatting
-                            f"{asset['content_name']}",
-                            f"{asset['url']}",
-                        ]
+                )
+                if asset["dl_status"] != "":
+                    rows["invalid_urls"].append(row)
+            else:
+                rows["missing_assets"].append(row)
+                rows["invalid_urls"].append(row)
+            if asset["content_name"] != "":
+                rows["content_names"].append(
+                    [
+                        f"{PurePosixPath(Path(asset['filename']))}",  # Use posix path formatting
+                        f"{asset['content_name']}",
+                        f"{asset['url']}",
+                    ]
+                )
+
+        amount_stored = 0
+
+        def on_written(filepath, size, *args):
+            nonlocal amount_stored
+            amount_stored += size
+            if amount_stored > PROGRESS_STEP:
+                self.post_message(
+                    self.UpdateProgress(
+                        mod_filename,
+                        *self.progress.advance(mod_filename, amount_stored),
                     )
+                )
+                amount_stored = 0
 
-            if missing_csv.tell() > 0:
-                modzip.writestr("missing_assets.csv", missing_csv.getvalue())
-            if invalid_urls_csv.tell() > 0:
-                modzip.writestr("invalid_urls.csv", invalid_urls_csv.getvalue())
-            if content_names_csv.tell() > 0:
-                modzip.writestr("content_names.csv", content_names_csv.getvalue())
+        def on_error(filepath, error):
+            self.post_message(UpdateLog(f"Unable to back up `{filepath}`: {error}"))
 
-            missing_csv.close()
-            invalid_urls_csv.close()
-            content_names_csv.close()
+        if to_store:
+            store = BackupStore(Path(zip_path).parent)
+            entries = store_files(
+                store, files, readers, is_cancelled, on_written, on_error
+            )
+            completed = entries is not None
+            if completed:
+                write_manifest(zip_path, make_manifest(mod, entries, rows))
+                if old_file != "" and Path(old_file) != Path(zip_path):
+                    self.post_message(UpdateLog(f"Removing old backup: '{old_file}"))
+                    os.remove(old_file)
+        else:
+            extras = {}
+            for name, csv_rows in rows.items():
+                if len(csv_rows) > 0:
+                    csv_file = io.StringIO()
+                    csv.writer(csv_file, delimiter="\t").writerows(csv_rows)
+                    extras[name + ".csv"] = csv_file.getvalue()
+                    csv_file.close()
+            completed = write_zip(
+                zip_path,
+                [entry[:3] for entry in files],
+                extras,
+                readers,
+                is_cancelled,
+                on_written,
+                on_error,
+                CompressionPolicy(int(config.backup_compression_level)),
+                max_dead if update else None,
+            )
 
-            # Make sure we get progress bar to 100%
-            self.post_message(self.UpdateProgress(mod_filename, None, amount_stored))
-            amount_stored = 0
+        # Make sure we get progress bar to 100%
+        self.progress.advance(mod_filename, amount_stored)
+        self.post_message(
+            self.UpdateProgress(mod_filename, *self.progress.finish(mod_filename))
+        )
 
-        if cancelled:
-            self.post_message(UpdateLog("Backup cancelled."))
-            os.remove(zip_path)
+        if not completed:
+            self.post_message(UpdateLog(f"Backup of {mod_filename} cancelled."))
+            if update and Path(zip_path).exists():
+                # Still needs backing up
+                os.utime(zip_path, ns=(old_stat.st_atime_ns, old_stat.st_mtime_ns))
         else:
-            self.post_message(UpdateLog("Backup complete."))
+            self.post_message(UpdateLog(f"Backup of {mod_filename} complete."))
 
         self.post_message(self.BackupComplete(mod_filename))
-        self.mod_filenames.task_done()
 
 
-def unzip_backup(backup_path: Path, dest_path: Path, backup_name) -> None:
+def restore_zip(
+    backup_path: Path,
+    dest_path: Path,
+    num_threads: int = 4,
+    on_progress=None,
+) -> list:
+    """Extract the members of a zip backup that are newer than the files
+    they'd replace, in parallel.
+
+    Each thread reads through its own handle on the zip.  Members are
+    extracted to a temporary file and renamed into place with the time
+    they were backed up, so a file is never left half written.
+
+    Args:
+        on_progress: Called with the total bytes to restore, then with
+            each amount restored.
+
+    Returns:
+        Names of the members restored.
+    """
+    with ZipFile(backup_path) as zf:
+        infos = [
+            info
+            for info in zf.infolist()
+            if not info.is_dir() and info.filename not in REPORTS
+        ]
+    mtimes = existing_mtimes(dest_path, [info.filename for info in infos])
+    to_restore = []
+    for info in infos:
+        mtime = time.mktime(datetime.datetime(*info.date_time).timetuple())
+        if mtimes.get(info.filename, 0) >= mtime:
+            continue
+        filepath = member_path(dest_path, info.filename)
+        if filepath is not None:
+            to_restore.append((info, filepath, mtime))
+    if on_progress is not None:
+        on_progress(total=sum(info.file_size for info, _, _ in to_restore))
+
+    local = threading.local()
+    handles = []
+    handles_lock = threading.Lock()
+
+    def extract(info, filepath, mtime):
+        if not hasattr(local, "zf"):
+            local.zf = ZipFile(backup_path)
+            with handles_lock:
+                handles.append(local.zf)
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = filepath.with_name(filepath.name + ".tmp")
+        try:
+            with local.zf.open(info) as src, open(tmp_path, "wb") as dest:
+                shutil.copyfileobj(src, dest, 1024 * 1024)
+            os.utime(tmp_path, (time.time(), mtime))
+            os.replace(tmp_path, filepath)
+        except BaseException:
+            if tmp_path.exists():
+                os.remove(tmp_path)
+            raise
+        return info
+
+    restored = []
+    amount = 0
+    try:
+        with ThreadPoolExecutor(num_threads) as extractors:
+            futures = [extractors.submit(extract, *entry) for entry in to_restore]
+            for future in as_completed(futures):
+                info = future.result()
+                restored.append(info.filename)
+                amount += info.file_size
+                if on_progress is not None and amount > PROGRESS_STEP:
+                    on_progress(advance=amount)
+                    amount = 0
+    finally:
+        for zf in handles:
+            zf.close()
+    if on_progress is not None:
+        on_progress(advance=amount)
+    return restored
+
+
+def unzip_backup(
+    backup_path: Path, dest_path: Path, backup_name, on_progress=None
+) -> None:
+    """Restore a zip backup and record what it restored in the DB, so the
+    assets are found without a rescan."""
+    num_threads = 2 * max(1, int(load_config().num_backup_threads))
+    restored = restore_zip(backup_path, dest_path, num_threads, on_progress)
+    record_restored(dest_path, restored)
+
     with ZipFile(backup_path, "r") as zf:
-        infos = zf.infolist()
-        files_to_unzip = []
-        for info in infos:
-            filepath = dest_path / info.filename
-            if filepath.exists() and filepath.stat().st_mtime > time.mktime(
-                datetime.datetime(*info.date_time).timetuple()
-            ):
-                continue
-            files_to_unzip.append(info)
-        zf.extractall(dest_path, members=files_to_unzip)
         if "content_names.csv" in zf.namelist():
             urls = []
             content_names = []
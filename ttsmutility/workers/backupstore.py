@@ -0,0 +1,256 @@
+import datetime
+import hashlib
+import json
+import os
+import posixpath
+import shutil
+import tempfile
+import time
+from collections import deque
+from pathlib import Path, PurePosixPath
+
+from ..parse.AssetList import AssetList
+from ..parse.FileFinder import (
+    AUDIOPATH,
+    BUNDLEPATH,
+    IMGPATH,
+    OBJPATH,
+    PDFPATH,
+    TXTPATH,
+)
+from .sha1 import hash_file
+
+# A mod backed up to the store is a manifest next to the zip backups
+MANIFEST_SUFFIX = ".manifest.json"
+MANIFEST_VERSION = 1
+STORE_DIR = "store"
+# Most files a mod can have waiting to be stored
+PENDING_FILES = 256
+COPY_CHUNK = 1024 * 1024
+# Directories of Mods whose files are recorded in tts_assets
+ASSET_PATHS = {AUDIOPATH, BUNDLEPATH, IMGPATH, OBJPATH, PDFPATH, TXTPATH}
+
+
+class BackupStore:
+    """Backed up files kept once each, named by their SHA1, and shared by
+    every mod's manifest.
+
+    Blobs are written to a temporary file and renamed into place, so a
+    blob that exists is always complete.
+    """
+
+    def __init__(self, backup_dir) -> None:
+        self.blob_dir = Path(backup_dir) / STORE_DIR
+
+    def blob_path(self, sha1: str) -> Path:
+        return self.blob_dir / sha1[:2] / sha1
+
+    def has(self, sha1: str) -> bool:
+        return sha1 != "" and self.blob_path(sha1).exists()
+
+    def add_file(self, filepath, sha1: str = "") -> tuple:
+        """Copy a file into the store, unless its content is already there.
+
+        Args:
+            sha1: The file's SHA1 if it's known, it is hashed otherwise.
+
+        Returns:
+            The SHA1 of the file and whether a blob was written for it.
+        """
+        if sha1 == "":
+            sha1 = hash_file(filepath)
+        if self.has(sha1):
+            return sha1, False
+
+        # Hash what is copied, in case the file changed since it was hashed
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self.blob_dir)
+        try:
+            digest = hashlib.sha1()
+            with os.fdopen(fd, "wb") as out, open(filepath, "rb") as f:
+                while chunk := f.read(COPY_CHUNK):
+                    digest.update(chunk)
+                    out.write(chunk)
+            sha1 = digest.hexdigest().upper()
+            blob_path = self.blob_path(sha1)
+            blob_path.parent.mkdir(exist_ok=True)
+            os.replace(tmp_path, blob_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return sha1, True
+
+
+def store_files(
+    store: BackupStore,
+    files,
+    readers,
+    is_cancelled=lambda: False,
+    on_stored=lambda filepath, size, written: None,
+    on_error=lambda filepath, error: None,
+) -> list | None:
+    """Add files to the store on a thread pool.
+
+    Args:
+        files: (filepath, arcname, size, known) of each file.  `known` is
+            the (sha1, size, mtime_ns) the file had when last hashed, or
+            None.  A file that hasn't changed since isn't read if the store
+            has its SHA1.
+
+    Returns:
+        [arcname, sha1, size, mtime] of each file stored, in order, or
+        None if cancelled.
+    """
+
+    def add(filepath, known):
+        stat = os.stat(filepath)
+        sha1 = ""
+        if known is not None and tuple(known[1:]) == (stat.st_size, stat.st_mtime_ns):
+            sha1 = known[0]
+        sha1, written = store.add_file(filepath, sha1)
+        return sha1, stat.st_size, stat.st_mtime, written
+
+    files = iter(files)
+    pending = deque()
+    entries = []
+    while True:
+        while len(pending) < PENDING_FILES:
+            entry = next(files, None)
+            if entry is None:
+                break
+            filepath, arcname, size, known = entry
+            pending.append(
+                (readers.submit(add, filepath, known), filepath, arcname, size)
+            )
+
+        if len(pending) == 0:
+            return entries
+        if is_cancelled():
+            for future, *_ in pending:
+                future.cancel()
+            return None
+
+        future, filepath, arcname, size = pending.popleft()
+        try:
+            sha1, file_size, mtime, written = future.result()
+        except OSError as error:
+            on_error(filepath, error)
+            continue
+        entries.append([Path(arcname).as_posix(), sha1, file_size, mtime])
+        on_stored(filepath, size, written)
+
+
+def write_manifest(manifest_path, manifest: dict) -> None:
+    """Write a manifest in place of any earlier one, never leaving it partly
+    written."""
+    manifest_path = Path(manifest_path)
+    tmp_path = manifest_path.with_name(manifest_path.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, manifest_path)
+
+
+def read_manifest(manifest_path) -> dict:
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version", 0) > MANIFEST_VERSION:
+        raise ValueError(
+            f"{manifest_path} is a newer backup (version {manifest['version']})"
+        )
+    return manifest
+
+
+def member_path(dest_path: Path, arcname: str) -> Path | None:
+    """Where a backed up file is restored to, None if it would be outside
+    `dest_path`."""
+    parts = PurePosixPath(arcname).parts
+    if len(parts) == 0 or PurePosixPath(arcname).is_absolute() or ".." in parts:
+        return None
+    return Path(dest_path, *parts)
+
+
+def existing_mtimes(dest_path: Path, arcnames) -> dict:
+    """The mtimes of the files backed up files would be restored over,
+    listing each directory once rather than checking each file."""
+    mtimes = {}
+    for directory in {posixpath.dirname(arcname) for arcname in arcnames}:
+        try:
+            with os.scandir(Path(dest_path, directory)) as it:
+                for entry in it:
+                    if entry.is_file():
+                        mtimes[
+                            posixpath.join(directory, entry.name)
+                        ] = entry.stat().st_mtime
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+    return mtimes
+
+
+def record_restored(dest_path: Path, arcnames) -> None:
+    """Add restored assets to the DB, so they're found without a rescan."""
+    assets = []
+    for arcname in arcnames:
+        parts = PurePosixPath(arcname).parts
+        if len(parts) != 3 or parts[0] != "Mods" or parts[1] not in ASSET_PATHS:
+            continue
+        stat = os.stat(Path(dest_path, *parts))
+        stem, ext = os.path.splitext(parts[2])
+        assets.append((parts[1], stem, ext, stat.st_mtime, stat.st_size))
+    if len(assets) > 0:
+        AssetList().set_restored_assets(assets)
+
+
+def restore_manifest(
+    manifest_path: Path, dest_path: Path, backup_name, on_progress=None
+) -> str:
+    """Copy the files of a backup out of the store, as `unzip_backup` does
+    for a zip, skipping files that are as new as the backup.
+    """
+    manifest = read_manifest(manifest_path)
+    store = BackupStore(Path(manifest_path).parent)
+    mtimes = existing_mtimes(dest_path, [entry[0] for entry in manifest["files"]])
+    to_restore = [
+        entry for entry in manifest["files"] if mtimes.get(entry[0], 0) < entry[3]
+    ]
+    if on_progress is not None:
+        on_progress(total=sum(size for _, _, size, _ in to_restore))
+
+    restored = []
+    for arcname, sha1, size, mtime in to_restore:
+        filepath = member_path(dest_path, arcname)
+        if filepath is None:
+            continue
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = filepath.with_name(filepath.name + ".tmp")
+        shutil.copyfile(store.blob_path(sha1), tmp_path)
+        os.utime(tmp_path, (time.time(), mtime))
+        os.replace(tmp_path, filepath)
+        restored.append(arcname)
+        if on_progress is not None:
+            on_progress(advance=size)
+
+    record_restored(dest_path, restored)
+    if len(manifest["content_names"]) > 0:
+        _, content_names, urls = zip(*manifest["content_names"])
+        asset_list = AssetList()
+        asset_list.set_content_names(urls, content_names)
+    return backup_name
+
+
+def make_manifest(mod: dict, entries: list, rows: dict) -> dict:
+    """The manifest of a mod backed up to the store.
+
+    Args:
+        entries: Files stored, as returned by `store_files()`.
+        rows: The missing_assets, invalid_urls and content_names rows that
+            a zip backup keeps as csv files.
+    """
+    return {
+        "version": MANIFEST_VERSION,
+        "mod_filename": mod["filename"],
+        "name": mod["name"],
+        "backup_time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "files": entries,
+        **rows,
+    }
@@ -0,0 +1,172 @@
+import threading
+import time
+from dataclasses import dataclass
+
+# Rate of a window in which nothing is downloaded
+PAUSED = 0.0
+
+
+@dataclass
+class RateWindow:
+    """A time of day, in minutes after midnight, with its own rate limit.
+
+    A window ending before it starts runs past midnight.  A rate of None is
+    unlimited and PAUSED stops new downloads from starting.
+    """
+
+    start: int
+    end: int
+    rate: float | None
+
+    def contains(self, minute: int) -> bool:
+        if self.start <= self.end:
+            return self.start <= minute < self.end
+        return minute >= self.start or minute < self.end
+
+
+def parse_rate(rate: str) -> float | None:
+    """Parse a rate in KiB/s, returns bytes per second."""
+    rate = rate.strip().lower()
+    if rate == "paused":
+        return PAUSED
+    kib = float(rate)
+    if kib < 0:
+        raise ValueError(f"Negative rate: {rate}")
+    return None if kib == 0 else kib * 1024
+
+
+def parse_windows(spec: str) -> list:
+    """Parse windows like "09:00-17:00=256, 23:00-07:00=0, 17:00-23:00=paused".
+
+    Rates are in KiB/s, 0 is unlimited.
+
+    Raises:
+        ValueError: The spec can't be parsed.
+    """
+
+    def minutes(hhmm: str) -> int:
+        hours, mins = hhmm.strip().split(":")
+        if not (0 <= int(hours) <= 24 and 0 <= int(mins) < 60):
+            raise ValueError(f"Invalid time: {hhmm}")
+        return (int(hours) * 60 + int(mins)) % (24 * 60)
+
+    windows = []
+    for window in spec.split(","):
+        if window.strip() == "":
+            continue
+        times, _, rate = window.partition("=")
+        start, _, end = times.partition("-")
+        windows.append(RateWindow(minutes(start), minutes(end), parse_rate(rate)))
+    return windows
+
+
+class BandwidthLimiter:
+    """A token bucket shared by every download.
+
+    Downloads call `consume()` with each chunk they receive, which blocks
+    until the bucket can pay for it.  Chunks are paid for in the order they
+    arrive, so a worker never waits behind more than one chunk from each of
+    the others.  Keep chunks to `chunk_size()` so that wait stays short.
+
+    While paused, new downloads aren't started, see `paused_delay()`, but
+    those already running aren't held up, so they don't sit on idle
+    connections until the host drops them.
+    """
+
+    def __init__(
+        self,
+        rate: float | None = None,
+        windows: list = (),
+        burst: float = 0.25,
+    ) -> None:
+        """
+        Args:
+            rate: Bytes per second outside of the windows, None for unlimited.
+            windows: RateWindows that override the rate at times of day.
+            burst: Seconds of unused bandwidth that can be saved up.
+        """
+        self.default_rate = rate
+        self.windows = list(windows)
+        self.burst = burst
+        self.tokens = 0.0
+        self.last = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def rate(self, now: float | None = None) -> float | None:
+        """Bytes per second allowed at wall clock time `now`."""
+        if len(self.windows) == 0:
+            return self.default_rate
+        if now is None:
+            now = time.time()
+        local = time.localtime(now)
+        minute = local.tm_hour * 60 + local.tm_min
+        for window in self.windows:
+            if window.contains(minute):
+                return window.rate
+        return self.default_rate
+
+    def paused_delay(self, now: float | None = None) -> float:
+        """Seconds until downloads may be started again, 0 if they aren't
+        paused.  Windows are whole minutes, so a pause is checked again at
+        the start of the next minute."""
+        if now is None:
+            now = time.time()
+        if self.rate(now) != PAUSED:
+            return 0.0
+        return 60 - now % 60
+
+    def chunk_size(self, chunk_size: int) -> int:
+        """How much to read at a time, a tenth of a second at the current rate."""
+        rate = self.rate()
+        if rate is None or rate == PAUSED:
+            return chunk_size
+        return max(4096, min(chunk_size, int(rate / 10)))
+
+    def reserve(self, amount: int, now: float, wall: float | None = None) -> float:
+        """Take `amount` bytes from the bucket.
+
+        Returns:
+            Seconds to wait before the bytes may be used, or -1 if downloads
+            are paused and nothing was reserved.  Nothing is reserved while
+            paused, the dispatcher holds back new downloads instead.
+        """
+        rate = self.rate(wall)
+        with self._lock:
+            if rate is None:
+                self.last = None
+                return 0.0
+            if rate == PAUSED:
+                self.last = None
+                return -1
+            if self.last is None:
+                self.tokens = 0.0
+            else:
+                self.tokens = min(
+                    self.burst * rate, self.tokens + (now - self.last) * rate
+                )
+            self.last = now
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / rate
+
+    def consume(self, amount: int) -> None:
+        """Block until `amount` bytes fit within the limit."""
+        if self._closed:
+            return
+        delay = self.reserve(amount, time.monotonic())
+        if delay > 0:
+            time.sleep(delay)
+
+    def status(self) -> str:
+        rate = self.rate()
+        if rate is None:
+            return ""
+        if rate == PAUSED:
+            return "paused"
+        return f"limit {rate / 1024:.0f} KiB/s"
+
+    def close(self) -> None:
+        """Stop blocking downloads, for shutdown."""
+        self._closed = True
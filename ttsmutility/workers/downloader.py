@@ -1,18 +1,28 @@
+import asyncio
+import contextvars
+import hashlib
 import http.client
-import ssl
 import os
+import shutil
 import socket
-import urllib.error
+import time
 import urllib.parse
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
 from contextlib import suppress
+from functools import partial
 from pathlib import Path
 
+import requests
+import urllib3
+
 from textual.app import ComposeResult
-from textual.message import Message
 from textual.widget import Widget
 
 from ..data.config import load_config
+from ..parse.DownloadJournal import DownloadJournal
+from ..parse.HostCapabilities import HostCapabilities
 from ..parse.FileFinder import (
     ALL_VALID_EXTS,
     UPPER_EXTS,
@@ -27,18 +37,44 @@ from ..parse.FileFinder import (
     is_pdf,
 )
 from ..utility.advertising import USER_AGENT
-from ..utility.messages import UpdateLog
-from ..utility.util import get_steam_sha1_from_url, get_content_name, detect_file_type
+from ..utility.util import (
+    FILE_TYPE_HEADER_LEN,
+    detect_file_type_from_header,
+    get_content_name,
+    get_steam_sha1_from_url,
+)
+from .bandwidth import BandwidthLimiter
+from .hosts import OK, THROTTLED, TIMEOUT, HostLimits
+from .resolver import AssetResolver
+from .retry import TRANSIENT, RetryPolicy, classify
+from .scheduler import DownloadJob, DownloadScheduler, url_host
+
+
+def make_download_session(max_per_host: int) -> requests.Session:
+    """Session whose connections are kept alive and shared between downloads.
+
+    Args:
+        max_per_host: Number of idle connections kept open to each host.
+    """
+    # We ignore SSL errors, so don't warn about it on every request
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    session = requests.Session()
+    session.verify = False
+    # Look up proxy settings once rather than scanning the environment (and
+    # reading .netrc) on every request
+    session.trust_env = False
+    session.proxies = urllib.request.getproxies()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=32, pool_maxsize=max_per_host, max_retries=0
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
 
 class FileDownload(Widget):
-    class FileDownloadProgress(Message):
-        def __init__(self, url, worker_num, filesize=None, bytes_complete=0) -> None:
-            super().__init__()
-            self.worker_num = worker_num
-            self.url = url
-            self.filesize = filesize
-            self.bytes_complete = bytes_complete
+    # Responses that mean the host wants us to slow down
+    THROTTLE_STATUS = (429, 503)
 
     DEFAULT_EXT = {
         "text/plain": ".obj",
@@ -103,37 +139,65 @@ class FileDownload(Widget):
     def __init__(
         self,
         timeout: int = 10,
-        timeout_retries: int = 10,
+        retry_policy: RetryPolicy | None = None,
         user_agent: str = USER_AGENT,
         status_id: int = 0,
         ignore_content_type: bool = False,
         chunk_size: int = 1024 * 1024,
+        session: requests.Session | None = None,
+        bandwidth: BandwidthLimiter | None = None,
+        resolver: AssetResolver | None = None,
+        capabilities: HostCapabilities | None = None,
     ):
         super().__init__()
+        if session is None:
+            session = make_download_session(1)
+        self.session = session
         self.timeout = timeout
-        self.timeout_retries = timeout_retries
+        if retry_policy is None:
+            retry_policy = RetryPolicy()
+        self.retry_policy = retry_policy
         self.user_agent = user_agent
         self.status_id = status_id
         self.ignore_content_type = ignore_content_type
         self.chunk_size = chunk_size
+        self.bandwidth = bandwidth
+        self.resolver = resolver
+        self.capabilities = capabilities
 
         config = load_config()
         self.mod_dir = config.tts_mods_dir
 
+        # Sampled by DownloadProgress, so the download never waits on the UI
+        self.active = False
+        self.url = ""
+        self.bytes_complete = 0
+        self.content_length = 0
+        # Bytes received over every download, to work out the rate
+        self.bytes_received = 0
+        # (message, prefix) for the log
+        self.log_lines = deque()
+
     def compose(self) -> ComposeResult:
         return []
 
+    def _log(self, message: str, prefix: str | None = None) -> None:
+        self.log_lines.append((message, prefix))
+
     def make_asset(self):
         asset = {
             "url": self.url,
             "filename": self.filename,
             "mtime": self.mtime,
             "size": self.filesize,
-            "sha1": "",
+            "sha1": self.sha1,
+            "sha1_mtime": self.mtime if self.sha1 != "" else 0,
             "steam_sha1": self.steam_sha1,
             "dl_status": self.error,
             "content_name": self.content_name,
             "ignore_missing": False,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
         }
         return asset
 
@@ -218,31 +282,159 @@ class FileDownload(Widget):
         self.content_name = ""
         self.filesize = 0
         self.steam_sha1 = ""
+        # Computed as the file is written, so it needn't be read again
+        self.sha1 = ""
         self.error = ""
         self.mtime = 0
         self.worker_num = worker_num
+        # How the host behaved, for the download scheduler
+        self.status_code = 0
+        self.retry_after = 0.0
+        self.timeouts = 0
+        # How far we got, so the download can be resumed
+        self.accept_ranges = False
+        self.bytes_complete = 0
+        self.content_length = 0
+        # Validators, so a freshness check can tell if the asset changed
+        self.etag = ""
+        self.last_modified = ""
+        # How long it took, including retries
+        self.duration = 0.0
+
+        start = time.monotonic()
+        self.active = True
+        try:
+            return self._download_with_retries()
+        finally:
+            self.duration = time.monotonic() - start
+            self.active = False
 
+    def _backoff(self, attempt: int) -> None:
+        delay = self.retry_policy.delay(attempt)
+        self._log(f"Retrying in {delay:.1f}s")
+        time.sleep(delay)
+
+    def _download_with_retries(self):
         self._prep_url_for_download()
         if self.error != "":
             return self.error, self.make_asset()
 
+        self._log("---", prefix="")
+        self._log(f"Downloading: `{self.url}`")
+        if self.resolver is not None:
+            if self._copy_local_match():
+                return "", self.make_asset()
+            mirrors = self.resolver.mirrors_for(self.fetch_url)
+        else:
+            mirrors = []
+
+        if any(self._try_mirror(mirror) for mirror in mirrors):
+            error = None
+        else:
+            error = self._fetch_with_retries()
+
+        if error is None:
+            filepath = os.path.join(self.mod_dir, str(self.filename))
+            self.filesize = self.bytes_complete
+            self.mtime = os.path.getmtime(filepath)
+            self._log(f"Download Success: `{self.filename}`")
+            self.error = ""
+            return "", self.make_asset()
+        return error, self.make_asset()
+
+    def _copy_local_match(self) -> bool:
+        """Copy a file with the same content from disk, rather than download it."""
+        if self.filename is None:
+            # The extension comes from the response
+            return False
+        match = self.resolver.find_local(self.url)
+        if match is None:
+            return False
+        src, sha1, content_name = match
+
+        filename = Path(self.filename).with_suffix(src.suffix)
+        filepath = Path(self.mod_dir) / filename
+        temp_path = filepath.with_suffix(".tmp")
+        try:
+            shutil.copyfile(src, temp_path)
+            os.replace(temp_path, filepath)
+        except OSError as error:
+            self._log(f"Copying local match `{src}` failed: {error}")
+            with suppress(FileNotFoundError):
+                os.remove(temp_path)
+            return False
+
+        stat = filepath.stat()
+        self.filename = filename
+        self.filesize = stat.st_size
+        self.bytes_complete = stat.st_size
+        self.mtime = stat.st_mtime
+        self.sha1 = sha1
+        self.steam_sha1 = get_steam_sha1_from_url(self.url)
+        if self.content_name == "":
+            self.content_name = content_name
+        self._log(f"Copied local match: `{src}`")
+        return True
+
+    def _try_mirror(self, mirror: str) -> bool:
+        """Make a single attempt to download from a mirror."""
+        fetch_url = self.fetch_url
+        self.fetch_url = mirror
+        self._log(f"Trying mirror: `{mirror}`")
+        try:
+            error = self._download_file()
+        except (
+            socket.timeout,
+            http.client.IncompleteRead,
+            requests.exceptions.RequestException,
+        ) as exception:
+            error = str(exception)
+        self.fetch_url = fetch_url
+        if error is None:
+            return True
+
+        self._log(f"Mirror failed ({error})")
+        # The url itself is tried next, the host limits and partial download
+        # shouldn't come from somewhere else
+        self.status_code = 0
+        self.retry_after = 0.0
+        if self.filename is not None:
+            with suppress(FileNotFoundError):
+                os.remove(Path(self.mod_dir) / Path(self.filename).with_suffix(".tmp"))
+        return False
+
+    def _fetch_with_retries(self) -> str | None:
+        """Download from fetch_url, returns the error or None once downloaded."""
         first_error = ""
-        for i in range(self.timeout_retries):
-            if i == 0:
-                self.post_message(UpdateLog("---", prefix=""))
-                self.post_message(UpdateLog(f"Downloading: `{self.url}`"))
-            else:
-                self.post_message(UpdateLog(f"Retry #{i}"))
+        for i in range(self.retry_policy.max_retries + 1):
+            if i > 0:
+                self._log(f"Retry #{i}")
             try:
                 error = self._download_file()
             except socket.timeout:
+                self.timeouts += 1
+                self._backoff(i)
                 continue
             except http.client.IncompleteRead:
+                self._backoff(i)
+                continue
+            except requests.exceptions.RequestException as error:
+                # Timed out or connection dropped while reading the response.
+                # Read timeouts in the body arrive wrapped in a ConnectionError.
+                if isinstance(error, requests.exceptions.Timeout) or isinstance(
+                    error.__context__, urllib3.exceptions.ReadTimeoutError
+                ):
+                    self.timeouts += 1
+                self._backoff(i)
                 continue
             if error is not None:
                 if first_error == "":
                     first_error = error
 
+                if self.status_code in self.THROTTLE_STATUS:
+                    # Retrying now would only make it worse
+                    break
+
                 # See if we have some trailing URL options and retry if so
                 offset = self.fetch_url.rfind("?")
                 if offset > 0:
@@ -252,25 +444,24 @@ class FileDownload(Widget):
                 if "mismatch" in error:
                     # Try again...
                     continue
+
+                if classify(error) == TRANSIENT and i < self.retry_policy.max_retries:
+                    # Server errors, refused connections...
+                    self._backoff(i)
+                    continue
             break
         else:
-            return "Retries exhausted", self.make_asset()
+            return "Retries exhausted"
 
         if error is None:
-            filepath = os.path.join(self.mod_dir, str(self.filename))
-            self.filesize = os.path.getsize(filepath)
-            self.mtime = os.path.getmtime(filepath)
-            self.post_message(UpdateLog(f"Download Success: `{self.filename}`"))
-            self.error = ""
-            return "", self.make_asset()
-        else:
-            # We retried with a different URL, but use the first error
-            if first_error != "":
-                self.error = first_error
-            return self.error, self.make_asset()
+            return None
+        # We retried with a different URL, but use the first error
+        self.error = first_error
+        return self.error
 
     def _download_file(self):
-        headers = {"User-Agent": self.user_agent}
+        # Same as urllib, otherwise Content-Length is the compressed size
+        headers = {"User-Agent": self.user_agent, "Accept-Encoding": "identity"}
 
         if "pastebin.com" in self.fetch_url:
             # Pastebin will provide us the original filename if we use the dl link.
@@ -286,37 +477,108 @@ class FileDownload(Widget):
                 headers["Referer"] = f"http://pastebin.com/{pastebin_ref}"
                 self.fetch_url = f"http://pastebin.com/dl/{pastebin_ref}"
 
+        host = url_host(self.fetch_url)
+        timeout = self.timeout
+        if self.capabilities is not None:
+            timeout = self.capabilities.timeout(host, timeout)
+
+        # Partial downloads are only kept when the host supports ranges
         if (
             self.filename is not None
-            and (existing_file := Path(self.filename).with_suffix(".tmp")).exists()
+            and (
+                existing_file := Path(self.mod_dir)
+                / Path(self.filename).with_suffix(".tmp")
+            ).exists()
         ):
-            headers["Range"] = f"bytes={existing_file.stat().st_size}-"
+            if (
+                self.capabilities is not None
+                and self.capabilities.get(host).ranges is False
+            ):
+                # The whole file would be sent again anyway
+                os.remove(existing_file)
+                existing_file = None
+            else:
+                headers["Range"] = f"bytes={existing_file.stat().st_size}-"
         else:
             existing_file = None
 
-        request = urllib.request.Request(url=self.fetch_url, headers=headers)
-
         try:
-            # Ignore SSL errors with this context setting
-            response = urllib.request.urlopen(
-                request, timeout=self.timeout, context=ssl.SSLContext()
+            response = self.session.get(
+                self.fetch_url, headers=headers, timeout=timeout, stream=True
             )
 
-        except urllib.error.HTTPError as error:
-            return f"HTTPError {error.code} ({error.reason})"
+        except requests.exceptions.ConnectionError as error:
+            if isinstance(error, requests.exceptions.ConnectTimeout):
+                self.timeouts += 1
+            # Unwrap urllib3's MaxRetryError to get at the underlying failure
+            reason = getattr(error.args[0], "reason", error.args[0])
+            return f"URLError ({reason})"
 
-        except urllib.error.URLError as error:
-            return f"URLError ({error.reason})"
+        except requests.exceptions.InvalidURL as error:
+            return f"URLError ({error})"
 
-        except http.client.HTTPException as error:
+        except (
+            requests.exceptions.InvalidHeader,
+            requests.exceptions.TooManyRedirects,
+        ) as error:
             return f"HTTPException ({error})"
 
+        if self.capabilities is not None:
+            self.capabilities.record_response(host, response, existing_file is not None)
+
+        # Closing the response returns the connection to the pool
+        with response:
+            return self._save_response(response, existing_file)
+
+    def _read_size(self) -> int:
+        if self.bandwidth is None:
+            return self.chunk_size
+        return self.bandwidth.chunk_size(self.chunk_size)
+
+    def _read_into(self, response, buffer: memoryview) -> int:
+        """Read the next part of the body into `buffer`, returns the size read.
+
+        The same errors are raised as `iter_content()` would, so download()
+        treats them the same way.
+        """
         try:
-            if os.path.basename(response.url) == "removed.png":
-                # Imgur sends bogus png when files are missing, ignore them
-                return "Removed"
-        except UnboundLocalError:
-            pass
+            return response.raw.readinto(buffer)
+        except urllib3.exceptions.ProtocolError as error:
+            raise requests.exceptions.ChunkedEncodingError(error)
+        except urllib3.exceptions.DecodeError as error:
+            raise requests.exceptions.ContentDecodingError(error)
+        except urllib3.exceptions.ReadTimeoutError as error:
+            raise requests.exceptions.ConnectionError(error)
+        except urllib3.exceptions.SSLError as error:
+            raise requests.exceptions.SSLError(error)
+
+    def _save_response(self, response, existing_file):
+        self.status_code = response.status_code
+        if response.status_code in self.THROTTLE_STATUS:
+            try:
+                self.retry_after = float(response.headers.get("Retry-After", 0))
+            except ValueError:
+                # Could be an HTTP date, just use our own backoff
+                self.retry_after = 0.0
+
+        if response.status_code == 416 and existing_file is not None:
+            # The file has changed since our partial download
+            os.remove(existing_file)
+            return "Partial download size mismatch"
+
+        if response.status_code >= 400:
+            return f"HTTPError {response.status_code} ({response.reason})"
+
+        if response.status_code == 206 and existing_file is not None:
+            resume_from = existing_file.stat().st_size
+        else:
+            # The host ignored our range request, start from scratch
+            existing_file = None
+            resume_from = 0
+
+        if os.path.basename(response.url) == "removed.png":
+            # Imgur sends bogus png when files are missing, ignore them
+            return "Removed"
 
         # Possible ways to determine the file extension.
         # Use them in this order...
@@ -333,10 +595,15 @@ class FileDownload(Widget):
         if self.filename is not None:
             extensions["filename"] = os.path.splitext(self.filename)[1]
 
-        range_support = response.getheader("Accept-Ranges")
+        self.accept_ranges = (
+            response.headers.get("Accept-Ranges") == "bytes"
+            or response.status_code == 206
+        )
+        self.etag = response.headers.get("ETag", "")
+        self.last_modified = response.headers.get("Last-Modified", "")
         # Some content_type arrives as: 'text/plain; charset=utf-8', we only care about
         # the first part...
-        content_type = response.getheader("Content-Type", "").split(";")[0].strip()
+        content_type = response.headers.get("Content-Type", "").split(";")[0].strip()
         is_expected = not content_type or self.content_expected(
             content_type, self.tts_type
         )
@@ -350,9 +617,7 @@ class FileDownload(Widget):
             extensions["mime"] = self.DEFAULT_EXT[content_type]
 
         # Format of content disposition looks like this:
-        content_disposition = response.getheader("Content-Disposition", "").strip()
-        if content_disposition == "":
-            content_disposition = response.getheader("content-disposition", "").strip()
+        content_disposition = response.headers.get("Content-Disposition", "").strip()
         self.content_name = get_content_name(self.url, content_disposition)
 
         if self.content_name != "":
@@ -393,14 +658,13 @@ class FileDownload(Widget):
         asset_dir = os.path.split(os.path.split(filepath)[0])[1]
         # self.post_message(UpdateLog(f"Asset dir: `{asset_dir}`"))
 
-        length = int(response.getheader("Content-Length", 0))
-        # Reduce message traffic for small file sizes
-        if length > self.chunk_size:
-            self.post_message(
-                self.FileDownloadProgress(
-                    self.url, self.worker_num, filesize=length, bytes_complete=0
-                )
-            )
+        # For a resumed download, Content-Length is what is left to download.
+        # A length that isn't a number is as good as none.
+        length = response.headers.get("Content-Length", "")
+        length = int(length) if length.isdecimal() else 0
+        if length != 0:
+            length += resume_from
+        self.content_length = length
         # self.post_message(UpdateLog(f"URL Filesize: `{length}`"))
 
         temp_path = filepath.with_suffix(".tmp")
@@ -409,29 +673,40 @@ class FileDownload(Widget):
         if existing_file is None and temp_path.exists():
             os.remove(temp_path)
 
-        # This will actually go negative since we already assume
-        # that we will read the chunk_size.
-        bytes_read = 0
+        # The SHA1 and file type are worked out as the file is written,
+        # starting with whatever a resumed download already has
+        sha1 = hashlib.sha1()
+        header = b""
+        if resume_from > 0:
+            with open(temp_path, "rb") as infile:
+                header = infile.read(FILE_TYPE_HEADER_LEN)
+                infile.seek(0)
+                sha1 = hashlib.file_digest(infile, "sha1")
+
+        # Undo any Content-Encoding the host used despite being asked not to
+        response.raw.decode_content = True
+        buffer = bytearray(self.chunk_size)
+        view = memoryview(buffer)
+
+        self.bytes_complete = resume_from
         try:
             with open(temp_path, "ab") as outfile:
-                data = response.read(self.chunk_size)
-                bytes_read += self.chunk_size
-                while data:
-                    if bytes_read > length:
-                        bytes_read = length
-                    # Reduce message traffic for small file sizes
-                    if length > self.chunk_size:
-                        self.post_message(
-                            self.FileDownloadProgress(
-                                self.url,
-                                self.worker_num,
-                                filesize=length,
-                                bytes_complete=bytes_read,
-                            )
-                        )
+                while (
+                    size := self._read_into(response, view[: self._read_size()])
+                ) > 0:
+                    if self.bandwidth is not None:
+                        self.bandwidth.consume(size)
+                    data = view[:size]
                     outfile.write(data)
-                    data = response.read(self.chunk_size)
-                    bytes_read += self.chunk_size
+                    sha1.update(data)
+                    if len(header) < FILE_TYPE_HEADER_LEN:
+                        header += data[: FILE_TYPE_HEADER_LEN - len(header)]
+                    self.bytes_complete += size
+                    self.bytes_received += size
+
+        except requests.exceptions.RequestException:
+            # These are OSErrors too, let download() retry them
+            raise
 
         except FileNotFoundError as error:
             return f"Error writing object to disk: {error}"
@@ -448,18 +723,18 @@ class FileDownload(Widget):
                 os.remove(temp_path)
             raise
 
-        if length != 0 and os.path.getsize(temp_path) != length:
+        if length != 0 and self.bytes_complete != length:
             msg = (
-                f"Filesize mismatch. Received {os.path.getsize(temp_path)}. "
+                f"Filesize mismatch. Received {self.bytes_complete}. "
                 f"Expected {length}."
             )
             # Check if the server supports resuming downloads,
             # if not remove the temp file
-            if range_support is None or range_support != "bytes":
+            if not self.accept_ranges:
                 os.remove(temp_path)
             return msg
 
-        file_ext = detect_file_type(temp_path)
+        file_ext = detect_file_type_from_header(header)
         if file_ext != "":
             filepath = filepath.with_suffix(file_ext)
             self.filename = self.filename.with_suffix(file_ext)
@@ -470,5 +745,231 @@ class FileDownload(Widget):
             os.remove(filepath)
 
         os.rename(temp_path, filepath)
+        self.sha1 = sha1.hexdigest().upper()
 
         return None
+
+
+class DownloadPool:
+    """Runs FileDownloads concurrently from the asyncio event loop.
+
+    Each FileDownload is a download slot, limiting the number of downloads in
+    progress.  Downloads wait in a DownloadScheduler and are started, round
+    robin between hosts, when both a slot and the host's HostLimiter allow
+    it.  All slots share keep-alive connections through a single session.
+    """
+
+    # Times a throttled download is put back in the queue before giving up
+    MAX_THROTTLED = 5
+
+    def __init__(
+        self,
+        num_downloads: int,
+        max_per_host: int,
+        on_done=None,
+        journal: DownloadJournal | None = None,
+        bandwidth: BandwidthLimiter | None = None,
+        resolver: AssetResolver | None = None,
+        capabilities: HostCapabilities | None = None,
+        on_error=None,
+    ) -> None:
+        """Create the download slots, they start when downloads are added.
+
+        Args:
+            num_downloads: Number of downloads in progress at once.
+            max_per_host: Limit for hosts without a known policy.
+            on_done: Called with (worker_num, error, asset, remaining) when a
+                download completes, remaining is the number of downloads left
+                for each mod waiting on it.
+            journal: Records the queue so it can be resumed after a restart.
+            bandwidth: Limits the rate of all the downloads together.
+            resolver: Finds local copies and mirrors to try first.
+            capabilities: Learns what each host supports from the downloads.
+            on_error: Called with (url, exception) when a download raises
+                rather than returning an error.
+        """
+        # Some hosts may use every slot, keep a connection alive for each
+        self.session = make_download_session(num_downloads)
+        self.fds = [
+            FileDownload(
+                session=self.session,
+                bandwidth=bandwidth,
+                resolver=resolver,
+                capabilities=capabilities,
+            )
+            for _ in range(num_downloads)
+        ]
+        self.bandwidth = bandwidth
+        self.capabilities = capabilities
+        self.hosts = HostLimits(max_per_host)
+        self.scheduler = DownloadScheduler()
+        self.on_done = on_done
+        self.on_error = on_error
+        self.journal = journal
+        # Downloads block on socket reads, so they run on our own threads
+        self.executor = ThreadPoolExecutor(
+            max_workers=num_downloads, thread_name_prefix="ttsmutility_dl"
+        )
+        self.idle = list(range(num_downloads))
+        self.waiters = {}
+        # Running downloads, so they aren't garbage collected part way
+        self.tasks = set()
+        self.wakeup = None
+        self.dispatcher = None
+
+    def add(self, urls: list, trails: list, mod_filename: str = "") -> int:
+        """Queue downloads for a mod.
+
+        Returns:
+            Number of downloads the mod is now waiting on.
+        """
+        if self.dispatcher is None:
+            self.wakeup = asyncio.Event()
+            self.dispatcher = asyncio.create_task(self._dispatch())
+        remaining = self.scheduler.add(urls, trails, mod_filename)
+        if self.journal is not None:
+            self.journal.queue(urls, trails, mod_filename)
+        self.wakeup.set()
+        return remaining
+
+    def cancel(self, mod_filename: str) -> list:
+        if self.journal is not None:
+            self.journal.cancel(mod_filename)
+        return self.scheduler.cancel(mod_filename)
+
+    def focus(self, mod_filename: str) -> None:
+        self.scheduler.focus(mod_filename)
+
+    async def download(self, url: str, trail: list) -> tuple[int, str, dict]:
+        """Download a single asset once its host and a slot are free.
+
+        Returns:
+            The slot (worker) number used, the error and the asset.
+        """
+        result = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(url, []).append(result)
+        self.add([url], [trail])
+        return await result
+
+    def _start_ready(self) -> float | None:
+        """Start every download we can, returns how long until we can do more."""
+        if self.bandwidth is not None:
+            # Don't open connections that would only wait for the pause to end
+            paused = self.bandwidth.paused_delay()
+            if paused > 0:
+                return paused
+        now = time.monotonic()
+        next_delay = None
+        started = True
+        while started and len(self.idle) > 0:
+            started = False
+            for host in self.scheduler.hosts():
+                if len(self.idle) == 0:
+                    break
+                limiter = self.hosts[host]
+                delay = limiter.delay(now)
+                if delay is None:
+                    continue
+                if delay > 0:
+                    if next_delay is None or delay < next_delay:
+                        next_delay = delay
+                    continue
+                job = self.scheduler.pop(host)
+                if job is None:
+                    continue
+                limiter.start(now)
+                if self.journal is not None:
+                    self.journal.start(job.url)
+                worker_num = self.idle.pop()
+                task = asyncio.create_task(self._run(worker_num, job))
+                self.tasks.add(task)
+                task.add_done_callback(partial(self._run_done, job.url))
+                started = True
+        return next_delay
+
+    async def _dispatch(self) -> None:
+        while True:
+            self.wakeup.clear()
+            delay = self._start_ready()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _run_done(self, url: str, task: asyncio.Task) -> None:
+        self.tasks.discard(task)
+        if task.cancelled():
+            return
+        # Retrieved here, anyone waiting on the download has it already
+        exception = task.exception()
+        if exception is not None and self.on_error is not None:
+            self.on_error(url, exception)
+
+    async def _run(self, worker_num: int, job: DownloadJob) -> None:
+        fd = self.fds[worker_num]
+        limiter = self.hosts[job.host]
+        # Keep the context so messages posted by the download reach the app
+        func = partial(
+            contextvars.copy_context().run, fd.download, worker_num, job.url, job.trail
+        )
+        try:
+            error, asset = await asyncio.get_running_loop().run_in_executor(
+                self.executor, func
+            )
+        except BaseException as exception:
+            limiter.finish(OK)
+            self.scheduler.done(job.url)
+            for waiter in self.waiters.pop(job.url, []):
+                if not waiter.done():
+                    waiter.set_exception(exception)
+            raise
+        finally:
+            self.idle.append(worker_num)
+            self.wakeup.set()
+
+        requeue = False
+        if fd.status_code in fd.THROTTLE_STATUS:
+            limiter.finish(THROTTLED, fd.retry_after)
+            # Not the asset's fault, try again once the host has recovered
+            requeue = job.throttled < self.MAX_THROTTLED
+        elif fd.timeouts > 0:
+            limiter.finish(TIMEOUT)
+        else:
+            limiter.finish(OK)
+
+        if self.journal is not None:
+            self.journal.finish(
+                job.url,
+                error,
+                fd.bytes_complete,
+                fd.content_length,
+                fd.accept_ranges,
+                requeue=requeue,
+                duration=fd.duration,
+            )
+        if requeue:
+            job.throttled += 1
+            self.scheduler.requeue(job)
+            return
+
+        remaining = self.scheduler.done(job.url)
+        for waiter in self.waiters.pop(job.url, []):
+            if not waiter.done():
+                waiter.set_result((worker_num, error, asset))
+        if self.on_done is not None:
+            self.on_done(worker_num, error, asset, remaining)
+
+    def status(self) -> str:
+        return self.hosts.status()
+
+    def close(self) -> None:
+        if self.dispatcher is not None:
+            self.dispatcher.cancel()
+        if self.bandwidth is not None:
+            self.bandwidth.close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+        if self.journal is not None:
+            self.journal.close()
+        if self.capabilities is not None:
+            self.capabilities.flush()
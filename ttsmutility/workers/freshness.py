@@ -0,0 +1,183 @@
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from textual.app import ComposeResult
+from textual.message import Message
+from textual.worker import get_current_worker
+
+from ..data.config import load_config
+from ..parse.AssetList import AssetList
+from ..parse.FileFinder import trailstring_to_trail
+from ..utility.advertising import USER_AGENT
+from ..utility.messages import UpdateLog
+from .downloader import make_download_session
+from .hosts import SharedHostLimits
+from .scheduler import url_host
+from .TTSWorker import TTSWorker
+
+# Outcomes of a freshness check
+FRESH = "fresh"
+CHANGED = "changed"
+FAILED = "failed"
+
+
+def check_freshness(
+    session: requests.Session,
+    url: str,
+    size: int,
+    etag: str = "",
+    last_modified: str = "",
+    timeout: float = 10,
+) -> tuple[str, str, str, int]:
+    """Ask the host whether our copy of an asset is still current.
+
+    With validators from an earlier download a conditional GET is made, a
+    304 means the asset is unchanged and no body is sent.  Otherwise a HEAD
+    request compares Content-Length with the size of our copy.
+
+    Returns:
+        The outcome, the ETag and Last-Modified headers for next time and the
+        HTTP status code (0 if there was no response).
+    """
+    fetch_url = url.strip().replace(" ", "%20")
+    if not urllib.parse.urlparse(fetch_url).scheme:
+        fetch_url = "http://" + fetch_url
+
+    headers = {"User-Agent": USER_AGENT, "Accept-Encoding": "identity"}
+    if etag != "":
+        headers["If-None-Match"] = etag
+    if last_modified != "":
+        headers["If-Modified-Since"] = last_modified
+
+    try:
+        if "If-None-Match" in headers or "If-Modified-Since" in headers:
+            # Only the headers are read, the body of a changed asset is left
+            # for the download
+            response = session.get(
+                fetch_url, headers=headers, timeout=timeout, stream=True
+            )
+        else:
+            response = session.head(
+                fetch_url, headers=headers, timeout=timeout, allow_redirects=True
+            )
+    except requests.exceptions.RequestException:
+        return FAILED, etag, last_modified, 0
+
+    with response:
+        new_etag = response.headers.get("ETag", etag)
+        new_last_modified = response.headers.get("Last-Modified", last_modified)
+        if response.status_code == 304:
+            return FRESH, new_etag, new_last_modified, 304
+        if response.status_code != 200:
+            return FAILED, etag, last_modified, response.status_code
+
+        if etag != "" and new_etag != etag:
+            return CHANGED, new_etag, new_last_modified, 200
+        # A length that isn't a number tells us nothing
+        length = response.headers.get("Content-Length", "")
+        if length.isdecimal() and int(length) != size:
+            return CHANGED, new_etag, new_last_modified, 200
+        if etag == "" and last_modified != "" and new_last_modified != last_modified:
+            return CHANGED, new_etag, new_last_modified, 200
+        return FRESH, new_etag, new_last_modified, 200
+
+
+class FreshnessChecker(TTSWorker):
+    """Checks downloaded assets against their hosts and re-fetches those that
+    changed.  Requests are made concurrently over pooled connections, within
+    each host's concurrency and rate limits.
+    """
+
+    class AssetsChanged(Message):
+        def __init__(self, urls: list, trails: list) -> None:
+            super().__init__()
+            self.urls = urls
+            self.trails = trails
+
+    # Base class is installed in each screen, so we don't want
+    # to inherit the same widgets when this subclass is mounted
+    def compose(self) -> ComposeResult:
+        return []
+
+    def check_assets(self, max_age: float = 0.0) -> None:
+        """Check every downloaded asset not checked in the last `max_age` seconds."""
+        config = load_config()
+        num_checks = int(config.num_download_threads)
+        asset_list = AssetList()
+        worker = get_current_worker()
+
+        assets = asset_list.get_assets_to_check(time.time() - max_age)
+        self.post_message(UpdateLog(f"Checking {len(assets)} assets for changes."))
+        self.post_message(self.UpdateProgress(len(assets), None))
+        self.post_message(self.UpdateStatus(f"Checking {len(assets)} assets."))
+
+        session = make_download_session(num_checks)
+        hosts = SharedHostLimits(int(config.num_downloads_per_host))
+
+        def check(asset: dict) -> tuple:
+            limiter = hosts.acquire(url_host(asset["url"]))
+            result = (FAILED, "", "", 0)
+            try:
+                if not worker.is_cancelled:
+                    result = check_freshness(
+                        session,
+                        asset["url"],
+                        asset["size"],
+                        asset["etag"],
+                        asset["last_modified"],
+                    )
+            finally:
+                hosts.release(limiter, result[3])
+            return result
+
+        start = time.time()
+        counts = {FRESH: 0, CHANGED: 0, FAILED: 0}
+        validators = []
+        changed_urls = []
+        changed_trails = []
+        with ThreadPoolExecutor(
+            max_workers=num_checks, thread_name_prefix="ttsmutility_fresh"
+        ) as executor:
+            futures = {executor.submit(check, asset): asset for asset in assets}
+            for i, future in enumerate(as_completed(futures)):
+                if worker.is_cancelled:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    break
+                asset = futures[future]
+                outcome, etag, last_modified, _ = future.result()
+                counts[outcome] += 1
+                if outcome == FRESH:
+                    validators.append((asset["url"], etag, last_modified, time.time()))
+                elif outcome == CHANGED:
+                    changed_urls.append(asset["url"])
+                    changed_trails.append(trailstring_to_trail(asset["trail"]))
+
+                if i % 50 == 49:
+                    self.post_message(self.UpdateProgress(advance_amount=50))
+                    self.post_message(
+                        self.UpdateStatus(
+                            f"Checked {i + 1}/{len(assets)} assets, "
+                            f"{counts[CHANGED]} changed."
+                        )
+                    )
+                if len(validators) >= 500:
+                    asset_list.set_validators(validators)
+                    validators = []
+
+        self.post_message(self.UpdateProgress(advance_amount=len(assets) % 50))
+        asset_list.set_validators(validators)
+        session.close()
+
+        summary = (
+            f"Checked {sum(counts.values())} assets in {time.time() - start:.1f}s: "
+            f"{counts[FRESH]} unchanged, {counts[CHANGED]} changed, "
+            f"{counts[FAILED]} could not be checked."
+        )
+        if worker.is_cancelled:
+            summary = "Freshness check cancelled. " + summary
+        self.post_message(UpdateLog(summary, flush=True))
+        self.post_message(self.UpdateStatus(summary))
+        if len(changed_urls) > 0:
+            self.post_message(self.AssetsChanged(changed_urls, changed_trails))
@@ -0,0 +1,189 @@
+import threading
+import time
+from dataclasses import dataclass
+
+
+@dataclass
+class HostPolicy:
+    max_concurrency: int
+    # Requests per second, None for no limit
+    rate: float | None = None
+    burst: float = 1.0
+
+
+# Hosts that are known to tolerate (or punish) parallel downloads.  Matched
+# against the end of the hostname.
+HOST_POLICIES = {
+    "steamusercontent.com": HostPolicy(16),
+    "pastebin.com": HostPolicy(1, rate=1.0),
+    "paste.ee": HostPolicy(1, rate=1.0),
+    "drive.google.com": HostPolicy(2, rate=2.0, burst=2.0),
+    "docs.google.com": HostPolicy(2, rate=2.0, burst=2.0),
+}
+
+# Outcomes of a download, as far as the host is concerned
+OK = "ok"
+THROTTLED = "throttled"
+TIMEOUT = "timeout"
+
+
+def outcome_for_status(status_code: int) -> str:
+    """Outcome of a request that got `status_code`, 0 if there was no response."""
+    if status_code in (429, 503):
+        return THROTTLED
+    if status_code == 0:
+        return TIMEOUT
+    return OK
+
+
+class HostLimiter:
+    """AIMD concurrency and token bucket rate limit for a single host.
+
+    The concurrency limit starts low, grows by one for every `limit`
+    successful downloads and is halved when the host throttles us (429/503)
+    or times out.  Throttling also pauses the host, for Retry-After seconds
+    if the host sent it, otherwise for an exponentially growing backoff.
+
+    Times are taken from `time.monotonic()` unless given, so the limiter can
+    be driven by tests.
+    """
+
+    START_CONCURRENCY = 2.0
+    MIN_BACKOFF = 1.0
+    MAX_BACKOFF = 300.0
+
+    def __init__(self, host: str, policy: HostPolicy) -> None:
+        self.host = host
+        self.policy = policy
+        self.limit = min(self.START_CONCURRENCY, float(policy.max_concurrency))
+        self.active = 0
+        self.tokens = policy.burst
+        self.last_refill = time.monotonic()
+        self.paused_until = 0.0
+        self.backoff = self.MIN_BACKOFF
+
+        self.completed = 0
+        self.throttled = 0
+        self.timeouts = 0
+
+    def _refill(self, now: float) -> None:
+        if self.policy.rate is not None:
+            self.tokens = min(
+                self.policy.burst,
+                self.tokens + (now - self.last_refill) * self.policy.rate,
+            )
+        self.last_refill = now
+
+    def delay(self, now: float | None = None) -> float | None:
+        """Seconds until another download may start.
+
+        Returns:
+            0 if a download can start now, or None if we have to wait for one
+            of the active downloads to finish.
+        """
+        if now is None:
+            now = time.monotonic()
+        if self.paused_until > now:
+            return self.paused_until - now
+        if self.active >= int(self.limit):
+            return None
+        if self.policy.rate is not None:
+            self._refill(now)
+            if self.tokens < 1.0:
+                return (1.0 - self.tokens) / self.policy.rate
+        return 0.0
+
+    def start(self, now: float | None = None) -> None:
+        if now is None:
+            now = time.monotonic()
+        self._refill(now)
+        if self.policy.rate is not None:
+            self.tokens -= 1.0
+        self.active += 1
+
+    def finish(
+        self, outcome: str, retry_after: float = 0.0, now: float | None = None
+    ) -> None:
+        if now is None:
+            now = time.monotonic()
+        self.active -= 1
+        if outcome == THROTTLED:
+            self.throttled += 1
+            self.limit = max(1.0, self.limit / 2)
+            if retry_after > 0:
+                pause = min(retry_after, self.MAX_BACKOFF)
+            else:
+                pause = self.backoff
+                self.backoff = min(self.backoff * 2, self.MAX_BACKOFF)
+            self.paused_until = max(self.paused_until, now + pause)
+        elif outcome == TIMEOUT:
+            self.timeouts += 1
+            self.limit = max(1.0, self.limit / 2)
+        else:
+            self.completed += 1
+            self.backoff = self.MIN_BACKOFF
+            self.limit = min(
+                float(self.policy.max_concurrency), self.limit + 1 / int(self.limit)
+            )
+
+    def status(self, now: float | None = None) -> str:
+        if now is None:
+            now = time.monotonic()
+        status = f"{self.host} {self.active}/{int(self.limit)}"
+        if self.paused_until > now:
+            status += f" paused {self.paused_until - now:.0f}s"
+        return status
+
+
+class HostLimits:
+    """Creates and holds a HostLimiter for each host we download from."""
+
+    def __init__(self, default_max_concurrency: int) -> None:
+        self.default_policy = HostPolicy(default_max_concurrency)
+        self.limiters = {}
+
+    def policy(self, host: str) -> HostPolicy:
+        for domain, policy in HOST_POLICIES.items():
+            if host == domain or host.endswith("." + domain):
+                return policy
+        return self.default_policy
+
+    def __getitem__(self, host: str) -> HostLimiter:
+        if host not in self.limiters:
+            self.limiters[host] = HostLimiter(host, self.policy(host))
+        return self.limiters[host]
+
+    def status(self) -> str:
+        """Short summary of the hosts we are downloading from."""
+        now = time.monotonic()
+        return " | ".join(
+            limiter.status(now)
+            for limiter in self.limiters.values()
+            if limiter.active > 0 or limiter.paused_until > now
+        )
+
+
+class SharedHostLimits(HostLimits):
+    """HostLimits for requests made from a pool of threads.
+
+    Each thread blocks in `acquire()` until its host has a free slot, so the
+    pool can be larger than any one host allows.
+    """
+
+    def __init__(self, default_max_concurrency: int) -> None:
+        super().__init__(default_max_concurrency)
+        self._lock = threading.Lock()
+
+    def acquire(self, host: str) -> HostLimiter:
+        while True:
+            with self._lock:
+                limiter = self[host]
+                delay = limiter.delay()
+                if delay == 0:
+                    limiter.start()
+                    return limiter
+            time.sleep(0.05 if delay is None else delay)
+
+    def release(self, limiter: HostLimiter, status_code: int) -> None:
+        with self._lock:
+            limiter.finish(outcome_for_status(status_code))
@@ -1,15 +1,21 @@
-import site
-from urllib.parse import urlparse
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from urllib.parse import urlparse
 
 import requests
 from textual.app import ComposeResult
 from textual.worker import get_current_worker
 
+from ..data.config import load_config
 from ..parse.AssetList import AssetList
+from ..parse.HostCapabilities import HostCapabilities
 from ..utility.advertising import USER_AGENT
 from ..utility.messages import UpdateLog
 from ..utility.util import get_content_name
+from .downloader import make_download_session
+from .hosts import SharedHostLimits
+from .scheduler import url_host
 from .TTSWorker import TTSWorker
 
 # Recursively read each directory
@@ -21,14 +27,201 @@ from .TTSWorker import TTSWorker
 #   Check if matching SHA-1 file is found
 #   Copy and rename to destination directory
 
+# Where a name came from
+URL_NAME = "url"
+CD_NAME = "cd"
+# The host answered, but without a Content-Disposition
+NO_CD = "no cd"
+
+
+def fetch_content_disposition(
+    session: requests.Session,
+    fetch_url: str,
+    headers: dict,
+    use_head: bool = True,
+    timeout: float = 10,
+    capabilities: HostCapabilities | None = None,
+) -> tuple[int, str, str | None]:
+    """Ask a host for the Content-Disposition of `fetch_url`, without the body.
+
+    A HEAD request is tried first.  Not every host answers HEAD properly
+    (steamusercontent can 404), so otherwise only the first byte is asked for.
+    What the host supports is recorded in `capabilities`, and HEAD isn't
+    tried on hosts known not to answer it.
+
+    Returns:
+        The HTTP status code (206 is returned as 200), the reason and the
+        Content-Disposition header, or None if there wasn't one.
+    """
+    host = url_host(fetch_url)
+    if capabilities is not None:
+        use_head = use_head and capabilities.use_head(host)
+        timeout = capabilities.timeout(host, timeout)
+    if use_head:
+        with session.head(
+            fetch_url, headers=headers, allow_redirects=True, timeout=timeout
+        ) as response:
+            if response.status_code == 200:
+                if capabilities is not None:
+                    capabilities.record(host, head=True)
+                    capabilities.record_response(host, response, False)
+                return 200, response.reason, response.headers.get("Content-Disposition")
+    with session.get(
+        fetch_url,
+        headers=headers | {"Range": "bytes=0-0"},
+        allow_redirects=True,
+        stream=True,
+        timeout=timeout,
+    ) as response:
+        status_code = 200 if response.status_code == 206 else response.status_code
+        if capabilities is not None and status_code == 200:
+            if use_head:
+                capabilities.record(host, head=False)
+            capabilities.record_response(host, response, True)
+        return (
+            status_code,
+            response.reason,
+            response.headers.get("Content-Disposition"),
+        )
+
+
+def paste_ee_name(session: requests.Session, fetch_url: str, headers: dict) -> str:
+    """paste.ee doesn't send names, but an obj file may mention its own."""
+    with session.get(
+        url=fetch_url, headers=headers, allow_redirects=True, stream=True, timeout=10
+    ) as response:
+        to_search = ["obj file: '", "mtllib "]
+        lines = response.iter_lines()
+        for j, line in enumerate(lines):
+            line = line.decode("utf-8")
+            start_offset = 0
+            end_offset = 0
+            if (start_offset := line.lower().find(to_search[0])) != -1:
+                start_offset += len(to_search[0])
+                end_offset = line.find("'", start_offset)
+            elif (start_offset := line.lower().find(to_search[1])) != -1:
+                start_offset += len(to_search[1])
+                end_offset = len(line)
+            if start_offset != -1 and start_offset != end_offset:
+                content_name = line[start_offset:end_offset].strip()
+                return str(Path(content_name).with_suffix(".obj"))
+            # Only search the first few lines
+            if j >= 5:
+                break
+    return ""
+
 
 class NameScanner(TTSWorker):
+    """Finds content names for assets that don't have one.
+
+    Names in the url are used as is, otherwise the host is asked for a
+    Content-Disposition.  Requests are made concurrently over pooled
+    connections, within each host's concurrency and rate limits.
+    """
+
     # Base class is installed in each screen, so we don't want
     # to inherit the same widgets when this subclass is mounted
     def compose(self) -> ComposeResult:
         return []
 
+    def lookup_name(
+        self,
+        session: requests.Session,
+        hosts: SharedHostLimits,
+        url: str,
+        capabilities: HostCapabilities | None = None,
+    ) -> tuple[str, str, str, str]:
+        """Find the content name of one url.
+
+        Returns:
+            The content name ("" if none was found), where it came from
+            (URL_NAME, CD_NAME, NO_CD or ""), a note for the status line and
+            the dl_status to record if the url doesn't exist.
+        """
+        if (content_name := get_content_name(url)) != "":
+            return content_name, URL_NAME, f'"{content_name}"', ""
+
+        domain = urlparse(url).netloc
+        headers = {"User-Agent": USER_AGENT}
+        use_head = True
+        if "pastebin.com" in domain:
+            # Pastebin will provide us the original filename if we use the dl link.
+            # This requires a referer from the original pastebin link, so we need
+            # to extract it.
+            pastebin_ref = ""
+            if "pastebin.com/raw.php" in url:
+                pastebin_ref = url.split("=")[-1]
+            else:
+                pastebin_ref = url.split("/")[-1]
+
+            if len(pastebin_ref) == 0:
+                return "", "", "(Unable to detect pastebin hash)", ""
+            headers["Referer"] = f"http://pastebin.com/{pastebin_ref}"
+            fetch_url = f"http://pastebin.com/dl/{pastebin_ref}"
+            use_head = False
+        elif "paste.ee" in domain:
+            if "/p/" in url:
+                fetch_url = url.replace("paste.ee/p/", "paste.ee/d/")
+            else:
+                fetch_url = url
+            limiter = hosts.acquire(url_host(fetch_url))
+            status_code = 0
+            try:
+                content_name = paste_ee_name(session, fetch_url, headers)
+                status_code = 200
+            except requests.exceptions.RequestException as error:
+                return "", "", str(error), ""
+            finally:
+                hosts.release(limiter, status_code)
+            if content_name == "":
+                return "", "", "(paste.ee tell no names)", ""
+            return content_name, CD_NAME, f'"{content_name}"', ""
+        else:
+            fetch_url = url
+
+        # Trim any junk at the end of steam urls
+        if "steamuser" in fetch_url:
+            use_head = False
+            if fetch_url[-1] != "/":
+                fetch_url = fetch_url[0 : fetch_url.rfind("/") + 1]
+
+        # Some links are missing the http:// portion of the address
+        if not urlparse(fetch_url).scheme:
+            fetch_url = "http://" + fetch_url
+
+        host = url_host(fetch_url)
+        if capabilities is not None and not capabilities.sends_content_disposition(
+            host
+        ):
+            return "", "", "(Site does not support context disposition)", ""
+
+        limiter = hosts.acquire(host)
+        status_code = 0
+        try:
+            status_code, reason, content_disposition = fetch_content_disposition(
+                session, fetch_url, headers, use_head, capabilities=capabilities
+            )
+        except Exception as error:
+            # Can be caused by local file urls or embedded <dlc>
+            return "", "", str(error), ""
+        finally:
+            hosts.release(limiter, status_code)
+
+        if status_code != 200:
+            dl_status = f"HTTPError {status_code} ({reason}) [namescan]"
+            # In most cases, 404 does mean the asset doesn't exist.
+            return "", "", f"<{dl_status}>", dl_status if status_code == 404 else ""
+        if content_disposition is None:
+            return "", NO_CD, "(No Content-Disposition)", ""
+
+        content_name = get_content_name(url, content_disposition.strip())
+        if content_name == "":
+            return "", "", "(No Name Found)", ""
+        return content_name, CD_NAME, f'"{content_name}"', ""
+
     def scan_names(self) -> None:
+        config = load_config()
+        num_lookups = int(config.num_download_threads)
         asset_list = AssetList()
 
         worker = get_current_worker()
@@ -38,187 +231,69 @@ class NameScanner(TTSWorker):
         urls = asset_list.get_blank_content_names()
 
         self.post_message(self.UpdateProgress(len(urls), None))
-
-        updated_urls = []
-        updated_names = []
-
-        url_name_count = 0
-        cd_name_count = 0
-
-        sites_with_no_context_disposition = []
-
         self.post_message(UpdateLog(f"R {len(urls)} missing names to be scanned."))
-        self.post_message(self.UpdateProgress(advance_amount=1))
-        for i, url in enumerate(urls):
-            self.post_message(self.UpdateProgress(advance_amount=1))
 
+        session = make_download_session(num_lookups)
+        hosts = SharedHostLimits(int(config.num_downloads_per_host))
+        capabilities = self.app.host_capabilities
+
+        def lookup(url: str) -> tuple:
             if worker.is_cancelled:
-                asset_list.set_content_names(updated_urls, updated_names)
-                self.post_message(
-                    UpdateLog(
-                        f"Name detection cancelled at {i}/{len(urls)}.", flush=True
-                    )
-                )
-                return
+                return "", "", "(Cancelled)", ""
+            return self.lookup_name(session, hosts, url, capabilities)
 
-            if (content_name := get_content_name(url)) != "":
-                updated_urls.append(url)
-                updated_names.append(content_name)
-                url_name_count += 1
+        start = time.time()
+        updated_urls = []
+        updated_names = []
+        counts = {URL_NAME: 0, CD_NAME: 0}
+        done = 0
+        with ThreadPoolExecutor(
+            max_workers=num_lookups, thread_name_prefix="ttsmutility_names"
+        ) as executor:
+            futures = {executor.submit(lookup, url): url for url in urls}
+            for done, future in enumerate(as_completed(futures), start=1):
+                if worker.is_cancelled:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    break
+                url = futures[future]
+                content_name, source, note, dl_status = future.result()
+                if content_name != "":
+                    updated_urls.append(url)
+                    updated_names.append(content_name)
+                    counts[source] += 1
+                if dl_status != "":
+                    self.app.write_queue.set_dl_status(url, dl_status)
 
-                self.post_message(
-                    self.UpdateStatus(
-                        f'Scanning {i}/{len(urls)} missing names.\n{url} -> "{content_name}"'
-                    )
-                )
-                continue
-
-            domain = urlparse(url).netloc
-            headers = {"User-Agent": USER_AGENT}
-            if "pastebin.com" in domain:
-                # Pastebin will provide us the original filename if we use the dl link.
-                # This requires a referer from the original pastebin link, so we need
-                # to extract it.
-                pastebin_ref = ""
-                if "pastebin.com/raw.php" in url:
-                    pastebin_ref = url.split("=")[-1]
-                else:
-                    pastebin_ref = url.split("/")[-1]
-
-                if len(pastebin_ref) > 0:
-                    headers["Referer"] = f"http://pastebin.com/{pastebin_ref}"
-                    fetch_url = f"http://pastebin.com/dl/{pastebin_ref}"
-                else:
+                if done % 50 == 0:
+                    self.post_message(self.UpdateProgress(advance_amount=50))
                     self.post_message(
                         self.UpdateStatus(
-                            f"Scanning {i}/{len(urls)} missing names.\n{url} -> (Unable to detect pastebin hash)"
-                        )
-                    )
-                    continue
-            elif "paste.ee" in domain:
-                if "/p/" in url:
-                    fetch_url = url.replace("paste.ee/p/", "paste.ee/d/")
-                else:
-                    fetch_url = url
-                with requests.get(
-                    url=fetch_url, headers=headers, allow_redirects=True, stream=True
-                ) as response:
-                    content_name = "(paste.ee tell no names)"
-                    to_search = ["obj file: '", "mtllib "]
-                    lines = response.iter_lines()
-                    for j, line in enumerate(lines):
-                        line = line.decode("utf-8")
-                        start_offset = 0
-                        end_offset = 0
-                        if (start_offset := line.lower().find(to_search[0])) != -1:
-                            start_offset += len(to_search[0])
-                            end_offset = line.find("'", start_offset)
-                        elif (start_offset := line.lower().find(to_search[1])) != -1:
-                            start_offset += len(to_search[1])
-                            end_offset = len(line)
-                        if start_offset != -1 and start_offset != end_offset:
-                            content_name = line[start_offset:end_offset].strip()
-                            content_name = str(Path(content_name).with_suffix(".obj"))
-                            updated_urls.append(url)
-                            updated_names.append(content_name)
-                            cd_name_count += 1
-                            break
-                        # Only search the first few lines
-                        if j >= 5:
-                            break
-                self.post_message(
-                    self.UpdateStatus(
-                        f"Scanning {i}/{len(urls)} missing names.\n{url} -> {content_name}"
-                    )
-                )
-                continue
-            elif domain in sites_with_no_context_disposition:
-                self.post_message(
-                    self.UpdateStatus(
-                        f"Scanning {i}/{len(urls)} missing names.\n{url} -> (Site does not support context disposition)"
-                    )
-                )
-                continue
-            else:
-                fetch_url = url
-
-            # Trim any junk at the end of steam urls
-            if "steamuser" in fetch_url:
-                if fetch_url[-1] != "/":
-                    fetch_url = fetch_url[0 : fetch_url.rfind("/") + 1]
-
-            # Some links are missing the http:// portion of the address
-            if not urlparse(fetch_url).scheme:
-                fetch_url = "http://" + fetch_url
-            try:
-                with requests.get(
-                    url=fetch_url, headers=headers, allow_redirects=True, stream=True
-                ) as response:
-                    if response.status_code != 200:
-                        dl_status = f"HTTPError {response.status_code} ({response.reason}) [namescan]"
-                        self.post_message(
-                            self.UpdateStatus(
-                                f"Scanning {i}/{len(urls)} missing names.\n{url} -> <{dl_status}>"
-                            )
-                        )
-                        # In most cases, 404 does mean the asset doesn't exist. This error will get
-                        # returned by steamusercontent if the HEAD method is used for some cases.
-                        if response.status_code == 404:
-                            asset_list.set_dl_status(url, dl_status)
-                        continue
-                    if "Content-Disposition" in response.headers:
-                        content_disposition = response.headers[
-                            "Content-Disposition"
-                        ].strip()
-                    elif "content-disposition" in response.headers:
-                        content_disposition = response.headers[
-                            "content-disposition"
-                        ].strip()
-                    else:
-                        self.post_message(
-                            self.UpdateStatus(
-                                f"Scanning {i}/{len(urls)} missing names.\n{url} -> (No Content-Disposition)"
-                            )
+                            f"Scanning {done}/{len(urls)} missing names.\n{url} -> {note}"
                         )
-                        if "steamuser" not in domain:
-                            sites_with_no_context_disposition.append(domain)
-                        continue
-            except Exception as error:
-                # Can be caused by local file urls or embedded <dlc>
-                self.post_message(
-                    self.UpdateStatus(
-                        f"Scanning {i}/{len(urls)} missing names.\n{url} -> {error}"
                     )
-                )
-                continue
+                if len(updated_names) >= 500:
+                    asset_list.set_content_names(updated_urls, updated_names)
+                    updated_urls = []
+                    updated_names = []
 
-            if (content_name := get_content_name(url, content_disposition)) != "":
-                updated_urls.append(url)
-                updated_names.append(content_name)
-                cd_name_count += 1
+        self.post_message(self.UpdateProgress(advance_amount=done % 50))
+        asset_list.set_content_names(updated_urls, updated_names)
+        capabilities.flush()
+        session.close()
 
-                self.post_message(
-                    self.UpdateStatus(
-                        f'Scanning {i}/{len(urls)} missing names.\n{url} -> "{content_name}"'
-                    )
-                )
-            else:
-                self.post_message(
-                    self.UpdateStatus(
-                        f"Scanning {i}/{len(urls)} missing names.\n{url} -> (No Name Found)"
-                    )
+        if worker.is_cancelled:
+            self.post_message(
+                UpdateLog(
+                    f"Name detection cancelled at {done}/{len(urls)}.", flush=True
                 )
+            )
+            return
 
-            if len(updated_names) > 50:
-                asset_list.set_content_names(updated_urls, updated_names)
-                updated_urls = []
-                updated_names = []
-
-        asset_list.set_content_names(updated_urls, updated_names)
-
-        self.post_message(UpdateLog("Content Name detection complete."))
+        self.post_message(
+            UpdateLog(f"Content Name detection complete in {time.time() - start:.1f}s.")
+        )
         self.post_message(
             self.UpdateStatus(
-                f"Complete. New names: URL:{url_name_count} & CD:{cd_name_count}"
+                f"Complete. New names: URL:{counts[URL_NAME]} & CD:{counts[CD_NAME]}"
             )
         )
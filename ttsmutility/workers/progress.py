@@ -0,0 +1,107 @@
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+
+@dataclass
+class WorkerProgress:
+    worker_num: int
+    url: str
+    filesize: int
+    bytes_complete: int
+
+
+@dataclass
+class ProgressSnapshot:
+    """Everything the UI needs to show about downloads, for one frame."""
+
+    # Downloads in progress
+    workers: list = field(default_factory=list)
+    # (worker_num, error, asset, files_remaining) for downloads finished since
+    # the last frame
+    completed: list = field(default_factory=list)
+    # (message, prefix) log lines since the last frame
+    log: list = field(default_factory=list)
+    # Bytes received this session
+    bytes_total: int = 0
+    # Bytes per second
+    rate: float = 0.0
+    # Downloads waiting to start
+    queued: int = 0
+    # Estimated seconds until the queue is empty, None if unknown
+    eta: float | None = None
+
+    def is_empty(self) -> bool:
+        return len(self.workers) + len(self.completed) + len(self.log) == 0
+
+
+class DownloadProgress:
+    """Samples the state of the download slots at the UI frame rate.
+
+    Downloads only update plain attributes and append to their log deque, so
+    they never wait on the UI.  Completed downloads are added with
+    `complete()` from the event loop.  Each `sample()` gathers it all into
+    one ProgressSnapshot.
+    """
+
+    def __init__(self, fds: list, window: float = 2.0) -> None:
+        """
+        Args:
+            fds: The FileDownload slots.
+            window: Seconds over which the rate is averaged.
+        """
+        self.fds = fds
+        self.window = window
+        self.completed = deque()
+        # (time, bytes_total) for the samples within the window
+        self.history = deque()
+        self.files_done = 0
+        self.bytes_done = 0
+
+    def complete(
+        self, worker_num: int, error: str, asset: dict, files_remaining: dict
+    ) -> None:
+        self.completed.append((worker_num, error, asset, files_remaining))
+        if error == "":
+            self.files_done += 1
+            self.bytes_done += asset["size"]
+
+    def sample(self, queued: int = 0, now: float | None = None) -> ProgressSnapshot:
+        """Gather the progress since the last sample.
+
+        Args:
+            queued: Number of downloads waiting to start.
+        """
+        if now is None:
+            now = time.monotonic()
+        snapshot = ProgressSnapshot(queued=queued)
+
+        bytes_left = 0
+        for worker_num, fd in enumerate(self.fds):
+            snapshot.bytes_total += fd.bytes_received
+            while len(fd.log_lines) > 0:
+                snapshot.log.append(fd.log_lines.popleft())
+            if fd.active:
+                snapshot.workers.append(
+                    WorkerProgress(
+                        worker_num, fd.url, fd.content_length, fd.bytes_complete
+                    )
+                )
+                bytes_left += max(fd.content_length - fd.bytes_complete, 0)
+
+        while len(self.completed) > 0:
+            snapshot.completed.append(self.completed.popleft())
+
+        self.history.append((now, snapshot.bytes_total))
+        while len(self.history) > 2 and self.history[1][0] <= now - self.window:
+            self.history.popleft()
+        start, start_bytes = self.history[0]
+        if now > start:
+            snapshot.rate = (snapshot.bytes_total - start_bytes) / (now - start)
+
+        if snapshot.rate > 0 and (len(snapshot.workers) > 0 or queued > 0):
+            # Queued downloads are guessed to be the average size so far
+            if self.files_done > 0:
+                bytes_left += queued * self.bytes_done / self.files_done
+            snapshot.eta = bytes_left / snapshot.rate
+        return snapshot
@@ -0,0 +1,66 @@
+from pathlib import Path
+
+from ..parse.AssetList import AssetList
+
+
+def parse_mirrors(spec: str) -> list:
+    """Parse mirror rewrites like "http://a.com/ => https://b.com/; ...".
+
+    Returns:
+        (prefix, replacement) tuples, in the order they should be tried.
+
+    Raises:
+        ValueError: A rewrite is missing its "=>".
+    """
+    mirrors = []
+    for rewrite in spec.split(";"):
+        if rewrite.strip() == "":
+            continue
+        prefix, arrow, replacement = rewrite.partition("=>")
+        if arrow == "" or prefix.strip() == "" or replacement.strip() == "":
+            raise ValueError(f"Expected 'prefix => replacement': {rewrite.strip()}")
+        mirrors.append((prefix.strip(), replacement.strip()))
+    return mirrors
+
+
+class AssetResolver:
+    """Finds somewhere other than the asset's own url to get it from.
+
+    Before going to the network a download asks for a local match, a file
+    already on disk with the same SHA1, either the one in a steam url or one
+    recorded from an earlier download of the url.  Failing that, mirrors of
+    the url are tried before the url itself.
+    """
+
+    def __init__(self, mirrors: list = (), asset_list: AssetList | None = None):
+        """
+        Args:
+            mirrors: (prefix, replacement) rewrites, see `parse_mirrors()`.
+        """
+        self.mirrors = list(mirrors)
+        if asset_list is None:
+            asset_list = AssetList()
+        self.asset_list = asset_list
+
+    def mirrors_for(self, fetch_url: str) -> list:
+        """Rewrites of `fetch_url`, in the order they should be tried."""
+        urls = []
+        for prefix, replacement in self.mirrors:
+            if fetch_url.startswith(prefix):
+                url = replacement + fetch_url[len(prefix) :]
+                if url != fetch_url and url not in urls:
+                    urls.append(url)
+        return urls
+
+    def find_local(self, url: str) -> tuple | None:
+        """A file on disk with the same content as `url`.
+
+        Returns:
+            The path, SHA1 and content name of the file, or None.
+        """
+        mod_dir = Path(self.asset_list.mod_dir)
+        for path, sha1, content_name in self.asset_list.find_local_copies(url):
+            filepath = mod_dir / path
+            if filepath.is_file():
+                return filepath, sha1, content_name
+        return None
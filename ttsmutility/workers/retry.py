@@ -0,0 +1,131 @@
+import random
+import time
+from dataclasses import dataclass, field
+
+from .scheduler import url_host
+
+# How a failed download should be treated
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+DEAD_HOST = "dead host"
+
+# Errors that won't go away by asking again
+PERMANENT_ERRORS = (
+    "Removed",
+    "Wrong context type",
+    "Invalid hostname",
+    "Invalid filename",
+    "localhost url",
+    "Do not know how to retrieve",
+    "Filename too long",
+)
+
+# HTTP errors a host may recover from
+TRANSIENT_HTTP_STATUS = (408, 425, 429, 500, 502, 503, 504)
+
+# The host name doesn't resolve, nothing on it can be downloaded
+DNS_ERRORS = (
+    "Name or service not known",
+    "Failed to resolve",
+    "getaddrinfo failed",
+    "nodename nor servname",
+    "No address associated",
+)
+
+
+def classify(error: str) -> str | None:
+    """Classify a download error, None if the download succeeded."""
+    if error == "":
+        return None
+    if error.startswith("HTTPError "):
+        try:
+            status = int(error.split()[1])
+        except (IndexError, ValueError):
+            return TRANSIENT
+        if status in TRANSIENT_HTTP_STATUS:
+            return TRANSIENT
+        return PERMANENT
+    if error.startswith("URLError") and any(dns in error for dns in DNS_ERRORS):
+        return DEAD_HOST
+    if error.startswith(PERMANENT_ERRORS):
+        return PERMANENT
+    return TRANSIENT
+
+
+@dataclass
+class RetryPolicy:
+    """Exponential backoff, with full jitter, between download attempts.
+
+    Each retry waits a random time up to `base * 2**attempt` seconds (capped
+    at `cap`), so downloads that failed together don't retry together.
+    """
+
+    max_retries: int = 5
+    base: float = 0.5
+    cap: float = 10.0
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.cap, self.base * 2**attempt))
+
+
+@dataclass
+class DeadUrl:
+    error: str
+    expires: float
+    # How long the failed attempt took, the time saved by skipping it
+    duration: float
+
+
+@dataclass
+class NegativeCache:
+    """Urls (and hosts) that recently failed for good, so bulk downloads can
+    skip them.  Entries expire after `ttl` seconds, `host_ttl` for hosts that
+    don't resolve, after which the url is tried again.
+    """
+
+    ttl: float = 7 * 24 * 60 * 60
+    host_ttl: float = 24 * 60 * 60
+    urls: dict = field(default_factory=dict)
+    hosts: dict = field(default_factory=dict)
+
+    def add(self, url: str, error: str, when: float, duration: float = 0.0) -> None:
+        """Record the outcome of a download, oldest first."""
+        kind = classify(error)
+        if kind is None:
+            # It can be downloaded after all
+            self.urls.pop(url, None)
+            self.hosts.pop(url_host(url), None)
+        elif kind == PERMANENT:
+            self.urls[url] = DeadUrl(error, when + self.ttl, duration)
+        elif kind == DEAD_HOST:
+            host = url_host(url)
+            if host != "":
+                self.hosts[host] = DeadUrl(error, when + self.host_ttl, duration)
+
+    def lookup(self, url: str, now: float | None = None) -> DeadUrl | None:
+        if now is None:
+            now = time.time()
+        dead = self.urls.get(url)
+        if dead is None:
+            dead = self.hosts.get(url_host(url))
+        if dead is not None and dead.expires > now:
+            return dead
+        return None
+
+    def filter(self, urls, trails, now: float | None = None) -> tuple:
+        """Split out the urls that are known to be dead.
+
+        Returns:
+            The urls and trails to download, and a list of skipped DeadUrls.
+        """
+        keep_urls = []
+        keep_trails = []
+        skipped = []
+        for url, trail in zip(urls, trails):
+            dead = self.lookup(url, now)
+            if dead is None:
+                keep_urls.append(url)
+                keep_trails.append(trail)
+            else:
+                skipped.append(dead)
+        return keep_urls, keep_trails, skipped
@@ -0,0 +1,205 @@
+import heapq
+import itertools
+import urllib.parse
+from collections import deque
+from dataclasses import dataclass, field
+
+
+def url_host(url: str) -> str:
+    try:
+        return urllib.parse.urlparse(url.strip()).hostname or ""
+    except ValueError:
+        return ""
+
+
+@dataclass
+class DownloadJob:
+    url: str
+    trail: list
+    host: str
+    # Mods waiting on this download
+    mods: set = field(default_factory=set)
+    running: bool = False
+    throttled: int = 0
+
+
+@dataclass
+class ModDownloads:
+    filename: str
+    order: int
+    total: int = 0
+    # Urls queued or running for this mod
+    pending: set = field(default_factory=set)
+    # Urls not started yet, by host
+    queued: dict = field(default_factory=dict)
+    # Bumped whenever the priority changes, older heap entries are stale
+    version: int = 0
+
+
+class DownloadScheduler:
+    """Priority queue of asset downloads shared by all mods.
+
+    A url is downloaded once, however many mods are waiting for it.  Mods are
+    prioritized by: the mod being viewed, then the fewest files remaining,
+    then the smallest fraction remaining, then the order they were queued.
+    Each host has a heap of mods with downloads queued for it, so the
+    download pool can take the best job for any host that is ready.  Heap
+    entries are invalidated lazily, so adding, starting, finishing and
+    reprioritizing are all O(log n).
+    """
+
+    def __init__(self) -> None:
+        self.jobs = {}
+        self.mods = {}
+        self.heaps = {}
+        self.focused = ""
+        self._order = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self.jobs)
+
+    def _key(self, mod: ModDownloads) -> tuple:
+        remaining = len(mod.pending)
+        return (
+            mod.filename != self.focused,
+            remaining,
+            remaining / max(mod.total, 1),
+            mod.order,
+        )
+
+    def _push(self, mod: ModDownloads) -> None:
+        mod.version += 1
+        key = self._key(mod)
+        for host, queued in mod.queued.items():
+            if len(queued) > 0:
+                heap = self.heaps.setdefault(host, [])
+                heapq.heappush(heap, (key, mod.version, mod.filename))
+                if len(heap) > 4 * len(self.mods) + 64:
+                    self._compact(host)
+
+    def _compact(self, host: str) -> None:
+        heap = [
+            entry
+            for entry in self.heaps[host]
+            if entry[2] in self.mods and self.mods[entry[2]].version == entry[1]
+        ]
+        heapq.heapify(heap)
+        self.heaps[host] = heap
+
+    def add(self, urls: list, trails: list, mod_filename: str = "") -> int:
+        """Queue downloads for a mod.
+
+        Returns:
+            Number of downloads the mod is now waiting on.
+        """
+        if mod_filename not in self.mods:
+            self.mods[mod_filename] = ModDownloads(mod_filename, next(self._order))
+        mod = self.mods[mod_filename]
+
+        for url, trail in zip(urls, trails):
+            if url in mod.pending:
+                continue
+            if url not in self.jobs:
+                self.jobs[url] = DownloadJob(url, trail, url_host(url))
+            job = self.jobs[url]
+            job.mods.add(mod_filename)
+            mod.pending.add(url)
+            mod.total += 1
+            if not job.running:
+                mod.queued.setdefault(job.host, deque()).append(url)
+
+        self._push(mod)
+        return len(mod.pending)
+
+    def hosts(self) -> list:
+        """Hosts with downloads waiting to start."""
+        return list(self.heaps)
+
+    def pop(self, host: str) -> DownloadJob | None:
+        """Start the highest priority download queued for `host`."""
+        heap = self.heaps.get(host, [])
+        while len(heap) > 0:
+            _, version, mod_filename = heap[0]
+            mod = self.mods.get(mod_filename)
+            if mod is None or mod.version != version:
+                heapq.heappop(heap)
+                continue
+            queued = mod.queued.get(host, deque())
+            while len(queued) > 0:
+                job = self.jobs.get(queued.popleft())
+                # Could have been started for another mod, or cancelled
+                if job is not None and not job.running:
+                    job.running = True
+                    return job
+            heapq.heappop(heap)
+        self.heaps.pop(host, None)
+        return None
+
+    def requeue(self, job: DownloadJob) -> None:
+        """Put a started download back at the front of the queue."""
+        job.running = False
+        if len(job.mods) == 0:
+            # Every mod waiting on it was cancelled
+            del self.jobs[job.url]
+            return
+        for mod_filename in job.mods:
+            mod = self.mods[mod_filename]
+            mod.queued.setdefault(job.host, deque()).appendleft(job.url)
+            self._push(mod)
+
+    def done(self, url: str) -> dict:
+        """Finish a download.
+
+        Returns:
+            Number of downloads remaining for each mod that was waiting on it.
+        """
+        job = self.jobs.pop(url, None)
+        if job is None:
+            return {}
+        remaining = {}
+        for mod_filename in job.mods:
+            mod = self.mods[mod_filename]
+            mod.pending.discard(url)
+            remaining[mod_filename] = len(mod.pending)
+            if len(mod.pending) == 0:
+                del self.mods[mod_filename]
+            else:
+                self._push(mod)
+        return remaining
+
+    def cancel(self, mod_filename: str) -> list:
+        """Stop queued downloads for a mod, those already running finish.
+
+        Returns:
+            The urls that will no longer be downloaded.
+        """
+        mod = self.mods.pop(mod_filename, None)
+        if mod is None:
+            return []
+        cancelled = []
+        for url in mod.pending:
+            job = self.jobs[url]
+            job.mods.discard(mod_filename)
+            if len(job.mods) == 0 and not job.running:
+                del self.jobs[url]
+                cancelled.append(url)
+        return cancelled
+
+    def focus(self, mod_filename: str) -> None:
+        """Download this mod's assets before any other."""
+        previous = self.mods.get(self.focused)
+        self.focused = mod_filename
+        if previous is not None:
+            self._push(previous)
+        if mod_filename in self.mods:
+            self._push(self.mods[mod_filename])
+
+    def mods_for(self, url: str) -> set:
+        if url in self.jobs:
+            return self.jobs[url].mods
+        return set()
+
+    def remaining(self, mod_filename: str) -> int:
+        if mod_filename in self.mods:
+            return len(self.mods[mod_filename].pending)
+        return 0
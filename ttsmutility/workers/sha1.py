@@ -1,6 +1,7 @@
 import hashlib
 import os
 import pathlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 from textual.app import ComposeResult
 from textual.worker import get_current_worker
@@ -21,38 +22,123 @@ from .TTSWorker import TTSWorker
 #   Copy and rename to destination directory
 
 
+def hash_file(filepath) -> str:
+    with open(filepath, "rb") as f:
+        return hashlib.file_digest(f, "sha1").hexdigest().upper()
+
+
+class HashPipeline:
+    """Hashes files on a pool of threads while the caller finds more.
+
+    hashlib releases the GIL while it hashes, so on an SSD the hashers run
+    in parallel.  At most `max_pending` files are queued, so the caller
+    can't get far ahead and cancelling loses little.  `on_done` is called
+    with each file's context and SHA1, or the OSError raised reading it,
+    from the caller's thread during `submit()` and `finish()`.
+    """
+
+    def __init__(self, num_hashers: int, on_done, max_pending: int = 0) -> None:
+        self.executor = ThreadPoolExecutor(
+            max_workers=num_hashers, thread_name_prefix="ttsmutility_sha1"
+        )
+        self.on_done = on_done
+        self.max_pending = max_pending if max_pending > 0 else num_hashers * 4
+        self.pending = {}
+
+    def submit(self, filepath, context) -> None:
+        self._drain(self.max_pending - 1)
+        self.pending[self.executor.submit(hash_file, filepath)] = context
+
+    def _drain(self, max_pending: int) -> None:
+        while len(self.pending) > max_pending:
+            done, _ = wait(self.pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                context = self.pending.pop(future)
+                try:
+                    self.on_done(context, future.result())
+                except OSError as error:
+                    self.on_done(context, error)
+
+    def finish(self) -> None:
+        """Wait for every file to be hashed."""
+        self._drain(0)
+        self.executor.shutdown()
+
+    def cancel(self) -> None:
+        """Drop the files that haven't been hashed."""
+        self.pending = {}
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
 class Sha1Scanner(TTSWorker):
+    def __init__(self, num_hashers: int = 0) -> None:
+        super().__init__()
+        if num_hashers <= 0:
+            num_hashers = min(8, os.cpu_count() or 1)
+        self.num_hashers = num_hashers
+
     # Base class is installed in each screen, so we don't want
     # to inherit the same widgets when this subclass is mounted
     def compose(self) -> ComposeResult:
         return []
 
     async def scan_sha1s(self) -> None:
-        filepath = None
-        mtime = 0
-        skip = False
-
         config = load_config()
         asset_list = AssetList()
+        write_queue = self.app.write_queue
 
         worker = get_current_worker()
 
         self.post_message(UpdateLog("Starting SHA1 scan."))
         self.post_message(self.UpdateProgress(100, None))
 
+        # A directory is only listed if it changed since the last complete
+        # scan, or it has files that have never been fingerprinted
+        scanned_dirs = asset_list.get_sha1_dirs()
+        clean_dirs = {}
+        failed_dirs = set()
+
+        def hashed(context, sha1):
+            dir_name, asset_path, filepath, steam_sha1, mtime, fingerprint = context
+            if isinstance(sha1, OSError):
+                failed_dirs.add(dir_name)
+                self.post_message(UpdateLog(f"Unable to read `{filepath}`: {sha1}"))
+                return
+            write_queue.sha1_scan_done(asset_path, sha1, steam_sha1, mtime, fingerprint)
+
+        hashers = HashPipeline(self.num_hashers, hashed)
+
         ignore_paths = ["Mods", "Workshop"]
 
-        for root, dirnames, files in os.walk(config.tts_mods_dir, topdown=True):
+        to_scan = [config.tts_mods_dir]
+        while len(to_scan) > 0:
+            root = to_scan.pop()
             dir_name = pathlib.PurePath(root).name
 
             if dir_name in TTS_RAW_DIRS or dir_name in ignore_paths:
-                if dir_name != "Mods":
-                    # Do not recurse into directories we are ignoring
-                    while len(dirnames) > 0:
-                        _ = dirnames.pop()
+                # Do not recurse into directories we are ignoring
+                if dir_name == "Mods":
+                    with os.scandir(root) as it:
+                        to_scan.extend(entry.path for entry in it if entry.is_dir())
                 continue
 
-            self.post_message(self.UpdateProgress(len(files), None))
+            try:
+                dir_mtime_ns = os.stat(root).st_mtime_ns
+            except OSError:
+                continue
+
+            # Asset directories are flat, so skipping an unchanged one
+            # doesn't miss any changes below it
+            unchanged = scanned_dirs.get(dir_name) == dir_mtime_ns
+            assets = asset_list.get_sha1_info(dir_name, unhashed_only=unchanged)
+            if unchanged and len(assets) == 0:
+                clean_dirs[dir_name] = dir_mtime_ns
+                continue
+
+            with os.scandir(root) as it:
+                entries = list(it)
+            files = [entry for entry in entries if entry.is_file()]
+            to_scan.extend(entry.path for entry in entries if entry.is_dir())
 
             # Updating bar for every file can be very expensive, so scale it to
             # a min of 100 times, but no more than every 51 files
@@ -72,27 +158,28 @@ class Sha1Scanner(TTSWorker):
                 UpdateLog(f"Computing SHA1s for {dir_name} ({len(files)}).")
             )
 
-            assets = asset_list.get_sha1_info(dir_name)
             if len(assets) == 0:
+                clean_dirs[dir_name] = dir_mtime_ns
                 continue
 
-            for filename in files:
+            for entry in files:
                 if worker.is_cancelled:
+                    hashers.cancel()
+                    write_queue.flush()
                     self.post_message(UpdateLog("SHA1 scan cancelled."))
                     return
 
-                ext = os.path.splitext(filename)[1]
+                filestem, ext = os.path.splitext(entry.name)
                 if ext.upper() in FILES_TO_IGNORE:
                     continue
 
-                # Remove the '.\' at the front of the path
-                filepath = str(pathlib.PurePath(os.path.join(root, filename)))
-                asset_path = pathlib.Path(dir_name) / filename
-
-                filestem = pathlib.Path(filename).stem
                 if filestem not in assets:
                     continue
 
+                filepath = entry.path
+                asset_path = pathlib.Path(dir_name) / entry.name
+                sha1, db_steam_sha1, sha1_mtime, db_fingerprint = assets[filestem]
+
                 update_steam_sha1 = False
                 update_sha1 = False
 
@@ -103,35 +190,46 @@ class Sha1Scanner(TTSWorker):
                 ):
                     hexdigest = os.path.splitext(filestem)[0][-40:]
                     steam_sha1 = hexdigest.upper()
-                    if steam_sha1 != assets[filestem]["steam_sha1"]:
+                    if steam_sha1 != db_steam_sha1:
                         update_steam_sha1 = True
 
-                sha1 = assets[filestem]["sha1"]
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    failed_dirs.add(dir_name)
+                    continue
+                mtime = stat.st_mtime
+                fingerprint = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
 
-                mtime = os.path.getmtime(filepath)
-                if (
-                    assets[filestem]["sha1_mtime"] == 0
-                    or sha1 is None
-                    or sha1 == ""
-                    or sha1 == "0"
-                ):
-                    update_sha1 = True
-                elif mtime > assets[filestem]["sha1_mtime"]:
-                    update_sha1 = True
+                unhashed = sha1 is None or sha1 == "" or sha1 == "0"
+                if db_fingerprint[1] != 0:
+                    update_sha1 = unhashed or fingerprint != db_fingerprint
+                    update_fingerprint = False
+                else:
+                    # Hashed by a download, or before fingerprints were kept
+                    update_sha1 = unhashed or sha1_mtime == 0 or mtime > sha1_mtime
+                    update_fingerprint = True
 
                 i += 1
 
-                if update_sha1:
-                    with open(filepath, "rb") as f:
-                        digest = hashlib.file_digest(f, "sha1")
-                    hexdigest = digest.hexdigest()
-                    sha1 = hexdigest.upper()
-
                 update_progress = skip_update_amount
 
-                if update_sha1 or update_steam_sha1:
-                    await asset_list.sha1_scan_done(
-                        str(asset_path), sha1, steam_sha1, mtime
+                if update_sha1:
+                    hashers.submit(
+                        filepath,
+                        (
+                            dir_name,
+                            str(asset_path),
+                            filepath,
+                            steam_sha1,
+                            mtime,
+                            fingerprint,
+                        ),
+                    )
+                    update_progress = update_amount
+                elif update_steam_sha1 or update_fingerprint:
+                    write_queue.sha1_scan_done(
+                        str(asset_path), sha1, steam_sha1, mtime, fingerprint
                     )
                     update_progress = update_amount
 
@@ -143,5 +241,16 @@ class Sha1Scanner(TTSWorker):
                         )
                     )
 
+            clean_dirs[dir_name] = dir_mtime_ns
+
+        hashers.finish()
+        write_queue.flush()
+        asset_list.set_sha1_dirs(
+            {
+                dir_name: mtime_ns
+                for dir_name, mtime_ns in clean_dirs.items()
+                if dir_name not in failed_dirs
+            }
+        )
         self.post_message(UpdateLog("SHA1 scan complete."))
         self.post_message(self.UpdateStatus("SHA1 scan complete."))
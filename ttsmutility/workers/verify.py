@@ -0,0 +1,179 @@
+import hashlib
+import os
+import struct
+import time
+
+from textual.app import ComposeResult
+from textual.message import Message
+from textual.worker import get_current_worker
+
+from ..parse.AssetList import AssetList
+from ..parse.FileFinder import trailstring_to_trail
+from ..utility.messages import UpdateLog
+from ..utility.util import (
+    FILE_TYPE_HEADER_LEN,
+    FILE_TYPES,
+    detect_file_type_from_header,
+)
+from .TTSWorker import TTSWorker
+
+# Why a file doesn't match the SHA1 in its steam url.  Only TRUNCATED and
+# WRONG_CONTENT files are downloaded again.
+TRUNCATED = "truncated"
+WRONG_CONTENT = "wrong content"
+EXTRA_DATA = "extra data"
+REENCODED = "re-encoded"
+UNVERIFIED = "unverified"
+
+CORRUPT = (TRUNCATED, WRONG_CONTENT)
+
+# Bytes a complete file of each type ends with, searched for near the end
+TRAILERS = {
+    ".png": b"IEND\xaeB`\x82",
+    ".jpg": b"\xff\xd9",
+    ".PDF": b"%%EOF",
+}
+TRAILER_LEN = 1024
+
+# Types every valid file starts with the FILE_TYPES magic of.  An MP3 needn't
+# have an ID3 tag, nor an OBJ a comment, so those aren't judged by it.
+MAGIC_REQUIRED = {".png", ".jpg", ".jpeg", ".pdf", ".unity3d", ".ogg", ".wav"}
+
+# Error pages hosts send in place of the asset
+HTML_HEADERS = (b"<!doctype", b"<html", b"<?xml", b"<head")
+
+
+def file_size_from_header(header: bytes) -> int | None:
+    """The size a file says it is, for the types that record it."""
+    if header.startswith(FILE_TYPES[".WAV"]) and len(header) >= 8:
+        return struct.unpack("<I", header[4:8])[0] + 8
+    if header.startswith(FILE_TYPES[".unity3d"] + b"\0"):
+        # UnityFS\0, format version, player and engine versions, then size
+        end = header.find(b"\0", 12)
+        end = header.find(b"\0", end + 1)
+        if end > 0 and len(header) >= end + 9:
+            return struct.unpack(">Q", header[end + 1 : end + 9])[0]
+    return None
+
+
+def classify_mismatch(filepath, steam_sha1: str, expected_size: int = 0) -> str:
+    """Work out why a file doesn't match the SHA1 in its steam url.
+
+    Args:
+        expected_size: Content-Length of the last download, 0 if unknown.
+
+    Returns:
+        One of TRUNCATED, WRONG_CONTENT, EXTRA_DATA, REENCODED or UNVERIFIED.
+    """
+    size = os.path.getsize(filepath)
+    with open(filepath, "rb") as f:
+        header = f.read(256)
+        f.seek(max(size - TRAILER_LEN, 0))
+        trailer = f.read()
+
+        if expected_size > 0 and size > expected_size:
+            # Something was appended to an otherwise good download
+            f.seek(0)
+            digest = hashlib.sha1()
+            remaining = expected_size
+            while remaining > 0:
+                chunk = f.read(min(remaining, 1024 * 1024))
+                if chunk == b"":
+                    break
+                digest.update(chunk)
+                remaining -= len(chunk)
+            if digest.hexdigest().upper() == steam_sha1.upper():
+                return EXTRA_DATA
+
+    if size == 0 or header.lstrip().lower().startswith(HTML_HEADERS):
+        return WRONG_CONTENT
+    if 0 < expected_size and size < expected_size:
+        return TRUNCATED
+
+    file_type = detect_file_type_from_header(header[:FILE_TYPE_HEADER_LEN])
+    ext = os.path.splitext(filepath)[1]
+    if file_type == "":
+        return WRONG_CONTENT if ext.lower() in MAGIC_REQUIRED else UNVERIFIED
+
+    recorded_size = file_size_from_header(header)
+    if recorded_size is not None:
+        return TRUNCATED if size < recorded_size else REENCODED
+    if file_type in TRAILERS:
+        return REENCODED if TRAILERS[file_type] in trailer else TRUNCATED
+    return UNVERIFIED
+
+
+class Sha1Verifier(TTSWorker):
+    """Classifies steam assets whose SHA1 doesn't match their url and
+    re-fetches the ones that are corrupt, leaving good copies alone.
+    """
+
+    class AssetsCorrupt(Message):
+        def __init__(self, urls: list, trails: list) -> None:
+            super().__init__()
+            self.urls = urls
+            self.trails = trails
+
+    # Base class is installed in each screen, so we don't want
+    # to inherit the same widgets when this subclass is mounted
+    def compose(self) -> ComposeResult:
+        return []
+
+    def verify_mismatches(self, batch_size: int = 100) -> None:
+        asset_list = AssetList()
+        worker = get_current_worker()
+
+        assets = asset_list.get_mismatches_to_verify()
+        self.post_message(UpdateLog(f"Verifying {len(assets)} SHA1 mismatches."))
+        self.post_message(self.UpdateProgress(len(assets), None))
+
+        start = time.time()
+        counts = {}
+        urls = []
+        trails = []
+        for i, asset in enumerate(assets):
+            if worker.is_cancelled:
+                break
+
+            filepath = os.path.join(asset_list.mod_dir, asset["filename"])
+            try:
+                outcome = classify_mismatch(
+                    filepath, asset["steam_sha1"], asset["expected_size"]
+                )
+            except OSError as error:
+                self.post_message(UpdateLog(f"Unable to read `{filepath}`: {error}"))
+                continue
+            counts[outcome] = counts.get(outcome, 0) + 1
+            self.post_message(UpdateLog(f"`{asset['filename']}`: {outcome}."))
+
+            if outcome in CORRUPT:
+                urls.append(asset["url"])
+                trails.append(trailstring_to_trail(asset["trail"]))
+                if len(urls) >= batch_size:
+                    self.post_message(self.AssetsCorrupt(urls, trails))
+                    urls = []
+                    trails = []
+
+            if i % 50 == 49:
+                self.post_message(self.UpdateProgress(advance_amount=50))
+                self.post_message(
+                    self.UpdateStatus(
+                        f"Verified {i + 1}/{len(assets)} SHA1 mismatches."
+                    )
+                )
+
+        self.post_message(self.UpdateProgress(advance_amount=len(assets) % 50))
+        if len(urls) > 0:
+            self.post_message(self.AssetsCorrupt(urls, trails))
+
+        outcomes = ", ".join(
+            f"{count} {outcome}" for outcome, count in sorted(counts.items())
+        )
+        summary = (
+            f"Verified {sum(counts.values())} SHA1 mismatches "
+            f"in {time.time() - start:.1f}s: {outcomes or 'none found'}."
+        )
+        if worker.is_cancelled:
+            summary = "SHA1 verification cancelled. " + summary
+        self.post_message(UpdateLog(summary, flush=True))
+        self.post_message(self.UpdateStatus(summary))